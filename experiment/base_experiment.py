@@ -1,10 +1,12 @@
 from __future__ import print_function
 
-from experiment.resources import TRAINING, TESTING, RESULT, Logger
+from experiment.resources import TRAINING, TESTING, RESULT, Logger, CallRecorder, replay
 from grammar.lcfrs import LCFRS
+from grammar.lcfrs_binary import is_binary_grammar
+from parser.worker_pool import TIMEOUT
 import tempfile
-import multiprocessing
 import os
+import time
 import json
 import pickle
 
@@ -32,6 +34,8 @@ class Experiment(object):
         self.resources = {}  # to hold file paths, intervals of sentences etc.
         self.resources_data = {}  # to hold actual lists or sets
         self.parsing_timeout = None
+        self.parsing_workers = 1
+        self.parsing_chunksize = 1
         self.oracle_parsing = False
         self.max_score = None
         self.purge_rule_freq = None
@@ -49,7 +53,15 @@ class Experiment(object):
                 self.stage_dict = json.load(f)
 
                 if "base_grammar" in self.stage_dict:
-                    self.base_grammar = pickle.load(open(self.stage_dict["base_grammar"], 'rb'))
+                    self.base_grammar = self.load_grammar(self.stage_dict["base_grammar"])
+
+    @staticmethod
+    def load_grammar(path):
+        # stage files of older experiments contain pickled grammars
+        if is_binary_grammar(path):
+            return LCFRS.load_binary(path)
+        with open(path, 'rb') as f:
+            return pickle.load(f)
 
     def write_stage_file(self):
         with open(self.__stage_path, "w") as f:
@@ -63,23 +75,20 @@ class Experiment(object):
         pass
 
     def induce_grammar(self, corpus, start="START"):
-        grammar = LCFRS(start=start)
-        for obj in corpus:
-            obj = self.preprocess_before_induction(obj)
-            additional_induction_params = self.additional_induction_params(obj)
-            obj_grammar, features = self.induce_from(obj, **additional_induction_params)
-            if obj_grammar is None:
-                continue
-            if features is None:
-                grammar.add_gram(obj_grammar, None)
-            else:
-                grammar.add_gram(obj_grammar, (self.feature_log, features))
+        def induced_grammars():
+            for obj in corpus:
+                obj = self.preprocess_before_induction(obj)
+                additional_induction_params = self.additional_induction_params(obj)
+                obj_grammar, features = self.induce_from(obj, **additional_induction_params)
+                if obj_grammar is not None:
+                    yield obj_grammar, features
+
+        grammar = LCFRS(start=start).merge(induced_grammars(), self.feature_log)
         self.postprocess_grammar(grammar)
         self.base_grammar = grammar
         _, path = tempfile.mkstemp(suffix=".base.grammar", dir=self.directory)
-        with open(path, 'wb') as f:
-            pickle.dump(self.base_grammar, f)
-            self.stage_dict["base_grammar"] = path
+        self.base_grammar.save_binary(path)
+        self.stage_dict["base_grammar"] = path
 
     def postprocess_grammar(self, grammar):
         if self.purge_rule_freq is not None:
@@ -121,7 +130,9 @@ class Experiment(object):
         result_resource.init()
         from time import clock
         begin = clock()
-        if self.parsing_timeout is None:
+        if self.parsing_timeout is None and self.parsing_workers > 1:
+            self.do_parse_parallel(gold_corpus, test_inputs, result_resource)
+        elif self.parsing_timeout is None:
             for gold_obj, obj in zip(gold_corpus, test_inputs):
                 parser_input = self.parsing_preprocess(obj)
                 self.parser.set_input(parser_input)
@@ -135,6 +146,35 @@ class Experiment(object):
         print("\nParsing time, ", clock() - begin, file=self.logger)
         result_resource.finalize()
 
+    def do_parse_parallel(self, gold_corpus, test_inputs, result_resource):
+        """
+        Parse with self.parsing_workers forked processes (cf. AbstractParser.parse_batch), which inherit
+        the initialized parser, or threads of the parser (cf. CFGParser.parse_batch). process_parse is run
+        on the parser that parsed each input with recorders in place of result_resource and the logger,
+        whose calls are replayed in the order of test_inputs.
+        """
+        gold_corpus, test_inputs = list(gold_corpus), list(test_inputs)
+        parser_inputs = [self.parsing_preprocess(obj) for obj in test_inputs]
+
+        def action(parser, index):
+            # parse_batch may pass another parser than self.parser, which holds the chart of the input
+            logger, self.logger = self.logger, CallRecorder()
+            own_parser, self.parser = self.parser, parser
+            resource = CallRecorder()
+            try:
+                self.process_parse(gold_corpus[index], test_inputs[index], resource)
+                return self.logger.calls, resource.calls
+            finally:
+                self.logger = logger
+                self.parser = own_parser
+
+        self.logger.flush()
+        for logger_calls, resource_calls in self.parser.parse_batch(
+                parser_inputs, action, workers=self.parsing_workers, chunksize=self.parsing_chunksize,
+                max_length=self.max_sentence_length_for_parsing):
+            replay(logger_calls, self.logger)
+            replay(resource_calls, result_resource)
+
     def process_parse(self, gold_obj, obj, result_resource):
         sentence = self.obtain_sentence(obj)
 
@@ -189,47 +229,50 @@ class Experiment(object):
         assert False
 
     def do_parse_with_timeout(self, test_inputs, result_resource):
-        manager = multiprocessing.Manager()
-        return_dict = manager.dict()
-        recognized = 0
-
-        for obj in test_inputs:
-            parser_input = self.parsing_preprocess(obj)
-            self.parser.set_input(parser_input)
+        """
+        Parse with self.parsing_workers long-lived processes (at least one), each sentence within
+        self.parsing_timeout seconds, cf. AbstractParser.parse_batch. Only workers that exceed the
+        timeout are restarted.
+        """
+        test_inputs = list(test_inputs)
+        parser_inputs = [self.parsing_preprocess(obj) for obj in test_inputs]
 
-            timeout = False
-            p = multiprocessing.Process(target=self.timeout_worker, args=(self.parser, obj, return_dict))
-            p.start()
-            p.join(timeout=self.parsing_timeout)
-            if p.is_alive():
-                p.terminate()
-                p.join()
-                timeout = True
+        def action(parser, index):
+            return_dict = {}
+            self.timeout_worker(parser, test_inputs[index], return_dict)
+            return return_dict.get(0)
 
-            if 0 in return_dict and return_dict[0] is not None:
+        recognized = 0
+        timeouts = 0
+        begin = time.time()
+        self.logger.flush()
+        results = self.parser.parse_batch(parser_inputs, action, workers=self.parsing_workers,
+                                          max_length=self.max_sentence_length_for_parsing,
+                                          timeout=self.parsing_timeout)
+        for obj, result in zip(test_inputs, results):
+            if result is TIMEOUT:
+                timeouts += 1
+                print("t", end='', file=self.logger)
+                result = self.compute_fallback(self.obtain_sentence(obj), self.obtain_label(obj))
+            elif result is not None:
                 recognized += 1
                 print(".", end='', file=self.logger)
-                result = return_dict[0]
             else:
-                if timeout:
-                    print("t", end='', file=self.logger)
-                else:
-                    print("-", end='', file=self.logger)
+                print("-", end='', file=self.logger)
                 result = self.compute_fallback(self.obtain_sentence(obj), self.obtain_label(obj))
 
             self.post_parsing_action(obj, result, result_resource)
 
-            return_dict[0] = None
-            self.parser.clear()
-
         print(file=self.logger)
         print("From {} sentences, {} were recognized.".format(len(test_inputs), recognized), file=self.logger)
+        print("{} sentences timed out, {:.2f} sentences per second.".format(
+            timeouts, len(test_inputs) / max(time.time() - begin, 1e-9)), file=self.logger)
 
     def post_parsing_action(self, gold, system, result_resource):
         result_resource.write(self.serialize(system))
 
     def timeout_worker(self, parser, obj, return_dict):
-        parser.parse()
+        # parser has already parsed obj, cf. AbstractParser.parse_batch
         if parser.recognized():
             derivation = parser.best_derivation_tree()
             return_dict[0] = self.parsing_postprocess(sentence=self.obtain_sentence(obj), derivation=derivation
@@ -282,6 +325,7 @@ class Experiment(object):
         print("Score", self.score_name, file=file)
         print("Resources", '{\n' + '\n'.join(['\t' + str(k) + ' : ' + str(self.resources[k]) for k in self.resources]) + '\n}', file=file)
         print("Parsing Timeout: ", self.parsing_timeout, file=file)
+        print("Parsing workers: ", self.parsing_workers, file=file)
         print("Oracle parsing: ", self.oracle_parsing, file=file)
 
     def update_stage(self, new_stage):
@@ -341,17 +385,16 @@ class ScoringExperiment(Experiment):
             result_resource.failure(gold_obj)
 
     def timeout_worker(self, parser, obj, return_dict):
-        parser.parse()
         sentence = self.obtain_sentence(obj)
 
         if parser.recognized():
             if self.oracle_parsing:
-                derivations = [der for _, der in self.parser.k_best_derivation_trees()]
+                derivations = [der for _, der in parser.k_best_derivation_trees()]
                 best_derivation = self.compute_oracle_derivation(derivations, obj)
             else:
-                best_derivation = self.parser.best_derivation_tree()
+                best_derivation = parser.best_derivation_tree()
                 if self.filters:
-                    for _, der in self.parser.k_best_derivation_trees():
+                    for _, der in parser.k_best_derivation_trees():
                         tree = self.parsing_postprocess(sentence=sentence, derivation=der,
                                                         label=self.obtain_label(obj))
                         if all([predicate(tree) for predicate in self.filters]):
@@ -18,6 +18,7 @@ except ImportError:
 from parser.sDCP_parser.sdcp_trace_manager import compute_reducts, PySDCPTraceManager
 from parser.sDCPevaluation.evaluator import DCP_evaluator, dcp_to_hybridtree
 from parser.trace_manager.sm_trainer import build_PyLatentAnnotation
+from parser.trace_manager.trace_store import load_traces
 from parser.lcfrs_la import construct_fine_grammar
 import plac
 import json
@@ -479,7 +480,9 @@ class ConstituentSMExperiment(ConstituentExperiment, SplitMergeExperiment):
                                               beam_beta=self.disco_dop_params["beam_beta"],
                                               beam_delta=self.disco_dop_params["beam_delta"],
                                               pruning_k=self.disco_dop_params["pruning_k"],
-                                              cfg_ctf=self.disco_dop_params["cfg_ctf"])
+                                              cfg_ctf=self.disco_dop_params["cfg_ctf"],
+                                              cache_dir=self.disco_dop_params["cache_dir"],
+                                              estimates_max_length=self.disco_dop_params["estimates_max_length"])
         else:
             self.parser = GFParser_k_best(grammar=self.base_grammar, k=self.k_best,
                                           save_preprocessing=(self.directory, "gfgrammar"))
@@ -489,13 +492,11 @@ class ConstituentSMExperiment(ConstituentExperiment, SplitMergeExperiment):
 
         if "training_reducts" in self.stage_dict:
             self.organizer.training_reducts = PySDCPTraceManager(self.base_grammar, self.terminal_labeling)
-            self.organizer.training_reducts.load_traces_from_file(
-                bytes(self.stage_dict["training_reducts"], encoding="utf-8"))
+            load_traces(self.organizer.training_reducts, self.stage_dict["training_reducts"])
 
         if "validation_reducts" in self.stage_dict:
             self.organizer.validation_reducts = PySDCPTraceManager(self.base_grammar, self.terminal_labeling)
-            self.organizer.validation_reducts.load_traces_from_file(
-                bytes(self.stage_dict["validation_reducts"], encoding="utf-8"))
+            load_traces(self.organizer.validation_reducts, self.stage_dict["validation_reducts"])
 
         if "rule_smooth_list" in self.stage_dict:
             with open(self.stage_dict["rule_smooth_list"]) as file:
@@ -573,10 +574,11 @@ class ConstituentSMExperiment(ConstituentExperiment, SplitMergeExperiment):
         nonterminal_map = self.organizer.nonterminal_map
         frequency = self.backoff_factor if self.backoff else 1.0
         trace = compute_reducts(self.base_grammar, corpus, self.induction_settings.terminal_labeling,
-                                parser=parser, nont_map=nonterminal_map, frequency=frequency)
+                                parser=parser, nont_map=nonterminal_map, frequency=frequency,
+                                workers=self.reduct_workers)
         if self.backoff:
             self.terminal_labeling.backoff_mode = True
-            trace.compute_reducts(corpus, frequency=1.0)
+            trace.compute_reducts(corpus, frequency=1.0, workers=self.reduct_workers)
             self.terminal_labeling.backoff_mode = False
         return trace
 
@@ -744,10 +746,9 @@ class ConstituentSMExperiment(ConstituentExperiment, SplitMergeExperiment):
             # self.base_grammar_backup = self.base_grammar
             self.stage_dict["backup_grammar"] = self.stage_dict["base_grammar"]
             self.base_grammar = grammar_fine
-            _, path = tempfile.mkstemp(suffix="basegram.pkl", dir=self.directory)
-            with open(path, 'wb') as file:
-                pickle.dump(self.base_grammar, file)
-                self.stage_dict["base_grammar"] = path
+            _, path = tempfile.mkstemp(suffix=".basegram", dir=self.directory)
+            self.base_grammar.save_binary(path)
+            self.stage_dict["base_grammar"] = path
 
             self.organizer.grammarInfo = grammar_fine_info
             self.organizer.nonterminal_map = grammar_fine_nonterminal_map
@@ -881,6 +882,9 @@ BACKOFF = ['yes', 'auto', 'no']  # auto: use backoff for form+unk terminal
                  None,
                  str),
     parsing_limit=('only evaluate on sentences of length up to 40', 'flag'),
+    parsing_workers=('number of processes for parsing the test corpus', 'option', None, int),
+    reduct_workers=('number of processes for computing the reducts of the training corpus', 'option', None, int),
+    em_batch_size=('mini-batch size of stepwise EM, which replaces the initial EM training', 'option', None, int),
     k_best=('k in k-best reranking parsing mode', 'option', None, int),
     directory=('directory in which experiment is run (default: mktemp)', 'option', None, str),
     counts_prior=('number that is added to each rule\'s expected frequency during EM training', 'option', None, float)
@@ -904,6 +908,9 @@ def main(split,
          parsing_mode=MULTI_OBJECTIVES,
          product_las="",
          parsing_limit=False,
+         parsing_workers=1,
+         reduct_workers=1,
+         em_batch_size=None,
          k_best=500,
          directory=None,
          counts_prior=0.0
@@ -924,6 +931,7 @@ def main(split,
     experiment.organizer.seed = seed
     experiment.organizer.em_epochs = em_epochs
     experiment.organizer.em_epochs_sm = em_epochs_sm
+    experiment.organizer.em_batch_size = em_batch_size
     experiment.organizer.validator_type = "SIMPLE"
     experiment.organizer.max_sm_cycles = sm_cycles
     experiment.counts_prior = counts_prior
@@ -951,6 +959,8 @@ def main(split,
 
     if parsing_limit:
         experiment.max_sentence_length_for_parsing = 40
+    experiment.parsing_workers = parsing_workers
+    experiment.reduct_workers = reduct_workers
 
     experiment.k_best = k_best
 
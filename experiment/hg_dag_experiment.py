@@ -25,6 +25,7 @@ from hybridtree.monadic_tokens import construct_constituent_token
 from parser.discodop_parser.parser import DiscodopKbestParser
 from parser.sDCPevaluation.evaluator import dcp_to_hybriddag, DCP_evaluator
 from parser.supervised_trainer.trainer import PyDerivationManager
+from parser.trace_manager.trace_store import load_traces
 
 TRAINING_BIN = 'TRAINING_BIN'
 TEST_SECOND_HALF = False
@@ -312,7 +313,9 @@ class DagExperiment(ScoringExperiment, SplitMergeExperiment):
                                           beam_beta=self.disco_dop_params["beam_beta"],
                                           beam_delta=self.disco_dop_params["beam_delta"],
                                           pruning_k=self.disco_dop_params["pruning_k"],
-                                          cfg_ctf=self.disco_dop_params["cfg_ctf"])
+                                          cfg_ctf=self.disco_dop_params["cfg_ctf"],
+                                          cache_dir=self.disco_dop_params["cache_dir"],
+                                          estimates_max_length=self.disco_dop_params["estimates_max_length"])
 
     def read_stage_file(self):
         ScoringExperiment.read_stage_file(self)
@@ -324,13 +327,11 @@ class DagExperiment(ScoringExperiment, SplitMergeExperiment):
 
         if "training_reducts" in self.stage_dict:
             self.organizer.training_reducts = PyDerivationManager(self.base_grammar) # self.terminal_labeling)
-            self.organizer.training_reducts.load_traces_from_file(
-                bytes(self.stage_dict["training_reducts"], encoding="utf-8"))
+            load_traces(self.organizer.training_reducts, self.stage_dict["training_reducts"])
 
         if "validation_reducts" in self.stage_dict:
             self.organizer.validation_reducts = PyDerivationManager(self.base_grammar)  # self.terminal_labeling)
-            self.organizer.validation_reducts.load_traces_from_file(
-                bytes(self.stage_dict["validation_reducts"], encoding="utf-8"))
+            load_traces(self.organizer.validation_reducts, self.stage_dict["validation_reducts"])
 
         SplitMergeExperiment.read_stage_file(self)
 
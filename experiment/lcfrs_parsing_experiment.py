@@ -6,6 +6,7 @@ try:
 except ImportError:
     print("The Grammatical Framework is not installed properly – the GFParser is unavailable.")
 from parser.sDCP_parser.sdcp_trace_manager import compute_reducts, PySDCPTraceManager
+from parser.trace_manager.trace_store import load_traces
 import plac
 from constituent.induction import direct_extract_lcfrs, BasicNonterminalLabeling, \
     direct_extract_lcfrs_from_prebinarized_corpus
@@ -142,6 +143,8 @@ class LCFRSExperiment(ConstituentExperiment, SplitMergeExperiment):
         if "disco-dop" in self.parsing_mode:
             self.parser = DiscodopKbestParser(grammar=self.base_grammar, k=self.k_best,
                                               cfg_ctf=self.disco_dop_params["cfg_ctf"],
+                                              cache_dir=self.disco_dop_params["cache_dir"],
+                                              estimates_max_length=self.disco_dop_params["estimates_max_length"],
                                               pruning_k=self.disco_dop_params["pruning_k"],
                                               beam_beta=self.disco_dop_params["beam_beta"],
                                               beam_delta=self.disco_dop_params["beam_delta"]
@@ -185,13 +188,11 @@ class LCFRSExperiment(ConstituentExperiment, SplitMergeExperiment):
 
         if "training_reducts" in self.stage_dict:
             self.organizer.training_reducts = PySDCPTraceManager(self.base_grammar, self.terminal_labeling)
-            self.organizer.training_reducts.load_traces_from_file(
-                bytes(self.stage_dict["training_reducts"], encoding="utf-8"))
+            load_traces(self.organizer.training_reducts, self.stage_dict["training_reducts"])
 
         if "validation_reducts" in self.stage_dict:
             self.organizer.validation_reducts = PySDCPTraceManager(self.base_grammar, self.terminal_labeling)
-            self.organizer.validation_reducts.load_traces_from_file(
-                bytes(self.stage_dict["validation_reducts"], encoding="utf-8"))
+            load_traces(self.organizer.validation_reducts, self.stage_dict["validation_reducts"])
 
         SplitMergeExperiment.read_stage_file(self)
 
@@ -80,6 +80,32 @@ class Logger(object):
         self.stdout.flush()
 
 
+class CallRecorder(object):
+    """
+    Records the method calls on a resource or a logger, e.g., in a parsing worker process, such that
+    they can be replayed on the actual object later, cf. Experiment.do_parse_parallel.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return record
+
+
+def replay(calls, target):
+    """
+    :param calls: calls recorded by a CallRecorder
+    :type calls: list
+    """
+    for name, args, kwargs in calls:
+        getattr(target, name)(*args, **kwargs)
+
+
 class ScorerResource(Resource):
     def __init__(self, path=None, start=None, end=None):
         super(ScorerResource, self).__init__(path, start, end)
@@ -92,4 +118,4 @@ class ScorerResource(Resource):
 
 
 __all_ = ["TRAINING", "VALIDATION", "TESTING", "TESTING_INPUT", "RESULT", "Resource", "CorpusResource", "Logger",
-          "ScorerResource"]
+          "CallRecorder", "replay", "ScorerResource"]
@@ -1,10 +1,10 @@
-import multiprocessing
+import os
 import pickle
 import tempfile
 
 from experiment.base_experiment import Experiment
 from experiment.resources import TRAINING, VALIDATION, TESTING, TESTING_INPUT, RESULT
-from parser.coarse_to_fine_parser.coarse_to_fine import Coarse_to_fine_parser
+from parser.coarse_to_fine_parser.coarse_to_fine import Coarse_to_fine_parser, MultiLevelCoarseToFineParser
 from parser.discodop_parser.parser import DiscodopKbestParser
 try:
     from parser.gf_parser.gf_interface import GFParser_k_best
@@ -14,8 +14,10 @@ from parser.lcfrs_la import build_sm_grammar
 from parser.supervised_trainer.trainer import PyDerivationManager
 from parser.trace_manager.score_validator import PyCandidateScoreValidator
 from parser.trace_manager.sm_trainer import PySplitMergeTrainerBuilder, build_PyLatentAnnotation_initial, \
-    build_PyLatentAnnotation
+    build_PyLatentAnnotation, save_latent_annotation, load_latent_annotation
 from parser.trace_manager.sm_trainer_util import PyGrammarInfo, PyStorageManager
+from parser.trace_manager.trace_store import TraceStore, write_trace_store
+from parser.worker_pool import TIMEOUT
 
 
 MULTI_OBJECTIVES = "multi-objectives"
@@ -39,6 +41,10 @@ class SplitMergeOrganizer:
         self.training_reducts = None
         self.em_epochs = 20
         self.em_epochs_sm = 20
+        self.em_batch_size = None  # if set, stepwise EM on mini-batches replaces EM, cf. PyStepwiseEMTrainer
+        self.em_stepwise_epochs = 1
+        self.em_stepwise_full_batch = False  # em_epochs of EM follow the stepwise epochs
+        self.em_step_exponent = 0.7
         self.max_sm_cycles = 2
         self.min_epochs = 6
         self.min_epochs_smoothing = 3
@@ -87,8 +93,18 @@ class SplitMergeExperiment(Experiment):
         self.disco_dop_params = {"beam_beta": 0.0,
                                  "beam_delta": 50,
                                  "pruning_k": 10000,
-                                 "cfg_ctf": True}
+                                 "cfg_ctf": True,
+                                 "cache_dir": None,  # cf. DiscodopGrammarCache
+                                 "estimates_max_length": None}
         self.counts_prior = 0.0
+        # posterior thresholds of each split/merge cycle for the coarse-to-fine parsing mode
+        self.coarse_to_fine_thresholds = 1e-4
+        # number of processes that compute the reducts of corpus shards, cf. compute_reducts_sharded
+        self.reduct_workers = 1
+        # compress the serialized reducts, cf. write_trace_store
+        self.reduct_compression = False
+        # compress the saved latent annotations, cf. save_latent_annotation
+        self.la_compression = False
 
     def read_stage_file(self):
         # super(SplitMergeExperiment, self).read_stage_file()
@@ -102,13 +118,7 @@ class SplitMergeExperiment(Experiment):
 
             las = self.stage_dict["latent_annotations"]
             for key in las:
-                with open(las[key], "rb") as f:
-                    splits, rootWeights, ruleWeights = pickle.load(f)
-                    # print(key)
-                    # print(len(splits), len(rootWeights), len(ruleWeights))
-                    # print(len(self.base_grammar.nonts()))
-                    la = build_PyLatentAnnotation(splits, rootWeights, ruleWeights, self.organizer.grammarInfo, self.organizer.storageManager)
-                    self.organizer.latent_annotations[int(key)] = la
+                self.organizer.latent_annotations[int(key)] = self.load_la(las[key])
         if "last_sm_cycle" in self.stage_dict:
             self.organizer.last_sm_cycle = int(self.stage_dict["last_sm_cycle"])
             # TODO: delete unused latent annotations
@@ -117,14 +127,25 @@ class SplitMergeExperiment(Experiment):
         for path in paths:
             if path == '':
                 continue
-            with open(path, "rb") as f:
-                splits, rootWeights, ruleWeights = pickle.load(f)
-                # very basic tests to avoid incompatible LAs
-                assert len(splits) == len(self.base_grammar.nonts())
-                assert len(ruleWeights) == len(self.base_grammar.rules())
-                la = build_PyLatentAnnotation(splits, rootWeights, ruleWeights, self.organizer.grammarInfo,
-                                              self.organizer.storageManager)
-                self.organizer.secondary_latent_annotations.append(la)
+            la = self.load_la(path)
+            splits, _, _, offsets = la.to_arrays()
+            # very basic tests to avoid incompatible LAs
+            assert len(splits) == len(self.base_grammar.nonts())
+            assert len(offsets) - 1 == len(self.base_grammar.rules())
+            self.organizer.secondary_latent_annotations.append(la)
+
+    def load_la(self, path):
+        """
+        :param path: latent annotation written by save_current_la, i.e., an .npz file, or a pickled serialization
+            (of former versions)
+        :rtype: PyLatentAnnotation
+        """
+        if path.endswith(".npz"):
+            return load_latent_annotation(path, self.organizer.grammarInfo, self.organizer.storageManager)
+        with open(path, "rb") as f:
+            splits, rootWeights, ruleWeights = pickle.load(f)
+        return build_PyLatentAnnotation(splits, rootWeights, ruleWeights, self.organizer.grammarInfo,
+                                        self.organizer.storageManager)
 
     def build_score_validator(self, resource):
         self.organizer.validator = PyCandidateScoreValidator(self.organizer.grammarInfo
@@ -136,67 +157,62 @@ class SplitMergeExperiment(Experiment):
         timeout = False
 
         if self.parsing_timeout:
-            timeout_manager = multiprocessing.Manager()
-            return_dict = timeout_manager.dict()
-
-        for gold in corpus_validation:
-            obj_count += 1
-            self.parser.set_input(self.parsing_preprocess(gold))
+            corpus_validation = list(corpus_validation)
+            timeout_results = self.parser.parse_batch([self.parsing_preprocess(gold) for gold in corpus_validation],
+                                                      self._derivations_timeout_worker,
+                                                      workers=self.parsing_workers, timeout=self.parsing_timeout)
 
+        try:
+            for gold in corpus_validation:
+                obj_count += 1
+
+                if self.parsing_timeout:
+                    derivations_ = next(timeout_results)
+                    timeout = derivations_ is TIMEOUT
+                    derivations = [] if timeout else list(map(lambda x: x[1], derivations_))
+                else:
+                    self.parser.set_input(self.parsing_preprocess(gold))
+                    self.parser.parse()
+                    derivations = list(map(lambda x: x[1], self.parser.k_best_derivation_trees()))
+
+                manager = PyDerivationManager(self.base_grammar, self.organizer.nonterminal_map)
+                manager.convert_derivations_to_hypergraphs(derivations)
+                scores = []
+
+                # derivations = self.parser.k_best_derivation_trees()
+                for der in derivations:
+                    der_count += 1
+                    result = self.parsing_postprocess(self.obtain_sentence(gold), der)
+                    score = self.score_object(result, gold)
+                    scores.append(score)
+
+                self.organizer.validator.add_scored_candidates(manager, scores, self.max_score)
+                # print(obj_count, self.max_score, scores)
+                token = 't' if timeout else ('.' if scores else '-')
+                print(token, end='', file=self.logger)
+                if scores:
+                    print(obj_count, 'max', max(scores), 'firsts', scores[0:10], file=self.logger)
+                else:
+                    print(obj_count, 'max 00.00', '[]', file=self.logger)
+                if not self.parsing_timeout:
+                    self.parser.clear()
+        finally:
             if self.parsing_timeout:
-                timeout, derivations_ = self._compute_derivations_with_timeout(return_dict)
-                derivations = list(map(lambda x: x[1], derivations_))
-            else:
-                self.parser.parse()
-                derivations = list(map(lambda x: x[1], self.parser.k_best_derivation_trees()))
-
-            manager = PyDerivationManager(self.base_grammar, self.organizer.nonterminal_map)
-            manager.convert_derivations_to_hypergraphs(derivations)
-            scores = []
-
-            # derivations = self.parser.k_best_derivation_trees()
-            for der in derivations:
-                der_count += 1
-                result = self.parsing_postprocess(self.obtain_sentence(gold), der)
-                score = self.score_object(result, gold)
-                scores.append(score)
-
-            self.organizer.validator.add_scored_candidates(manager, scores, self.max_score)
-            # print(obj_count, self.max_score, scores)
-            token = 't' if timeout else ('.' if scores else '-')
-            print(token, end='', file=self.logger)
-            if scores:
-                print(obj_count, 'max', max(scores), 'firsts', scores[0:10], file=self.logger)
-            else:
-                print(obj_count, 'max 00.00', '[]', file=self.logger)
-            self.parser.clear()
+                # terminates the workers of the DeadlinePool, also if scoring fails
+                timeout_results.close()
         # print("trees used for validation ", obj_count, "with", der_count * 1.0 / obj_count, "derivations on average")
 
-    def _compute_derivations_with_timeout(self, return_dict):
-        p = multiprocessing.Process(target=self._derivations_timeout_worker, args=(self.parser, return_dict))
-        p.start()
-        p.join(timeout=self.parsing_timeout)
-        if p.is_alive():
-            p.terminate()
-            p.join()
-        if 0 in return_dict and return_dict[0] is not None:
-            result = return_dict[0]
-            # return_dict[0] = None
-            return False, result
-        return True, []
-
-    def _derivations_timeout_worker(self, parser, return_dict):
-        return_dict[0] = None
-        parser.parse()
+    def _derivations_timeout_worker(self, parser, index):
         if parser.recognized():
-            return_dict[0] = list(parser.k_best_derivation_trees())
+            return list(parser.k_best_derivation_trees())
+        return []
 
     def compute_reducts(self, resource):
         assert False
 
     def update_reducts(self, trace, type=TRAINING):
         _, trace_path = tempfile.mkstemp("." + type + ".reduct", dir=self.directory)
-        trace.serialize(bytes(trace_path, encoding="utf-8"))
+        write_trace_store(trace, trace_path, compression=self.reduct_compression)
         print("Serialized " + type + " reducts to " + trace_path, file=self.logger)
         if type is TRAINING:
             self.organizer.training_reducts = trace
@@ -209,6 +225,14 @@ class SplitMergeExperiment(Experiment):
         em_builder = PySplitMergeTrainerBuilder(self.organizer.training_reducts, self.organizer.grammarInfo)
         em_builder.set_em_epochs(self.organizer.em_epochs)
         em_builder.set_simple_expector(threads=self.organizer.threads)
+        if self.organizer.em_batch_size:
+            # the mini-batches are read from the serialized reducts, cf. update_reducts
+            trace_store = TraceStore(self.stage_dict["training_reducts"]) \
+                if "training_reducts" in self.stage_dict else None
+            em_builder.set_stepwise_em(self.organizer.storageManager, self.organizer.em_batch_size,
+                                       epochs=self.organizer.em_stepwise_epochs,
+                                       exponent=self.organizer.em_step_exponent, seed=self.organizer.seed,
+                                       full_batch=self.organizer.em_stepwise_full_batch, traceStore=trace_store)
         em_builder.set_scc_merger(self.organizer.merge_threshold)
         em_builder.set_scc_merge_threshold_function(self.organizer.merge_interpolation_factor)
         self.organizer.emTrainer = emTrainer = em_builder.build()
@@ -233,12 +257,12 @@ class SplitMergeExperiment(Experiment):
 
     def save_current_la(self):
         cycle = self.stage_dict["last_sm_cycle"] = self.organizer.last_sm_cycle
-        _, la_path = tempfile.mkstemp(suffix=".la" + str(cycle) + ".pkl", dir=self.directory)
-        with open(la_path, 'wb') as f:
-            pickle.dump(self.organizer.latent_annotations[cycle].serialize(), f)
-            if "latent_annotations" not in self.stage_dict:
-                self.stage_dict["latent_annotations"] = {}
-            self.stage_dict["latent_annotations"][cycle] = la_path
+        fd, la_path = tempfile.mkstemp(suffix=".la" + str(cycle) + ".npz", dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            save_latent_annotation(self.organizer.latent_annotations[cycle], f, compressed=self.la_compression)
+        if "latent_annotations" not in self.stage_dict:
+            self.stage_dict["latent_annotations"] = {}
+        self.stage_dict["latent_annotations"][cycle] = la_path
 
     def create_initial_la(self):
         # randomize initial weights and do em training
@@ -317,6 +341,8 @@ class SplitMergeExperiment(Experiment):
                                               variational=False,
                                               sum_op=False,
                                               cfg_ctf=self.disco_dop_params["cfg_ctf"],
+                                              cache_dir=self.disco_dop_params["cache_dir"],
+                                              estimates_max_length=self.disco_dop_params["estimates_max_length"],
                                               beam_beta=self.disco_dop_params["beam_beta"],
                                               beam_delta=self.disco_dop_params["beam_delta"],
                                               pruning_k=self.disco_dop_params["pruning_k"],
@@ -351,6 +377,8 @@ class SplitMergeExperiment(Experiment):
                                              nontMap=self.organizer.nonterminal_map,
                                              grammarInfo=self.organizer.grammarInfo,
                                              cfg_ctf=self.disco_dop_params["cfg_ctf"],
+                                             cache_dir=self.disco_dop_params["cache_dir"],
+                                             estimates_max_length=self.disco_dop_params["estimates_max_length"],
                                              beam_beta=self.disco_dop_params["beam_beta"],
                                              beam_delta=self.disco_dop_params["beam_beta"],
                                              pruning_k=self.disco_dop_params["pruning_k"],
@@ -391,12 +419,38 @@ class SplitMergeExperiment(Experiment):
                                                   variational="variational" in self.parsing_mode,
                                                   sum_op="sum" in self.parsing_mode,
                                                   cfg_ctf=self.disco_dop_params["cfg_ctf"],
+                                                  cache_dir=self.disco_dop_params["cache_dir"],
+                                                  estimates_max_length=self.disco_dop_params["estimates_max_length"],
                                                   beam_beta=self.disco_dop_params["beam_beta"],
                                                   beam_delta=self.disco_dop_params["beam_delta"],
                                                   pruning_k=self.disco_dop_params["pruning_k"],
                                                   grammarInfo=self.organizer.grammarInfo,
                                                   projection_mode=True)
 
+        elif self.parsing_mode in {"coarse-to-fine-" + method for method in {"max-rule-prod", "max-rule-sum", "variational"}}:
+            hierarchy = [self.organizer.latent_annotations[cycle]
+                         for cycle in sorted(self.organizer.latent_annotations)
+                         if cycle <= self.organizer.last_sm_cycle]
+            if self.organizer.project_weights_before_parsing:
+                self.project_weights()
+            engine = DiscodopKbestParser(self.base_grammar,
+                                         k=self.k_best,
+                                         nontMap=self.organizer.nonterminal_map,
+                                         cfg_ctf=self.disco_dop_params["cfg_ctf"],
+                                         cache_dir=self.disco_dop_params["cache_dir"],
+                                         estimates_max_length=self.disco_dop_params["estimates_max_length"],
+                                         beam_beta=self.disco_dop_params["beam_beta"],
+                                         beam_delta=self.disco_dop_params["beam_delta"],
+                                         pruning_k=self.disco_dop_params["pruning_k"])
+            self.parser = MultiLevelCoarseToFineParser(self.base_grammar,
+                                                       hierarchy,
+                                                       self.organizer.grammarInfo,
+                                                       self.organizer.nonterminal_map,
+                                                       base_parser=engine,
+                                                       thresholds=self.coarse_to_fine_thresholds,
+                                                       variational="variational" in self.parsing_mode,
+                                                       sum_op="sum" in self.parsing_mode)
+
         else:
             raise ValueError("Unknown parsing mode %s" % self.parsing_mode)
 
@@ -490,6 +544,9 @@ class SplitMergeExperiment(Experiment):
         print("heuristics", self.heuristics)
         print("disco-dop engine settings", self.disco_dop_params, file=file)
         print("counts prior", self.counts_prior, file=file)
+        print("reduct workers", self.reduct_workers, file=file)
+        print("reduct compression", self.reduct_compression, file=file)
+        print("LA compression", self.la_compression, file=file)
 
 
 __all__ = ["SplitMergeExperiment", "SplitMergeOrganizer", 'MULTI_OBJECTIVES', 'BASE_GRAMMAR',
@@ -0,0 +1,374 @@
+# Binarization of LCFRS/DCP hybrid grammars.
+#
+# Each rule of rank > 2 is replaced by a tree of binary rules. The tree is
+# chosen per rule by a strategy, the default one minimising the parsing
+# complexity (fanout of the LHS plus fanouts of the RHS) and, among the trees
+# with least complexity, the fanout of the introduced nonterminals. The new
+# nonterminals are specific to the original rule, which keeps the binarized
+# grammar weight-equivalent (the original weight is put on the topmost rule, all
+# other rules get unit weight) and derivations unambiguously debinarizable.
+#
+# Rules of rank <= 2 are copied together with their DCP rules. The DCP rules of
+# a binarized rule refer to RHS members that are split over several new rules;
+# they are dropped from the binary rules and evaluated on the debinarized
+# derivation, which consists of the original rules.
+
+from __future__ import print_function
+
+from collections import defaultdict
+
+from grammar.lcfrs import LCFRS, LCFRS_lhs, LCFRS_var
+from grammar.lcfrs_derivation import LCFRSDerivation
+
+STRATEGIES = ['optimal', 'greedy', 'left-to-right', 'right-to-left']
+
+
+def rule_complexity(rule, fanout):
+    """
+    :type rule: LCFRS_rule
+    :param fanout: function from nonterminals to fanouts, e.g., LCFRS.fanout
+    :return: parsing complexity of rule, i.e., the number of string positions to be considered
+    :rtype: int
+    """
+    return rule.lhs().fanout() + sum([fanout(nont) for nont in rule.rhs()])
+
+
+def grammar_complexity(grammar):
+    """
+    :type grammar: LCFRS
+    :return: maximal rank, maximal fanout, and maximal parsing complexity of rules of grammar
+    :rtype: tuple[int]
+    """
+    rank, fanout, complexity = 0, 0, 0
+    for rule in grammar.rules():
+        rank = max(rank, rule.rank())
+        fanout = max(fanout, rule.lhs().fanout())
+        complexity = max(complexity, rule_complexity(rule, grammar.fanout))
+    return rank, fanout, complexity
+
+
+class _RuleBinarizer(object):
+    """
+    Binarization trees for a single rule. A tree is either a RHS member (int) or a pair of trees.
+    Sets of RHS members are represented as bit masks.
+    """
+    def __init__(self, rule):
+        self.rule = rule
+        self.rank = rule.rank()
+        self.full = (1 << self.rank) - 1
+        # the LHS as sequence of (argument, position, member) where member is -1 for terminals
+        self.positions = [(i, j, elem.mem if isinstance(elem, LCFRS_var) else -1)
+                          for i, arg in enumerate(rule.lhs().args()) for j, elem in enumerate(arg)]
+        self.__fanout = {}
+
+    def fanout(self, mask):
+        """ Number of maximal runs of variables of the members in mask within the LHS arguments. """
+        if mask == self.full:
+            return self.rule.lhs().fanout()
+        if mask not in self.__fanout:
+            runs = 0
+            previous = None
+            for arg, _, mem in self.positions:
+                inside = mem >= 0 and mask >> mem & 1
+                if inside and previous != arg:
+                    runs += 1
+                previous = arg if inside else None
+            self.__fanout[mask] = runs
+        return self.__fanout[mask]
+
+    def mask(self, tree):
+        if isinstance(tree, tuple):
+            return self.mask(tree[0]) | self.mask(tree[1])
+        return 1 << tree
+
+    def step_complexity(self, mask1, mask2):
+        return self.fanout(mask1 | mask2) + self.fanout(mask1) + self.fanout(mask2)
+
+    def left_to_right(self):
+        tree = 0
+        for mem in range(1, self.rank):
+            tree = tree, mem
+        return tree
+
+    def right_to_left(self):
+        tree = self.rank - 1
+        for mem in range(self.rank - 2, -1, -1):
+            tree = mem, tree
+        return tree
+
+    def greedy(self):
+        parts = list(range(self.rank))
+        while len(parts) > 2:
+            best = None
+            for a in range(len(parts)):
+                for b in range(a + 1, len(parts)):
+                    mask1, mask2 = self.mask(parts[a]), self.mask(parts[b])
+                    score = self.step_complexity(mask1, mask2), self.fanout(mask1 | mask2)
+                    if best is None or score < best[0]:
+                        best = score, a, b
+            _, a, b = best
+            parts[a] = parts[a], parts[b]
+            del parts[b]
+        return parts[0], parts[1]
+
+    def optimal(self):
+        # best[mask] = (max. complexity, max. fanout of a new nonterminal, tree) for the members in mask
+        best = {1 << mem: (0, 0, mem) for mem in range(self.rank)}
+        for mask in sorted(range(1, self.full + 1), key=lambda m: bin(m).count('1')):
+            if mask in best:
+                continue
+            lowest = mask & -mask
+            # enumerate splits (sub, mask - sub) where sub contains the lowest member of mask
+            sub = (mask - 1) & mask
+            while sub:
+                if sub & lowest:
+                    rest = mask ^ sub
+                    left, right = best[sub], best[rest]
+                    fanout = 0 if mask == self.full else self.fanout(mask)
+                    score = (max(left[0], right[0], self.step_complexity(sub, rest)),
+                             max(left[1], right[1], fanout))
+                    if mask not in best or score < best[mask][:2]:
+                        best[mask] = score + ((left[2], right[2]),)
+                sub = (sub - 1) & mask
+        return best[self.full][2]
+
+    def components(self, tree):
+        """
+        :return: the components of the nonterminal for tree, each a list of LHS positions (argument,
+            position); for a RHS member, the i-th component is the position of its i-th variable
+        """
+        if not isinstance(tree, tuple):
+            components = {}
+            for i, arg in enumerate(self.rule.lhs().args()):
+                for j, elem in enumerate(arg):
+                    if isinstance(elem, LCFRS_var) and elem.mem == tree:
+                        components[elem.arg] = [(i, j)]
+            return [components[k] for k in range(len(components))]
+        mask = self.mask(tree)
+        components = []
+        previous = None
+        for arg, pos, mem in self.positions:
+            inside = mem >= 0 and mask >> mem & 1
+            if inside:
+                if previous != arg:
+                    components.append([])
+                components[-1].append((arg, pos))
+            previous = arg if inside else None
+        return components
+
+
+class Binarization(object):
+    """
+    Binarized version of an LCFRS together with the mapping back to the original rules.
+    """
+    def __init__(self, grammar, strategy='optimal', max_optimal_rank=10):
+        """
+        :type grammar: LCFRS
+        :param strategy: one of STRATEGIES
+        :type strategy: str
+        :param max_optimal_rank: rules of higher rank are binarized greedily by the optimal strategy, since
+            the search for an optimal binarization takes time exponential in the rank
+        :type max_optimal_rank: int
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError('unknown binarization strategy ' + str(strategy))
+        self.__original = grammar
+        self.__strategy = strategy
+        self.__max_optimal_rank = max_optimal_rank
+        self.__grammar = LCFRS(start=grammar.start(), unit=grammar.unit())
+        # new rule idx -> (original rule idx, for each RHS member: original member or None)
+        self.__origin = {}
+        # nonterminals introduced by binarization
+        self.__intermediate = set()
+        for rule in grammar.rules():
+            if rule.rank() <= 2:
+                self.__add_rule(rule.lhs(), rule.rhs(), rule.weight(), rule.dcp(), rule.get_idx(),
+                                list(range(rule.rank())))
+            else:
+                self.__binarize_rule(rule)
+
+    def __tree(self, binarizer):
+        if self.__strategy == 'optimal' and binarizer.rank <= self.__max_optimal_rank:
+            return binarizer.optimal()
+        elif self.__strategy in ['optimal', 'greedy']:
+            return binarizer.greedy()
+        elif self.__strategy == 'left-to-right':
+            return binarizer.left_to_right()
+        else:
+            return binarizer.right_to_left()
+
+    def __add_rule(self, lhs, nonts, weight, dcp, original_idx, slots):
+        rule = self.__grammar.add_rule(lhs, nonts, weight=weight, dcp=dcp)
+        assert rule.get_idx() not in self.__origin
+        self.__origin[rule.get_idx()] = original_idx, slots
+        return rule
+
+    def __nont(self, rule, binarizer, tree, fanout):
+        members = sorted([mem for mem in range(binarizer.rank) if binarizer.mask(tree) >> mem & 1])
+        return 'BAR/' + rule.lhs().nont() + '/' + str(rule.get_idx()) + '_' \
+               + '_'.join(map(str, members)) + '/' + str(fanout)
+
+    def __binarize_rule(self, rule):
+        binarizer = _RuleBinarizer(rule)
+        root = self.__tree(binarizer)
+
+        def add(tree):
+            if not isinstance(tree, tuple):
+                return rule.rhs_nont(tree)
+            # order children by their leftmost position in the LHS
+            children = sorted(tree, key=lambda child: binarizer.components(child)[0][0])
+            nonts = [add(child) for child in children]
+            start = {}
+            for i, child in enumerate(children):
+                for k, component in enumerate(binarizer.components(child)):
+                    start[component[0]] = LCFRS_var(i, k), len(component)
+            slots = [None if isinstance(child, tuple) else child for child in children]
+
+            if tree is root:
+                lhs = LCFRS_lhs(rule.lhs().nont())
+                args = [[(i, j) for j in range(len(arg))] for i, arg in enumerate(rule.lhs().args())]
+                weight = rule.weight()
+            else:
+                args = binarizer.components(tree)
+                lhs = LCFRS_lhs(self.__nont(rule, binarizer, tree, len(args)))
+                weight = self.__grammar.unit()
+                self.__intermediate.add(lhs.nont())
+            for positions in args:
+                new_arg = []
+                k = 0
+                while k < len(positions):
+                    if positions[k] in start:
+                        var, length = start[positions[k]]
+                        new_arg.append(var)
+                        k += length
+                    else:
+                        i, j = positions[k]
+                        new_arg.append(rule.lhs().arg(i)[j])
+                        k += 1
+                lhs.add_arg(new_arg)
+            self.__add_rule(lhs, nonts, weight, None, rule.get_idx(), slots)
+            return lhs.nont()
+
+        add(root)
+
+    def grammar(self):
+        """
+        :rtype: LCFRS
+        :return: the binarized grammar
+        """
+        return self.__grammar
+
+    def original(self):
+        """
+        :rtype: LCFRS
+        """
+        return self.__original
+
+    def original_rule_idx(self, idx):
+        """
+        :param idx: index of a rule of the binarized grammar
+        :return: index of the rule of the original grammar, from which the rule was obtained
+        :rtype: int
+        """
+        return self.__origin[idx][0]
+
+    def is_intermediate(self, nont):
+        """
+        :return: whether nont was introduced by binarization
+        :rtype: bool
+        """
+        return nont in self.__intermediate
+
+    def debinarize(self, derivation):
+        """
+        :param derivation: derivation w.r.t. the binarized grammar
+        :type derivation: LCFRSDerivation
+        :rtype: DebinarizedDerivation
+        """
+        return DebinarizedDerivation(self, derivation)
+
+    def __str__(self):
+        rank, fanout, complexity = grammar_complexity(self.__original)
+        rank_b, fanout_b, complexity_b = grammar_complexity(self.__grammar)
+        return 'binarization (' + self.__strategy + '): ' \
+               + 'rules ' + str(len(self.__original.rules())) + ' -> ' + str(len(self.__grammar.rules())) \
+               + ', rank ' + str(rank) + ' -> ' + str(rank_b) \
+               + ', fanout ' + str(fanout) + ' -> ' + str(fanout_b) \
+               + ', complexity ' + str(complexity) + ' -> ' + str(complexity_b)
+
+    def members(self, derivation, id):
+        """
+        :return: mapping from the RHS members of the original rule of node id to the
+            nodes of derivation that correspond to them
+        :rtype: dict
+        """
+        _, slots = self.__origin[derivation.getRule(id).get_idx()]
+        members = {}
+        for child, slot in zip(derivation.child_ids(id), slots):
+            if slot is None:
+                members.update(self.members(derivation, child))
+            else:
+                members[slot] = child
+        return members
+
+
+class DebinarizedDerivation(LCFRSDerivation):
+    """
+    Derivation w.r.t. the original grammar of a Binarization, obtained from a derivation w.r.t.
+    the binarized grammar by contracting the rules of intermediate nonterminals.
+    """
+    def __init__(self, binarization, derivation):
+        """
+        :type binarization: Binarization
+        :type derivation: LCFRSDerivation
+        """
+        self.node_counter = 0
+        self.rules = {}
+        self.children = defaultdict(list)
+        self.parent = {}
+        self.spans = None
+        self.__init__rec(binarization, derivation, derivation.root_id())
+
+    def __init__rec(self, binarization, derivation, id):
+        rule = derivation.getRule(id)
+        node = self.node_counter
+        self.node_counter += 1
+        self.rules[node] = binarization.original().rule_index(binarization.original_rule_idx(rule.get_idx()))
+        members = binarization.members(derivation, id)
+        for i in range(len(members)):
+            child = self.__init__rec(binarization, derivation, members[i])
+            self.children[node].append(child)
+            self.parent[child] = node
+        return node
+
+    def root_id(self):
+        return 0
+
+    def getRule(self, id):
+        return self.rules[id]
+
+    def child_ids(self, id):
+        return self.children[id]
+
+    def child_id(self, id, i):
+        return self.children[id][i]
+
+    def position_relative_to_parent(self, id):
+        p = self.parent[id]
+        return p, self.children[p].index(id)
+
+    def ids(self):
+        return range(0, self.node_counter)
+
+
+def binarize(grammar, strategy='optimal', max_optimal_rank=10):
+    """
+    :type grammar: LCFRS
+    :param strategy: one of STRATEGIES
+    :rtype: Binarization
+    """
+    return Binarization(grammar, strategy=strategy, max_optimal_rank=max_optimal_rank)
+
+
+__all__ = ["Binarization", "DebinarizedDerivation", "binarize", "rule_complexity", "grammar_complexity",
+           "STRATEGIES"]
@@ -2,15 +2,22 @@
 # Rules are augmented with DCP rules.
 # Together this forms LCFRS/DCP hybrid grammars.
 
+from array import array
 from collections import defaultdict, namedtuple
+import numpy as np
 from grammar.dcp import dcp_rules_to_str, dcp_rules_to_key
 from grammar.rtg import RTG_like, RTG
+from grammar.weights import normalize, prune_mask
 
 # ##########################################################################
 # Parts of the grammar.
 
 # LCFRS_var = namedtuple('LCFRS_var', ['mem', 'arg'])
 
+# Result of LCFRS.trim: mapping from old to new rule indices (cf. LCFRS.remove_rules)
+# and the sets of removed nonterminals.
+TrimReport = namedtuple('TrimReport', ['index_map', 'unproductive', 'unreachable'])
+
 # Variable of LCFRS rule.
 # Represents i-th member in RHS and j-th argument thereof.
 cdef class LCFRS_var:
@@ -133,6 +140,24 @@ cdef class LCFRS_lhs:
         s += ')'
         return s
 
+    # Structural representation for hashing: nonterminal and arguments,
+    # where variable <i,j> is encoded as integer -1-(i*2^16+j).
+    # return: tuple
+    cpdef tuple signature(self):
+        cdef list args = []
+        cdef list encoded
+        cdef LCFRS_var var
+        for arg in self.__args:
+            encoded = []
+            for elem in arg:
+                if isinstance(elem, LCFRS_var):
+                    var = elem
+                    encoded.append(-1 - ((var._mem << 16) | var._arg))
+                else:
+                    encoded.append(elem)
+            args.append(tuple(encoded))
+        return self.__nont, tuple(args)
+
 
 # LCFRS rule, optionally with DCP rules.
 cdef class LCFRS_rule:
@@ -301,12 +326,77 @@ cdef class LCFRS_rule:
             s += '::' + dcp_rules_to_key(self.dcp())
         return s
 
+    # Structural representation (without probability) for hashing,
+    # cf. LCFRS_lhs.signature.
+    # return: tuple
+    cpdef tuple signature(self):
+        return rule_signature(self.lhs(), self.rhs(), self.dcp())
+
         # def __hash__(self):
         #     # TODO: there might be collisions. Since the number of rules is finite,
         #     # TODO: we can give every rule a unique number during training.
         #     return hash(self.key())
 
 
+# Signature of the rule with given lhs, rhs, and DCP rules.
+# lhs: LCFRS_lhs
+# nonts: list of string
+# dcp: list of DCP_rule or None
+# return: tuple
+cpdef tuple rule_signature(LCFRS_lhs lhs, nonts, dcp):
+    return lhs.signature(), tuple(nonts), None if dcp is None else dcp_rules_to_key(dcp)
+
+
+# Rule of a CompactLCFRS.
+# Holds no data itself, but reads and writes the arrays of the grammar.
+cdef class LCFRS_rule_view(LCFRS_rule):
+    cdef object _store
+    cdef int _view_idx
+
+    def __init__(self, store, int idx):
+        self._store = store
+        self._view_idx = idx
+
+    cpdef int get_idx(self):
+        return self._view_idx
+
+    cpdef int set_idx(self, int idx):
+        self._view_idx = idx
+
+    cpdef void add_rhs_nont(self, str nont):
+        raise Exception('rules of a CompactLCFRS cannot be modified structurally')
+
+    cpdef void add_weight(self, double weight):
+        self._store._set_weight(self._view_idx, self._store._weight(self._view_idx) + weight)
+
+    cpdef void set_dcp(self, list dcp):
+        self._store._set_dcp(self._view_idx, dcp)
+
+    cpdef void set_weight(self, double weight):
+        self._store._set_weight(self._view_idx, weight)
+
+    cpdef double weight(self):
+        return self._store._weight(self._view_idx)
+
+    cpdef list dcp(self):
+        return self._store._dcp(self._view_idx)
+
+    cpdef LCFRS_lhs lhs(self):
+        return self._store._lhs(self._view_idx)
+
+    cpdef int rank(self):
+        return self._store._rank(self._view_idx)
+
+    cpdef list rhs(self):
+        return self._store._rhs(self._view_idx)
+
+    cpdef str rhs_nont(self, int i):
+        return self._store._rhs(self._view_idx)[i]
+
+    cpdef int size(self):
+        return 1 + self.rank()
+
+
 ###########################################################################
 # The grammar.
 
@@ -344,7 +434,7 @@ class LCFRS(RTG_like):
         self.__rules = []
         # Mapping from nonterminal to list of rules with that nont as LHS.
         self.__lhs_nont_to_rules = defaultdict(list)
-        # Mapping from string representation of rule (without weight) to rule
+        # Mapping from signature of rule (without weight) to rule
         # if it already exists.
         self.__key_to_rule = {}
         # Mapping from rule idx to rule
@@ -357,10 +447,27 @@ class LCFRS(RTG_like):
         # Mapping from nonterminal to rules where nonterminal occurs as
         # first element in RHS.
         self.__nont_corner_of = defaultdict(list)
+        # Mapping from terminal to rules in which terminal occurs.
+        self.__term_to_rules = defaultdict(list)
+        # Mapping from nonterminal to rules where nonterminal occurs in RHS,
+        # once per occurrence.
+        self.__rhs_nont_to_rules = defaultdict(list)
         if start:
             self.__start = start
             self.__nont_to_fanout[start] = 1
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # grammars pickled before rule signatures were introduced are keyed by rule.key()
+        if isinstance(next(iter(self.__key_to_rule), None), str):
+            self.__key_to_rule = {rule.signature(): rule for rule in self.__rules}
+        # grammars pickled before the inverted terminal index was introduced
+        if '_LCFRS__term_to_rules' not in state:
+            self.__term_to_rules = defaultdict(list)
+            self.__rhs_nont_to_rules = defaultdict(list)
+            for rule in self.__rules:
+                self.__index_occurrences(rule, rule.terms())
+
     # Add rule to grammar.
     # lhs: 
     # nonts: list of string
@@ -375,13 +482,16 @@ class LCFRS(RTG_like):
         """
         if weight is None:
             weight = self.__unit
+        return self.__add_rule(lhs, nonts, weight, dcp, rule_signature(lhs, nonts, dcp))
+
+    def __add_rule(self, lhs, nonts, weight, dcp, signature):
+        if signature in self.__key_to_rule:
+            rule = self.__key_to_rule[signature]
+            rule.add_weight(weight)
+            return rule
         rule = LCFRS_rule(lhs, weight=weight, dcp=dcp, idx=len(self.__idx_to_rule))
         for nont in nonts:
             rule.add_rhs_nont(nont)
-        if rule.key() in self.__key_to_rule:
-            rule = self.__key_to_rule[rule.key()]
-            rule.add_weight(weight)
-            return rule
         if not lhs.nont() in self.__nont_to_fanout or \
                         self.__nont_to_fanout[lhs.nont()] == lhs.fanout():
             self.__nont_to_fanout[lhs.nont()] = lhs.fanout()
@@ -401,10 +511,11 @@ class LCFRS(RTG_like):
             else:
                 raise Exception('unexpected fanout in ' + str(rule))
         self.__rules += [rule]
-        self.__key_to_rule[rule.key()] = rule
+        self.__key_to_rule[signature] = rule
         self.__lhs_nont_to_rules[rule.lhs().nont()] += [rule]
+        terms = rule.terms()
+        self.__index_occurrences(rule, terms)
         if rule.rank() == 0:
-            terms = rule.terms()
             if len(terms) > 0:
                 self.__first_term_of[terms[0]] += [rule]
             else:
@@ -418,6 +529,12 @@ class LCFRS(RTG_like):
         self.__idx_to_rule[rule.get_idx()] = rule
         return rule
 
+    def __index_occurrences(self, rule, terms):
+        for term in set(terms):
+            self.__term_to_rules[term].append(rule)
+        for nont in rule.rhs():
+            self.__rhs_nont_to_rules[nont].append(rule)
+
     # Get unit element.
     # return: real
     def unit(self):
@@ -490,74 +607,190 @@ class LCFRS(RTG_like):
     def epsilon_rules(self):
         return self.__epsilon_rules
 
+    # Get rules in which terminal occurs (anywhere in the LHS).
+    # term: string
+    # return: list of LCFRS_rule
+    def term_rules(self, str term):
+        return self.__term_to_rules.get(term, [])
+
+    # Get rules in which nonterminal occurs in RHS, once per occurrence.
+    # nont: string
+    # return: list of LCFRS_rule
+    def rhs_nont_to_rules(self, str nont):
+        return self.__rhs_nont_to_rules.get(nont, [])
+
+    def filter_for_input(self, tokens):
+        """
+        :param tokens: the sentence to be parsed
+        :type tokens: list[str]
+        :return: view of the rules that may occur in a derivation of a string over tokens, cf. input_rules
+        :rtype: RestrictedLCFRS
+        """
+        return RestrictedLCFRS(self, input_rules(self, tokens))
+
     def purge_rules(self, threshold, feature_log=None):
         """
         :param threshold: remove rules with probability <= threshold from grammar
         :type threshold: float
+        :param feature_log: features of rules (cf. add_gram), which are remapped to the new rule indices
+        :return: mapping from old to new rule indices, cf. remove_rules
+        :rtype: array
         """
+        index_map = self.remove_rules(prune_mask(self.weight_vector(), threshold))
         if feature_log is not None:
-            assert False
-        to_remove = []
-        i = 0
-        while i < len(self.__rules):
-            rule = self.__rules[i]
-            if rule.weight() <= threshold:
-                to_remove.append(rule)
-                self.__rules = self.__rules[:i] + self.__rules[i+1:]
-            else:
-                i += 1
-
-        # remove rule from auxiliary structures
-        for rule in to_remove:
-            del self.__idx_to_rule[rule.get_idx()]
-            self.__lhs_nont_to_rules[rule.lhs().nont()].remove(rule)
-            if rule.rank() > 0:
-                self.__nont_corner_of[rule.rhs_nont(0)].remove(rule)
-            elif rule.rank() == 0:
-                terms = rule.terms()
-                if terms:
-                    self.__first_term_of[terms[0]].remove(rule)
+            remap_feature_log(feature_log, index_map)
+        return index_map
 
-        # rebuild rule index
-        new_index = {}
-        next_idx = 0
-        for idx in self.__idx_to_rule:
-            new_index[next_idx] = self.__idx_to_rule[idx]
-            new_index[next_idx].set_idx(next_idx)
-            next_idx += 1
-        self.__idx_to_rule = new_index
-        # TODO: handle features by building a translation dict: old idx -> new idx
+    def remove_rules(self, remove):
+        """
+        Remove rules from the grammar in a single pass. The remaining rules keep their relative
+        order and are assigned consecutive indices.
 
+        :param remove: a predicate on LCFRS_rule or a sequence of booleans (e.g., a NumPy mask)
+            indexed by rule idx, which selects the rules to be removed
+        :return: array mapping each old rule idx to its new idx, or to -1 if the rule was removed
+        :rtype: array
+        """
+        cdef int new_idx = 0
+        index_map = array('l', [-1]) * len(self.__rules)
+        predicate = remove if callable(remove) else None
+        kept = []
+        for rule in self.__rules:
+            old_idx = rule.get_idx()
+            if predicate(rule) if predicate is not None else remove[old_idx]:
+                continue
+            index_map[old_idx] = new_idx
+            rule.set_idx(new_idx)
+            kept.append(rule)
+            new_idx += 1
+
+        if len(kept) == len(self.__rules):
+            return index_map
+
+        # removed rules keep their old idx, hence a rule is retained iff it is indexed under its idx
+        self.__idx_to_rule = {rule.get_idx(): rule for rule in kept}
+        self.__rules = kept
+        self.__key_to_rule = {key: rule for key, rule in self.__key_to_rule.items()
+                              if self.__idx_to_rule.get(rule.get_idx()) is rule}
+        for index in [self.__lhs_nont_to_rules, self.__nont_corner_of, self.__first_term_of,
+                      self.__term_to_rules, self.__rhs_nont_to_rules]:
+            for key in index:
+                index[key] = [rule for rule in index[key] if self.__idx_to_rule.get(rule.get_idx()) is rule]
+        self.__epsilon_rules = [rule for rule in self.__epsilon_rules
+                                if self.__idx_to_rule.get(rule.get_idx()) is rule]
+        return index_map
+
+    def trim(self, feature_log=None):
+        """
+        Remove useless rules and nonterminals, i.e., those that do not occur in any derivation
+        of a terminal string from the start symbol. Runs in time linear in the size of the grammar.
+        The start symbol is kept, even if it is unproductive.
+
+        :param feature_log: features of rules (cf. add_gram), which are remapped to the new rule indices
+        :return: mapping from old to new rule indices and the removed nonterminals
+        :rtype: TrimReport
+        """
+        remove, unproductive, unreachable = useless_rules(self)
+        index_map = self.remove_rules(remove)
+        if feature_log is not None:
+            remap_feature_log(feature_log, index_map)
+        for nont in unproductive | unreachable:
+            if nont != self.__start:
+                del self.__nont_to_fanout[nont]
+            self.__lhs_nont_to_rules.pop(nont, None)
+            self.__nont_corner_of.pop(nont, None)
+            self.__rhs_nont_to_rules.pop(nont, None)
+        return TrimReport(index_map, unproductive, unreachable)
 
     # Adjust weights to make grammar proper.
     def make_proper(self):
-        for nont in self.__lhs_nont_to_rules:
-            rules = self.__lhs_nont_to_rules[nont]
-            if len(rules) > 0:
-                total = sum([rule.weight() for rule in rules])
+        groups, _ = self.lhs_group_index()
+        self.set_weight_vector(normalize(self.weight_vector(), groups))
+
+    def weight_vector(self):
+        """
+        :return: copy of the rule weights, indexed by rule idx
+        :rtype: numpy.ndarray
+        """
+        cdef LCFRS_rule rule
+        weights = np.empty(len(self.__rules), dtype=np.float64)
+        cdef double[:] view = weights
+        for rule in self.__rules:
+            view[rule.get_idx()] = rule.weight()
+        return weights
+
+    def set_weight_vector(self, weights):
+        """
+        :param weights: new rule weights, indexed by rule idx, cf. grammar.weights
+        """
+        cdef LCFRS_rule rule
+        cdef double[:] view = np.ascontiguousarray(weights, dtype=np.float64)
+        assert view.shape[0] == len(self.__rules)
+        for rule in self.__rules:
+            rule.set_weight(view[rule.get_idx()])
+
+    def lhs_group_index(self):
+        """
+        :return: the id of the LHS nonterminal of each rule (indexed by rule idx) and the list of
+            nonterminals by id; rules with the same LHS nonterminal form a normalization group
+        :rtype: tuple[numpy.ndarray, list[str]]
+        """
+        cdef LCFRS_rule rule
+        groups = np.empty(len(self.__rules), dtype=np.intp)
+        nonts = []
+        for nont, rules in self.__lhs_nont_to_rules.items():
+            if rules:
                 for rule in rules:
-                    rule.set_weight(1.0 * rule.weight() / total)
+                    groups[rule.get_idx()] = len(nonts)
+                nonts.append(nont)
+        return groups, nonts
 
     # Join grammar into this.
     # other: LCFRS
     def add_gram(self, other, feature_logging=None):
         if feature_logging is not None:
-            selfLog = feature_logging[0]
-            otherLog = feature_logging[1]
-        for other_rule in other.__rules:
+            self.__merge_one(other, feature_logging[0], feature_logging[1])
+        else:
+            self.__merge_one(other, None, None)
+
+    def merge(self, grammars, feature_log=None):
+        """
+        Join many grammars into this one in a single pass, e.g., the grammars induced from
+        the sentences of a corpus.
+        :param grammars: iterable of LCFRS or of pairs of LCFRS and their feature log (cf. add_gram),
+            where the feature log may be None
+        :param feature_log: feature log of this grammar
+        :return: self
+        """
+        for other in grammars:
+            if isinstance(other, tuple):
+                other, other_log = other
+                self.__merge_one(other, feature_log, other_log)
+            else:
+                self.__merge_one(other, None, None)
+        return self
+
+    def __merge_one(self, other, selfLog, otherLog):
+        # features of each rule of other, grouped by rule idx
+        rule_features = defaultdict(list)
+        if otherLog is not None:
+            for key in otherLog:
+                if isinstance(key[0], int):
+                    rule_features[key[0]].append(key)
+        # the signatures of rules in other are the keys of its rule index
+        if isinstance(other, LCFRS):
+            signed_rules = other.__key_to_rule.items()
+        else:
+            signed_rules = [(other_rule.signature(), other_rule) for other_rule in other.rules()]
+        for signature, other_rule in signed_rules:
             lhs = other_rule.lhs()
-            nonts = other_rule.rhs()
-            weight = other_rule.weight()
-            dcp = other_rule.dcp()
-            self_rule = self.add_rule(lhs, nonts, weight=weight, dcp=dcp)
+            self_rule = self.__add_rule(lhs, other_rule.rhs(), other_rule.weight(), other_rule.dcp(), signature)
 
-            if feature_logging is not None:
-                for key in otherLog:
-                    if key[0] == other_rule.get_idx():
-                        selfLog[(self_rule.get_idx(),) + key[1:]] += otherLog[key]
-                        selfLog[(lhs.nont(), key[1])] += otherLog[key]
-                        # for entry in zip(nonts, list(key[2])):
-                        #    selfLog[(entry[0],) + entry[1]] += 1
+            for key in rule_features.get(other_rule.get_idx(), ()):
+                selfLog[(self_rule.get_idx(),) + key[1:]] += otherLog[key]
+                selfLog[(lhs.nont(), key[1])] += otherLog[key]
+                # for entry in zip(nonts, list(key[2])):
+                #    selfLog[(entry[0],) + entry[1]] += 1
 
     # String representation. First print rules for start symbol.
     # Otherwise leave order unchanged.
@@ -579,5 +812,728 @@ class LCFRS(RTG_like):
         """
         return self.__lhs_nont_to_rules[nont]
 
+    def save_binary(self, path):
+        """
+        Store the grammar in the memory-mappable binary format of grammar.lcfrs_binary.
+        :param path: output file
+        :type path: str
+        """
+        from grammar.lcfrs_binary import write_grammar
+        write_grammar(self, path)
+
+    @staticmethod
+    def load_binary(path):
+        """
+        :param path: file written by save_binary
+        :type path: str
+        :rtype: LCFRS
+        """
+        from grammar.lcfrs_binary import read_grammar
+        return read_grammar(path)
+
+
+# LCFRS backend with a struct-of-arrays rule store.
+# Nonterminals and terminals are interned to integer ids. For each rule, the
+# LHS nonterminal, the weight, the RHS nonterminals, and the id of its argument
+# pattern are kept in contiguous arrays. Argument patterns (the LHS arguments
+# with terminals replaced by their ids and variables <i,j> by -1-(i*2^16+j))
+# are stored once and shared by all rules. Rules are exposed as
+# LCFRS_rule_view objects which are created on demand.
+class CompactLCFRS(RTG_like):
+    def __init__(self, start=None, unit=1):
+        self.__unit = unit
+        self.__start = None
+        # Interned symbols.
+        self.__nont_ids = {}
+        self.__nonts = []
+        self.__fanouts = array('i')
+        self.__term_ids = {}
+        self.__terms = []
+        # Interned argument patterns and their LHS arguments.
+        self.__pattern_ids = {}
+        self.__patterns = []
+        self.__pattern_args = {}
+        # Rule store, indexed by rule idx.
+        self.__rule_lhs = array('i')
+        self.__rule_pattern = array('i')
+        self.__rule_weight = array('d')
+        self.__rhs_offsets = array('q', [0])
+        self.__rhs = array('i')
+        # DCP rules of those rules that have some.
+        self.__rule_dcp = {}
+        # Mapping from rule signature (without weight) to rule idx.
+        self.__key_to_idx = {}
+        # Auxiliary indices from symbol id to rule ids.
+        self.__lhs_nont_to_rules = {}
+        self.__first_term_of = {}
+        self.__nont_corner_of = {}
+        self.__term_to_rules = {}
+        self.__rhs_nont_to_rules = {}
+        self.__epsilon_rules = array('i')
+        # Caches of objects handed out to clients.
+        self.__views = []
+        self.__lhs_cache = {}
+        if start:
+            self.__start = start
+            self.__set_fanout(self.__nont_id(start), 1)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_CompactLCFRS__views'] = []
+        state['_CompactLCFRS__lhs_cache'] = {}
+        state['_CompactLCFRS__pattern_args'] = {}
+        return state
+
+    def __nont_id(self, nont):
+        try:
+            return self.__nont_ids[nont]
+        except KeyError:
+            self.__nont_ids[nont] = len(self.__nonts)
+            self.__nonts.append(nont)
+            self.__fanouts.append(-1)
+            return self.__nont_ids[nont]
+
+    def __term_id(self, term):
+        try:
+            return self.__term_ids[term]
+        except KeyError:
+            self.__term_ids[term] = len(self.__terms)
+            self.__terms.append(term)
+            return self.__term_ids[term]
+
+    def __set_fanout(self, nont_id, fanout, rule=None):
+        if self.__fanouts[nont_id] == -1:
+            self.__fanouts[nont_id] = fanout
+        elif self.__fanouts[nont_id] != fanout:
+            raise Exception('unexpected fanout in ' + str(rule))
+
+    def __pattern_id(self, args):
+        for arg in args:
+            for elem in arg:
+                if isinstance(elem, LCFRS_var) and not (0 <= elem.mem < 1 << 15 and 0 <= elem.arg < 1 << 16):
+                    raise Exception('variable ' + str(elem) + ' cannot be encoded')
+        pattern = tuple([tuple([-1 - ((elem.mem << 16) | elem.arg) if isinstance(elem, LCFRS_var)
+                                else self.__term_id(elem) for elem in arg]) for arg in args])
+        try:
+            return self.__pattern_ids[pattern]
+        except KeyError:
+            self.__pattern_ids[pattern] = len(self.__patterns)
+            self.__patterns.append(pattern)
+            return self.__pattern_ids[pattern]
+
+    # Add rule to grammar.
+    # Same interface as LCFRS.add_rule.
+    # return: LCFRS_rule_view
+    def add_rule(self, lhs, nonts, weight=None, dcp=None):
+        """
+        :type lhs: LCFRS_lhs
+        :type nonts: list
+        :type weight: double
+        """
+        if weight is None:
+            weight = self.__unit
+        lhs_id = self.__nont_id(lhs.nont())
+        pattern_id = self.__pattern_id(lhs.args())
+        rhs = tuple([self.__nont_id(nont) for nont in nonts])
+        key = lhs_id, pattern_id, rhs, None if dcp is None else dcp_rules_to_key(dcp)
+        if key in self.__key_to_idx:
+            idx = self.__key_to_idx[key]
+            self.__rule_weight[idx] += weight
+            return self.__view(idx)
+        if lhs.fanout() == 0:
+            raise Exception('0 fanout in ' + str(lhs))
+        self.__set_fanout(lhs_id, lhs.fanout(), lhs)
+        fanouts = [0] * len(rhs)
+        for arg in self.__patterns[pattern_id]:
+            for elem in arg:
+                if elem < 0:
+                    mem = (-1 - elem) >> 16
+                    fanouts[mem] = max(fanouts[mem], ((-1 - elem) & 0xFFFF) + 1)
+        for nont_id, fanout in zip(rhs, fanouts):
+            self.__set_fanout(nont_id, fanout, lhs)
+
+        idx = len(self.__rule_lhs)
+        self.__rule_lhs.append(lhs_id)
+        self.__rule_pattern.append(pattern_id)
+        self.__rule_weight.append(weight)
+        self.__rhs.extend(rhs)
+        self.__rhs_offsets.append(len(self.__rhs))
+        if dcp is not None:
+            self.__rule_dcp[idx] = dcp
+        self.__key_to_idx[key] = idx
+
+        self.__lhs_nont_to_rules.setdefault(lhs_id, array('i')).append(idx)
+        terms = [elem for arg in self.__patterns[pattern_id] for elem in arg if elem >= 0]
+        for term_id in set(terms):
+            self.__term_to_rules.setdefault(term_id, array('i')).append(idx)
+        for nont_id in rhs:
+            self.__rhs_nont_to_rules.setdefault(nont_id, array('i')).append(idx)
+        if len(rhs) == 0:
+            if terms:
+                self.__first_term_of.setdefault(terms[0], array('i')).append(idx)
+            else:
+                self.__epsilon_rules.append(idx)
+        else:
+            self.__nont_corner_of.setdefault(rhs[0], array('i')).append(idx)
+        if self.__start is None:
+            self.__start = lhs.nont()
+            if lhs.fanout() != 1:
+                raise Exception('start symbol should have fanout 1')
+        return self.__view(idx)
+
+    def __view(self, idx):
+        while len(self.__views) <= idx:
+            self.__views.append(LCFRS_rule_view(self, len(self.__views)))
+        return self.__views[idx]
+
+    def __views_of(self, ids):
+        return [self.__view(idx) for idx in ids]
+
+    # Accessors used by LCFRS_rule_view.
+    def _weight(self, idx):
+        return self.__rule_weight[idx]
+
+    def _set_weight(self, idx, weight):
+        self.__rule_weight[idx] = weight
+
+    def _dcp(self, idx):
+        return self.__rule_dcp.get(idx, None)
+
+    def _set_dcp(self, idx, dcp):
+        self.__rule_dcp[idx] = dcp
+
+    def _rank(self, idx):
+        return self.__rhs_offsets[idx + 1] - self.__rhs_offsets[idx]
+
+    def _rhs(self, idx):
+        return [self.__nonts[nont_id] for nont_id in self.__rhs[self.__rhs_offsets[idx]:self.__rhs_offsets[idx + 1]]]
+
+    def _lhs(self, idx):
+        key = self.__rule_lhs[idx], self.__rule_pattern[idx]
+        try:
+            return self.__lhs_cache[key]
+        except KeyError:
+            lhs = LCFRS_lhs(self.__nonts[key[0]])
+            for arg in self.__args_of_pattern(key[1]):
+                lhs.add_arg(arg)
+            self.__lhs_cache[key] = lhs
+            return lhs
+
+    def __args_of_pattern(self, pattern_id):
+        try:
+            return self.__pattern_args[pattern_id]
+        except KeyError:
+            args = [[LCFRS_var((-1 - elem) >> 16, (-1 - elem) & 0xFFFF) if elem < 0 else self.__terms[elem]
+                     for elem in arg] for arg in self.__patterns[pattern_id]]
+            self.__pattern_args[pattern_id] = args
+            return args
+
+    # Get unit element.
+    # return: real
+    def unit(self):
+        return self.__unit
+
+    # Get start symbol.
+    # return: string
+    def start(self):
+        return self.__start
+
+    def initial(self):
+        return self.__start
+
+    def rules(self):
+        """
+        :rtype: list[LCFRS_rule_view]
+        """
+        return self.__views_of(range(len(self.__rule_lhs)))
+
+    def rule_index(self, i=None):
+        if i is None:
+            return self.rules()
+        if not 0 <= i < len(self.__rule_lhs):
+            raise KeyError(i)
+        return self.__view(i)
+
+    def number_of_patterns(self):
+        return len(self.__patterns)
+
+    # Mapping from nonterminals to fanouts.
+    # return: dict
+    def nonts(self):
+        return {nont: self.__fanouts[i] for i, nont in enumerate(self.__nonts)}
+
+    def fanout(self, str nont):
+        return self.__fanouts[self.__nont_ids[nont]]
+
+    def size(self):
+        return len(self.__rule_lhs) + len(self.__rhs)
+
+    def lhs_nont_to_rules(self, nont):
+        if nont not in self.__nont_ids:
+            return []
+        return self.__views_of(self.__lhs_nont_to_rules.get(self.__nont_ids[nont], ()))
+
+    def nont_corner_of(self, str nont):
+        if nont not in self.__nont_ids:
+            return []
+        return self.__views_of(self.__nont_corner_of.get(self.__nont_ids[nont], ()))
+
+    def lex_rules(self, str term):
+        if term not in self.__term_ids:
+            return []
+        return self.__views_of(self.__first_term_of.get(self.__term_ids[term], ()))
+
+    def epsilon_rules(self):
+        return self.__views_of(self.__epsilon_rules)
+
+    def term_rules(self, str term):
+        if term not in self.__term_ids:
+            return []
+        return self.__views_of(self.__term_to_rules.get(self.__term_ids[term], ()))
+
+    def rhs_nont_to_rules(self, str nont):
+        if nont not in self.__nont_ids:
+            return []
+        return self.__views_of(self.__rhs_nont_to_rules.get(self.__nont_ids[nont], ()))
+
+    def filter_for_input(self, tokens):
+        """
+        :type tokens: list[str]
+        :rtype: RestrictedLCFRS
+        """
+        return RestrictedLCFRS(self, input_rules(self, tokens))
+
+    def well_formed(self):
+        fanout = self.nonts()
+        for rule in self.rules():
+            check = rule.well_formed(fanout)
+            if check is not None:
+                return check
+        return None
+
+    def ordered(self):
+        for rule in self.rules():
+            if not rule.ordered():
+                return False, rule
+        return True, None
+
+    def purge_rules(self, threshold, feature_log=None):
+        """
+        Same interface as LCFRS.purge_rules.
+        """
+        index_map = self.remove_rules(prune_mask(self.weight_vector(), threshold))
+        if feature_log is not None:
+            remap_feature_log(feature_log, index_map)
+        return index_map
+
+    def remove_rules(self, remove):
+        """
+        Same interface as LCFRS.remove_rules. The arrays of the rule store are compacted and the views of
+        the remaining rules are renumbered; views of removed rules must not be used any more.
+
+        :param remove: a predicate on LCFRS_rule or a sequence of booleans indexed by rule idx
+        :return: array mapping each old rule idx to its new idx, or to -1 if the rule was removed
+        :rtype: array
+        """
+        if callable(remove):
+            remove = [remove(self.__view(idx)) for idx in range(len(self.__rule_lhs))]
+        index_map = self.__index_map(remove)
+        self.__compact(index_map)
+        return index_map
+
+    def trim(self, feature_log=None):
+        """
+        Same interface as LCFRS.trim. The removed nonterminals are also dropped from the interned
+        symbols, i.e., the remaining nonterminals are renumbered (cf. lhs_group_index).
+
+        :rtype: TrimReport
+        """
+        remove, unproductive, unreachable = useless_rules(self)
+        index_map = self.__index_map(remove)
+        useless = unproductive | unreachable
+        nont_map = array('l', [-1]) * len(self.__nonts)
+        cdef int new_id = 0
+        for nont_id, nont in enumerate(self.__nonts):
+            if nont not in useless or nont == self.__start:
+                nont_map[nont_id] = new_id
+                new_id += 1
+        self.__compact(index_map, nont_map)
+        if feature_log is not None:
+            remap_feature_log(feature_log, index_map)
+        return TrimReport(index_map, unproductive, unreachable)
+
+    def __index_map(self, remove):
+        cdef int new_idx = 0
+        index_map = array('l', [-1]) * len(self.__rule_lhs)
+        for idx in range(len(self.__rule_lhs)):
+            if not remove[idx]:
+                index_map[idx] = new_idx
+                new_idx += 1
+        return index_map
+
+    def __compact(self, index_map, nont_map=None):
+        """
+        Drop the rules mapped to -1 by index_map and the nonterminals mapped to -1 by nont_map (both
+        mappings preserve the order of the remaining ids); the rules of a dropped nonterminal need to be dropped.
+        """
+        if all(new_idx >= 0 for new_idx in index_map) \
+                and (nont_map is None or all(new_id >= 0 for new_id in nont_map)):
+            return
+        if nont_map is None:
+            nont_map = range(len(self.__nonts))
+
+        def remap_rules(ids):
+            return array('i', [index_map[idx] for idx in ids if index_map[idx] >= 0])
+
+        def remap_nont_index(index):
+            return {nont_map[nont_id]: remap_rules(ids) for nont_id, ids in index.items() if nont_map[nont_id] >= 0}
+
+        rule_lhs, rule_pattern, rule_weight = array('i'), array('i'), array('d')
+        rhs_offsets, rhs = array('q', [0]), array('i')
+        rule_dcp = {}
+        for idx, new_idx in enumerate(index_map):
+            if new_idx < 0:
+                continue
+            rule_lhs.append(nont_map[self.__rule_lhs[idx]])
+            rule_pattern.append(self.__rule_pattern[idx])
+            rule_weight.append(self.__rule_weight[idx])
+            rhs.extend([nont_map[nont_id]
+                        for nont_id in self.__rhs[self.__rhs_offsets[idx]:self.__rhs_offsets[idx + 1]]])
+            rhs_offsets.append(len(rhs))
+            if idx in self.__rule_dcp:
+                rule_dcp[new_idx] = self.__rule_dcp[idx]
+        self.__rule_lhs, self.__rule_pattern, self.__rule_weight = rule_lhs, rule_pattern, rule_weight
+        self.__rhs_offsets, self.__rhs = rhs_offsets, rhs
+        self.__rule_dcp = rule_dcp
+        self.__key_to_idx = {(nont_map[lhs_id], pattern_id, tuple([nont_map[nont_id] for nont_id in rhs_ids]), dcp_key):
+                             index_map[idx]
+                             for (lhs_id, pattern_id, rhs_ids, dcp_key), idx in self.__key_to_idx.items()
+                             if index_map[idx] >= 0}
+
+        self.__lhs_nont_to_rules = remap_nont_index(self.__lhs_nont_to_rules)
+        self.__nont_corner_of = remap_nont_index(self.__nont_corner_of)
+        self.__rhs_nont_to_rules = remap_nont_index(self.__rhs_nont_to_rules)
+        self.__first_term_of = {term_id: remap_rules(ids) for term_id, ids in self.__first_term_of.items()}
+        self.__term_to_rules = {term_id: remap_rules(ids) for term_id, ids in self.__term_to_rules.items()}
+        self.__epsilon_rules = remap_rules(self.__epsilon_rules)
+
+        self.__nonts = [nont for nont_id, nont in enumerate(self.__nonts) if nont_map[nont_id] >= 0]
+        self.__fanouts = array('i', [fanout for nont_id, fanout in enumerate(self.__fanouts) if nont_map[nont_id] >= 0])
+        self.__nont_ids = {nont: nont_id for nont_id, nont in enumerate(self.__nonts)}
+
+        # the views are indexed by rule idx, the views of the remaining rules form a prefix again
+        views = []
+        for idx, view in enumerate(self.__views):
+            if index_map[idx] >= 0:
+                view.set_idx(index_map[idx])
+                views.append(view)
+        self.__views = views
+        self.__lhs_cache = {}
+
+    # Adjust weights to make grammar proper.
+    def make_proper(self):
+        groups, _ = self.lhs_group_index()
+        self.set_weight_vector(normalize(self.weight_vector(), groups))
+
+    def weight_vector(self):
+        """
+        :rtype: numpy.ndarray
+        """
+        return np.array(self.__rule_weight, dtype=np.float64)
+
+    def set_weight_vector(self, weights):
+        weights = np.ascontiguousarray(weights, dtype=np.float64)
+        assert len(weights) == len(self.__rule_weight)
+        self.__rule_weight = array('d', weights.tobytes())
+
+    def lhs_group_index(self):
+        """
+        :return: the id of the LHS nonterminal of each rule and the list of nonterminals by id
+        :rtype: tuple[numpy.ndarray, list[str]]
+        """
+        return np.frombuffer(self.__rule_lhs, dtype=np.intc).astype(np.intp), list(self.__nonts)
+
+    # Join grammar into this.
+    # other: LCFRS or CompactLCFRS
+    def add_gram(self, other, feature_logging=None):
+        if feature_logging is not None:
+            selfLog = feature_logging[0]
+            otherLog = feature_logging[1]
+        for other_rule in other.rules():
+            lhs = other_rule.lhs()
+            self_rule = self.add_rule(lhs, other_rule.rhs(), weight=other_rule.weight(), dcp=other_rule.dcp())
+
+            if feature_logging is not None:
+                for key in otherLog:
+                    if key[0] == other_rule.get_idx():
+                        selfLog[(self_rule.get_idx(),) + key[1:]] += otherLog[key]
+                        selfLog[(lhs.nont(), key[1])] += otherLog[key]
+
+    def to_rtg(self):
+        rtg = RTG(self.__start)
+        for idx in range(len(self.__rule_lhs)):
+            rtg.construct_and_add_rule(self.__nonts[self.__rule_lhs[idx]], idx, self._rhs(idx))
+        return rtg
+
+    @staticmethod
+    def from_lcfrs(grammar):
+        """
+        :type grammar: LCFRS
+        :rtype: CompactLCFRS
+        :return: compact copy of grammar with the same rule indices
+        """
+        compact = CompactLCFRS(start=grammar.start(), unit=grammar.unit())
+        for i in range(len(grammar.rules())):
+            rule = grammar.rule_index(i)
+            compact.add_rule(rule.lhs(), rule.rhs(), weight=rule.weight(), dcp=rule.dcp())
+        return compact
+
+    def to_lcfrs(self):
+        """
+        :rtype: LCFRS
+        :return: copy of the grammar with independent rule objects and the same rule indices
+        """
+        grammar = LCFRS(start=self.__start, unit=self.__unit)
+        for rule in self.rules():
+            grammar.add_rule(rule.lhs(), rule.rhs(), weight=rule.weight(), dcp=rule.dcp())
+        return grammar
+
+    def save_binary(self, path):
+        from grammar.lcfrs_binary import write_grammar
+        write_grammar(self, path)
+
+    def __str__(self):
+        s = ''
+        for rule in self.lhs_nont_to_rules(self.start()):
+            s += str(rule) + '\n'
+        for rule in self.rules():
+            if rule.lhs().nont() != self.start():
+                s += str(rule) + '\n'
+        return s
+
+
+# Read-only view of a subset of the rules of an LCFRS (or CompactLCFRS), as
+# returned by filter_for_input. Rules are shared with the underlying grammar
+# and keep their indices. The view offers the queries of LCFRS that are used
+# by parsers.
+class RestrictedLCFRS(RTG_like):
+    def __init__(self, grammar, rules):
+        """
+        :param grammar: the underlying grammar
+        :param rules: rules of grammar, ordered by idx
+        :type rules: list[LCFRS_rule]
+        """
+        self.__grammar = grammar
+        self.__rules = rules
+        self.__idx_to_rule = {}
+        self.__lhs_nont_to_rules = defaultdict(list)
+        self.__nont_corner_of = defaultdict(list)
+        self.__first_term_of = defaultdict(list)
+        self.__epsilon_rules = []
+        for rule in rules:
+            self.__idx_to_rule[rule.get_idx()] = rule
+            self.__lhs_nont_to_rules[rule.lhs().nont()].append(rule)
+            if rule.rank() == 0:
+                terms = rule.terms()
+                if terms:
+                    self.__first_term_of[terms[0]].append(rule)
+                else:
+                    self.__epsilon_rules.append(rule)
+            else:
+                self.__nont_corner_of[rule.rhs_nont(0)].append(rule)
+
+    # Get the underlying grammar.
+    def grammar(self):
+        return self.__grammar
+
+    def unit(self):
+        return self.__grammar.unit()
+
+    def start(self):
+        return self.__grammar.start()
+
+    def initial(self):
+        return self.__grammar.start()
+
+    def rules(self):
+        """
+        :rtype: list[LCFRS_rule]
+        """
+        return self.__rules
+
+    def rule_index(self, i=None):
+        if i is None:
+            return self.__idx_to_rule
+        else:
+            return self.__idx_to_rule[i]
+
+    def nonts(self):
+        return {nont: self.__grammar.fanout(nont) for nont in self.__lhs_nont_to_rules}
+
+    def fanout(self, str nont):
+        return self.__grammar.fanout(nont)
+
+    def size(self):
+        return sum([rule.size() for rule in self.__rules])
+
+    def lhs_nont_to_rules(self, nont):
+        return self.__lhs_nont_to_rules.get(nont, [])
+
+    def nont_corner_of(self, str nont):
+        return self.__nont_corner_of.get(nont, [])
+
+    def lex_rules(self, str term):
+        return self.__first_term_of.get(term, [])
+
+    def epsilon_rules(self):
+        return self.__epsilon_rules
+
+    def to_rtg(self):
+        rtg = RTG(self.start())
+        for rule in self.__rules:
+            rtg.construct_and_add_rule(rule.lhs().nont(), rule.get_idx(), rule.rhs())
+        return rtg
+
+    def __str__(self):
+        s = ''
+        for rule in self.lhs_nont_to_rules(self.start()):
+            s += str(rule) + '\n'
+        for rule in self.__rules:
+            if rule.lhs().nont() != self.start():
+                s += str(rule) + '\n'
+        return s
+
 
-__all__ = ["LCFRS", "LCFRS_var", "LCFRS_lhs", "LCFRS_rule"]
\ No newline at end of file
+def input_rules(grammar, tokens):
+    """
+    Select the rules of a grammar that may occur in a derivation from the start symbol of a string
+    over tokens. A rule is admissible if all of its terminals occur in tokens. Starting from the
+    admissible rules of rank 0, which are found via the inverted terminal index (term_rules),
+    nonterminals are marked productive bottom-up along rhs_nont_to_rules; finally, the rules are
+    restricted to those reachable from the start symbol. Only the rules that contain some token,
+    the epsilon rules, and the rules enabled by them are visited.
+
+    :param grammar: LCFRS or CompactLCFRS
+    :type tokens: list[str]
+    :return: the selected rules, ordered by idx
+    :rtype: list[LCFRS_rule]
+    """
+    hits = defaultdict(int)
+    candidates = {}
+    for term in set(tokens):
+        for rule in grammar.term_rules(term):
+            hits[rule.get_idx()] += 1
+            candidates[rule.get_idx()] = rule
+
+    # rules with LHS nonterminal whose RHS nonterminals are all productive
+    enabled = defaultdict(list)
+    productive = set()
+    agenda = []
+
+    def enable(rule):
+        nont = rule.lhs().nont()
+        enabled[nont].append(rule)
+        if nont not in productive:
+            productive.add(nont)
+            agenda.append(nont)
+
+    for rule in grammar.epsilon_rules():
+        enable(rule)
+    for idx, rule in candidates.items():
+        if rule.rank() == 0 and hits[idx] == len(set(rule.terms())):
+            enable(rule)
+    pending = {}
+    while agenda:
+        for rule in grammar.rhs_nont_to_rules(agenda.pop()):
+            idx = rule.get_idx()
+            pending[idx] = pending.get(idx, rule.rank()) - 1
+            if pending[idx] == 0 and hits.get(idx, 0) == len(set(rule.terms())):
+                enable(rule)
+
+    reachable = set()
+    if grammar.start() in productive:
+        reachable.add(grammar.start())
+        agenda.append(grammar.start())
+    while agenda:
+        for rule in enabled[agenda.pop()]:
+            for nont in rule.rhs():
+                if nont not in reachable:
+                    reachable.add(nont)
+                    agenda.append(nont)
+    return sorted([rule for nont in reachable for rule in enabled[nont]], key=lambda rule: rule.get_idx())
+
+
+def useless_rules(grammar):
+    """
+    Determine the rules and nonterminals of a grammar that do not occur in any derivation of a
+    terminal string from the start symbol. Productive nonterminals are found bottom-up by counting,
+    for each rule, the RHS occurrences of nonterminals not yet known to be productive; reachable
+    nonterminals are then found top-down via productive rules. Each rule is visited a constant
+    number of times per RHS member.
+
+    :param grammar: LCFRS or CompactLCFRS
+    :return: list of booleans indexed by rule idx, which selects the useless rules (cf. LCFRS.remove_rules),
+        the set of unproductive nonterminals, and the set of productive but unreachable nonterminals
+    :rtype: tuple
+    """
+    cdef int idx
+    rules = grammar.rules()
+    pending = [0] * len(rules)
+    lhs_of = [None] * len(rules)
+    occurrences = defaultdict(list)
+    productive = set()
+    agenda = []
+    for rule in rules:
+        idx = rule.get_idx()
+        lhs_of[idx] = rule.lhs().nont()
+        rhs = rule.rhs()
+        pending[idx] = len(rhs)
+        for nont in rhs:
+            occurrences[nont].append(idx)
+        if not rhs and lhs_of[idx] not in productive:
+            productive.add(lhs_of[idx])
+            agenda.append(lhs_of[idx])
+    while agenda:
+        for idx in occurrences[agenda.pop()]:
+            pending[idx] -= 1
+            if pending[idx] == 0 and lhs_of[idx] not in productive:
+                productive.add(lhs_of[idx])
+                agenda.append(lhs_of[idx])
+
+    rules_of = defaultdict(list)
+    for rule in rules:
+        if pending[rule.get_idx()] == 0:
+            rules_of[rule.lhs().nont()].append(rule)
+    reachable = set()
+    if grammar.start() in productive:
+        reachable.add(grammar.start())
+        agenda.append(grammar.start())
+    while agenda:
+        for rule in rules_of[agenda.pop()]:
+            for nont in rule.rhs():
+                if nont not in reachable:
+                    reachable.add(nont)
+                    agenda.append(nont)
+
+    remove = [pending[idx] > 0 or lhs_of[idx] not in reachable for idx in range(len(rules))]
+    nonts = set(grammar.nonts())
+    return remove, nonts - productive, (nonts & productive) - reachable
+
+
+def remap_feature_log(feature_log, index_map):
+    """
+    Translate rule indices in the keys of a feature log (as filled by add_gram and
+    constituent.induction.fringe_extract_lcfrs) according to the result of LCFRS.remove_rules.
+    Entries of removed rules are dropped.
+    :type feature_log: dict
+    :param index_map: mapping from old to new rule indices, -1 for removed rules
+    """
+    rule_entries = [(key, feature_log.pop(key)) for key in list(feature_log) if isinstance(key[0], int)]
+    for key, count in rule_entries:
+        new_idx = index_map[key[0]]
+        if new_idx >= 0:
+            feature_log[(new_idx,) + key[1:]] = count
+
+
+__all__ = ["LCFRS", "LCFRS_var", "LCFRS_lhs", "LCFRS_rule", "CompactLCFRS", "LCFRS_rule_view", "remap_feature_log",
+           "rule_signature", "TrimReport", "useless_rules", "RestrictedLCFRS", "input_rules"]
\ No newline at end of file
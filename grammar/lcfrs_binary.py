@@ -0,0 +1,350 @@
+# Versioned binary storage format for LCFRS/DCP hybrid grammars.
+#
+# The format replaces pickling of the LCFRS object graph. Nonterminals,
+# terminals and DCP labels are interned into string tables; rules are stored
+# as flat arrays (lhs nonterminal, weight, rhs nonterminals, argument
+# patterns) and the DCP rules of each rule as a preorder encoded integer
+# stream addressed by offsets. All sections are 8-byte aligned, such that the
+# file can be memory-mapped and rules can be decoded one at a time.
+
+from __future__ import print_function
+
+import mmap
+import struct
+import sys
+from array import array
+
+from grammar.lcfrs import LCFRS, LCFRS_lhs, LCFRS_var
+from grammar.dcp import DCP_rule, DCP_var, DCP_index, DCP_string, DCP_term
+
+MAGIC = b'PANDALCF'
+VERSION = 1
+
+# header: magic, version, number of sections, start nonterminal, unit
+_HEADER = struct.Struct('<8sIIiid')
+_SECTION = struct.Struct('<QQ')
+
+SECTIONS = ['nont_offsets', 'nont_blob', 'nont_fanout',
+            'term_offsets', 'term_blob',
+            'label_offsets', 'label_blob',
+            'rule_lhs', 'rule_weight',
+            'rule_rhs_offsets', 'rule_rhs',
+            'rule_arg_offsets', 'arg_offsets', 'arg_elems',
+            'dcp_offsets', 'dcp']
+
+_TYPECODES = {'nont_offsets': 'q', 'nont_fanout': 'i', 'term_offsets': 'q', 'label_offsets': 'q',
+              'rule_lhs': 'i', 'rule_weight': 'd', 'rule_rhs_offsets': 'q', 'rule_rhs': 'i',
+              'rule_arg_offsets': 'q', 'arg_offsets': 'q', 'arg_elems': 'i', 'dcp_offsets': 'q', 'dcp': 'i'}
+
+# tags of the DCP stream
+DCP_VAR_TAG = 0
+DCP_INDEX_TAG = 1
+DCP_STRING_TAG = 2
+DCP_TERM_TAG = 3
+
+# variables <mem,arg> in argument patterns are encoded as negative integers
+_ARG_BITS = 16
+_MAX_MEM = 1 << 15
+
+
+def is_binary_grammar(path):
+    """
+    :param path: path to some file
+    :type path: str
+    :rtype: bool
+    :return: whether the file starts with the magic bytes of the binary grammar format
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def encode_variable(mem, arg):
+    if not 0 <= mem < _MAX_MEM or not 0 <= arg < (1 << _ARG_BITS):
+        raise ValueError('variable <%d,%d> exceeds the range of the binary format' % (mem, arg))
+    return -1 - ((mem << _ARG_BITS) | arg)
+
+
+def decode_variable(code):
+    code = -1 - code
+    return code >> _ARG_BITS, code & ((1 << _ARG_BITS) - 1)
+
+
+class _Interner(object):
+    def __init__(self):
+        self.ids = {}
+        self.symbols = []
+
+    def __call__(self, symbol):
+        if symbol is None:
+            return -1
+        if not isinstance(symbol, str):
+            raise ValueError('only str symbols can be stored in the binary format, got ' + repr(symbol))
+        try:
+            return self.ids[symbol]
+        except KeyError:
+            self.ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            return self.ids[symbol]
+
+    def to_arrays(self):
+        blob = bytearray()
+        offsets = array('q', [0])
+        for symbol in self.symbols:
+            blob += symbol.encode('utf-8')
+            offsets.append(len(blob))
+        return offsets, bytes(blob)
+
+
+def _encode_dcp_object(obj, stream, labels):
+    if isinstance(obj, DCP_var):
+        stream.extend([DCP_VAR_TAG, obj.mem(), obj.arg()])
+    elif isinstance(obj, DCP_index):
+        stream.extend([DCP_INDEX_TAG, obj.index(), labels(obj.edge_label()), labels(obj.pos())])
+    elif isinstance(obj, DCP_string):
+        stream.extend([DCP_STRING_TAG, labels(obj.get_string()), labels(obj.edge_label())])
+    elif isinstance(obj, DCP_term):
+        stream.append(DCP_TERM_TAG)
+        _encode_dcp_object(obj.head(), stream, labels)
+        stream.append(len(obj.arg()))
+        for child in obj.arg():
+            _encode_dcp_object(child, stream, labels)
+    else:
+        raise ValueError('cannot encode DCP object ' + str(obj))
+
+
+def _encode_dcp(dcp, stream, labels):
+    if dcp is None:
+        stream.append(-1)
+        return
+    stream.append(len(dcp))
+    for dcp_rule in dcp:
+        stream.extend([dcp_rule.lhs().mem(), dcp_rule.lhs().arg(), len(dcp_rule.rhs())])
+        for obj in dcp_rule.rhs():
+            _encode_dcp_object(obj, stream, labels)
+
+
+def write_grammar(grammar, path):
+    """
+    Store grammar in the binary format. Rules are written in the order of their index, i.e.,
+    rule i of the loaded grammar has index i.
+
+    :type grammar: LCFRS
+    :param path: output file
+    :type path: str
+    """
+    nonts = _Interner()
+    terms = _Interner()
+    labels = _Interner()
+
+    rules = [grammar.rule_index(i) for i in range(len(grammar.rules()))]
+
+    start = nonts(grammar.start())
+    for nont in grammar.nonts():
+        nonts(nont)
+
+    data = {name: array(_TYPECODES[name]) for name in _TYPECODES}
+    data['rule_rhs_offsets'].append(0)
+    data['rule_arg_offsets'].append(0)
+    data['arg_offsets'].append(0)
+    data['dcp_offsets'].append(0)
+
+    for rule in rules:
+        lhs = rule.lhs()
+        data['rule_lhs'].append(nonts(lhs.nont()))
+        data['rule_weight'].append(rule.weight())
+        data['rule_rhs'].extend([nonts(nont) for nont in rule.rhs()])
+        data['rule_rhs_offsets'].append(len(data['rule_rhs']))
+        for arg in lhs.args():
+            for elem in arg:
+                if isinstance(elem, LCFRS_var):
+                    data['arg_elems'].append(encode_variable(elem.mem, elem.arg))
+                else:
+                    data['arg_elems'].append(terms(elem))
+            data['arg_offsets'].append(len(data['arg_elems']))
+        data['rule_arg_offsets'].append(len(data['arg_offsets']) - 1)
+        _encode_dcp(rule.dcp(), data['dcp'], labels)
+        data['dcp_offsets'].append(len(data['dcp']))
+
+    data['nont_fanout'].extend([grammar.fanout(nont) for nont in nonts.symbols])
+    data['nont_offsets'], data['nont_blob'] = nonts.to_arrays()
+    data['term_offsets'], data['term_blob'] = terms.to_arrays()
+    data['label_offsets'], data['label_blob'] = labels.to_arrays()
+
+    sections = []
+    position = _HEADER.size + _SECTION.size * len(SECTIONS)
+    payload = []
+    for name in SECTIONS:
+        section = data[name]
+        if isinstance(section, array):
+            if sys.byteorder != 'little':
+                section.byteswap()
+            section = section.tobytes()
+        padding = -position % 8
+        position += padding
+        payload.append(b'\0' * padding)
+        sections.append((position, len(section)))
+        payload.append(section)
+        position += len(section)
+
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(SECTIONS), start, 0, float(grammar.unit())))
+        for offset, size in sections:
+            f.write(_SECTION.pack(offset, size))
+        for chunk in payload:
+            f.write(chunk)
+
+
+class BinaryGrammar(object):
+    """
+    Read access to a grammar in the binary format. The file is memory-mapped and rules
+    are decoded lazily, i.e., only when they are requested.
+    """
+    def __init__(self, path):
+        self.__file = open(path, 'rb')
+        self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.__map)
+        magic, version, n_sections, start, _, self.__unit = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise IOError(path + ' is not a binary grammar file')
+        if version != VERSION or n_sections != len(SECTIONS):
+            raise IOError('unsupported version %d of binary grammar file %s' % (version, path))
+        self.__sections = {}
+        for i, name in enumerate(SECTIONS):
+            offset, size = _SECTION.unpack_from(view, _HEADER.size + i * _SECTION.size)
+            section = view[offset:offset + size]
+            if name in _TYPECODES:
+                if sys.byteorder != 'little':
+                    swapped = array(_TYPECODES[name], section.tobytes())
+                    swapped.byteswap()
+                    section = memoryview(swapped)
+                else:
+                    section = section.cast(_TYPECODES[name])
+            self.__sections[name] = section
+        self.__nonts = self.__strings('nont_offsets', 'nont_blob')
+        self.__terms = self.__strings('term_offsets', 'term_blob')
+        self.__labels = self.__strings('label_offsets', 'label_blob')
+        self.__start = self.__nonts[start] if start >= 0 else None
+
+    def __strings(self, offsets_name, blob_name):
+        offsets = self.__sections[offsets_name]
+        blob = self.__sections[blob_name]
+        return [bytes(blob[offsets[i]:offsets[i + 1]]).decode('utf-8') for i in range(len(offsets) - 1)]
+
+    def close(self):
+        self.__sections = {}
+        self.__map.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        return self.__start
+
+    def unit(self):
+        return self.__unit
+
+    def nonterminals(self):
+        return self.__nonts
+
+    def terminals(self):
+        return self.__terms
+
+    def fanout(self, nont_id):
+        return self.__sections['nont_fanout'][nont_id]
+
+    def __len__(self):
+        return len(self.__sections['rule_lhs'])
+
+    def rule(self, i):
+        """
+        Decode the i-th rule.
+
+        :type i: int
+        :return: lhs, rhs nonterminals, weight, dcp rules (or None)
+        :rtype: tuple[LCFRS_lhs, list[str], float, list[DCP_rule]]
+        """
+        sec = self.__sections
+        lhs = LCFRS_lhs(self.__nonts[sec['rule_lhs'][i]])
+        arg_offsets = sec['arg_offsets']
+        elems = sec['arg_elems']
+        for a in range(sec['rule_arg_offsets'][i], sec['rule_arg_offsets'][i + 1]):
+            arg = []
+            for code in elems[arg_offsets[a]:arg_offsets[a + 1]]:
+                if code < 0:
+                    arg.append(LCFRS_var(*decode_variable(code)))
+                else:
+                    arg.append(self.__terms[code])
+            lhs.add_arg(arg)
+        rhs = [self.__nonts[nont] for nont in sec['rule_rhs'][sec['rule_rhs_offsets'][i]:sec['rule_rhs_offsets'][i + 1]]]
+        dcp = self.__decode_dcp(sec['dcp'], sec['dcp_offsets'][i])
+        return lhs, rhs, sec['rule_weight'][i], dcp
+
+    def __label(self, label_id):
+        return self.__labels[label_id] if label_id >= 0 else None
+
+    def __decode_dcp(self, stream, pos):
+        n = stream[pos]
+        if n < 0:
+            return None
+        pos += 1
+        dcp = []
+        for _ in range(n):
+            mem, arg, n_rhs = stream[pos], stream[pos + 1], stream[pos + 2]
+            pos += 3
+            rhs = []
+            for _ in range(n_rhs):
+                obj, pos = self.__decode_dcp_object(stream, pos)
+                rhs.append(obj)
+            dcp.append(DCP_rule(DCP_var(mem, arg), rhs))
+        return dcp
+
+    def __decode_dcp_object(self, stream, pos):
+        tag = stream[pos]
+        if tag == DCP_VAR_TAG:
+            return DCP_var(stream[pos + 1], stream[pos + 2]), pos + 3
+        elif tag == DCP_INDEX_TAG:
+            return DCP_index(stream[pos + 1], edge_label=self.__label(stream[pos + 2]),
+                             pos=self.__label(stream[pos + 3])), pos + 4
+        elif tag == DCP_STRING_TAG:
+            return DCP_string(self.__label(stream[pos + 1]), edge_label=self.__label(stream[pos + 2])), pos + 3
+        elif tag == DCP_TERM_TAG:
+            head, pos = self.__decode_dcp_object(stream, pos + 1)
+            n_args = stream[pos]
+            pos += 1
+            args = []
+            for _ in range(n_args):
+                child, pos = self.__decode_dcp_object(stream, pos)
+                args.append(child)
+            return DCP_term(head, args), pos
+        raise IOError('corrupted DCP stream')
+
+    def rules(self):
+        for i in range(len(self)):
+            yield self.rule(i)
+
+    def to_lcfrs(self):
+        """
+        :rtype: LCFRS
+        :return: the grammar with all rules decoded
+        """
+        grammar = LCFRS(start=self.__start, unit=self.__unit)
+        for lhs, rhs, weight, dcp in self.rules():
+            grammar.add_rule(lhs, rhs, weight=weight, dcp=dcp)
+        return grammar
+
+
+def read_grammar(path):
+    """
+    :param path: file in binary grammar format
+    :type path: str
+    :rtype: LCFRS
+    """
+    with BinaryGrammar(path) as binary:
+        return binary.to_lcfrs()
+
+
+__all__ = ["BinaryGrammar", "write_grammar", "read_grammar", "is_binary_grammar"]
@@ -0,0 +1,94 @@
+# Vectorized operations on rule weights.
+#
+# Weights are NumPy arrays indexed by rule idx (cf. LCFRS.weight_vector) and
+# rules are grouped by their LHS nonterminal (cf. LCFRS.lhs_group_index), i.e.,
+# groups[i] is the id of the LHS nonterminal of rule i. Operations on groups
+# are segment reductions by np.bincount and do not loop over rules in Python.
+
+from __future__ import division
+
+import numpy as np
+
+
+def group_sums(weights, groups, n_groups=None):
+    """
+    :param weights: rule weights
+    :type weights: numpy.ndarray
+    :param groups: group id of each rule
+    :type groups: numpy.ndarray
+    :param n_groups: number of groups (default: max. group id + 1)
+    :return: sum of weights in each group
+    :rtype: numpy.ndarray
+    """
+    if n_groups is None:
+        n_groups = groups.max() + 1 if len(groups) else 0
+    return np.bincount(groups, weights=weights, minlength=n_groups)
+
+
+def group_sizes(groups, n_groups=None):
+    """
+    :return: number of rules in each group
+    :rtype: numpy.ndarray
+    """
+    if n_groups is None:
+        n_groups = groups.max() + 1 if len(groups) else 0
+    return np.bincount(groups, minlength=n_groups)
+
+
+def normalize(weights, groups):
+    """
+    Make weights proper: divide each weight by the sum of its group. Groups whose weights sum to
+    0 are assigned the uniform distribution.
+    :rtype: numpy.ndarray
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    totals = group_sums(weights, groups)[groups]
+    sizes = group_sizes(groups)[groups]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(totals > 0, weights / totals, 1.0 / sizes)
+
+
+def log_weights(weights):
+    """
+    :return: natural logarithm of the weights, -inf for weight 0
+    :rtype: numpy.ndarray
+    """
+    with np.errstate(divide='ignore'):
+        return np.log(np.asarray(weights, dtype=np.float64))
+
+
+def additive_smoothing(weights, groups, alpha):
+    """
+    Add alpha to each weight (i.e., to the counts of relative frequency estimation) and normalize.
+    :type alpha: float
+    :rtype: numpy.ndarray
+    """
+    return normalize(np.asarray(weights, dtype=np.float64) + alpha, groups)
+
+
+def interpolation_smoothing(weights, groups, factor, background=None):
+    """
+    Interpolate the normalized weights with a background distribution:
+    (1 - factor) * weights + factor * background.
+    :param factor: interpolation factor in [0, 1]
+    :type factor: float
+    :param background: weights that are normalized per group (default: uniform distribution per group)
+    :rtype: numpy.ndarray
+    """
+    if background is None:
+        background = 1.0 / group_sizes(groups)[groups]
+    else:
+        background = normalize(background, groups)
+    return (1 - factor) * normalize(weights, groups) + factor * background
+
+
+def prune_mask(weights, threshold):
+    """
+    :return: mask of the rules with weight <= threshold, e.g., for LCFRS.remove_rules
+    :rtype: numpy.ndarray
+    """
+    return np.asarray(weights) <= threshold
+
+
+__all__ = ["group_sums", "group_sizes", "normalize", "log_weights", "additive_smoothing",
+           "interpolation_smoothing", "prune_mask"]
@@ -18,7 +18,7 @@ cdef extern from "LCFR/LCFRS_Parser.h" namespace "LCFR":
         pass
     cdef cppclass LCFRS_Parser[Nonterminal, Terminal]:
         LCFRS_Parser(LCFRS grammar, vector[Terminal] word)
-        void do_parse()
+        void do_parse() nogil
         void prune_trace()
         void print_trace()
         # HypergraphPtr[Nonterminal] convert_trace_to_hypergraph(
@@ -29,6 +29,9 @@ cdef extern from "LCFR/LCFRS_Parser.h" namespace "LCFR":
         pair[Nonterminal, vector[pair[unsigned_long, unsigned_long]]] get_initial_passive_item()
 
 
+cdef extern from "../commons/parallel.h":
+    void parse_all[Parser](vector[Parser*] &parsers, unsigned n_threads) nogil except +
+
 cdef extern from "LCFR/LCFRS_util.h" namespace "LCFR":
     cdef cppclass LCFRSFactory[Nonterminal, Terminal]:
         LCFRSFactory(const Nonterminal initial)
@@ -49,8 +52,12 @@ cdef class PyLCFRSParser:
     cdef unique_ptr[LCFRS_Parser[NONTERMINAL,TERMINAL]] parser
     cdef shared_ptr[LCFRS[NONTERMINAL, TERMINAL]] grammar
     cdef Enumerator tMap
+    cdef public object deadline
+    cdef bint exhausted
     cdef set_grammar(self, shared_ptr[LCFRS[NONTERMINAL, TERMINAL]] grammar)
+    cdef void set_word(self, word)
     cpdef void do_parse(self, word)
+    cpdef bint budget_exhausted(self)
     cpdef void prune_trace(self)
     cpdef map[unsigned_long, pair[NONTERMINAL, vector[pair[unsigned_long, unsigned_long]]]] get_passive_items_map(self)
     cpdef map[unsigned_long, vector[pair[unsigned_long, vector[unsigned_long]]]] convert_trace(self)
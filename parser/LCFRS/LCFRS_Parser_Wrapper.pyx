@@ -1,5 +1,6 @@
 from cython.operator cimport dereference as deref
 from grammar.lcfrs import LCFRS as PyLCFRS, LCFRS_var as PyLCFRS_var
+import time
 
 # Options:
 DEF ENCODE_NONTERMINALS = True
@@ -63,20 +64,64 @@ cdef class PyLCFRSFactory:
                 self.add_rule_to_grammar(rule.rhs(), rule.get_idx())
 
 
+ctypedef LCFRS_Parser[NONTERMINAL, TERMINAL] Parser
+
+
 cdef class PyLCFRSParser:
     def __cinit__(self, Enumerator tMap):
         self.tMap = tMap
+        self.deadline = None
+        self.exhausted = False
 
     cdef set_grammar(self, shared_ptr[LCFRS[NONTERMINAL, TERMINAL]] grammar):
         self.grammar = grammar
 
-    cpdef void do_parse(self, word):
+    cdef void set_word(self, word):
+        # The agenda loop of LCFRS_Parser cannot be interrupted: the deadline (cf. time.time) is
+        # checked before and after it. If it has already passed, the empty word is parsed instead,
+        # such that the trace is valid but does not recognize the input.
+        self.exhausted = self.deadline is not None and time.time() > self.deadline
+        if self.exhausted:
+            word = []
         IF ENCODE_TERMINALS:
             cdef vector[TERMINAL] words_encoded = <vector[TERMINAL]> self.tMap.objects_indices(word)
             self.parser = make_unique[LCFRS_Parser[NONTERMINAL, TERMINAL]](deref(self.grammar), words_encoded)
         ELSE:
             self.parser = make_unique[LCFRS_Parser[NONTERMINAL, TERMINAL]](deref(self.grammar), word)
-        deref(self.parser).do_parse()
+
+    cpdef void do_parse(self, word):
+        self.set_word(word)
+        with nogil:
+            deref(self.parser).do_parse()
+        if self.deadline is not None and time.time() > self.deadline:
+            self.exhausted = True
+
+    def parse_batch(self, words, unsigned n_threads):
+        """
+        Parse the words on n_threads threads without the GIL. The threads share the grammar.
+
+        :return: one parser per word, which holds its trace
+        :rtype: list[PyLCFRSParser]
+        """
+        cdef vector[Parser*] parsers
+        cdef PyLCFRSParser handle
+        handles = []
+        for word in words:
+            handle = PyLCFRSParser(self.tMap)
+            handle.grammar = self.grammar
+            handle.deadline = self.deadline
+            handle.set_word(word)
+            parsers.push_back(handle.parser.get())
+            handles.append(handle)
+        with nogil:
+            parse_all(parsers, n_threads)
+        if self.deadline is not None and time.time() > self.deadline:
+            for handle in handles:
+                handle.exhausted = True
+        return handles
+
+    cpdef bint budget_exhausted(self):
+        return self.exhausted
 
     cpdef void prune_trace(self):
         deref(self.parser).prune_trace()
@@ -5,6 +5,7 @@ from libcpp.vector cimport vector
 from cython.operator cimport dereference as deref
 import time
 from parser.trace_manager.trace_manager cimport PyTraceManager, build_trace_manager_ptr, TraceManagerPtr
+from parser.trace_manager.sharded_reducts import compute_reducts_sharded
 
 
 cdef extern from "LCFR/manager_util.h":
@@ -28,15 +29,39 @@ cdef class PyLCFRSTraceManager(PyTraceManager):
 
         cdef vector[NONTERMINAL] node_labels = range(0, nonterminal_map.counter)
         cdef vector[size_t] edge_labels = range(0, len(grammar.rule_index()))
+        self.node_labels = make_shared[vector[NONTERMINAL]](node_labels)
+        self.edge_labels = make_shared[vector[size_t]](edge_labels)
 
-        self.trace_manager = build_trace_manager_ptr[NONTERMINAL, size_t](
-            make_shared[vector[NONTERMINAL]](node_labels)
-            , make_shared[vector[size_t]](edge_labels)
-            , False)
+        self.trace_manager = build_trace_manager_ptr[NONTERMINAL, size_t](self.node_labels, self.edge_labels, False)
 
         self.nonterminal_map = nonterminal_map
 
-    cpdef void compute_reducts(self, corpus, terminal_labelling):
+    def empty_copy(self):
+        """
+        :return: an empty trace manager with the same parser, nonterminal map and labels
+        :rtype: PyLCFRSTraceManager
+        """
+        cdef PyLCFRSTraceManager copy = PyLCFRSTraceManager.__new__(PyLCFRSTraceManager)
+        copy.parser = self.parser
+        copy.nonterminal_map = self.nonterminal_map
+        copy.node_labels = self.node_labels
+        copy.edge_labels = self.edge_labels
+        copy.trace_manager = build_trace_manager_ptr[NONTERMINAL, size_t](self.node_labels, self.edge_labels, False)
+        return copy
+
+    def compute_reducts(self, corpus, terminal_labelling, workers=1, directory=None):
+        """
+        :param workers: if > 1, the corpus is split into shards, whose reducts are computed by as many forked
+            processes, cf. compute_reducts_sharded
+        :type workers: int
+        :param directory: directory for the serialized reducts of the shards (default: temporary)
+        :type directory: str
+        """
+        if workers > 1:
+            compute_reducts_sharded(self, self.empty_copy,
+                                    lambda manager, trees: manager.compute_reducts(trees, terminal_labelling),
+                                    corpus, workers, directory=directory)
+            return
         start_time = time.time()
         for i, tree in enumerate(corpus):
             word = [terminal_labelling.token_label(token) for token in tree.token_yield()]
@@ -54,11 +79,11 @@ cdef class PyLCFRSTraceManager(PyTraceManager):
         return self.nonterminal_map
 
 
-def compute_LCFRS_reducts(grammar, corpus, terminal_labelling, nonterminal_map=Enumerator()):
+def compute_LCFRS_reducts(grammar, corpus, terminal_labelling, nonterminal_map=Enumerator(), workers=1, directory=None):
     #output_helper("creating trace")
     print("creating trace")
     trace = PyLCFRSTraceManager(grammar, nonterminal_map)
     # output_helper("computing reducts")
     print("computing reducts")
-    trace.compute_reducts(corpus, terminal_labelling)
+    trace.compute_reducts(corpus, terminal_labelling, workers=workers, directory=directory)
     return trace
\ No newline at end of file
@@ -7,8 +7,10 @@ import collections
 
 
 class DerivationItem(PassiveItem):
-    def __init__(self, rule, variables):
-        PassiveItem.__init__(self, rule, variables)
+    __slots__ = ['__children']
+
+    def __init__(self, layout, ranges):
+        PassiveItem.__init__(self, layout, ranges)
         self.__children = []
 
     def add_child(self, child):
@@ -18,7 +20,7 @@ class DerivationItem(PassiveItem):
         return self.__children
 
     def copy(self):
-        item = DerivationItem(self._rule, self._variables)
+        item = DerivationItem(self._layout, self._ranges)
         for child in self.children():
             item.add_child(child)
         return item
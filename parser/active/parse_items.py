@@ -39,43 +39,98 @@ def extend(range, diff):
     return Range(range.left, range.right + diff)
 
 
-class PassiveItem:
-    def __init__(self, rule, variables):
+class PassiveItem(object):
+    """
+    The ranges of an item are packed into a tuple of integers: the left and right position of each
+    slot of the layout of the rule (cf. parser.active.parsing.ItemLayout), i.e., of the LHS components
+    and of the RHS variables, where -1 marks ranges that are not found yet. Items are hashed by
+    their rule and their ranges.
+    """
+    __slots__ = ['_layout', '_ranges', '_cost', '__complete_to']
+
+    def __init__(self, layout, ranges, cost=0.0):
         """
-        :param rule:
-        :type rule: LCFRS_rule
-        :param variables:
+        :param layout:
+        :type layout: ItemLayout
+        :param ranges: packed ranges
+        :type ranges: tuple[int]
+        :param cost: inside cost (negative log weight) of the item
+        :type cost: float
         :return:
         """
-        self._rule = rule
-        self._variables = variables
+        self._layout = layout
+        self._ranges = ranges
+        self._cost = cost
 
         # Caching some frequently needed values
         self.__complete_to = None
-        self.__max_mem = None
 
     def fanout(self):
-        return self._rule.lhs().fanout()
+        return self._layout.fanout
 
     def nont(self):
         """
         :rtype: nonterminal_type
         :return:
         """
-        return self._rule.lhs().nont()
+        return self._layout.nont
+
+    def layout(self):
+        """
+        :rtype: ItemLayout
+        """
+        return self._layout
+
+    def ranges(self):
+        """
+        :return: packed ranges
+        :rtype: tuple[int]
+        """
+        return self._ranges
+
+    def slot(self, variable):
+        """
+        :type variable: LCFRS_var
+        :rtype: int
+        """
+        if variable.mem < 0:
+            return variable.arg
+        return self._layout.offsets[variable.mem] + variable.arg
 
     def range(self, variable):
         """
 
         :param variable:
         :type variable: LCFRS_var
-        :return:
+        :return: range of variable or None, if it is not found yet
         :rtype: Range
         """
-        return self._variables[variable]
+        index = 2 * self.slot(variable)
+        if self._ranges[index] < 0:
+            return None
+        return Range(self._ranges[index], self._ranges[index + 1])
 
     def variables(self):
-        return self._variables
+        """
+        :return: ranges of the LHS components and RHS variables found so far
+        :rtype: dict[LCFRS_var, Range]
+        """
+        return {var: Range(self._ranges[2 * slot], self._ranges[2 * slot + 1])
+                for slot, var in enumerate(self._layout.variables) if self._ranges[2 * slot] >= 0}
+
+    def cost(self):
+        """
+        :rtype: float
+        """
+        return self._cost
+
+    def length(self):
+        """
+        :return: total length of the LHS components found so far
+        :rtype: int
+        """
+        return sum([self._ranges[2 * c_index + 1] - self._ranges[2 * c_index]
+                    for c_index in range(self.complete_to() + 1)])
 
     def complete_to(self):
         """
@@ -91,14 +146,14 @@ class PassiveItem:
         :return:
         :rtype: LCFRS_rule
         """
-        return self._rule
+        return self._layout.rule
 
     def rule_id(self):
         """
         :return:
         :rtype: int
         """
-        return id(self._rule)
+        return id(self._layout.rule)
 
     def action_id(self):
         """
@@ -112,47 +167,33 @@ class PassiveItem:
             ['{' + ','.join([str(self.range(LCFRS_var(-1, arg))) for arg in range(self.complete_to() + 1)]) + '}']
             + ['{' + ','.join([str(self.range(LCFRS_var(mem, arg))) for arg in range(self.max_arg(mem) + 1)]) + '}' for
                mem in range(self.max_mem() + 1)]) + '}'
-        return '[' + self.action_id() + ':' + str(self._rule) + ':' + s + ']'
+        return '[' + self.action_id() + ':' + str(self.rule()) + ':' + s + ']'
 
     def __eq__(self, other):
-        # if id(self) == id(other):
-        #     return True
-        # if not isinstance(other, PassiveItem):
-        #     return False
-        if self.rule() != other.rule():
-            return False
-        # if self.complete_to() != other.complete_to():
-        #     return False
-
-        for var in self._variables.keys():
-            if var in other.variables().keys():
-                if self.range(var) != other.range(var):
-                    return False
-            else:
-                return False
-
-        return True
+        return self._layout is other._layout and self._ranges == other._ranges
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    # def __hash__(self):
-    # return hash(tuple(self.children()))
+    def __hash__(self):
+        return hash((self._layout.index, self._ranges))
 
     def max_mem(self):
-        if self.__max_mem is None:
-            self.__max_mem = max([var.mem for var in self._variables.keys()])
-        return self.__max_mem
+        mems = self._layout.mems
+        return max([mems[slot] for slot in range(len(mems)) if self._ranges[2 * slot] >= 0] + [-1])
 
     def max_arg(self, mem):
-        args = [var.arg for var in self._variables.keys() if var.mem == mem]
-        if args:
-            return max(args)
+        if mem < 0:
+            first, last = 0, self._layout.fanout
         else:
-            return -1
+            first, last = self._layout.offsets[mem], self._layout.offsets[mem + 1]
+        for slot in range(last - 1, first - 1, -1):
+            if self._ranges[2 * slot] >= 0:
+                return slot - first
+        return -1
 
     def copy(self):
-        item = PassiveItem(self._rule, self._variables)
+        item = PassiveItem(self._layout, self._ranges, self._cost)
         return item
 
 
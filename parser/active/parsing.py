@@ -5,19 +5,26 @@ __author__ = 'kilian'
 from grammar.lcfrs import *
 from collections import deque
 from parser.parser_interface import AbstractParser
+from parser.estimates import NullEstimate
 from parser.active.derivation import Derivation, DerivationItem
-from parser.active.parse_items import PassiveItem, terminal_type, Range, extend, length, join
+from parser.active.parse_items import PassiveItem, terminal_type
 import itertools
+import heapq
+import math
 from collections import defaultdict
 
 
 class ActiveItem(PassiveItem):
-    def __init__(self, rule, variables, dot_component, dot_position, remaining_input):
+    __slots__ = ['_dot_component', '_dot_position', '_remaining_input']
+
+    def __init__(self, layout, ranges, dot_component, dot_position, remaining_input, cost=0.0):
         """
-            :param rule:
-            :type rule: LCFRS_rule
+            :param layout:
+            :type layout: ItemLayout
+            :param ranges: packed ranges, cf. PassiveItem
+            :type ranges: tuple[int]
             """
-        PassiveItem.__init__(self, rule, variables)
+        PassiveItem.__init__(self, layout, ranges, cost)
         self._dot_component = dot_component
         self._dot_position = dot_position
         self._remaining_input = remaining_input
@@ -37,7 +44,8 @@ class ActiveItem(PassiveItem):
         :type range: Range
         :return:
         """
-        self._variables[variable] = range
+        index = 2 * self.slot(variable)
+        self._ranges = self._ranges[:index] + (range.left, range.right) + self._ranges[index + 2:]
 
     def action_id(self):
         """
@@ -51,7 +59,7 @@ class ActiveItem(PassiveItem):
             ['{' + ','.join([str(self.range(LCFRS_var(-1, arg))) for arg in range(self._dot_component + 1)]) + '}']
             + ['{' + ','.join([str(self.range(LCFRS_var(mem, arg))) for arg in range(self.max_arg(mem) + 1)]) + '}' for
                mem in range(self.max_mem() + 1)]) + '}'
-        return '[' + self.action_id() + ':' + str(self._rule) + ':' + s + ': ' + str(self._remaining_input) + ']'
+        return '[' + self.action_id() + ':' + str(self.rule()) + ':' + s + ': ' + str(self._remaining_input) + ']'
 
     def convert_to_passive_item(self):
         """
@@ -59,9 +67,7 @@ class ActiveItem(PassiveItem):
         :rtype: PassiveItem
         """
         # since our grammar is ordered, we can assumed all components up to the dot component to be found
-        variables = self._variables.copy()
-
-        item = PassiveItem(self._rule, variables)
+        item = PassiveItem(self._layout, self._ranges, self._cost)
         return item
 
     def remaining_input(self):
@@ -69,40 +75,39 @@ class ActiveItem(PassiveItem):
 
 
 class ScanItem(ActiveItem):
+    __slots__ = ()
+
     def process(self, parser):
         """
         :type parser: Parser
         """
-        c_index, j = self.dot_position()
-        word_tuple_string = self._rule.lhs().arg(c_index)
-        obj = word_tuple_string[j]
-        current_component = LCFRS_var(-1, c_index)
-        current_range = self.range(current_component)
+        layout = self._layout
+        c_index, j = self._dot_component, self._dot_position
+        obj = layout.args[c_index][j]
+        right = self._ranges[2 * c_index + 1]
 
-        if isinstance(obj, LCFRS_var):
-            mem = obj.mem
-            index = obj.arg
-            nont = self._rule.rhs_nont(mem)
+        if isinstance(obj, int):
+            # obj is the slot of a variable
+            mem = layout.mems[obj]
+            first = layout.offsets[mem]
 
-            found_variables = [self.range(LCFRS_var(mem, j)) for j in range(obj.arg)]
+            remaining_input = self._remaining_input - layout.consumed[c_index][j]
 
-            remaining_input = self._remaining_input - number_of_consumed_terminals(self._rule, c_index,
-                                                                                   self._dot_position, mem)
-
-            parser.predict(nont, index, current_range.right, remaining_input, found_variables)
+            parser.predict(layout.rhs[mem], obj - first, right, remaining_input,
+                           self._ranges[2 * first:2 * obj])
 
             self.__class__ = CombineItem
             parser.record_active_item(self)
 
         else:
             assert isinstance(obj, terminal_type)
-            if parser.in_input(current_range.right) and parser.terminal(current_range.right) == obj:
+            if parser.in_input(right) and parser.terminal(right) == obj:
                 # if terminal matches current input position
-                self.set_range(current_component, extend(current_range, 1))
+                self._ranges = self._ranges[:2 * c_index + 1] + (right + 1,) + self._ranges[2 * c_index + 2:]
                 self._dot_position += 1
                 self._remaining_input -= 1
 
-                if self._dot_position == len(word_tuple_string):
+                if self._dot_position == len(layout.args[c_index]):
                     # end of word tuple component reached:
                     item = self.convert_to_passive_item()
                     parser.record_passive_item(item)
@@ -116,52 +121,118 @@ class ScanItem(ActiveItem):
 
 
 class CombineItem(ActiveItem):
+    __slots__ = ()
+
     def action_id(self):
         return 'C'
 
     def process(self, parser):
-        c_index, j = self.dot_position()
-        word_tuple_string = self._rule.lhs().arg(c_index)
-        variable = word_tuple_string[j]
-        assert isinstance(variable, LCFRS_var)
-        current_component = LCFRS_var(-1, c_index)
-        current_position = self.range(LCFRS_var(-1, c_index))
+        layout = self._layout
+        c_index, j = self._dot_component, self._dot_position
+        slot = layout.args[c_index][j]
+        mem = layout.mems[slot]
 
         # start positions of strings
-        range_constraints = [self.range(LCFRS_var(variable.mem, comp)).left for comp in range(variable.arg)]
+        range_constraints = [self._ranges[2 * other] for other in range(layout.offsets[mem], slot)]
         # add end of range right to dot
-        range_constraints += [current_position.right]
+        range_constraints += [self._ranges[2 * c_index + 1]]
 
-        nont = self._rule.rhs_nont(variable.mem)
+        nont = layout.rhs[mem]
+        parser.await_passive_items(self, nont, range_constraints)
         passive_items = parser.query_passive_items(nont, range_constraints)
 
         for item in passive_items:
-            assert isinstance(item, PassiveItem)
+            self.combine(item, parser)
 
-            consistent = True
-
-            for comp in range(variable.arg):
-                if item.range(LCFRS_var(-1, comp)) != self.range(LCFRS_var(variable.mem, comp)):
-                    consistent = False
-                    break
+    def combine(self, item, parser):
+        """
+        Combine with a passive item of the nonterminal at the dot.
+        :type item: PassiveItem
+        :type parser: Parser
+        """
+        assert isinstance(item, PassiveItem)
+        layout = self._layout
+        c_index, j = self._dot_component, self._dot_position
+        slot = layout.args[c_index][j]
+        first = layout.offsets[layout.mems[slot]]
+        arg = slot - first
+        ranges = self._ranges
+        item_ranges = item.ranges()
+
+        if item_ranges[:2 * arg] != ranges[2 * first:2 * slot]:
+            return
+
+        # the range constraints ensure that the item continues the current component
+        left, right = item_ranges[2 * arg], item_ranges[2 * arg + 1]
+        last = j + 1 == len(layout.args[c_index])
+        remaining_input = self._remaining_input - (right - left)
+        if not (remaining_input > 0 or (remaining_input == 0 and last)):
+            return
+
+        # new ranges, set ranges for current component and found variable
+        new_ranges = list(ranges)
+        new_ranges[2 * c_index + 1] = right
+        new_ranges[2 * slot] = left
+        new_ranges[2 * slot + 1] = right
+        new_ranges = tuple(new_ranges)
+
+        # the cost of the child is added once its last component is found
+        cost = self._cost
+        if arg == item.fanout() - 1:
+            cost += item.cost()
+
+        if last:
+            parser.record_passive_item(PassiveItem(layout, new_ranges, cost))
+        else:
+            parser.record_active_item(ScanItem(layout, new_ranges, c_index, j + 1, remaining_input, cost))
 
-            if consistent:
-                remaining_input = self._remaining_input - length(item.range(LCFRS_var(-1, variable.arg)))
-                if not (remaining_input > 0 or (remaining_input == 0 and j + 1 == len(word_tuple_string))):
-                    continue
 
-                # new variables dict, set ranges for found variables
-                variables = dict(self._variables)
-                new_position = join(current_position, item.range(LCFRS_var(-1, variable.arg)))
-                variables[current_component] = new_position
-                variables[variable] = item.range(LCFRS_var(-1, variable.arg))
+class ItemLayout(object):
+    """
+    Metadata of a rule that is computed once per parser: the slots of the ranges of items of the
+    rule (the LHS components 0, ..., fanout - 1, followed by the components of each RHS member),
+    the LHS arguments with variables replaced by their slots and the filter criteria of
+    minimum_string_size, number_of_consumed_terminals and do_all_terminals_occur_in_input.
+    """
+    __slots__ = ['rule', 'index', 'nont', 'fanout', 'rhs', 'offsets', 'variables', 'mems', 'args',
+                 'min_size', 'consumed', 'members', 'unset']
 
-                active_item = ScanItem(self._rule, variables, c_index, j + 1, remaining_input)
-                if j + 1 == len(word_tuple_string):
-                    passive_item = active_item.convert_to_passive_item()
-                    parser.record_passive_item(passive_item)
-                else:
-                    parser.record_active_item(active_item)
+    def __init__(self, rule, index):
+        """
+        :type rule: LCFRS_rule
+        :param index: unique id of the layout, which is used in the keys of items
+        :type index: int
+        """
+        self.rule = rule
+        self.index = index
+        lhs = rule.lhs()
+        self.nont = lhs.nont()
+        self.fanout = lhs.fanout()
+        self.rhs = [rule.rhs_nont(mem) for mem in range(rule.rank())]
+
+        rhs_fanouts = [0] * rule.rank()
+        for arg in lhs.args():
+            for obj in arg:
+                if isinstance(obj, LCFRS_var):
+                    rhs_fanouts[obj.mem] = max(rhs_fanouts[obj.mem], obj.arg + 1)
+        # first slot of each RHS member (and total number of slots)
+        self.offsets = []
+        self.variables = [LCFRS_var(-1, c_index) for c_index in range(self.fanout)]
+        for mem, fanout in enumerate(rhs_fanouts):
+            self.offsets.append(len(self.variables))
+            self.variables += [LCFRS_var(mem, arg) for arg in range(fanout)]
+        self.offsets.append(len(self.variables))
+        self.mems = [var.mem for var in self.variables]
+        self.unset = (-1, ) * (2 * len(self.variables))
+
+        self.args = [[self.offsets[obj.mem] + obj.arg if isinstance(obj, LCFRS_var) else obj for obj in arg]
+                     for arg in lhs.args()]
+        self.min_size = [minimum_string_size(rule, c_index) for c_index in range(self.fanout)]
+        self.consumed = [[number_of_consumed_terminals(rule, c_index, j, obj.mem) if isinstance(obj, LCFRS_var)
+                          else None for j, obj in enumerate(arg)] for c_index, arg in enumerate(lhs.args())]
+        # members of the components from c_index on, where variables are None
+        self.members = [[None if isinstance(obj, LCFRS_var) else obj for arg in lhs.args()[c_index:] for obj in arg]
+                        for c_index in range(self.fanout)]
 
 
 class Parser(AbstractParser):
@@ -174,12 +245,15 @@ class Parser(AbstractParser):
         return all_trees
 
     def best_derivation_tree(self):
+        if self.__best_first:
+            return self.__viterbi_derivation_tree()
         best_derivation = None
         best_weight = float('-inf')
         for derivation in self.all_derivation_trees():
             # print "any: ", derivation, derivation.weight()
             if derivation.weight() > best_weight:
                 best_derivation = derivation
+                best_weight = derivation.weight()
         # print "best:" , best_derivation, best_weight
         return best_derivation
 
@@ -192,28 +266,50 @@ class Parser(AbstractParser):
 
     def recognized(self):
         for item in self.query_passive_items(self.__grammar.start(), [0]):
-            if item.range(LCFRS_var(-1, 0)) == Range(0, len(self.__word)):
+            if item.ranges()[1] == len(self.__word):
                 return True
         return False
 
-    def __init__(self, grammar, input=None, debug=False):
+    def __init__(self, grammar, input=None, debug=False, filter_input=True, best_first=False, estimate=None,
+                 deadline=None, max_items=None):
         """
 
             :param grammar:
             :type grammar: LCFRS
             :param input:
+            :param filter_input: predict with the rules of grammar.filter_for_input(input) only
+            :type filter_input: bool
+            :param best_first: process items by increasing inside cost (plus estimate) and stop as soon as
+                the goal item is found; best_derivation_tree() then returns the Viterbi derivation
+                (requires rule weights <= 1)
+            :type best_first: bool
+            :param estimate: outside estimate for A* parsing in best-first mode (default: NullEstimate)
+            :type estimate: OutsideEstimate
+            :param deadline: cf. AbstractParser.set_budget
+            :type deadline: float
+            :param max_items: cf. AbstractParser.set_budget
+            :type max_items: int
             :return:
             """
         super(Parser, self).__init__(grammar, input)
+        self.set_budget(deadline, max_items)
         self.__debug = debug
         self.__grammar = grammar
+        self.__filter_input = filter_input
+        self.__best_first = best_first
+        self.__estimate = estimate if estimate is not None else NullEstimate()
+        self.__rules = grammar
+        self.__layouts = {}
         self.__word = input
         self.__scan_items = set()
         self.__combine_items = set()
         self.__passive_items = {}
+        self.__passive_index = {}
+        self.__predicted = set()
         self.__process_counter = 0
         self.__scan_agenda = deque()
         self.__combine_agenda = []
+        self.__init_best_first()
         if input is not None:
             self.__init_agenda()
             self.__parse()
@@ -229,16 +325,43 @@ class Parser(AbstractParser):
         self.__scan_items = set()
         self.__combine_items = set()
         self.__passive_items = {}
+        self.__passive_index = {}
+        self.__predicted = set()
         self.__process_counter = 0
         self.__scan_agenda = deque()
         self.__combine_agenda = []
+        self.__init_best_first()
+
+    def __init_best_first(self):
+        # priority agenda of all kinds of items
+        self.__agenda = []
+        self.__agenda_counter = 0
+        # lowest cost by key of active item
+        self.__active_costs = {}
+        # combine items and requests for the next component by key of the passive items they wait for
+        self.__waiting = defaultdict(list)
+        self.__predictions = defaultdict(list)
+        self.__stored_at = {}
+        self.__estimates = {}
 
     def parse(self):
         self.__init_agenda()
         self.__parse()
 
     def __init_agenda(self):
-        self.predict(self.__grammar.start(), 0, 0, len(self.__word), [])
+        self.__rules = self.__grammar.filter_for_input(self.__word) if self.__filter_input else self.__grammar
+        self.predict(self.__grammar.start(), 0, 0, len(self.__word), ())
+
+    def __layout(self, rule):
+        """
+        :type rule: LCFRS_rule
+        :rtype: ItemLayout
+        """
+        # the layout keeps the rule alive, hence its id is not reused
+        layout = self.__layouts.get(id(rule))
+        if layout is None:
+            layout = self.__layouts[id(rule)] = ItemLayout(rule, len(self.__layouts))
+        return layout
 
     def record_passive_item(self, item):
         """
@@ -247,20 +370,27 @@ class Parser(AbstractParser):
         :type item: PassiveItem
         :return:
         """
-        key = tuple(
-            [item.nont()] + [item.range(LCFRS_var(-1, c_index)).left for c_index in range(item.complete_to() + 1)])
-        if key in self.__passive_items:
-            if item not in self.__passive_items[key]:
-                self.__passive_items[key] += [item]
-                if self.__debug:
-                    print(" recorded   ", item)
-            elif self.__debug:
+        if self.__best_first:
+            self.__push(item)
+            return
+        if item in self.__passive_index:
+            if self.__debug:
                 print(" skipped    ", item)
         else:
-            self.__passive_items[key] = [item]
+            items = self.__passive_items.setdefault(self.__passive_key(item), [])
+            self.__passive_index[item] = len(items)
+            items.append(item)
             if self.__debug:
                 print(" recorded   ", item)
 
+    @staticmethod
+    def __passive_key(item):
+        """
+        :return: nonterminal and start positions of the components found so far
+        :rtype: tuple
+        """
+        return (item.nont(), ) + item.ranges()[0:2 * item.complete_to() + 1:2]
+
     def record_active_item(self, item):
         """
 
@@ -268,11 +398,16 @@ class Parser(AbstractParser):
         :type item: ActiveItem
         :return:
         """
-        key = tuple([item.action_id(), item.nont(), item.rule_id(), item.dot_position(), item.remaining_input()] + [
-            item.range(LCFRS_var(-1, c_index)) for c_index in range(item.dot_position()[0] + 1)] + [
-                        item.range(LCFRS_var(mem, arg)) for mem in range(item.max_mem() + 1) for arg in
-                        range(item.max_arg(mem) + 1)]
-                    )
+        key = self.__active_key(item)
+        if self.__best_first:
+            if key not in self.__active_costs or item.cost() < self.__active_costs[key]:
+                self.__active_costs[key] = item.cost()
+                self.__push(item)
+                if self.__debug:
+                    print(" recorded   ", item)
+            elif self.__debug:
+                print(" skipped    ", item)
+            return
         if isinstance(item, CombineItem):
             if key in self.__combine_items:
                 if self.__debug:
@@ -293,6 +428,14 @@ class Parser(AbstractParser):
                 if self.__debug:
                     print(" recorded   ", item)
 
+    @staticmethod
+    def __active_key(item):
+        """
+        :type item: ActiveItem
+        :rtype: tuple
+        """
+        return item.action_id(), item.layout().index, item.dot_position(), item.remaining_input(), item.ranges()
+
     def query_passive_items(self, nont, range_constraints):
         """
 
@@ -307,8 +450,16 @@ class Parser(AbstractParser):
         return self.__passive_items.get(key, [])
 
     def __parse(self):
+        budget = self.budget
+        if budget is not None:
+            budget.reset()
+        if self.__best_first:
+            self.__parse_best_first(budget)
+            return
         while self.__combine_agenda or self.__scan_agenda:
             while self.__scan_agenda:
+                if budget is not None and budget.spend():
+                    return
                 item = self.__scan_agenda.popleft()
                 if self.__debug:
                     self.__process_counter += 1
@@ -318,6 +469,8 @@ class Parser(AbstractParser):
 
                 item.process(self)
             if self.__combine_agenda:
+                if budget is not None and budget.spend():
+                    return
                 item = self.__combine_agenda.pop()
                 if self.__debug:
                     self.__process_counter += 1
@@ -326,29 +479,92 @@ class Parser(AbstractParser):
                     print("process  {:>3d}".format(self.__process_counter), item)
                 item.process(self)
 
+    def __parse_best_first(self, budget):
+        while self.__agenda:
+            if budget is not None and budget.spend():
+                return
+            _, _, item = heapq.heappop(self.__agenda)
+            if self.__debug:
+                self.__process_counter += 1
+                print("process  {:>3d}".format(self.__process_counter), item)
+            if isinstance(item, ActiveItem):
+                # skip outdated entries of items that were recorded with lower cost meanwhile
+                if item.cost() <= self.__active_costs[self.__active_key(item)]:
+                    item.process(self)
+            elif self.__store_passive_item(item) and item.nont() == self.__grammar.start() \
+                    and item.ranges()[:2] == (0, len(self.__word)):
+                return
+
+    def __push(self, item):
+        """
+        Add item to the priority agenda.
+        :type item: PassiveItem
+        """
+        complete = not isinstance(item, ActiveItem) and item.complete_to() == item.fanout() - 1
+        key = item.nont(), item.length(), complete
+        if key not in self.__estimates:
+            if complete:
+                self.__estimates[key] = self.__estimate.passive(item.nont(), item.length(), len(self.__word))
+            else:
+                self.__estimates[key] = self.__estimate.active(item.nont(), item.length(), len(self.__word))
+        self.__agenda_counter += 1
+        heapq.heappush(self.__agenda, (item.cost() + self.__estimates[key], self.__agenda_counter, item))
+
+    def __store_passive_item(self, item):
+        """
+        Store passive item from the agenda and combine it with the items waiting for it.
+        If an equal item is stored already, it is replaced, if item has lower cost.
+        :type item: PassiveItem
+        :return: whether item was stored
+        :rtype: bool
+        """
+        key = self.__passive_key(item)
+        items = self.__passive_items.setdefault(key, [])
+        position = self.__passive_index.get(item)
+        if position is not None:
+            if item.cost() >= items[position].cost():
+                if self.__debug:
+                    print(" skipped    ", item)
+                return False
+            items[position] = item
+        else:
+            self.__passive_index[item] = len(items)
+            items.append(item)
+        if self.__debug:
+            print(" recorded   ", item)
+        self.__stored_at[id(item)] = len(self.__stored_at)
+
+        for combine_item in list(self.__waiting[key]):
+            combine_item.combine(item, self)
+        if item.complete_to() < item.fanout() - 1:
+            ranges = item.ranges()[:2 * item.complete_to() + 2]
+            for input_position, remaining_input in list(self.__predictions[(item.nont(), ) + ranges]):
+                self.__predict_next_component(item, item.complete_to() + 1, input_position, remaining_input)
+        return True
+
+    def await_passive_items(self, item, nont, range_constraints):
+        """
+        In best-first mode, register combine item for the passive items with key nont and range_constraints
+        that are stored later.
+        :type item: CombineItem
+        """
+        if self.__best_first:
+            self.__waiting[tuple([nont] + range_constraints)].append(item)
+
     def query_passive_items_strict(self, nont, complete, ranges):
         """
         :param nont:
         :type nont: nonterminal_type
         :param complete:
         :type complete: int
-        :param ranges: list[Range]
+        :param ranges: packed ranges of the first complete components
+        :type ranges: tuple[int]
         :return:
+        :rtype: list[PassiveItem]
         """
-        range_constraints = list(map(lambda x: x.left, ranges))
-        result = []
-        for passive_item in self.query_passive_items(nont, range_constraints):
-            assert isinstance(passive_item, PassiveItem)
-
-            consistent = True
-            for c_index in range(complete):
-                if ranges[c_index] != passive_item.range(LCFRS_var(-1, c_index)):
-                    consistent = False
-                    break
-
-            if consistent:
-                result.append(passive_item)
-        return result
+        range_constraints = list(ranges[0:2 * complete:2])
+        return [passive_item for passive_item in self.query_passive_items(nont, range_constraints)
+                if passive_item.ranges()[:2 * complete] == ranges]
 
     def predict(self, nont, component, input_position, remaining_input, found_variables):
         """
@@ -357,45 +573,62 @@ class Parser(AbstractParser):
         :type component: int
         :param input_position:
         :type input_position: int
-        :param found_variables:
-        :type found_variables: list[Range]
+        :param found_variables: packed ranges of the components 0, ..., component - 1
+        :type found_variables: tuple[int]
         :rtype: Bool
         """
-        assert len(found_variables) == component
+        assert len(found_variables) == 2 * component
         predicted_new = False
         if component == 0:
-            for rule in self.__grammar.lhs_nont_to_rules(nont):
+            # the items predicted for the first component only depend on the grammar
+            if (nont, input_position, remaining_input) in self.__predicted:
+                return False
+            self.__predicted.add((nont, input_position, remaining_input))
+            for rule in self.__rules.lhs_nont_to_rules(nont):
+                layout = self.__layout(rule)
                 # TODO: filtering
-                if minimum_string_size(rule, 0) > remaining_input:
+                if layout.min_size[0] > remaining_input:
                     continue
-                if not do_all_terminals_occur_in_input(rule, component, self.__word, input_position):
+                if not terminals_occur(layout.members[0], self.__word, input_position):
                     continue
                 # TODO: filtering end
-                initial_range = Range(input_position, input_position)
-                variables = defaultdict()
-                variables[LCFRS_var(-1, 0)] = initial_range
-                item = ScanItem(rule, variables, 0, 0, remaining_input)
+                ranges = (input_position, input_position) + layout.unset[2:]
+                cost = -math.log(rule.weight()) if self.__best_first else 0.0
+                item = ScanItem(layout, ranges, 0, 0, remaining_input, cost)
                 predicted_new = self.record_active_item(item) or predicted_new
         else:
+            if self.__best_first:
+                self.__predictions[(nont, ) + found_variables].append((input_position, remaining_input))
             for passive_item in self.query_passive_items_strict(nont, component, found_variables):
-                assert isinstance(passive_item, PassiveItem)
+                predicted_new = self.__predict_next_component(passive_item, component, input_position,
+                                                              remaining_input) or predicted_new
 
-                # TODO: filtering
-                if minimum_string_size(passive_item.rule(), component) > remaining_input:
-                    continue
-                if not do_all_terminals_occur_in_input(passive_item.rule(), component, self.__word, input_position):
-                    continue
-                # TODO: filtering end
+        return predicted_new
+
+    def __predict_next_component(self, passive_item, component, input_position, remaining_input):
+        """
+        Continue passive item, that is complete up to component - 1, with component.
+        :type passive_item: PassiveItem
+        :type component: int
+        :type input_position: int
+        :type remaining_input: int
+        """
+        assert isinstance(passive_item, PassiveItem)
+        layout = passive_item.layout()
 
-                variables = passive_item.variables().copy()
-                variables[LCFRS_var(-1, component)] = Range(input_position, input_position)
+        # TODO: filtering
+        if layout.min_size[component] > remaining_input:
+            return False
+        if not terminals_occur(layout.members[component], self.__word, input_position):
+            return False
+        # TODO: filtering end
 
-                item = ScanItem(passive_item.rule(), variables, component, 0,
-                    remaining_input)
+        ranges = passive_item.ranges()
+        ranges = ranges[:2 * component] + (input_position, input_position) + ranges[2 * component + 2:]
 
-                predicted_new = self.record_active_item(item) or predicted_new
+        item = ScanItem(layout, ranges, component, 0, remaining_input, passive_item.cost())
 
-        return predicted_new
+        return self.record_active_item(item)
 
     def terminal(self, position):
         """
@@ -423,26 +656,28 @@ class Parser(AbstractParser):
         :type item: PassiveItem
         :return:
         """
-        range_constraints = [item.range(LCFRS_var(-1, arg)).left() for arg in range(item.complete_to() + 1)]
-        key = tuple([item.nont()] + range_constraints)
-        self.__passive_items.get(key, []).remove(item)
+        items = self.__passive_items.get(self.__passive_key(item), [])
+        items.remove(item)
+        del self.__passive_index[item]
+        for position, other in enumerate(items):
+            self.__passive_index[other] = position
 
     def connect_passive_items(self, start):
         """
         :type start: PassiveItem
         :rtype: list[DerivationItem]
         """
+        layout = start.layout()
         rank = start.rule().rank()
         # either a leaf in the parse tree, or already connected
         if rank == 0:
-            return [DerivationItem(start.rule(), start.variables())]
+            return [DerivationItem(layout, start.ranges())]
 
         connected_children = []
         for mem in range(rank):
-            unconnected_mem_children = self.query_passive_items_strict(start.rule().rhs_nont(mem),
-                                                                       start.max_arg(mem) + 1,
-                                                                       [start.range(LCFRS_var(mem, arg)) for arg in
-                                                                        range(start.max_arg(mem) + 1)])
+            first, last = layout.offsets[mem], layout.offsets[mem + 1]
+            unconnected_mem_children = self.query_passive_items_strict(layout.rhs[mem], last - first,
+                                                                       start.ranges()[2 * first:2 * last])
             connected_mem_children = []
             for child in unconnected_mem_children:
                 connected_mem_children += self.connect_passive_items(child)
@@ -453,7 +688,7 @@ class Parser(AbstractParser):
 
         connected_selfs = []
         for choice in itertools.product(*connected_children):
-            connected_item = DerivationItem(start.rule(), start.variables())
+            connected_item = DerivationItem(layout, start.ranges())
             for child in list(choice):
                 connected_item.add_child(child)
             connected_selfs.append(connected_item)
@@ -465,10 +700,42 @@ class Parser(AbstractParser):
 
         return connected_selfs
 
+    def __viterbi_derivation_tree(self):
+        """
+        :return: derivation of the goal item with lowest cost or None
+        :rtype: Derivation
+        """
+        roots = [item for item in self.query_passive_items(self.__grammar.start(), [0])
+                 if item.ranges()[1] == len(self.__word)]
+        if not roots:
+            return None
+        root = min(roots, key=lambda item: (item.cost(), self.__stored_at[id(item)]))
+        derivation = Derivation()
+        derivation_tree(derivation, self.__viterbi_derivation_item(root), None)
+        return derivation
+
+    def __viterbi_derivation_item(self, item):
+        """
+        Connect passive item with the cheapest children, each of which was stored before item.
+        :type item: PassiveItem
+        :rtype: DerivationItem
+        """
+        layout = item.layout()
+        connected = DerivationItem(layout, item.ranges())
+        for mem in range(item.rule().rank()):
+            first, last = layout.offsets[mem], layout.offsets[mem + 1]
+            children = [child for child
+                        in self.query_passive_items_strict(layout.rhs[mem], last - first,
+                                                           item.ranges()[2 * first:2 * last])
+                        if self.__stored_at[id(child)] < self.__stored_at[id(item)]]
+            child = min(children, key=lambda child: (child.cost(), self.__stored_at[id(child)]))
+            connected.add_child(self.__viterbi_derivation_item(child))
+        return connected
+
     def successful_root_items(self):
         connected_items = []
         for passive_item in self.query_passive_items(self.__grammar.start(), [0]):
-            if passive_item.range(LCFRS_var(-1, 0)) == Range(0, len(self.__word)):
+            if passive_item.ranges()[1] == len(self.__word):
                 connected_items += self.connect_passive_items(passive_item)
         return connected_items
 
@@ -540,6 +807,27 @@ def number_of_consumed_terminals(rule, start_component, start_position, current_
     return terminals
 
 
+def terminals_occur(members, input, input_index):
+    """
+    Same as do_all_terminals_occur_in_input for the precomputed members of ItemLayout.
+    :param members: terminals and variables (None) of the remaining components of a rule
+    :type members: list[str]
+    :type input: list[str]
+    :type input_index: int
+    :rtype: bool
+    """
+    for member in members:
+        if member is not None:
+            try:
+                input_index = input.index(member, input_index)
+            except ValueError:
+                return False
+        input_index += 1
+        if input_index > len(input):
+            return False
+    return True
+
+
 def do_all_terminals_occur_in_input(rule, start_component, input, input_index, end_component=None):
     if end_component is None or end_component > rule.lhs().fanout():
         end_component = rule.lhs().fanout()
@@ -4,6 +4,9 @@ from parser.trace_manager.sm_trainer import PyLatentAnnotation
 from parser.supervised_trainer.trainer import PyDerivationManager
 from parser.coarse_to_fine_parser.trace_weight_projection import py_edge_weight_projection
 from parser.trace_manager.trace_manager import add, prod
+from parser.discodop_parser.grammar_adapter import rule_idx_from_label, striplabelre, unescape_brackets
+from grammar.lcfrs_derivation import LCFRSDerivationWrapper
+from sys import stdout
 import math
 
 
@@ -158,4 +161,314 @@ class Coarse_to_fine_parser(AbstractParser):
         return self.base_parser.resolve_path(preprocess_path)
 
 
-__all__ = ["Coarse_to_fine_parser"]
+def chart_to_forest(chart, disco_grammar):
+    """
+    :param chart: a populated Chart from the discodop parser (obtained with *disco_grammar*)
+    :param disco_grammar: a discodop grammar
+    :return: the items (nonterminal, span) of the chart, the hyperedges (rule index, head, tails)
+        between the positions of the items and the position of the root item
+    :rtype: tuple[list[tuple[str, tuple[int]]], list[tuple[int, int, list[int]]], int]
+    Extracts the parse forest of the chart, where (like in PyDerivationManager.convert_chart_to_hypergraph)
+    the intermediate nodes, which discodop adds for each rule, are contracted into the hyperedges.
+    """
+    items = []
+    positions = {}
+    for node in range(1, chart.numitems()):
+        nont = unescape_brackets(disco_grammar.nonterminalstr(chart.label(node)))
+        if striplabelre.match(nont):
+            continue
+        positions[node] = len(items)
+        items.append((nont, tuple(chart.indices(node))))
+
+    edges = []
+    for node in range(1, chart.numitems()):
+        if node not in positions:
+            continue
+        for edge_num in range(chart.numedges(node)):
+            intermediate = chart.getEdgeForItem(node, edge_num)[1]
+            rule_idx = rule_idx_from_label(disco_grammar.nonterminalstr(chart.label(intermediate)))
+            for edge_num_inter in range(chart.numedges(intermediate)):
+                edge = chart.getEdgeForItem(intermediate, edge_num_inter)
+                tails = [positions[child] for child in [edge[1], edge[2]] if child != 0] \
+                    if isinstance(edge, tuple) else []
+                edges.append((rule_idx, positions[node], tails))
+
+    return items, edges, positions[chart.root()]
+
+
+def restrict_forest(items, edges, root, keep):
+    """
+    :param keep: whether the item at each position survives
+    :type keep: list[bool]
+    :return: the forest (items, edges, root) with the surviving items only, which is trimmed to the
+        items that are derivable and reachable from the root, or None if the root is not derivable
+    """
+    # bottom-up: items with a derivation by surviving items
+    missing = [len(tails) for _, _, tails in edges]
+    edges_by_tail = [[] for _ in items]
+    agenda = []
+    for idx, (_, head, tails) in enumerate(edges):
+        if not keep[head] or not all([keep[tail] for tail in tails]):
+            missing[idx] = -1
+            continue
+        for tail in tails:
+            edges_by_tail[tail].append(idx)
+        if not tails:
+            agenda.append(head)
+    derivable = [False] * len(items)
+    while agenda:
+        node = agenda.pop()
+        if derivable[node]:
+            continue
+        derivable[node] = True
+        for idx in edges_by_tail[node]:
+            missing[idx] -= 1
+            if missing[idx] == 0:
+                agenda.append(edges[idx][1])
+    if not derivable[root]:
+        return None
+
+    # top-down: derivable items that are reachable from the root
+    edges_by_head = [[] for _ in items]
+    for idx, (_, head, _) in enumerate(edges):
+        if missing[idx] == 0:
+            edges_by_head[head].append(idx)
+    reachable = [False] * len(items)
+    reachable[root] = True
+    agenda = [root]
+    while agenda:
+        node = agenda.pop()
+        for idx in edges_by_head[node]:
+            for tail in edges[idx][2]:
+                if not reachable[tail]:
+                    reachable[tail] = True
+                    agenda.append(tail)
+
+    positions = {}
+    restricted_items = []
+    for node, item in enumerate(items):
+        if reachable[node]:
+            positions[node] = len(restricted_items)
+            restricted_items.append(item)
+    restricted_edges = [(rule_idx, positions[head], [positions[tail] for tail in tails])
+                        for idx, (rule_idx, head, tails) in enumerate(edges)
+                        if missing[idx] == 0 and reachable[head]]
+    return restricted_items, restricted_edges, positions[root]
+
+
+class PruningStatistics(object):
+    """
+    Sizes of the parse forests before and after the pruning at one level of the coarse-to-fine
+    parser, summed over all parsed sentences.
+    """
+    def __init__(self, level, threshold):
+        self.level = level
+        self.threshold = threshold
+        self.sentences = 0
+        self.nodes = 0
+        self.edges = 0
+        self.surviving_nodes = 0
+        self.surviving_edges = 0
+        # sentences, for which the pruning removed all derivations and the forest was kept
+        self.failures = 0
+
+    def add(self, nodes, edges, surviving_nodes, surviving_edges, failed=False):
+        self.sentences += 1
+        self.nodes += nodes
+        self.edges += edges
+        self.surviving_nodes += surviving_nodes
+        self.surviving_edges += surviving_edges
+        if failed:
+            self.failures += 1
+
+    def __str__(self):
+        def ratio(part, total):
+            return 100.0 * part / total if total else 100.0
+        return "level %d (threshold %g): %d sentences, nodes %d -> %d (%.1f%%), edges %d -> %d (%.1f%%), " \
+               "%d failures" % (self.level, self.threshold, self.sentences,
+                                self.nodes, self.surviving_nodes, ratio(self.surviving_nodes, self.nodes),
+                                self.edges, self.surviving_edges, ratio(self.surviving_edges, self.edges),
+                                self.failures)
+
+
+class MultiLevelCoarseToFineParser(AbstractParser):
+    """
+    Coarse-to-fine parser over a hierarchy of latent annotations of the same base grammar, e.g.,
+    the annotations after each split/merge cycle. The sentence is parsed with the base grammar by
+    discodop. Then, for each level of the hierarchy, the inside/outside weights of the latent
+    annotation are computed over the items (nonterminal, span) that survived the previous levels
+    and the items with a posterior probability below the threshold of the level are pruned.
+    The remaining forest is decoded with the finest annotation (max-rule-product, max-rule-sum,
+    or variational).
+    """
+    def __init__(self,
+                 grammar,
+                 la,
+                 grammarInfo,
+                 nontMap,
+                 base_parser=None,
+                 input=None,
+                 k=50,
+                 cfg_ctf=False,
+                 thresholds=1e-4,
+                 sum_op=False,
+                 variational=False,
+                 statistics=True):
+        """
+        :param la: latent annotations from coarse to fine
+        :type la: list[PyLatentAnnotation] | PyLatentAnnotation
+        :param base_parser: a parser with the base grammar, whose chart is pruned
+        :type base_parser: DiscodopKbestParser
+        :param thresholds: minimum posterior probability of an item at each level
+            (or one threshold for all levels); 0.0 disables the pruning at that level
+        :type thresholds: list[float] | float
+        :param statistics: collect PruningStatistics for each level
+        :type statistics: bool
+        """
+        self.grammar = grammar
+        self.la = [la] if isinstance(la, PyLatentAnnotation) else list(la)
+        assert len(self.la) > 0
+        self.grammarInfo = grammarInfo
+        self.nontMap = nontMap
+        if base_parser is None:
+            from parser.discodop_parser.parser import DiscodopKbestParser
+            base_parser = DiscodopKbestParser(grammar, input=input, k=k, nontMap=nontMap, cfg_ctf=cfg_ctf)
+        self.base_parser = base_parser
+        if isinstance(thresholds, (int, float)):
+            thresholds = [thresholds] * len(self.la)
+        if len(thresholds) != len(self.la):
+            raise ValueError("Expected %d thresholds, got %d" % (len(self.la), len(thresholds)))
+        self.thresholds = list(thresholds)
+        self.op = add if sum_op else prod
+        self.variational = variational
+        self.statistics = [PruningStatistics(level, threshold) for level, threshold in enumerate(self.thresholds)] \
+            if statistics else None
+        self.io_cycle_limit = 200
+        self.io_precision = 0.000001
+        self.forest = None
+        # index of the finest annotation that was applied to the forest
+        self.level = None
+
+    def set_input(self, input):
+        self.base_parser.set_input(input)
+
+    def set_budget(self, deadline=None, max_items=None):
+        """
+        The budget is passed to the base parser and checked between the levels: once it is
+        exhausted, the forest of the last completed level is decoded with its annotation.
+        """
+        AbstractParser.set_budget(self, deadline, max_items)
+        self.base_parser.budget = self.budget
+
+    def parse(self):
+        self.forest = None
+        self.level = None
+        self.base_parser.parse()
+        if not self.base_parser.recognized():
+            return
+        forest = chart_to_forest(self.base_parser.chart, self.base_parser.disco_grammar)
+        self.level = 0
+
+        for level, (la, threshold) in enumerate(zip(self.la, self.thresholds)):
+            if self.budget is not None and self.budget.expired():
+                break
+            items, edges, root = forest
+            self.level = level
+            if threshold > 0.0:
+                posteriors = self.__node_posteriors(forest, la)
+                keep = [posterior >= threshold for posterior in posteriors]
+                keep[root] = True
+                restricted = restrict_forest(items, edges, root, keep)
+            else:
+                restricted = forest
+            if self.statistics is not None:
+                if restricted is None:
+                    self.statistics[level].add(len(items), len(edges), len(items), len(edges), failed=True)
+                else:
+                    self.statistics[level].add(len(items), len(edges), len(restricted[0]), len(restricted[1]))
+            if restricted is not None:
+                forest = restricted
+        self.forest = forest
+
+    def __manager(self, forest):
+        items, edges, root = forest
+        manager = PyDerivationManager(self.grammar, self.nontMap)
+        manager.convert_forest_to_hypergraph([nont for nont, _ in items], edges, root)
+        manager.set_io_cycle_limit(self.io_cycle_limit)
+        manager.set_io_precision(self.io_precision)
+        return manager
+
+    def __node_posteriors(self, forest, la):
+        items, edges, _ = forest
+        # max-rule weights without normalization are the posterior probabilities of the edges
+        edge_posteriors = py_edge_weight_projection(la, self.__manager(forest), variational=False, log_mode=False)
+        posteriors = [0.0] * len(items)
+        for (_, head, _), posterior in zip(edges, edge_posteriors):
+            posteriors[head] += posterior
+        return posteriors
+
+    def surviving_items(self):
+        """
+        :return: the items (nonterminal, span) of the pruned forest of the last parse
+        :rtype: list[tuple[str, tuple[int]]]
+        """
+        return [] if self.forest is None else list(self.forest[0])
+
+    def recognized(self):
+        return self.forest is not None
+
+    def best(self):
+        pass
+
+    def best_derivation_tree(self):
+        if self.recognized():
+            return self.__projection_based_derivation_tree(self.la[self.level], variational=self.variational,
+                                                           op=self.op)
+
+    def max_rule_product_derivation(self):
+        if self.recognized():
+            return self.__projection_based_derivation_tree(self.la[self.level], variational=False, op=prod)
+
+    def max_rule_sum_derivation(self):
+        if self.recognized():
+            return self.__projection_based_derivation_tree(self.la[self.level], variational=False, op=add)
+
+    def variational_derivation(self):
+        if self.recognized():
+            return self.__projection_based_derivation_tree(self.la[self.level], variational=True, op=prod)
+
+    def __projection_based_derivation_tree(self, la, variational=False, op=prod):
+        manager = self.__manager(self.forest)
+        edge_weights = py_edge_weight_projection(la, manager, variational=variational, log_mode=True)
+        der = manager.viterbi_derivation(0, edge_weights, self.grammar, op=op, log_mode=True)
+        if der is not None:
+            return LCFRSDerivationWrapper(der)
+        for _, der in self.base_parser.k_best_derivation_trees():
+            return der
+
+    def all_derivation_trees(self):
+        pass
+
+    def k_best_derivation_trees(self):
+        return self.base_parser.k_best_derivation_trees()
+
+    def clear(self):
+        self.base_parser.clear()
+        self.forest = None
+        self.level = None
+
+    def reset_statistics(self):
+        if self.statistics is not None:
+            self.statistics = [PruningStatistics(level, threshold) for level, threshold in enumerate(self.thresholds)]
+
+    def print_statistics(self, file=stdout):
+        if self.statistics is not None:
+            for statistics in self.statistics:
+                print(statistics, file=file)
+
+    def resolve_path(self, preprocess_path):
+        return self.base_parser.resolve_path(preprocess_path)
+
+
+__all__ = ["Coarse_to_fine_parser", "MultiLevelCoarseToFineParser", "PruningStatistics", "chart_to_forest",
+           "restrict_forest"]
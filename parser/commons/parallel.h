@@ -0,0 +1,56 @@
+//
+// Thread pool helpers for the compiled parsers, which are called without the GIL.
+//
+
+#ifndef PANDA_PARALLEL_H
+#define PANDA_PARALLEL_H
+
+#include <algorithm>
+#include <atomic>
+#include <exception>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+// Call function(i) for i = 0, ..., n - 1 on at most n_threads threads, which take the next index
+// from a shared counter. The first exception of a call is rethrown, once all threads are joined.
+template<typename Function>
+void parallel_for(std::size_t n, unsigned n_threads, Function function) {
+    n_threads = std::max(1u, std::min<unsigned>(n_threads, n));
+    std::atomic<std::size_t> next(0);
+    std::exception_ptr error = nullptr;
+    std::mutex error_mutex;
+
+    auto work = [&]() {
+        for (std::size_t i = next++; i < n; i = next++) {
+            try {
+                function(i);
+            } catch (...) {
+                std::lock_guard<std::mutex> lock(error_mutex);
+                if (!error)
+                    error = std::current_exception();
+                next = n;
+            }
+        }
+    };
+
+    if (n_threads == 1) {
+        work();
+    } else {
+        std::vector<std::thread> threads;
+        for (unsigned thread = 0; thread < n_threads; ++thread)
+            threads.emplace_back(work);
+        for (std::thread &thread : threads)
+            thread.join();
+    }
+    if (error)
+        std::rethrow_exception(error);
+}
+
+// Call do_parse() of each parser on at most n_threads threads.
+template<typename Parser>
+void parse_all(std::vector<Parser *> &parsers, unsigned n_threads) {
+    parallel_for(parsers.size(), n_threads, [&parsers](std::size_t i) { parsers[i]->do_parse(); });
+}
+
+#endif //PANDA_PARALLEL_H
@@ -3,153 +3,318 @@
 //
 
 #include "parser.h"
+#include "../commons/parallel.h"
 #include <iostream>
 #include <queue>
+#include <algorithm>
+#include <limits>
 
 using namespace cyk;
 
-int the_item_counter = 0;
+static const double MINUS_INFINITY = -std::numeric_limits<double>::infinity();
 
-CYKParser::CYKParser(CFG grammar) : grammar(grammar) {}
-
-CYKItem::CYKItem(Nonterminal nont, unsigned int left, unsigned int right, Rule *rule) :
+CYKItem::CYKItem(Nonterminal nont, unsigned int left, unsigned int right, const Rule *rule) :
         CYKItem(nont, left, right, rule->weight, nullptr, nullptr, rule) {}
 
 CYKItem::CYKItem(Nonterminal nonterminal, unsigned int left, unsigned int right, double weight, CYKItem *left_child,
-                 CYKItem *right_child, Rule *rule) : nonterminal(nonterminal), left(left), right(right),
+                 CYKItem *right_child, const Rule *rule) : nonterminal(nonterminal), left(left), right(right),
                                                      weight(weight), left_child(left_child),
-                                                     right_child(right_child), rule(rule) {
-    counter = ++the_item_counter;
-}
+                                                     right_child(right_child), rule(rule) {}
 
 bool CYKItem::operator<(const CYKItem otherCYKItem) const {
     return weight < otherCYKItem.weight;
 }
 
-CYKItem::~CYKItem() {
-}
-
 int CYKItem::rule_idx() const {
     return this->rule->idx;
 }
 
-bool CYKParser::addToChart(std::shared_ptr<CYKItem> item) {
-    if (item->nonterminal >= chart.size()) {
-        chart.resize(item->nonterminal + 1);
-    }
-    auto &nt_chart = chart[item->nonterminal];
-    if (nt_chart.find(Range(item->left, item->right)) != nt_chart.end()) {
-        return false;
+CYKGrammar::CYKGrammar(const CFG &cfg) : cfg(cfg) {
+    nonterminals = std::max<Nonterminal>(cfg.initial + 1, cfg.lhn_to_rules.size());
+    nonterminals = std::max<Nonterminal>(nonterminals, cfg.left_nont_corner.size());
+    nonterminals = std::max<Nonterminal>(nonterminals, cfg.right_nont_corner.size());
+
+    binary_rules.assign(nonterminals, std::vector<LeftCornerRule>());
+    chain_rules.assign(nonterminals, std::vector<const Rule *>());
+    for (auto &rules : this->cfg.left_nont_corner) {
+        for (const Rule &rule : rules) {
+            // rules with weight 0 never contribute
+            if (rule.weight == MINUS_INFINITY)
+                continue;
+            if (rule.unary)
+                chain_rules[rule.left_child].push_back(&rule);
+            else
+                binary_rules[rule.left_child].push_back(LeftCornerRule{rule.lhn, rule.right_child, rule.weight, &rule});
+        }
     }
-    nt_chart.emplace(Range(item->left, item->right), item);
-    return true;
 }
 
-Range::Range(unsigned int left, unsigned int right) : left(left), right(right) {}
+CYKParser::CYKParser() : CYKParser(CFG()) {}
 
-bool Range::operator==(const Range &otherRange) const {
-    return (left == otherRange.left && right == otherRange.right);
+CYKParser::CYKParser(const CFG &grammar) : grammar(std::make_shared<const CYKGrammar>(grammar)) {
+    nonterminals = this->grammar->nonterminals;
 }
 
-bool Range::operator<(const Range otherRange) const {
-    return (left < otherRange.left || left == otherRange.left && right < otherRange.right);
+CYKParser::CYKParser(const CYKParser &other) : grammar(other.grammar) {
+    nonterminals = grammar->nonterminals;
+    max_seconds = other.max_seconds;
+    max_items = other.max_items;
 }
 
-void CYKParser::do_parse() {
-    std::shared_ptr<CYKItem> gen_item;
-    for (unsigned i = 0; i < length; ++i) {
-        for (Rule &rule : lexical_rules(input[i])) {
-            gen_item = std::make_shared<CYKItem>(CYKItem(rule.lhn, i, i + 1, &rule));
-            agenda.push(gen_item);
-        }
+CYKParser &CYKParser::operator=(const CYKParser &other) {
+    if (this != &other) {
+        clear();
+        grammar = other.grammar;
+        nonterminals = grammar->nonterminals;
+        max_seconds = other.max_seconds;
+        max_items = other.max_items;
     }
+    return *this;
+}
 
-    std::vector<std::shared_ptr<CYKItem>> transport;
-    std::shared_ptr<CYKItem> item_;
+bool CYKParser::relax(std::size_t span, Nonterminal nonterminal, double weight, const Rule *rule, unsigned split) {
+    std::size_t index = span * nonterminals + nonterminal;
+    if (weight <= scores[index])
+        return false;
+    if (scores[index] == MINUS_INFINITY)
+        span_nonterminals[span].push_back(nonterminal);
+    scores[index] = weight;
+    backpointers[index].rule = rule;
+    backpointers[index].split = split;
+    return true;
+}
 
+// account for a finished chart entry
+bool CYKParser::spend() {
+    ++processed;
+    if ((max_items >= 0 && processed > max_items)
+        || (max_seconds >= 0 && (processed - 1) % 64 == 0
+            && std::chrono::duration<double>(std::chrono::steady_clock::now() - started).count() > max_seconds))
+        exhausted = true;
+    return exhausted;
+}
+
+// Closure of a span under chain rules in the manner of Knuth's algorithm: the best entry is finished
+// first and finished entries are not updated anymore, which keeps the backpointers acyclic.
+bool CYKParser::close_unary(std::size_t span) {
+    std::priority_queue<std::pair<double, Nonterminal>> agenda;
+    for (Nonterminal nonterminal : span_nonterminals[span])
+        agenda.emplace(scores[span * nonterminals + nonterminal], nonterminal);
     while (!agenda.empty()) {
-        item_ = agenda.top();
-        CYKItem & item = *item_;
+        auto top = agenda.top();
         agenda.pop();
-
-        /*
-        std::cout << "Process " << item.counter << " " << item.nonterminal
-                  << ":" << item.left << "-" << item.right << " weight: " << item.weight;
-        */
-
-        if (!addToChart(item_)) {
-            // std::cout << " skipped " << std::endl;
+        Nonterminal nonterminal = top.second;
+        if (finished[nonterminal] == span + 1 || top.first < scores[span * nonterminals + nonterminal])
             continue;
+        finished[nonterminal] = span + 1;
+        if (spend())
+            return false;
+        for (const Rule *rule : grammar->chain_rules[nonterminal]) {
+            double weight = top.first + rule->weight;
+            if (finished[rule->lhn] != span + 1 && relax(span, rule->lhn, weight, rule, 0))
+                agenda.emplace(weight, rule->lhn);
         }
+    }
+    return true;
+}
 
-        // std::cout << " used" << std::endl;
+void CYKParser::do_parse() {
+    if (length == 0)
+        return;
+    const std::size_t spans = std::size_t(length) * (length + 1) / 2;
+    scores.assign(spans * nonterminals, MINUS_INFINITY);
+    backpointers.assign(spans * nonterminals, Backpointer());
+    span_nonterminals.assign(spans, std::vector<Nonterminal>());
+    finished.assign(nonterminals, 0);
 
-        if (item.nonterminal == grammar.initial
-            && item.left == 0
-            && item.right == length) {
-            goal = &item;
-            break;
-        }
+    for (unsigned i = 0; i < length; ++i) {
+        for (const Rule &rule : grammar->lexical_rules(input[i]))
+            relax(span(i, i + 1), rule.lhn, rule.weight, &rule, 0);
+        if (!close_unary(span(i, i + 1)))
+            return;
+    }
 
-        // item is left child
-        //for (Rule &rule : grammar.left_nont_corner[item.nonterminal]) {
-        for (Rule &rule : nonterminal_left_corner(item.nonterminal)) {
-                // unary rules
-            if (rule.unary) {
-                gen_item = std::make_shared<CYKItem>(CYKItem(rule.lhn, item.left, item.right, item.weight + rule.weight, &item, nullptr, &rule));
-                transport.push_back(gen_item);
-            } else {
-                if (rule.right_child < chart.size()) {
-                    auto chart_range = chart[rule.right_child].lower_bound(Range(item.right, item.right));
-                    while (chart_range != chart[rule.right_child].end()
-                           && chart_range->first.left == item.right) {
-                        gen_item = std::make_shared<CYKItem>(CYKItem(rule.lhn, item.left, chart_range->second->right,
-                                              item.weight + rule.weight + chart_range->second->weight, &item,
-                                              &(*(chart_range->second)), &rule));
-                        transport.push_back(gen_item);
-                        chart_range++;
+    for (unsigned width = 2; width <= length; ++width) {
+        for (unsigned left = 0; left + width <= length; ++left) {
+            const unsigned right = left + width;
+            const std::size_t parent = span(left, right);
+            for (unsigned split = left + 1; split < right; ++split) {
+                const std::size_t left_span = span(left, split);
+                const double *right_scores = &scores[span(split, right) * nonterminals];
+                for (Nonterminal left_child : span_nonterminals[left_span]) {
+                    const double left_weight = scores[left_span * nonterminals + left_child];
+                    for (const LeftCornerRule &rule : grammar->binary_rules[left_child]) {
+                        const double right_weight = right_scores[rule.right_child];
+                        if (right_weight != MINUS_INFINITY)
+                            relax(parent, rule.lhn, left_weight + right_weight + rule.weight, rule.rule, split);
                     }
                 }
             }
+            if (!close_unary(parent))
+                return;
         }
+    }
 
-        // item is right child
-        for (Rule &rule : nonterminal_right_corner(item.nonterminal)) {
-            if (rule.left_child < chart.size()) {
-                auto chart_range = chart[rule.left_child].begin();
-                while (chart_range != chart[rule.left_child].end()
-                       && chart_range->first.left <= item.left
-                        && chart_range->first.right <= item.left) {
-                    if (chart_range->first.right == item.left) {
-                        gen_item = std::make_shared<CYKItem>(CYKItem(rule.lhn, chart_range->second->left, item.right,
-                                               item.weight + rule.weight + chart_range->second->weight,
-                                               &(*(chart_range->second)), &item, &rule));
-                        transport.push_back(gen_item);
-                    }
-                    chart_range++;
+    if (scores[entry(0, length, grammar->cfg.initial)] != MINUS_INFINITY)
+        goal = viterbi_item(0, length, grammar->cfg.initial);
+}
+
+CYKItem *CYKParser::viterbi_item(unsigned left, unsigned right, Nonterminal nonterminal) {
+    const std::size_t index = entry(left, right, nonterminal);
+    const Backpointer &backpointer = backpointers[index];
+    const Rule *rule = backpointer.rule;
+    CYKItem *left_child = nullptr, *right_child = nullptr;
+    if (rule->unary && !rule->left_term)
+        left_child = viterbi_item(left, right, rule->left_child);
+    else if (!rule->unary) {
+        left_child = viterbi_item(left, backpointer.split, rule->left_child);
+        right_child = viterbi_item(backpointer.split, right, rule->right_child);
+    }
+    return items.make(nonterminal, left, right, scores[index], left_child, right_child, rule);
+}
+
+KBestEntry &CYKParser::kbest_entry(unsigned left, unsigned right, Nonterminal nonterminal) {
+    const std::size_t index = entry(left, right, nonterminal);
+    auto found = kbest_entries.find(index);
+    if (found != kbest_entries.end())
+        return found->second;
+
+    KBestEntry &entry = kbest_entries[index];
+    entry.left = left;
+    entry.right = right;
+    entry.nonterminal = nonterminal;
+    if (nonterminal < grammar->cfg.lhn_to_rules.size()) {
+        for (const Rule &rule : grammar->cfg.lhn_to_rules[nonterminal]) {
+            if (rule.weight == MINUS_INFINITY)
+                continue;
+            if (rule.unary && rule.left_term) {
+                if (right == left + 1 && input[left] == rule.left_child)
+                    entry.edges.push_back(Hyperedge{&rule, 0});
+            } else if (rule.unary) {
+                if (scores[this->entry(left, right, rule.left_child)] != MINUS_INFINITY)
+                    entry.edges.push_back(Hyperedge{&rule, 0});
+            } else {
+                for (unsigned split = left + 1; split < right; ++split) {
+                    if (scores[this->entry(left, split, rule.left_child)] != MINUS_INFINITY
+                        && scores[this->entry(split, right, rule.right_child)] != MINUS_INFINITY)
+                        entry.edges.push_back(Hyperedge{&rule, split});
                 }
             }
         }
+    }
 
-        // add new items to agenda if not present in chart
-        for (std::shared_ptr<CYKItem> & new_item_ : transport) {
-            CYKItem & new_item = *new_item_;
-            if (new_item.nonterminal >= chart.size())
-                chart.resize(new_item.nonterminal + 1);
-            auto chart_range = chart[new_item.nonterminal].find(Range(new_item.left, new_item.right));
-            if (chart_range == chart[new_item.nonterminal].end()) {
-                agenda.push(new_item_);
-            }
+    // The best derivation is the one of the Viterbi backpointers, which are acyclic. Thus, the
+    // candidates only refer to derivations of the children, which are already determined, and
+    // each derivation is finite (even if the weights tie or chain rules form cycles).
+    const Backpointer &backpointer = backpointers[index];
+    for (unsigned edge = 0; edge < entry.edges.size(); ++edge) {
+        const Hyperedge &hyperedge = entry.edges[edge];
+        const Rule *rule = hyperedge.rule;
+        double weight = rule->weight;
+        if (rule->unary && !rule->left_term)
+            weight += scores[this->entry(left, right, rule->left_child)];
+        else if (!rule->unary)
+            weight += scores[this->entry(left, hyperedge.split, rule->left_child)]
+                      + scores[this->entry(hyperedge.split, right, rule->right_child)];
+        if (entry.derivations.empty() && rule->idx == backpointer.rule->idx && hyperedge.split == backpointer.split)
+            entry.derivations.push_back(KBestCandidate{scores[index], edge, {0, 0}});
+        else
+            entry.candidates.push_back(KBestCandidate{weight, edge, {0, 0}});
+        entry.seen.emplace(edge, 0, 0);
+    }
+    std::make_heap(entry.candidates.begin(), entry.candidates.end());
+    return entry;
+}
+
+unsigned CYKParser::children(const KBestEntry &entry, const Hyperedge &edge, KBestEntry **children) {
+    const Rule *rule = edge.rule;
+    if (rule->unary && rule->left_term)
+        return 0;
+    if (rule->unary) {
+        children[0] = &kbest_entry(entry.left, entry.right, rule->left_child);
+        return 1;
+    }
+    children[0] = &kbest_entry(entry.left, edge.split, rule->left_child);
+    children[1] = &kbest_entry(edge.split, entry.right, rule->right_child);
+    return 2;
+}
+
+// Candidates that require a derivation of an entry, whose k-best list is currently extended
+// (i.e., of a cycle of chain rules), are skipped. Hence, the k-best lists are exact for grammars
+// without cycles of chain rules.
+bool CYKParser::kbest_derivation(KBestEntry &entry, unsigned rank, KBestCandidate &derivation) {
+    while (entry.derivations.size() <= rank) {
+        if (entry.expanding)
+            return false;
+        if (!entry.derivations.empty()) {
+            entry.expanding = true;
+            kbest_successors(entry, entry.derivations.back());
+            entry.expanding = false;
         }
+        if (entry.candidates.empty())
+            return false;
+        std::pop_heap(entry.candidates.begin(), entry.candidates.end());
+        entry.derivations.push_back(entry.candidates.back());
+        entry.candidates.pop_back();
+    }
+    derivation = entry.derivations[rank];
+    return true;
+}
 
-        transport.clear();
+void CYKParser::kbest_successors(KBestEntry &entry, const KBestCandidate &derivation) {
+    const Hyperedge edge = entry.edges[derivation.edge];
+    KBestEntry *successors[2];
+    const unsigned arity = children(entry, edge, successors);
+    for (unsigned i = 0; i < arity; ++i) {
+        KBestCandidate candidate = derivation;
+        ++candidate.rank[i];
+        if (entry.seen.count(std::make_tuple(candidate.edge, candidate.rank[0], candidate.rank[1])))
+            continue;
+        candidate.weight = edge.rule->weight;
+        bool available = true;
+        for (unsigned j = 0; j < arity && available; ++j) {
+            KBestCandidate child;
+            available = kbest_derivation(*successors[j], candidate.rank[j], child);
+            candidate.weight += child.weight;
+        }
+        if (!available)
+            continue;
+        entry.seen.emplace(candidate.edge, candidate.rank[0], candidate.rank[1]);
+        entry.candidates.push_back(candidate);
+        std::push_heap(entry.candidates.begin(), entry.candidates.end());
     }
 }
 
-void CYKParser::parse_input(Terminal *input, unsigned length) {
+CYKItem *CYKParser::kbest_item(KBestEntry &entry, unsigned rank) {
+    KBestCandidate derivation;
+    kbest_derivation(entry, rank, derivation);
+    const Hyperedge edge = entry.edges[derivation.edge];
+    KBestEntry *successors[2];
+    const unsigned arity = children(entry, edge, successors);
+    CYKItem *child_items[2] = {nullptr, nullptr};
+    for (unsigned i = 0; i < arity; ++i)
+        child_items[i] = kbest_item(*successors[i], derivation.rank[i]);
+    return items.make(entry.nonterminal, entry.left, entry.right, derivation.weight, child_items[0], child_items[1],
+                      edge.rule);
+}
+
+std::vector<CYKItem *> CYKParser::k_best(unsigned k) {
+    std::vector<CYKItem *> derivations;
+    if (goal == nullptr)
+        return derivations;
+    KBestEntry &root = kbest_entry(0, length, grammar->cfg.initial);
+    KBestCandidate derivation;
+    for (unsigned rank = 0; rank < k && kbest_derivation(root, rank, derivation); ++rank)
+        derivations.push_back(kbest_item(root, rank));
+    return derivations;
+}
+
+void CYKParser::parse_input(const std::vector<Terminal> &input) {
     this->clear();
     this->input = input;
-    this->length = length;
+    this->length = input.size();
+    this->processed = 0;
+    this->started = std::chrono::steady_clock::now();
     do_parse();
 }
 
@@ -157,32 +322,31 @@ CYKItem* CYKParser::get_goal() {
     return goal;
 }
 
-CYKParser::~CYKParser() {
-    /*
-    while(!agenda.empty()){
-        CYKItem* top = agenda.top();
-        agenda.pop();
-        std::cout << "delete " << top->counter << " " << top << std::endl;
-        delete top;
-    }
-    std::cout << "In chart: " << std::endl;
-    for(auto i = 0; i < chart.size(); ++ i) {
-        auto pointer = chart[i].begin();
-        while (pointer != chart[i].end()){
-            std::cout << "delete " << pointer->second->counter << " " << &(pointer->second) << std::endl;
-            pointer ++;
-        }
+std::vector<std::shared_ptr<CYKParser>> CYKParser::parse_batch(const std::vector<std::vector<Terminal>> &inputs,
+                                                               unsigned n_threads) const {
+    std::vector<std::shared_ptr<CYKParser>> parsers;
+    for (std::size_t i = 0; i < inputs.size(); ++i)
+        parsers.push_back(std::make_shared<CYKParser>(*this));
+    parallel_for(inputs.size(), n_threads, [&parsers, &inputs](std::size_t i) {
+        parsers[i]->parse_input(inputs[i]);
+    });
+    return parsers;
+}
 
-    }
-     */
+void CYKParser::set_budget(double max_seconds, long max_items) {
+    this->max_seconds = max_seconds;
+    this->max_items = max_items;
 }
 
-CYKParser::CYKParser() {}
+bool CYKParser::budget_exhausted() const {
+    return exhausted;
+}
 
 void CYKParser::clear() {
-    this->chart.clear();
-    this->agenda = std::priority_queue<std::shared_ptr<CYKItem>, std::vector<std::shared_ptr<CYKItem>>, Compare>();
+    this->items.clear();
+    this->kbest_entries.clear();
     this->goal = nullptr;
+    this->exhausted = false;
 }
 
 void ::cyk::print_derivation(CYKItem *root, int indent) {
@@ -194,7 +358,3 @@ void ::cyk::print_derivation(CYKItem *root, int indent) {
         print_derivation(root->right_child, indent + 1);
     }
 }
-
-bool Compare::operator()(std::shared_ptr<CYKItem> a, std::shared_ptr<CYKItem> b) {
-    return *a < *b;
-}
@@ -8,7 +8,11 @@
 #include "cfg.h"
 #include <unordered_map>
 #include <map>
+#include <set>
+#include <tuple>
+#include <vector>
 #include <memory>
+#include <chrono>
 
 namespace cyk {
 
@@ -19,96 +23,189 @@ namespace cyk {
         unsigned right;
         double weight;
         CYKItem *left_child, *right_child;
-        Rule *rule;
+        const Rule *rule;
 
-        int counter;
-
-        CYKItem(Nonterminal nonterminal, unsigned left, unsigned right, Rule *rule);
+        CYKItem(Nonterminal nonterminal, unsigned left, unsigned right, const Rule *rule);
 
         CYKItem(Nonterminal nonterminal, unsigned int left, unsigned int right, double weight, CYKItem *left_child,
-                CYKItem *right_child, Rule *rule);
-        ~CYKItem();
+                CYKItem *right_child, const Rule *rule);
         bool operator<(const CYKItem otherCYKItem) const;
 
         int rule_idx() const;
 
     };
 
-    class Range {
+    // Block allocator: objects keep their address until clear(), which releases all of them at once
+    // and keeps the memory for reuse.
+    template<typename T>
+    class Arena {
     public:
-        unsigned left, right;
-        bool operator==(const Range &otherRange) const;
-        bool operator<(const Range otherRange) const;
-        Range(unsigned int left, unsigned int right);
+        static const std::size_t BLOCK_SIZE = 1024;
+
+        template<typename... Args>
+        T *make(Args &&... args) {
+            if (current == blocks.size()) {
+                blocks.emplace_back();
+                blocks.back().reserve(BLOCK_SIZE);
+            }
+            std::vector<T> &block = blocks[current];
+            block.emplace_back(std::forward<Args>(args)...);
+            T *object = &block.back();
+            if (block.size() == BLOCK_SIZE)
+                ++current;
+            return object;
+        }
+
+        void clear() {
+            for (auto &block : blocks)
+                block.clear();
+            current = 0;
+        }
+
+    private:
+        std::vector<std::vector<T>> blocks;
+        std::size_t current = 0;
     };
 
-    class Compare {
-    public:
-        bool operator()(std::shared_ptr<CYKItem>, std::shared_ptr<CYKItem>);
+    // Viterbi backpointer of a chart entry
+    struct Backpointer {
+        const Rule *rule = nullptr;
+        // end of the span of the left child of a binary rule
+        unsigned split = 0;
     };
 
-}
+    // binary rule in the index by left child
+    struct LeftCornerRule {
+        Nonterminal lhn;
+        Nonterminal right_child;
+        double weight;
+        const Rule *rule;
+    };
 
-namespace std {
-    template<>
-    struct hash<cyk::Range> {
-        typedef cyk::Range argument_type;
-        typedef std::size_t result_type;
+    // incoming hyperedge of a chart entry for k-best extraction
+    struct Hyperedge {
+        const Rule *rule;
+        unsigned split;
+    };
+
+    // derivation of a chart entry by a hyperedge and the ranks of the derivations of its children
+    struct KBestCandidate {
+        double weight;
+        unsigned edge;
+        unsigned rank[2];
 
-        result_type operator()(argument_type const &r) const {
-            result_type const h1(std::hash<unsigned>{}(r.left));
-            result_type const h2(std::hash<unsigned>{}(r.right));
-            return h1 ^ (h2 << 1); // or use boost::hash_combine
+        bool operator<(const KBestCandidate &other) const {
+            return weight < other.weight;
         }
     };
-}
 
-namespace cyk {
-    class CYKParser {
-    private:
-        std::priority_queue<std::shared_ptr<CYKItem>, std::vector<std::shared_ptr<CYKItem>>, Compare> agenda;
-        void do_parse();
-        bool addToChart(std::shared_ptr<CYKItem> item);
-        CYKItem * goal = nullptr;
-        Terminal * input;
-        unsigned length;
-        std::vector<Rule> no_rules;
+    // lazily computed k-best list of a chart entry (cf. Huang & Chiang 2005, Algorithm 3)
+    struct KBestEntry {
+        unsigned left, right;
+        Nonterminal nonterminal;
+        std::vector<Hyperedge> edges;
+        // max-heap
+        std::vector<KBestCandidate> candidates;
+        std::vector<KBestCandidate> derivations;
+        std::set<std::tuple<unsigned, unsigned, unsigned>> seen;
+        bool expanding = false;
+    };
 
-        std::vector<Rule> & lexical_rules(Terminal terminal) {
-            if (grammar.the_lex_rules.size() > terminal)
-                return grammar.the_lex_rules[terminal];
+    // Grammar and its rule indices for parsing. It is immutable and shared by all copies of a parser,
+    // which may parse concurrently.
+    class CYKGrammar {
+    public:
+        explicit CYKGrammar(const CFG &cfg);
+        CYKGrammar(const CYKGrammar &) = delete;
+        CYKGrammar &operator=(const CYKGrammar &) = delete;
+
+        const CFG cfg;
+        Nonterminal nonterminals = 0;
+        // binary rules by left child and chain rules by child
+        std::vector<std::vector<LeftCornerRule>> binary_rules;
+        std::vector<std::vector<const Rule *>> chain_rules;
+
+        const std::vector<Rule> &lexical_rules(Terminal terminal) const {
+            if (cfg.the_lex_rules.size() > terminal)
+                return cfg.the_lex_rules[terminal];
             else
                 return no_rules;
         }
 
-        std::vector<Rule> & nonterminal_left_corner(Nonterminal nonterminal) {
-            if (grammar.left_nont_corner.size() > nonterminal)
-                return grammar.left_nont_corner[nonterminal];
-            else
-                return no_rules;
+    private:
+        std::vector<Rule> no_rules;
+    };
+
+    class CYKParser {
+    private:
+        std::shared_ptr<const CYKGrammar> grammar;
+        void do_parse();
+        CYKItem * goal = nullptr;
+        std::vector<Terminal> input;
+        unsigned length = 0;
+
+        // budget of each parse: negative values are unbounded
+        double max_seconds = -1;
+        long max_items = -1;
+        bool exhausted = false;
+        long processed = 0;
+        std::chrono::steady_clock::time_point started;
+
+        // Dense chart of log weights by [span][nonterminal], where the spans (left < right) are
+        // enumerated by span(left, right). Absent entries have weight -inf.
+        Nonterminal nonterminals = 0;
+        std::vector<double> scores;
+        std::vector<Backpointer> backpointers;
+        // nonterminals with an entry in each span
+        std::vector<std::vector<Nonterminal>> span_nonterminals;
+        // span + 1 of the last closure, in which a nonterminal was finished, by nonterminal
+        std::vector<std::size_t> finished;
+
+        Arena<CYKItem> items;
+        std::unordered_map<std::size_t, KBestEntry> kbest_entries;
+
+        std::size_t span(unsigned left, unsigned right) const {
+            return std::size_t(left) * (2 * length - left + 1) / 2 + (right - left - 1);
         }
 
-        std::vector<Rule> & nonterminal_right_corner(Nonterminal nonterminal) {
-            if (grammar.right_nont_corner.size() > nonterminal)
-                return grammar.right_nont_corner[nonterminal];
-            else
-                return no_rules;
+        std::size_t entry(unsigned left, unsigned right, Nonterminal nonterminal) const {
+            return span(left, right) * nonterminals + nonterminal;
         }
+
+        bool relax(std::size_t span, Nonterminal nonterminal, double weight, const Rule *rule, unsigned split);
+        bool close_unary(std::size_t span);
+        bool spend();
+        CYKItem *viterbi_item(unsigned left, unsigned right, Nonterminal nonterminal);
+
+        KBestEntry &kbest_entry(unsigned left, unsigned right, Nonterminal nonterminal);
+        bool kbest_derivation(KBestEntry &entry, unsigned rank, KBestCandidate &derivation);
+        void kbest_successors(KBestEntry &entry, const KBestCandidate &derivation);
+        unsigned children(const KBestEntry &entry, const Hyperedge &edge, KBestEntry **children);
+        CYKItem *kbest_item(KBestEntry &entry, unsigned rank);
+
         void clear();
 
     public:
 
-        CFG grammar;
         CYKParser();
-        CYKParser(CFG grammar);
+        CYKParser(const CFG &grammar);
+        // copies share the grammar and the budget, but not the chart
+        CYKParser(const CYKParser &other);
+        CYKParser &operator=(const CYKParser &other);
 
-        std::vector<std::map<Range, std::shared_ptr<CYKItem>>> chart;
-
-        void parse_input(Terminal *input, unsigned length);
+        void parse_input(const std::vector<Terminal> &input);
         CYKItem* get_goal();
 
-        ~CYKParser();
+        // parse each input by a copy of this parser on at most n_threads threads
+        std::vector<std::shared_ptr<CYKParser>> parse_batch(const std::vector<std::vector<Terminal>> &inputs,
+                                                            unsigned n_threads) const;
+
+        // derivations of the input by descending weight (at most k); they are valid until the next parse
+        std::vector<CYKItem *> k_best(unsigned k);
 
+        // stop parsing cleanly after max_seconds or after processing max_items chart entries
+        void set_budget(double max_seconds, long max_items);
+        bool budget_exhausted() const;
     };
 
     void print_derivation(CYKItem * root, int indent);
@@ -1,12 +1,11 @@
 from grammar.lcfrs import LCFRS, LCFRS_rule, LCFRS_lhs, LCFRS_var
 from util.enumerator cimport Enumerator
 from grammar.lcfrs_derivation import LCFRSDerivation
-from parser.parser_interface import AbstractParser
-cimport cython
-from libc.stdlib cimport malloc, free
-from math import log
-
-ctypedef unsigned int unsigned_int
+from parser.parser_interface import AbstractParser, Budget, best_weight
+from cython.operator cimport dereference as deref
+from libcpp.memory cimport shared_ptr, make_shared
+from libcpp.vector cimport vector
+from math import log, exp
 
 cdef extern from "cfg.h":
     ctypedef unsigned Terminal
@@ -26,8 +25,12 @@ cdef extern from "parser.h" namespace "cyk":
     cdef cppclass CYKParser:
         CYKParser();
         CYKParser(CFG grammar)
-        void parse_input(Terminal *input, unsigned length);
+        void parse_input(vector[Terminal] input) nogil
+        vector[shared_ptr[CYKParser]] parse_batch(vector[vector[Terminal]] inputs, unsigned n_threads) nogil except +
         CYKItem* get_goal();
+        vector[CYKItem*] k_best(unsigned k)
+        void set_budget(double max_seconds, long max_items)
+        bint budget_exhausted()
 
     cdef cppclass CYKItem:
         unsigned left;
@@ -115,32 +118,75 @@ cdef PyCFG grammar_to_cfg(grammar, Enumerator terminal_map, Enumerator nontermin
 
 
 cdef class PyCFGParser:
-    cdef CYKParser cpp_parser
+    cdef shared_ptr[CYKParser] cpp_parser
     cdef PyCFG py_cfg
 
-    def __cinit__(self, PyCFG py_cfg):
+    def __cinit__(self, PyCFG py_cfg=None):
+        # without py_cfg, the parser is a handle of parse_batch
         self.py_cfg = py_cfg
-        self.cpp_parser = CYKParser(py_cfg.cfg)
+        if py_cfg is not None:
+            self.cpp_parser = make_shared[CYKParser](py_cfg.cfg)
 
-    def parse_sentence(self, sentence):
-        my_ints = <unsigned *>malloc(len(sentence)*cython.sizeof(unsigned_int))
-        if my_ints is NULL:
-            raise MemoryError()
+    cdef vector[Terminal] encode(self, sentence):
+        cdef vector[Terminal] word
+        for terminal in sentence:
+            word.push_back(self.py_cfg.terminal_map.object_index(terminal))
+        return word
 
-        for i in range(len(sentence)):
+    def parse_sentence(self, sentence):
+        cdef vector[Terminal] word = self.encode(sentence)
+        with nogil:
+            deref(self.cpp_parser).parse_input(word)
 
-            my_ints[i] = self.py_cfg.terminal_map.object_index(sentence[i])
+    def parse_batch(self, sentences, unsigned n_threads):
+        """
+        Parse the sentences on n_threads threads without the GIL. The threads share the grammar
+        and the budget of this parser.
 
-        self.cpp_parser.parse_input(my_ints, len(sentence))
+        :return: one parser per sentence, which holds its chart
+        :rtype: list[PyCFGParser]
+        """
+        cdef vector[vector[Terminal]] words
+        cdef vector[shared_ptr[CYKParser]] parsers
+        cdef PyCFGParser handle
+        for sentence in sentences:
+            words.push_back(self.encode(sentence))
+        with nogil:
+            parsers = deref(self.cpp_parser).parse_batch(words, n_threads)
+        handles = []
+        for i in range(parsers.size()):
+            handle = PyCFGParser()
+            handle.py_cfg = self.py_cfg
+            handle.cpp_parser = parsers[i]
+            handles.append(handle)
+        return handles
 
     def recognized(self):
-        return not self.cpp_parser.get_goal() is NULL
+        return not deref(self.cpp_parser).get_goal() is NULL
+
+    def set_budget(self, double max_seconds, long max_items):
+        """
+        :param max_seconds: time limit of each parse, negative for unbounded
+        :param max_items: max. number of finished chart entries, negative for unbounded
+        """
+        deref(self.cpp_parser).set_budget(max_seconds, max_items)
+
+    def budget_exhausted(self):
+        return deref(self.cpp_parser).budget_exhausted()
 
     def goal(self):
-        return convert_items(self.cpp_parser.get_goal()[0])
+        return convert_items(deref(self.cpp_parser).get_goal()[0])
 
     def goal_weight(self):
-        return self.cpp_parser.get_goal().weight
+        return deref(self.cpp_parser).get_goal().weight
+
+    def k_best(self, unsigned k):
+        """
+        :return: at most k pairs of log weight and derivation by descending weight
+        :rtype: list[tuple[float, PyCYKItem]]
+        """
+        cdef vector[CYKItem*] derivations = deref(self.cpp_parser).k_best(k)
+        return [(derivation.weight, convert_items(derivation[0])) for derivation in derivations]
 
     def rule_map(self):
         return self.py_cfg.rule_map
@@ -153,9 +199,14 @@ class CFGParser(AbstractParser):
     def all_derivation_trees(self):
         pass
 
-    def __init__(self, grammar, input=None, save_preprocess=None, load_preprocess=None):
+    def __init__(self, grammar, input=None, save_preprocess=None, load_preprocess=None, k=50):
+        """
+        :param k: number of derivations of k_best_derivation_trees
+        :type k: int
+        """
         self.input = input
         self.goal = None
+        self.k = k
         if input is not None:
             self.parser = grammar.tmp
             self.parse()
@@ -171,15 +222,67 @@ class CFGParser(AbstractParser):
     def best(self):
         return self.parser.goal_weight()
 
+    def k_best_derivation_trees(self):
+        if not self.recognized():
+            return
+        for weight, item in self.parser.k_best(self.k):
+            yield exp(weight), CFGDerivation(item, self.parser.rule_map())
+
     def clear(self):
         self.input = None
         self.goal = None
 
+    def __pass_budget(self):
+        budget = self.budget
+        if budget is None:
+            self.parser.set_budget(-1.0, -1)
+        else:
+            budget.reset()
+            seconds = budget.seconds_left()
+            self.parser.set_budget(-1.0 if seconds is None else seconds,
+                                   -1 if budget.max_items is None else budget.max_items)
+
     def parse(self):
+        self.__pass_budget()
         self.parser.parse_sentence(self.input)
+        if self.budget is not None:
+            self.budget.exhausted = self.parser.budget_exhausted()
         if self.recognized():
             self.goal = self.parser.goal()
 
+    def parse_batch(self, inputs, action=None, workers=1, chunksize=1, max_length=None, timeout=None):
+        """
+        Cf. AbstractParser.parse_batch. Without timeout, workers > 1 threads of the C++ parser,
+        which share the grammar, parse workers * chunksize inputs at a time instead of forked
+        processes. action is called with a parser for each input, which holds its chart.
+        """
+        if workers <= 1 or timeout is not None:
+            for result in AbstractParser.parse_batch(self, inputs, action, workers, chunksize, max_length, timeout):
+                yield result
+            return
+        if action is None:
+            action = best_weight
+        inputs = list(inputs)
+        step = workers * chunksize
+        for start in range(0, len(inputs), step):
+            chunk = inputs[start:start + step]
+            self.__pass_budget()
+            handles = self.parser.parse_batch([input if max_length is None or len(input) <= max_length else []
+                                               for input in chunk], workers)
+            for index, (input, handle) in enumerate(zip(chunk, handles), start):
+                yield action(self.__batch_result(input, handle), index)
+
+    def __batch_result(self, input, handle):
+        result = CFGParser.__new__(CFGParser)
+        result.input = input
+        result.k = self.k
+        result.parser = handle
+        result.goal = handle.goal() if handle.recognized() else None
+        if self.budget is not None:
+            result.budget = Budget(self.budget.deadline, self.budget.max_items)
+            result.budget.exhausted = handle.budget_exhausted()
+        return result
+
     def set_input(self, input):
         self.input = input
 
@@ -190,7 +293,9 @@ class CFGParser(AbstractParser):
         return PyCFGParser(pycfg)
 
     @staticmethod
-    def preprocess_grammar(grammar):
+    def preprocess_grammar(grammar, trim=False):
+        if trim:
+            grammar.trim()
         grammar.tmp = CFGParser.__preprocess(grammar)
 
 
@@ -0,0 +1,142 @@
+from __future__ import print_function, unicode_literals
+from collections import OrderedDict
+from discodop.containers import Grammar
+from discodop.estimates import getestimates
+from parser.discodop_parser.grammar_adapter import transform_grammar, transform_grammar_cfg_approx
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+
+# increase, whenever the transformation of grammars or the format of the cache changes
+CACHE_VERSION = 1
+
+# marks the components of nonterminals in the CFG approximation
+CFG_APPROX_COMPONENT = re.compile(r'\*[0-9]+$')
+
+
+def grammar_fingerprint(grammar):
+    """
+    :type grammar: LCFRS
+    :return: SHA-256 digest of the start symbol, the rules (in index order), and the rule weights
+    :rtype: str
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((CACHE_VERSION, grammar.start())).encode('utf-8'))
+    for rule in grammar.rules():
+        digest.update(repr((rule.get_idx(), rule.lhs().signature(), tuple(rule.rhs()))).encode('utf-8'))
+    digest.update(grammar.weight_vector().tobytes())
+    return digest.hexdigest()
+
+
+class DiscodopGrammarCache(object):
+    """
+    Compiled discodop grammars, CFG approximations (mapped to the discodop grammar), and SX
+    estimates of LCFRS, keyed by grammar_fingerprint. Compiled grammars are kept in memory and
+    shared by all parsers of the process. If a directory is given, the transformed rules and
+    the estimates are also stored on disk, such that other processes and later experiment stages
+    skip the transformation and the computation of the estimates.
+    """
+    # number of compiled grammars kept in memory
+    MAX_GRAMMARS = 4
+
+    def __init__(self, directory=None):
+        """
+        :param directory: directory of the disk cache or None
+        :type directory: str
+        """
+        self.directory = directory
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.__grammars = OrderedDict()
+
+    def grammars(self, grammar, cfg_ctf=False, fingerprint=None):
+        """
+        :type grammar: LCFRS
+        :param cfg_ctf: also compile the CFG approximation and map the discodop grammar to it
+        :type cfg_ctf: bool
+        :param fingerprint: grammar_fingerprint(grammar), if already computed
+        :return: the discodop grammar and its CFG approximation (None unless cfg_ctf)
+        :rtype: tuple[Grammar, Grammar]
+        """
+        if fingerprint is None:
+            fingerprint = grammar_fingerprint(grammar)
+        key = fingerprint, cfg_ctf
+        if key in self.__grammars:
+            self.__grammars[key] = self.__grammars.pop(key)
+            return self.__grammars[key]
+
+        disco_grammar = Grammar(self.__rules(grammar, fingerprint, 'lcfrs', transform_grammar),
+                                start=grammar.start())
+        disco_cfg_grammar = None
+        if cfg_ctf:
+            disco_cfg_grammar = Grammar(self.__rules(grammar, fingerprint, 'cfg', transform_grammar_cfg_approx),
+                                        start=grammar.start())
+            disco_grammar.getmapping(disco_cfg_grammar, CFG_APPROX_COMPONENT, None, True, True)
+
+        self.__grammars[key] = disco_grammar, disco_cfg_grammar
+        while len(self.__grammars) > self.MAX_GRAMMARS:
+            self.__grammars.popitem(last=False)
+        return disco_grammar, disco_cfg_grammar
+
+    def estimates(self, grammar, disco_grammar, max_length, fingerprint=None):
+        """
+        :param disco_grammar: the discodop grammar of grammar, cf. grammars
+        :param max_length: maximum length of sentences, for which the estimates are computed
+        :type max_length: int
+        :return: SX estimates in the form expected by discodop.plcfrs.parse
+        """
+        if fingerprint is None:
+            fingerprint = grammar_fingerprint(grammar)
+        name = 'sx%d' % max_length
+        estimates = self.__load(fingerprint, name)
+        if estimates is None:
+            estimates = getestimates(disco_grammar, max_length, grammar.start())
+            self.__store(fingerprint, name, estimates)
+        return 'SXlrgaps', estimates
+
+    def __rules(self, grammar, fingerprint, name, transform):
+        rules = self.__load(fingerprint, name)
+        if rules is None:
+            rules = list(transform(grammar))
+            self.__store(fingerprint, name, rules)
+        return rules
+
+    def __path(self, fingerprint, name):
+        return os.path.join(self.directory, '%s.%s.pickle' % (fingerprint, name))
+
+    def __load(self, fingerprint, name):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.__path(fingerprint, name), 'rb') as f:
+                return pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def __store(self, fingerprint, name, obj):
+        if self.directory is None:
+            return
+        # write to a temporary file first, since concurrent processes may fill the same cache
+        fd, path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path, self.__path(fingerprint, name))
+
+
+_caches = {}
+
+
+def grammar_cache(directory=None):
+    """
+    :param directory: directory of the disk cache or None for the in-memory cache only
+    :return: the DiscodopGrammarCache of the process for directory
+    :rtype: DiscodopGrammarCache
+    """
+    if directory not in _caches:
+        _caches[directory] = DiscodopGrammarCache(directory)
+    return _caches[directory]
+
+
+__all__ = ["DiscodopGrammarCache", "grammar_cache", "grammar_fingerprint"]
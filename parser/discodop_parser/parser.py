@@ -2,19 +2,18 @@ from __future__ import print_function
 from discodop.containers import Grammar
 from discodop.plcfrs import parse
 import discodop.pcfg as pcfg
-from discodop.kbest import lazykbest
-from discodop.estimates import getestimates
 from discodop.coarsetofine import prunechart
 from parser.parser_interface import AbstractParser
 from grammar.lcfrs_derivation import LCFRSDerivation, LCFRSDerivationWrapper
 import nltk
+import numpy as np
 from math import log, exp
 from parser.trace_manager.trace_manager import add, prod
-from parser.supervised_trainer.trainer import PyDerivationManager
+from parser.supervised_trainer.trainer import ChartLabelTable, PyDerivationManager
 from parser.coarse_to_fine_parser.trace_weight_projection import py_edge_weight_projection
 from parser.discodop_parser.grammar_adapter import rule_idx_from_label, transform_grammar, transform_grammar_cfg_approx
+from parser.discodop_parser.grammar_cache import CFG_APPROX_COMPONENT, grammar_cache, grammar_fingerprint
 from parser.trace_manager.sm_trainer import PyLatentAnnotation
-import re
 from sys import stderr
 
 
@@ -91,11 +90,31 @@ class DiscodopKbestParser(AbstractParser):
                  grammarInfo=None,
                  projection_mode=False,
                  latent_viterbi_mode=False,
-                 secondaries=None
+                 secondaries=None,
+                 filter_input=False,
+                 cache_dir=None,
+                 estimates_max_length=None
                  ):
-        rule_list = list(transform_grammar(grammar))
-        self.disco_grammar = Grammar(rule_list, start=grammar.start())
+        """
+        :param filter_input: for each sentence, compile a discodop grammar from the rules of
+            grammar.filter_for_input(input) instead of parsing with the complete grammar
+        :type filter_input: bool
+        :param cache_dir: directory, in which the transformed grammars and estimates are cached
+            across processes (cf. DiscodopGrammarCache); compiled grammars are always shared in memory
+        :type cache_dir: str
+        :param estimates_max_length: use SX estimates for sentences up to this length (None to disable);
+            they are not used with filter_input
+        :type estimates_max_length: int
+        """
+        fingerprint = grammar_fingerprint(grammar)
+        cache = grammar_cache(cache_dir)
+        self.disco_grammar, self.disco_cfg_grammar = cache.grammars(grammar, cfg_ctf, fingerprint)
         self.chart = None
+        self.manager = None
+        self.labels = None
+        # nonterminal map of the derivation managers; if nontMap is None, the map of the first manager is
+        # kept, such that the label table of the chart conversion is built once per grammar
+        self.manager_nont_map = nontMap
         self.input = input
         self.grammar = grammar
         self.k = k
@@ -109,6 +128,7 @@ class DiscodopKbestParser(AbstractParser):
         self.debug = False
         self.log_mode = True
         self.estimates = None
+        self.estimates_max_length = estimates_max_length
         self.cfg_approx = cfg_ctf
         self.pruning_k = pruning_k
         self.grammarInfo = grammarInfo
@@ -117,17 +137,26 @@ class DiscodopKbestParser(AbstractParser):
         self.secondaries = [] if secondaries is None else secondaries
         self.secondary_mode = "DEFAULT"
         self.k_best_reranker = None
+        self.filter_input = filter_input
         if grammarInfo is not None:
             if isinstance(self.la, PyLatentAnnotation):
                 assert self.la.check_rule_split_alignment()
             else:
                 for l in self.la:
                     assert l.check_rule_split_alignment()
-        if cfg_ctf:
-            cfg_rule_list = list(transform_grammar_cfg_approx(grammar))
-            self.disco_cfg_grammar = Grammar(cfg_rule_list, start=grammar.start())
-            self.disco_grammar.getmapping(self.disco_cfg_grammar, re.compile('\*[0-9]+$'), None, True, True)
-        # self.estimates = 'SXlrgaps', getestimates(self.disco_grammar, 40, grammar.start())
+        if estimates_max_length is not None and not filter_input:
+            self.estimates = cache.estimates(grammar, self.disco_grammar, estimates_max_length, fingerprint)
+
+    def __estimates(self):
+        # the estimates cover neither longer sentences nor the grammars of filter_input
+        if self.estimates is None or self.filter_input or len(self.input) > self.estimates_max_length:
+            return None
+        return self.estimates
+
+    @staticmethod
+    def __disco_grammar(grammar, transform):
+        rule_list = list(transform(grammar))
+        return Grammar(rule_list, start=grammar.start())
 
     def best(self):
         pass
@@ -155,12 +184,9 @@ class DiscodopKbestParser(AbstractParser):
         if self.nontMap is None:
             print("A nonterminal map is required for weight projection based parsing!")
             return None
-        manager = PyDerivationManager(self.grammar, self.nontMap)
-        manager.convert_chart_to_hypergraph(self.chart, self.disco_grammar, debug=False)
+        manager = self.derivation_manager()
         if self.grammarInfo is not None:
             assert manager.is_consistent_with_grammar(self.grammarInfo)
-        manager.set_io_cycle_limit(200)
-        manager.set_io_precision(0.000001)
 
         if not isinstance(la, list):
             la = [la]
@@ -203,12 +229,28 @@ class DiscodopKbestParser(AbstractParser):
             _, der = next(self.k_best_derivation_trees())
         return der
 
+    def derivation_manager(self):
+        """
+        :return: a PyDerivationManager, whose trace 0 is the hypergraph of the chart of the last parse;
+            it is built once per sentence and shared by all decoding methods
+        :rtype: PyDerivationManager
+        """
+        if self.manager is None:
+            manager = PyDerivationManager(self.grammar, self.manager_nont_map)
+            nonterminal_map = self.manager_nont_map = manager.get_nonterminal_map()
+            if self.labels is None or self.labels[0] is not self.disco_grammar or self.labels[1] is not nonterminal_map:
+                self.labels = self.disco_grammar, nonterminal_map, ChartLabelTable(self.disco_grammar, nonterminal_map)
+            manager.convert_chart_to_hypergraph(self.chart, self.disco_grammar, labels=self.labels[2])
+            manager.set_io_cycle_limit(200)
+            manager.set_io_precision(0.000001)
+            self.manager = manager
+        return self.manager
+
     def set_secondary_mode(self, mode):
         self.secondary_mode = mode
 
     def latent_viterbi_derivation(self, debug=False):
-        manager = PyDerivationManager(self.grammar, self.nontMap)
-        manager.convert_chart_to_hypergraph(self.chart, self.disco_grammar, debug=False)
+        manager = self.derivation_manager()
         if debug:
             manager.serialize(b'/tmp/my_debug_hypergraph.hg')
         if isinstance(self.la, list):
@@ -255,23 +297,47 @@ class DiscodopKbestParser(AbstractParser):
 
     def parse(self):
         self.counter += 1
+        self.manager = None
+        # discodop's chart parsers cannot be interrupted: the budget is checked between the
+        # passes and max_items caps the number of items that survive coarse-to-fine pruning
+        budget = self.budget
+        if budget is not None:
+            budget.reset()
+            if budget.expired():
+                self.chart = None
+                return
+        if self.filter_input:
+            restricted = self.grammar.filter_for_input(self.input)
+            if not restricted.rules():
+                self.chart = None
+                return
+            self.disco_grammar = self.__disco_grammar(restricted, transform_grammar)
+            if self.cfg_approx:
+                self.disco_cfg_grammar = self.__disco_grammar(restricted, transform_grammar_cfg_approx)
+                self.disco_grammar.getmapping(self.disco_cfg_grammar, CFG_APPROX_COMPONENT, None, True, True)
         if self.cfg_approx:
             chart, msg = pcfg.parse(self.input,
                                     self.disco_cfg_grammar,
                                     beam_beta=self.beam_beta,
                                     beam_delta=self.beam_delta)
+            if chart and budget is not None and budget.expired():
+                self.chart = None
+                return
             if chart:
                 chart.filter()
+                pruning_k = self.pruning_k
+                if budget is not None and budget.max_items is not None:
+                    pruning_k = min(pruning_k, budget.max_items)
                 whitelist, msg = prunechart(chart,
                                             self.disco_grammar,
-                                            k=self.pruning_k,
+                                            k=pruning_k,
                                             splitprune=True,
                                             markorigin=True,
                                             finecfg=False)
                 try:
                     self.chart, msg = parse(self.input,
                                             self.disco_grammar,
-                                            estimates=self.estimates,
+                                            estimates=self.__estimates(),
                                             whitelist=whitelist,
                                             splitprune=True,
                                             markorigin=True,
@@ -282,7 +348,7 @@ class DiscodopKbestParser(AbstractParser):
         else:
             self.chart, msg = parse(self.input,
                                     self.disco_grammar,
-                                    estimates=self.estimates,
+                                    estimates=self.__estimates(),
                                     beam_beta=self.beam_beta,
                                     beam_delta=self.beam_delta,
                                     exhaustive=True)
@@ -290,24 +356,33 @@ class DiscodopKbestParser(AbstractParser):
         #     print(self.input)
         #     print(self.chart)
         #     print(msg)
+        if budget is not None and budget.expired():
+            self.chart = None
         if self.chart:
             self.chart.filter()
 
     def clear(self):
         self.input = None
         self.chart = None
+        self.manager = None
         if self.k_best_reranker:
             self.k_best_reranker.k_best_list = None
             self.k_best_reranker.ranking = None
             self.k_best_reranker.ranker = None
 
     def k_best_derivation_trees(self):
-        for tree_string, weight in lazykbest(self.chart, self.k):
-            try:
-                tree = nltk.Tree.fromstring(tree_string)
-                yield weight, DiscodopDerivation(tree, self.grammar)
-            except ValueError:
-                print("\nill-bracketed string:", tree_string, file=stderr)
+        """
+        Lazily enumerates the k best derivations on the hypergraph of the chart (cf. derivation_manager),
+        weighted by the rule weights of the grammar.
+        """
+        if not self.recognized():
+            return
+        manager = self.derivation_manager()
+        with np.errstate(divide='ignore'):
+            log_weights = np.log(self.grammar.weight_vector())
+        edge_weights = log_weights[np.array(manager.edge_rule_ids(0), dtype=np.int64)]
+        for weight, der in manager.k_best_derivations(0, edge_weights, self.grammar, self.k):
+            yield exp(weight), LCFRSDerivationWrapper(der)
 
 
 __all__ = ["DiscodopKbestParser"]
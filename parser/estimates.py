@@ -0,0 +1,186 @@
+from __future__ import print_function, division
+
+import math
+from abc import ABCMeta, abstractmethod
+from collections import defaultdict
+
+import numpy as np
+
+from grammar.lcfrs import LCFRS_var
+
+INFINITY = float('inf')
+
+
+class OutsideEstimate:
+    """
+    Estimate of the outside cost (i.e., negative log weight) of a parse item for best-first
+    parsing. The estimate is admissible, if it never exceeds the cost of the best context that
+    completes the item to a derivation of the whole input. A* search with an admissible estimate
+    finds the best derivation; the best estimates are those, which are also consistent (i.e., the
+    estimated cost of an item does not exceed the one of its consequents), since then no item
+    needs to be processed twice.
+    Costs are only non-negative if the weights of all rules are at most 1.
+    """
+    __metaclass__ = ABCMeta
+
+    @abstractmethod
+    def passive(self, nont, length, inp_len):
+        """
+        :param nont: nonterminal of a complete item
+        :type nont: str
+        :param length: total length of the spans of the item
+        :type length: int
+        :param inp_len: length of the input
+        :type inp_len: int
+        :rtype: float
+        """
+        pass
+
+    def active(self, nont, length, inp_len):
+        """
+        :param nont: LHS nonterminal of an incomplete item
+        :type nont: str
+        :param length: number of input positions that are covered by the item so far
+        :type length: int
+        :type inp_len: int
+        :rtype: float
+        """
+        return min([self.passive(nont, l, inp_len) for l in range(length, inp_len + 1)] + [INFINITY])
+
+    def inside(self, nont, inp_len):
+        """
+        :return: lower bound on the inside cost of any item of nont, which is added to the estimate
+            of incomplete items for each of their remaining RHS nonterminals
+        :rtype: float
+        """
+        return 0.0
+
+
+class NullEstimate(OutsideEstimate):
+    """
+    Estimates outside costs as 0, i.e., best-first parsing by inside costs only (Knuth's algorithm).
+    """
+    def passive(self, nont, length, inp_len):
+        return 0.0
+
+    def active(self, nont, length, inp_len):
+        return 0.0
+
+
+class ContextSummaryEstimate(OutsideEstimate):
+    """
+    SX estimate, which summarizes the context of an item by the number of input positions
+    it does not cover (cf. Klein & Manning 2003, Kallmeyer & Maier 2010). The estimates are
+    precomputed once for the grammar for all inputs up to max_length; for longer inputs the
+    estimate is 0.
+    """
+    def __init__(self, grammar, max_length):
+        """
+        :type grammar: LCFRS
+        :type max_length: int
+        """
+        self.__max_length = max_length
+        self.__rules = defaultdict(list)
+        for rule in grammar.rules():
+            if rule.weight() > 1.0:
+                raise ValueError('weight of ' + str(rule) + ' exceeds 1')
+            if rule.weight() <= 0.0:
+                continue
+            terms = len([mem for arg in rule.lhs().args() for mem in arg if not isinstance(mem, LCFRS_var)])
+            rhs = [rule.rhs_nont(i) for i in range(rule.rank())]
+            self.__rules[rule.lhs().nont()].append((rhs, -math.log(rule.weight()), terms))
+        self.__inside = self.__compute_inside(grammar)
+        self.__outside = self.__compute_outside(grammar)
+        # estimates for incomplete items: minimum over all lengths >= given length
+        self.__outside_min = {nont: np.minimum.accumulate(table[:, ::-1], axis=1)[:, ::-1]
+                              for nont, table in self.__outside.items()}
+
+    def __siblings(self, rhs, skip=None):
+        """
+        :return: cheapest total inside cost of the RHS nonterminals (except the one at position skip)
+            by the sum of their lengths
+        :rtype: numpy.ndarray
+        """
+        result = np.full(self.__max_length + 1, INFINITY)
+        result[0] = 0.0
+        for i, nont in enumerate(rhs):
+            if i != skip:
+                result = min_plus(result, self.__inside[nont])
+        return result
+
+    def __compute_inside(self, grammar):
+        # Cheapest inside cost by nonterminal and length.
+        self.__inside = {nont: np.full(self.__max_length + 1, INFINITY) for nont in grammar.nonts()}
+        changed = True
+        while changed:
+            changed = False
+            for lhs, rules in self.__rules.items():
+                for rhs, cost, terms in rules:
+                    if terms > self.__max_length:
+                        continue
+                    candidate = np.full(self.__max_length + 1, INFINITY)
+                    candidate[terms:] = self.__siblings(rhs)[:self.__max_length + 1 - terms] + cost
+                    if np.any(candidate < self.__inside[lhs]):
+                        self.__inside[lhs] = np.minimum(self.__inside[lhs], candidate)
+                        changed = True
+        return self.__inside
+
+    def __compute_outside(self, grammar):
+        # Cheapest outside cost by nonterminal, input length (rows) and length of the item (columns).
+        # The columns are processed by decreasing length, since the length of a child is at most
+        # the one of its parent. Only unary rules (or siblings of length 0) relate items of equal
+        # length, which requires to process a column until it does not change anymore.
+        size = self.__max_length + 1
+        outside = {nont: np.full((size, size), INFINITY) for nont in grammar.nonts()}
+        np.fill_diagonal(outside[grammar.start()], 0.0)
+        siblings = {}
+        for lhs_length in range(size - 1, -1, -1):
+            agenda = [nont for nont in outside if np.any(np.isfinite(outside[nont][:, lhs_length]))]
+            while agenda:
+                lhs = agenda.pop()
+                context = outside[lhs][:, lhs_length:lhs_length + 1]
+                for i, (rhs, cost, terms) in enumerate(self.__rules[lhs]):
+                    rest = lhs_length - terms
+                    if rest < 0:
+                        continue
+                    if (lhs, i) not in siblings:
+                        siblings[lhs, i] = [self.__siblings(rhs, skip=j) for j in range(len(rhs))]
+                    for nont, sibling in zip(rhs, siblings[lhs, i]):
+                        # child of length l, siblings of total length rest - l
+                        candidate = context + cost + sibling[rest::-1]
+                        current = outside[nont][:, :rest + 1]
+                        if np.any(candidate < current):
+                            if rest == lhs_length and np.any(candidate[:, -1] < current[:, -1]) \
+                                    and nont not in agenda:
+                                agenda.append(nont)
+                            outside[nont][:, :rest + 1] = np.minimum(current, candidate)
+        return outside
+
+    def passive(self, nont, length, inp_len):
+        if inp_len > self.__max_length:
+            return 0.0
+        return float(self.__outside[nont][inp_len, length]) if nont in self.__outside else INFINITY
+
+    def active(self, nont, length, inp_len):
+        if inp_len > self.__max_length:
+            return 0.0
+        return float(self.__outside_min[nont][inp_len, length]) if nont in self.__outside_min else INFINITY
+
+    def inside(self, nont, inp_len):
+        if inp_len > self.__max_length:
+            return 0.0
+        return float(self.__inside[nont][:inp_len + 1].min()) if nont in self.__inside else INFINITY
+
+
+def min_plus(costs1, costs2):
+    """
+    :return: result[l] = min_{i + j = l} costs1[i] + costs2[j] for all l < len(costs1)
+    :rtype: numpy.ndarray
+    """
+    result = np.full(len(costs1), INFINITY)
+    for i in np.nonzero(np.isfinite(costs1))[0]:
+        result[i:] = np.minimum(result[i:], costs1[i] + costs2[:len(costs1) - i])
+    return result
+
+
+__all__ = ["OutsideEstimate", "NullEstimate", "ContextSummaryEstimate"]
@@ -359,7 +359,9 @@ class RightBranchingFSTParserLazy(AbstractParser):
         pass
 
     @staticmethod
-    def preprocess_grammar(grammar):
+    def preprocess_grammar(grammar, trim=False):
+        if trim:
+            grammar.trim()
         grammar.tmp_fst = compile_wfst_from_right_branching_grammar(grammar)
 
 class RightBranchingFSTParser(AbstractParser):
@@ -410,7 +412,9 @@ class RightBranchingFSTParser(AbstractParser):
         pass
 
     @staticmethod
-    def preprocess_grammar(grammar):
+    def preprocess_grammar(grammar, trim=False):
+        if trim:
+            grammar.trim()
         grammar.tmp_fst = compile_wfst_from_right_branching_grammar(grammar)
 
 
@@ -467,7 +471,9 @@ class LeftBranchingFSTParserLazy(AbstractParser):
         pass
 
     @staticmethod
-    def preprocess_grammar(grammar):
+    def preprocess_grammar(grammar, trim=False):
+        if trim:
+            grammar.trim()
         grammar.tmp_fst = compile_wfst_from_left_branching_grammar(grammar)
 
 
@@ -524,7 +530,9 @@ class LeftBranchingFSTParser(AbstractParser):
         pass
 
     @staticmethod
-    def preprocess_grammar(grammar):
+    def preprocess_grammar(grammar, trim=False):
+        if trim:
+            grammar.trim()
         grammar.tmp_fst = compile_wfst_from_left_branching_grammar(grammar)
 
 
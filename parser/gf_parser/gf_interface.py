@@ -128,8 +128,10 @@ class GFParser(AbstractParser):
         return gf_grammar
 
     @staticmethod
-    def preprocess_grammar(grammar):
+    def preprocess_grammar(grammar, trim=False):
         # print gf_grammar
+        if trim:
+            grammar.trim()
         grammar.tmp_gf = GFParser._preprocess(grammar)
 
 
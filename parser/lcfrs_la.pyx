@@ -2,9 +2,11 @@ from cython.operator cimport dereference as deref
 from util.enumerator cimport Enumerator
 from libcpp.vector cimport vector
 from parser.trace_manager.sm_trainer_util cimport PyGrammarInfo, PyStorageManager
-from parser.trace_manager.sm_trainer cimport PyLatentAnnotation, build_PyLatentAnnotation
+from parser.trace_manager.sm_trainer cimport PyLatentAnnotation
+from parser.trace_manager.sm_trainer import build_PyLatentAnnotation_from_arrays
 import itertools
 from collections import defaultdict
+import numpy as np
 import grammar.lcfrs as gl
 
 
@@ -12,7 +14,8 @@ def build_sm_grammar(PyLatentAnnotation latent_annotation,
                      grammar,
                      PyGrammarInfo grammarInfo,
                      rule_pruning,
-                     rule_smoothing=0.0):
+                     rule_smoothing=0.0,
+                     compact=False):
     """
     Given a base LCFRS and a latent annotation object, construct a LCFRS with splitted states.
     :type latent_annotation: PyLatentAnnotation
@@ -20,37 +23,27 @@ def build_sm_grammar(PyLatentAnnotation latent_annotation,
     :type grammarInfo: PyGrammarInfo
     :type rule_pruning: float
     :type rule_smoothing: float
+    :param compact: construct a gl.CompactLCFRS, in which the split rules share their argument patterns
+    :type compact: bool
     :rtype: gl.LCFRS
     """
-    new_grammar = gl.LCFRS(grammar.start() + "[0]")
+    new_grammar = (gl.CompactLCFRS if compact else gl.LCFRS)(grammar.start() + "[0]")
+    _, _, rule_weights = latent_annotation.rule_weight_arrays(grammarInfo)
     for i in range(0, len(grammar.rule_index())):
         rule = grammar.rule_index(i)
 
-        rule_dimensions = [deref(latent_annotation.latentAnnotation).nonterminalSplits[nont]
-                           for nont in deref(grammarInfo.grammarInfo).rule_to_nonterminals[i]]
-        rule_dimensions_product = itertools.product(*[range(dim) for dim in rule_dimensions])
-
-        lhs_dims = deref(latent_annotation.latentAnnotation).nonterminalSplits[
-            deref(grammarInfo.grammarInfo).rule_to_nonterminals[i][0]
-        ]
-
-        for la in rule_dimensions_product:
-            index = list(la)
-
-            if rule_smoothing > 0.0:
-                weight_av = sum([deref(latent_annotation.latentAnnotation).get_weight(i, [lhs] + list(la)[1:])
-                    for lhs in range(lhs_dims)]) / lhs_dims
+        # weights of all splits of the rule, indexed by the splits of lhs and rhs nonterminals
+        weights = rule_weights[i]
+        if rule_smoothing > 0.0:
+            # interpolate with the average over the splits of the lhs nonterminal
+            weights = (1 - rule_smoothing) * weights + rule_smoothing * weights.mean(axis=0)
 
-                weight = (1 - rule_smoothing) * deref(latent_annotation.latentAnnotation).get_weight(i, index) \
-                         + rule_smoothing * weight_av
-            else:
-                weight = deref(latent_annotation.latentAnnotation).get_weight(i, index)
-            if weight > rule_pruning:
-                lhs_la = gl.LCFRS_lhs(rule.lhs().nont() + "[" + str(la[0]) + "]")
-                for arg in rule.lhs().args():
-                    lhs_la.add_arg(arg)
-                nonts = [rhs_nont + "[" + str(la[1 + j]) + "]" for j, rhs_nont in enumerate(rule.rhs())]
-                new_grammar.add_rule(lhs_la, nonts, weight, rule.dcp())
+        for la in zip(*np.nonzero(weights > rule_pruning)):
+            lhs_la = gl.LCFRS_lhs(rule.lhs().nont() + "[" + str(la[0]) + "]")
+            for arg in rule.lhs().args():
+                lhs_la.add_arg(arg)
+            nonts = [rhs_nont + "[" + str(la[1 + j]) + "]" for j, rhs_nont in enumerate(rule.rhs())]
+            new_grammar.add_rule(lhs_la, nonts, float(weights[la]), rule.dcp())
 
     return new_grammar
 
@@ -83,7 +76,8 @@ def construct_fine_grammar(PyLatentAnnotation latent_annotation,
 
     new_grammar = gl.LCFRS(grammar.start())
 
-    cdef vector[double] root_weights = deref(la_full.latentAnnotation).get_root_weights()
+    _, root_weights, full_weights = la_full.rule_weight_arrays(grammarInfo)
+    _, _, coarse_weights = latent_annotation.rule_weight_arrays(grammarInfo)
     cdef vector[size_t] smooth_rules = []
     latent_rule_weights = defaultdict(lambda: defaultdict(lambda: 0.0))
 
@@ -108,7 +102,7 @@ def construct_fine_grammar(PyLatentAnnotation latent_annotation,
 
         for la in rule_dimensions_product:
             index = list(la)
-            weight = deref(latent_annotation.latentAnnotation).get_weight(i, index)
+            weight = float(coarse_weights[i][la])
             if weight > 0.0:
                 lhs_la = gl.LCFRS_lhs(rename(rule.lhs().nont(), la[0], nont_ids[0]))
                 for arg in rule.lhs().args():
@@ -128,8 +122,7 @@ def construct_fine_grammar(PyLatentAnnotation latent_annotation,
 
                 for laf in itertools.product(*product_range):
                     laf_masked = tuple([0 if mb else laf[mi] for mi, mb in enumerate(mask)])
-                    latent_rule_weights[new_rule.get_idx()][laf_masked] \
-                        = deref(la_full.latentAnnotation).get_weight(i, list(laf))
+                    latent_rule_weights[new_rule.get_idx()][laf_masked] = full_weights[i][laf]
 
                 if nonts == [] and smooth_transform is not None:
                     # smoothing part
@@ -154,16 +147,17 @@ def construct_fine_grammar(PyLatentAnnotation latent_annotation,
         else:
             nonterminal_splits.push_back(deref(la_full.latentAnnotation).nonterminalSplits[old_idx])
 
-    cdef vector[vector[double]] rule_weights = []
-
+    rule_weights = []
     for idx, nonts in enumerate(deref(new_grammar_info.grammarInfo).rule_to_nonterminals):
-        weights = []
-        splits = [nonterminal_splits[nont] for nont in nonts]
-        for la in itertools.product(*[range(s) for s in splits]):
-            weights.append(latent_rule_weights[idx][la])
-        rule_weights.push_back(weights)
+        weights = np.zeros([nonterminal_splits[nont] for nont in nonts])
+        for la, weight in latent_rule_weights[idx].items():
+            weights[la] = weight
+        rule_weights.append(weights.ravel())
+    offsets = np.zeros(len(rule_weights) + 1, dtype=np.intp)
+    np.cumsum([len(weights) for weights in rule_weights], out=offsets[1:])
 
     cdef PyStorageManager storage_manager = PyStorageManager()
-    la_new_grammar = build_PyLatentAnnotation(nonterminal_splits, root_weights, rule_weights, new_grammar_info,
-                                              storage_manager)
+    la_new_grammar = build_PyLatentAnnotation_from_arrays(nonterminal_splits, root_weights,
+                                                          np.concatenate(rule_weights) if rule_weights else [],
+                                                          offsets, new_grammar_info, storage_manager)
     return new_grammar, la_new_grammar, new_grammar_info, nonterminals, nont_translation, smooth_rules
\ No newline at end of file
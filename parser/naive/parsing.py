@@ -2,18 +2,16 @@
 from __future__ import print_function
 import math
 import sys
-import re
 
 from grammar.lcfrs import *
 
 from parser.naive.derivation import Derivation
 from grammar.dcp import *
 from parser.parser_interface import AbstractParser
+from parser.estimates import NullEstimate, INFINITY
 from collections import namedtuple, defaultdict
-
-RULE = 0
-PAIR = 1
-KEY = 2
+from util.enumerator import Enumerator
+import heapq
 
 if sys.version_info[0] == 3:
     unicode = str
@@ -323,79 +321,123 @@ class Rule_instance:
     def new_key(self):
         return self.lhs().key_ranges(), self.dot(), id(self.rule())
 
+# Layout of a rule for parsing: the members of the LHS arguments are flattened into
+# slots, each of which is assigned one span. Nonterminals are integers.
+# rule: LCFRS_rule
+# lhs: int (LHS nonterminal)
+# rhs: tuple of int (RHS nonterminals)
+# slot_arg: list of int (LHS argument of each slot)
+# fixed: list of pairs of int and string/None (slots of terminals and of empty
+#        arguments, the latter with None as terminal)
+# var_slots: list of list of int (slot of variable [i,j] in var_slots[i][j])
+# arg_slots: list of pairs of int (first and last slot of each LHS argument)
+RuleLayout = namedtuple('RuleLayout', ['rule', 'lhs', 'rhs', 'slot_arg', 'fixed', 'var_slots', 'arg_slots'])
+
 
-# For rule and input string, replace terminals by spans in all possible
-# ways.
 # rule: LCFRS_rule
-# inp: list of string
-def make_rule_instances(rule, inp):
-    empty = LHS_instance(rule.lhs().nont())
-    lhs_instances = make_rule_instances_from_args(empty, \
-                                                  rule.lhs().args(), inp, 0)
-    lhs_instances = [lhs for lhs in lhs_instances if lhs.consistent()]
-    return [Rule_instance(rule, lhs) for lhs in lhs_instances]
-
-
-# Make instances from remaining arguments.
-# instance: LHS_instance
-# args: list of list of string/LCFRS_var
-# inp: list of string
-# pos: int
-# return: list of LHS_instance
-def make_rule_instances_from_args(instance, args, inp, pos):
-    if len(args) == 0:
-        return [instance]
-    else:
-        first_arg = args[0]
-        rest_args = args[1:]
-        instance.add_arg()
-        if len(first_arg) == 0:
-            out = []
-            for i in range(pos, len(inp) + 1):
-                span = Span(i, i)
-                new_instance = instance.clone()
-                new_instance.add_mem(span)
-                out += make_rule_instances_from_args(new_instance, \
-                                                     rest_args, inp, i)
-            return out
-        else:
-            return make_rule_instances_from_members(instance, \
-                                                    first_arg, rest_args, inp, pos)
-
-
-# Make instances from remaining members.
-# instance: LHS_instance
-# members: list of string/LCFRS_var
-# args: list of list of string/LCFRS_var
-# inp: list of string
-# pos: int
-# return: list of LHS_instance
-def make_rule_instances_from_members(instance, members, args, inp, pos):
-    if len(members) == 0:
-        return make_rule_instances_from_args(instance, args, inp, pos)
+# nonts: Enumerator
+# return: RuleLayout
+def rule_layout(rule, nonts):
+    slot_arg, fixed, arg_slots = [], [], []
+    var_slots = [{} for _ in range(rule.rank())]
+    for i, arg in enumerate(rule.lhs().args()):
+        first = len(slot_arg)
+        if len(arg) == 0:
+            fixed.append((len(slot_arg), None))
+            slot_arg.append(i)
+        for mem in arg:
+            if isinstance(mem, str) or isinstance(mem, unicode):
+                fixed.append((len(slot_arg), mem))
+            else:
+                var_slots[mem.mem][mem.arg] = len(slot_arg)
+            slot_arg.append(i)
+        arg_slots.append((first, len(slot_arg) - 1))
+    var_slots = [[slots[j] for j in range(len(slots))] for slots in var_slots]
+    rhs = tuple([nonts.object_index(rule.rhs_nont(i)) for i in range(rule.rank())])
+    return RuleLayout(rule, nonts.object_index(rule.lhs().nont()), rhs, slot_arg, fixed, var_slots, arg_slots)
+
+
+# Spans of slots are stored in a flat list bounds, where bounds[2 * slot] and
+# bounds[2 * slot + 1] are the low and high position of slot, or -1 if the
+# slot is not assigned yet.
+
+# Check whether assigning span (low, high) to slot is consistent with the
+# closest assigned slots to the left and to the right: spans must be in
+# increasing order, neighbouring ones in the same argument must connect, and
+# each unassigned slot in between covers at least one position (i.e., the
+# grammar is assumed to be epsilon-free).
+# bounds: list of int
+# slot_arg: list of int
+# slot: int
+# low: int
+# high: int
+# return: bool
+def fits(bounds, slot_arg, slot, low, high):
+    gap = 0
+    k = slot - 1
+    while k >= 0 and bounds[2 * k] < 0:
+        gap += 1
+        k -= 1
+    if k < 0:
+        if low < gap:
+            return False
+    elif gap == 0 and slot_arg[k] == slot_arg[slot]:
+        if low != bounds[2 * k + 1]:
+            return False
+    elif low < bounds[2 * k + 1] + gap:
+        return False
+    gap = 0
+    k = slot + 1
+    while k < len(slot_arg) and bounds[2 * k] < 0:
+        gap += 1
+        k += 1
+    if k == len(slot_arg):
+        return True
+    elif gap == 0 and slot_arg[k] == slot_arg[slot]:
+        return bounds[2 * k] == high
     else:
-        mem = members[0]
-        rest_mems = members[1:]
-        if isinstance(mem, str) or isinstance(mem, unicode):
-            out = []
-            for i in range(pos, len(inp)):
-                if inp[i] == mem:
-                    span = Span(i, i + 1)
-                    new_instance = instance.clone()
-                    new_instance.add_mem(span)
-                    if new_instance.consistent():
-                        out += make_rule_instances_from_members(new_instance, \
-                                                                rest_mems, args, inp, i + 1)
-            return out
-        else:
-            instance.add_mem(mem)
-            return make_rule_instances_from_members(instance, \
-                                                    rest_mems, args, inp, pos)
+        return bounds[2 * k] >= high + gap
+
+
+# Minimum and maximum left position of the span of (unassigned) slot.
+# bounds: list of int
+# slot_arg: list of int
+# slot: int
+# inp_len: int
+# return: pair of int
+def slot_bounds(bounds, slot_arg, slot, inp_len):
+    k = slot - 1
+    while k >= 0 and bounds[2 * k] < 0:
+        k -= 1
+    low = bounds[2 * k + 1] if k >= 0 else 0
+    if k == slot - 1 and k >= 0 and slot_arg[k] == slot_arg[slot]:
+        return low, low
+    k = slot + 1
+    while k < len(slot_arg) and bounds[2 * k] < 0:
+        k += 1
+    return low, bounds[2 * k] if k < len(slot_arg) else inp_len
+
+
+# Bitset of the positions in span (low, high).
+# return: int
+def span_mask(low, high):
+    return (1 << high) - (1 << low)
 
 
 #######################################################
 # Parser.
 
+# Items are identified by integers and their properties are stored in flat
+# lists. A passive item is a nonterminal together with one span per argument,
+# which is stored as the flat tuple (low_0, high_0, low_1, high_1, ...).
+# An active item is a rule layout with a dot and the bounds of its slots.
+# Both kinds of items carry a bitset of the covered input positions.
+# A trace (i.e., backpointer) of an item is a triple of the rule idx,
+# the active item (or -1 if the rule is instantiated) and the passive item
+# (or -1 if the rule has rank 0) it was obtained from.
+# By default, the chart is built exhaustively. In best-first mode, the agenda
+# is a priority queue ordered by the inside cost of items plus an outside
+# estimate, and parsing stops as soon as the goal item is processed.
 class LCFRS_parser(AbstractParser):
     def all_derivation_trees(self):
         assert 'Not implemented'
@@ -403,16 +445,22 @@ class LCFRS_parser(AbstractParser):
     # Constructor.
     # grammar: LCFRS
     # inp: list of string
-    def __init__(self, grammar, input=None, save_preprocess=None, load_preprocess=None):
+    # filter_input: parse with the rules of grammar.filter_for_input(inp) only
+    # best_first: use a priority agenda (requires rule weights <= 1)
+    # estimate: OutsideEstimate for A* parsing in best-first mode (default: NullEstimate)
+    # deadline, max_items: budget of each parse, cf. AbstractParser.set_budget
+    def __init__(self, grammar, input=None, save_preprocess=None, load_preprocess=None, filter_input=True,
+                 best_first=False, estimate=None, deadline=None, max_items=None):
         super(LCFRS_parser, self).__init__(grammar, input)
+        self.set_budget(deadline, max_items)
         self.__g = grammar
-        self.__nont_items = defaultdict(list)
-        self.__rule_items = defaultdict(list)
-        self.__agenda = []
-        self.__agenda_set = set()
-        self.__trace = defaultdict(list)
-        self.__best = {}
+        self.__filter_input = filter_input
+        self.__best_first = best_first
+        self.__estimate = estimate if estimate is not None else NullEstimate()
+        self.__nonts = Enumerator()
+        self.__layouts = {}
         self.__inp = input
+        self.__reset()
         if self.__inp is not None:
             self.__parse()
         else:
@@ -426,254 +474,447 @@ class LCFRS_parser(AbstractParser):
 
     def clear(self):
         self.__inp = None
-        self.__nont_items = defaultdict(list)
-        self.__rule_items = defaultdict(list)
+        self.__reset()
+
+    def __reset(self):
+        self.__inp_len = 0
+        self.__width = 0
+        self.__start = -1
+        self.__term_positions = defaultdict(list)
+        self.__instances = {}
+        self.__corners = {}
         self.__agenda = []
-        self.__agenda_set = set()
-        self.__trace = defaultdict(list)
-        self.__best = {}
+        self.__estimates = {}
+        # passive items
+        self.__passive_index = {}
+        self.__p_nont = []
+        self.__p_ranges = []
+        self.__p_mask = []
+        self.__p_traces = []
+        self.__p_best = []
+        self.__p_cost = []
+        self.__p_priority = []
+        self.__p_done = []
+        # active items
+        self.__active_index = {}
+        self.__a_layout = []
+        self.__a_dot = []
+        self.__a_bounds = []
+        self.__a_mask = []
+        self.__a_traces = []
+        self.__a_best = []
+        self.__a_cost = []
+        self.__a_priority = []
+        self.__a_done = []
+        # chart: items indexed by left position * width + nonterminal
+        self.__passive_at = []
+        self.__active_at = []
+
+    # Get layout of rule.
+    # rule: LCFRS_rule
+    # return: RuleLayout
+    def __layout(self, rule):
+        layout = self.__layouts.get(rule.get_idx())
+        if layout is None:
+            layout = rule_layout(rule, self.__nonts)
+            self.__layouts[rule.get_idx()] = layout
+        return layout
 
     def __parse(self):
+        self.__reset()
         inp = self.__inp
-        inp_len = len(inp)
-        for rule in self.__g.epsilon_rules():
-            for inst in make_rule_instances(rule, inp):
-                self.__record_item(inst, rule)
+        self.__inp_len = len(inp)
+        grammar = self.__g.filter_for_input(inp) if self.__filter_input else self.__g
+        self.__start = self.__nonts.object_index(grammar.start())
+        for nont in grammar.nonts():
+            self.__nonts.object_index(nont)
+        self.__width = self.__nonts.get_counter()
+        size = (self.__inp_len + 1) * self.__width
+        self.__passive_at = [None] * size
+        self.__active_at = [None] * size
+        for i, term in enumerate(inp):
+            self.__term_positions[term].append(i)
+
+        for rule in grammar.epsilon_rules():
+            self.__seed(rule)
         for term in set(inp):
-            for rule in self.__g.lex_rules(term):
-                for inst in make_rule_instances(rule, inp):
-                    self.__record_item(inst, rule)
+            for rule in grammar.lex_rules(term):
+                self.__seed(rule)
+
+        budget = self.budget
+        if budget is not None:
+            budget.reset()
+        if self.__best_first:
+            self.__parse_best_first(grammar, budget)
+            return
         while len(self.__agenda) != 0:
+            if budget is not None and budget.spend():
+                return
             item = self.__agenda.pop()
-            if isinstance(item, LHS_instance):
-                low = item.left_position()
-                nont = item.nont()
-                # key = str(low) + ' ' + nont
-                key = low, nont
-                self.__nont_items[key].append(item)
-                for rule_item in self.__rule_items[key]:
-                    # self.__combine(rule_item, item, rule_item.key(), str(item))
-                    self.__combine(rule_item, item, (KEY, rule_item.new_key()), (KEY, item.new_key()))
-                for rule in self.__g.nont_corner_of(nont):
-                    for inst in make_rule_instances(rule, inp):
-                        # self.__combine(inst, item, rule, str(item))
-                        self.__combine(inst, item, rule, (KEY, item.new_key()))
-
-            else:  # instance of Rule_instance
-                (low, high) = item.next_member_bounds(inp_len)
-                nont = item.next_nont()
-                # these are possible start positions for the next nont_item for A_i
-                # there might be multiple, if a variable precedes x_i,0
-                for pos in range(low, high + 1):
-                    # key = str(pos) + ' ' + nont
-                    key = pos, nont
-                    self.__rule_items[key].append(item)
-                    for nont_item in self.__nont_items[key]:
-                        # self.__combine(item, nont_item, item.key(), str(nont_item))
-                        self.__combine(item, nont_item, (KEY, item.new_key()), (KEY, nont_item.new_key()))
-
-                        # key = low, nont
-                        # self.__rule_items[key].append(item)
-                        # for nont_item in self.__nont_items[key]:
-                        #     # self.__combine(item, nont_item, item.key(), str(nont_item))
-                        #     self.__combine(item, nont_item, (KEY, item.new_key()), (KEY, nont_item.new_key()))
-
-    # Combine rule item with nont item.
-    # rule_item: Rule_instance
-    # nont_item: LHS_instance
-    # rule_trace: string or LCFRS_rule
-    # nont_trace: string
-    def __combine(self, rule_item, nont_item, rule_trace, nont_trace):
-        lhs = rule_item.lhs().clone()
-        dot = rule_item.dot()
-        # for i in range(nont_item.fanout()):
-        #     arg = nont_item.arg(i)
-        #     low = arg[0].low
-        #     high = arg[0].high
-        #     lhs.replace(dot, i, Span(low, high))
-        # if lhs.consistent():
-        if lhs.replace_consistent(dot, nont_item):
-            advanced_item = Rule_instance(rule_item.rule(), lhs, dot=dot + 1)
-            self.__record_item(advanced_item, (PAIR, rule_trace, nont_trace))
-
-    def __record_item(self, item, trace):
-        """
-        :type item: Rule_instance
-        :param trace: pair or LCFRS_rule
-        :return:
-        """
-        if item.complete():
-            lhs = item.lhs()
-            lhs.collapse()
-            # key = str(lhs)
-            key = KEY, lhs.new_key()
-            if key not in self.__agenda_set:
-                self.__agenda_set.add(key)
-                self.__agenda.append(lhs)
-            self.__trace[key].append(trace)
+            if item % 2 == 0:
+                self.__process_passive(item // 2, grammar)
+            else:
+                self.__process_active(item // 2)
+
+    # Process items in the order of their priority until the goal item is
+    # processed. Outdated agenda entries of items, whose cost was lowered
+    # meanwhile, are skipped. If an item is reached with a lower cost after
+    # it has been processed (i.e., the estimate is not consistent), it is
+    # processed again to propagate its new cost.
+    # grammar: LCFRS
+    # budget: Budget or None
+    def __parse_best_first(self, grammar, budget):
+        goal = 0, self.__inp_len
+        while len(self.__agenda) != 0:
+            if budget is not None and budget.spend():
+                return
+            priority, item = heapq.heappop(self.__agenda)
+            if item % 2 == 0:
+                passive = item // 2
+                if priority > self.__p_priority[passive]:
+                    continue
+                self.__process_passive(passive, grammar)
+                if self.__p_nont[passive] == self.__start and self.__p_ranges[passive] == goal:
+                    return
+            else:
+                active = item // 2
+                if priority > self.__a_priority[active]:
+                    continue
+                self.__process_active(active)
+
+    # Outside estimate of items with nonterminal nont covering length input positions.
+    # nont: int
+    # length: int
+    # complete: bool (whether nont is the nonterminal of a passive item or the LHS of an active item)
+    # return: float
+    def __outside_estimate(self, nont, length, complete):
+        key = nont, length, complete
+        estimate = self.__estimates.get(key)
+        if estimate is None:
+            if complete:
+                estimate = self.__estimate.passive(self.__nonts.index_object(nont), length, self.__inp_len)
+            else:
+                estimate = self.__estimate.active(self.__nonts.index_object(nont), length, self.__inp_len)
+            self.__estimates[key] = estimate
+        return estimate
+
+    # Lower bound on the inside costs of the RHS nonterminals of layout from dot on.
+    # layout: RuleLayout
+    # dot: int
+    # return: float
+    def __remaining_estimate(self, layout, dot):
+        key = layout.rule.get_idx(), dot
+        estimate = self.__estimates.get(key)
+        if estimate is None:
+            estimate = sum([self.__estimate.inside(self.__nonts.index_object(nont), self.__inp_len)
+                            for nont in layout.rhs[dot:]])
+            self.__estimates[key] = estimate
+        return estimate
+
+    # Inside cost of the item obtained by trace from the current costs of its antecedents.
+    # trace: triple of int
+    # return: float
+    def __trace_cost(self, trace):
+        idx, active, passive = trace
+        if active < 0:
+            cost = -math.log(self.__layouts[idx].rule.weight())
         else:
-            key = KEY, item.new_key()
-            # key = item.key()
-            if key not in self.__agenda_set:
-                self.__agenda_set.add(key)
-                self.__agenda.append(item)
-            self.__trace[key].append(trace)
-
-    # Start item (which if presence indicates recognition).
-    # return: LHS_instance
+            cost = self.__a_cost[active]
+        if passive >= 0:
+            cost += self.__p_cost[passive]
+        return cost
+
+    # Record all instances of a rule of rank 0.
+    # rule: LCFRS_rule
+    def __seed(self, rule):
+        layout = self.__layout(rule)
+        for bounds in self.__rule_instances(layout):
+            self.__record_passive(layout, bounds, (rule.get_idx(), -1, -1))
+
+    # Assign spans to the terminals and empty arguments of a rule in all
+    # consistent ways.
+    # layout: RuleLayout
+    # return: list of tuple of int (bounds)
+    def __rule_instances(self, layout):
+        idx = layout.rule.get_idx()
+        if idx in self.__instances:
+            return self.__instances[idx]
+        instances = [[-1] * (2 * len(layout.slot_arg))]
+        for slot, term in layout.fixed:
+            if term is None:
+                positions = [(i, i) for i in range(self.__inp_len + 1)]
+            else:
+                positions = [(i, i + 1) for i in self.__term_positions[term]]
+            extended = []
+            for bounds in instances:
+                for low, high in positions:
+                    if fits(bounds, layout.slot_arg, slot, low, high):
+                        new_bounds = list(bounds)
+                        new_bounds[2 * slot] = low
+                        new_bounds[2 * slot + 1] = high
+                        extended.append(new_bounds)
+            instances = extended
+        instances = [tuple(bounds) for bounds in instances]
+        self.__instances[idx] = instances
+        return instances
+
+    # Get layouts of the rules, whose first RHS nonterminal is nont.
+    # nont: int
+    # grammar: LCFRS
+    # return: list of RuleLayout
+    def __corner_layouts(self, nont, grammar):
+        if nont not in self.__corners:
+            self.__corners[nont] \
+                = [self.__layout(rule) for rule in grammar.nont_corner_of(self.__nonts.index_object(nont))]
+        return self.__corners[nont]
+
+    # passive: int
+    # grammar: LCFRS
+    def __process_passive(self, passive, grammar):
+        nont = self.__p_nont[passive]
+        key = self.__p_ranges[passive][0] * self.__width + nont
+        if not self.__p_done[passive]:
+            self.__p_done[passive] = True
+            if self.__passive_at[key] is None:
+                self.__passive_at[key] = []
+            self.__passive_at[key].append(passive)
+        for active in self.__active_at[key] or []:
+            self.__combine(self.__a_layout[active], self.__a_dot[active], self.__a_bounds[active],
+                           self.__a_mask[active], active, passive)
+        for layout in self.__corner_layouts(nont, grammar):
+            for bounds in self.__rule_instances(layout):
+                self.__combine(layout, 0, bounds, 0, -1, passive)
+
+    # active: int
+    def __process_active(self, active):
+        layout = self.__a_layout[active]
+        dot = self.__a_dot[active]
+        nont = layout.rhs[dot]
+        low, high = slot_bounds(self.__a_bounds[active], layout.slot_arg, layout.var_slots[dot][0],
+                                self.__inp_len)
+        # these are possible start positions for the next passive item,
+        # there might be multiple, if a variable precedes [dot,0]
+        register = not self.__a_done[active]
+        self.__a_done[active] = True
+        for pos in range(low, high + 1):
+            key = pos * self.__width + nont
+            if register:
+                if self.__active_at[key] is None:
+                    self.__active_at[key] = []
+                self.__active_at[key].append(active)
+            for passive in self.__passive_at[key] or []:
+                self.__combine(layout, dot, self.__a_bounds[active], self.__a_mask[active], active, passive)
+
+    # Combine rule instance or active item with passive item.
+    # layout: RuleLayout
+    # dot: int
+    # bounds: tuple of int
+    # mask: int (bitset of the positions covered by bounds)
+    # active: int (-1 for rule instance)
+    # passive: int
+    def __combine(self, layout, dot, bounds, mask, active, passive):
+        if mask & self.__p_mask[passive]:
+            return
+        ranges = self.__p_ranges[passive]
+        bounds = list(bounds)
+        for j, slot in enumerate(layout.var_slots[dot]):
+            low = ranges[2 * j]
+            high = ranges[2 * j + 1]
+            if not fits(bounds, layout.slot_arg, slot, low, high):
+                return
+            bounds[2 * slot] = low
+            bounds[2 * slot + 1] = high
+        trace = layout.rule.get_idx(), active, passive
+        if dot + 1 == len(layout.rhs):
+            self.__record_passive(layout, bounds, trace)
+        else:
+            self.__record_active(layout, dot + 1, tuple(bounds), mask | self.__p_mask[passive], trace)
+
+    # Record passive item obtained from complete rule instance.
+    # layout: RuleLayout
+    # bounds: list of int
+    # trace: triple of int
+    def __record_passive(self, layout, bounds, trace):
+        ranges = []
+        for first, last in layout.arg_slots:
+            ranges.append(bounds[2 * first])
+            ranges.append(bounds[2 * last + 1])
+        packed = 0
+        for pos in ranges:
+            packed = packed * (self.__inp_len + 1) + pos
+        key = packed * self.__width + layout.lhs
+        passive = self.__passive_index.get(key)
+        if passive is None:
+            passive = len(self.__p_nont)
+            self.__passive_index[key] = passive
+            self.__p_nont.append(layout.lhs)
+            self.__p_ranges.append(tuple(ranges))
+            mask = 0
+            for i in range(0, len(ranges), 2):
+                mask |= span_mask(ranges[i], ranges[i + 1])
+            self.__p_mask.append(mask)
+            self.__p_traces.append([])
+            self.__p_best.append(None)
+            self.__p_done.append(False)
+            if self.__best_first:
+                cost = self.__trace_cost(trace)
+                length = sum([ranges[i + 1] - ranges[i] for i in range(0, len(ranges), 2)])
+                priority = cost + self.__outside_estimate(layout.lhs, length, True)
+                self.__p_cost.append(cost)
+                self.__p_priority.append(priority)
+                if priority < INFINITY:
+                    heapq.heappush(self.__agenda, (priority, 2 * passive))
+            else:
+                self.__agenda.append(2 * passive)
+        elif self.__best_first:
+            cost = self.__trace_cost(trace)
+            if cost < self.__p_cost[passive]:
+                self.__p_priority[passive] -= self.__p_cost[passive] - cost
+                self.__p_cost[passive] = cost
+                heapq.heappush(self.__agenda, (self.__p_priority[passive], 2 * passive))
+        self.__p_traces[passive].append(trace)
+
+    # layout: RuleLayout
+    # dot: int
+    # bounds: tuple of int
+    # mask: int
+    # trace: triple of int
+    def __record_active(self, layout, dot, bounds, mask, trace):
+        key = layout.rule.get_idx(), dot, bounds
+        active = self.__active_index.get(key)
+        if active is None:
+            active = len(self.__a_layout)
+            self.__active_index[key] = active
+            self.__a_layout.append(layout)
+            self.__a_dot.append(dot)
+            self.__a_bounds.append(bounds)
+            self.__a_mask.append(mask)
+            self.__a_traces.append([])
+            self.__a_best.append(None)
+            self.__a_done.append(False)
+            if self.__best_first:
+                cost = self.__trace_cost(trace)
+                priority = cost + self.__outside_estimate(layout.lhs, bin(mask).count('1'), False) \
+                    + self.__remaining_estimate(layout, dot)
+                self.__a_cost.append(cost)
+                self.__a_priority.append(priority)
+                if priority < INFINITY:
+                    heapq.heappush(self.__agenda, (priority, 2 * active + 1))
+            else:
+                self.__agenda.append(2 * active + 1)
+        elif self.__best_first:
+            cost = self.__trace_cost(trace)
+            if cost < self.__a_cost[active]:
+                self.__a_priority[active] -= self.__a_cost[active] - cost
+                self.__a_cost[active] = cost
+                heapq.heappush(self.__agenda, (self.__a_priority[active], 2 * active + 1))
+        self.__a_traces[active].append(trace)
+
+    # Passive item (which if presence indicates recognition).
+    # return: int or None
     def __start_item(self):
-        start_lhs = LHS_instance(self.__g.start())
-        start_lhs.add_arg()
-        start_lhs.add_mem(Span(0, len(self.__inp)))
-        return start_lhs
+        return self.__passive_index.get(self.__inp_len * self.__width + self.__start)
 
     # Return weight of best derivation.
     # Or -1 when none found.
     # return: float
     def best(self):
-        start_lhs = self.__start_item()
-        # elem = str(start_lhs)
-        elem = KEY, start_lhs.new_key()
-        trace = self.__trace[elem]
-        if len(trace) == 0:
+        start = self.__start_item()
+        if start is None:
             return -1
         else:
-            return self.__find_best_from(elem)
+            return self.__passive_weight(start)
 
-    # Find weight of best subderivation for all items, top-down.
-    # elem: pair or string
+    # Find weight of best subderivation for items, top-down.
+    # passive: int
     # return: float
-    def __find_best_from(self, elem):
-        # if isinstance(elem, str) or isinstance(elem, unicode):
-        if isinstance(elem, tuple) and elem[0] == KEY:
-            if elem in self.__best:
-                return self.__best[elem]
-            else:
-                self.__best[elem] = sys.float_info.max  # avoid cycles
-                traces = self.__trace[elem]
-                best = sys.float_info.max
-                for trace in traces:
-                    best = min(best, self.__find_best_from(trace))
-                self.__best[elem] = best
-                return best
-        elif isinstance(elem, tuple) and elem[0] == PAIR:
-            # return self.__find_best_from(elem[0]) + self.__find_best_from(elem[1])
-            return self.__find_best_from(elem[1]) + self.__find_best_from(elem[2])
+    def __passive_weight(self, passive):
+        best = self.__p_best[passive]
+        if best is None:
+            self.__p_best[passive] = sys.float_info.max  # avoid cycles
+            best = sys.float_info.max
+            for trace in self.__p_traces[passive]:
+                best = min(best, self.__trace_weight(trace))
+            self.__p_best[passive] = best
+        return best
+
+    # active: int
+    # return: float
+    def __active_weight(self, active):
+        best = self.__a_best[active]
+        if best is None:
+            self.__a_best[active] = sys.float_info.max  # avoid cycles
+            best = sys.float_info.max
+            for trace in self.__a_traces[active]:
+                best = min(best, self.__trace_weight(trace))
+            self.__a_best[active] = best
+        return best
+
+    # trace: triple of int
+    # return: float
+    def __trace_weight(self, trace):
+        idx, active, passive = trace
+        if active < 0:
+            weight = -math.log(self.__layouts[idx].rule.weight())
         else:
-            return -math.log(elem.weight())
+            weight = self.__active_weight(active)
+        if passive >= 0:
+            weight += self.__passive_weight(passive)
+        return weight
 
     # Recognized?
     # return: bool
     def recognized(self):
-        start_lhs = self.__start_item()
-        # elem = str(start_lhs)
-        elem = KEY, start_lhs.new_key()
-        trace = self.__trace[elem]
-        return len(trace) > 0
+        return self.__start_item() is not None
 
     # Return best derivation or None.
     # return: Derivation
     def best_derivation_tree(self):
-        start_lhs = self.__start_item()
-        # elem = str(start_lhs)
-        elem = KEY, start_lhs.new_key()
-        trace = self.__trace[elem]
-        if len(trace) == 0:
+        start = self.__start_item()
+        if start is None:
             return None
         else:
-            w = self.best()
             tree = Derivation()
-            self.__best_derivation_tree_rec(elem, tree, tree.root_id(), w, [Span(0, len(self.__inp))])
+            self.__best_derivation_tree_rec(start, tree, tree.root_id())
             return tree
 
+    # Select the first trace that yields weight w.
+    # traces: list of triple of int
+    # w: float
+    # return: triple of int
+    def __best_trace(self, traces, w):
+        for trace in traces:
+            if w == self.__trace_weight(trace):
+                return trace
+        print('looking for', w, 'found:')
+        for trace in traces:
+            print(self.__trace_weight(trace))
+        raise Exception('backtrace failed')
+
     # Get derivation tree of best parse. (includes Spans of sub derivations)
-    # elem: string or tuple (identifier in trace)
+    # passive: int
     # tree: Derivation (tree that gets extended)
     # id: string position (Gorn) in Derivation tree that is extended
-    # w: float (weight of best path in subderivation)
-    # spans: list of Span (of subderivation)
-    # return: Derivation
-    def __best_derivation_tree_rec(self, elem, tree, id, w, spans):
-        # if isinstance(elem, str) or isinstance(elem, unicode):
-        if isinstance(elem, tuple) and elem[0] == KEY:
-            # passive item:
-            traces = self.__trace[elem]
-            for trace in traces:
-                if w == self.__find_best_from(trace):
-                    return self.__best_derivation_tree_rec(trace, tree, id, w, spans)
-            print('looking for', w, 'found:')
-            for trace in traces:
-                print(self.__find_best_from(trace))
-            raise Exception('backtrace failed')
-        elif isinstance(elem, tuple) and elem[0] == PAIR:
-            # active item (elem[0]) was combined with passive item (elem[0])
-            w1 = self.__find_best_from(elem[1])
-            w2 = self.__find_best_from(elem[2])
-            # extract span of the passive item
-
-            # sub_span = extract_spans(elem[1])
-            sub_span = new_extract_spans(elem[2])
-            # extend tree at child position corresponding to the dot of active item
-            # self.__best_derivation_tree_rec(elem[1], tree, id + tree.gorn_delimiter() + str(dot_position(elem[0])), w2,
-            #                             sub_span)
-            self.__best_derivation_tree_rec(elem[2], tree, id + tree.gorn_delimiter() + str(new_dot_position(elem[1])),
-                                            w2,
-                                            sub_span)
-            # extend active item
-            # self.__best_derivation_tree_rec(elem[0], tree, id, w1, spans)
-            self.__best_derivation_tree_rec(elem[1], tree, id, w1, spans)
-
-        else:
-            # if all children have been added to derivation, add parent rule
-            # as Rule_instance with detected spans
-            lhs = LHS_instance(elem.lhs().nont())
-            for span in spans:
-                lhs.add_arg()
-                lhs.add_mem(span)
-            ri = Rule_instance(elem, lhs, elem.rank())
-            tree.add_rule(id, ri, w)
-
-
-# FIXME: This method only works, if nonterminals don't contain whitespace!!!
-# FIXME: there must a better way to construct the Derivation tree
-# the position of the nonterminal no rhs that follows the dot
-# (counting started from 0)
-# input: key-string of Rule_instance
-# return: int
-def dot_position(key):
-    if isinstance(key, str) or isinstance(key, unicode):
-        match = re.search(r'^.*->(.*)\*(.*)$', key)
-        return len([i for i in match.group(1).split(' ') if i != ''])
-    else:
-        return 0
-
-
-def new_dot_position(key):
-    if isinstance(key, LCFRS_rule):
-        return 0
-    # elif: isinstance(key, tuple) and key[0] == KEY:
-    else:
-        return key[1][1]
-
-
-# extract spans from key-string of passive item
-# key: string (e.g. "A([0-4]; [12-15])" )
-# return: list of Span
-def extract_spans(key):
-    spans = []
-    match = re.search(r'^\s*.*\((\s*\[.*\]\s*)\)\s*$', key)
-    for s in match.group(1).split('; '):
-        match1 = re.search(r'^\[([0-9]+)-([0-9]+)\];*$', s)
-        spans += [Span(int(match1.group(1)), int(match1.group(2)))]
-    return spans
-
-
-def new_extract_spans(key):
-    # assert key[0] == KEY
-    spans = []
-    for low, high in list(key[1][1]):
-        spans.append(Span(low, high))
-    return spans
-
-
-__all__ = ["LCFRS_parser", "LHS_instance", "Span"]
\ No newline at end of file
+    def __best_derivation_tree_rec(self, passive, tree, id):
+        idx, active, child = self.__best_trace(self.__p_traces[passive], self.__passive_weight(passive))
+        children = []
+        while True:
+            if child >= 0:
+                children.append(child)
+            if active < 0:
+                break
+            idx, active, child = self.__best_trace(self.__a_traces[active], self.__active_weight(active))
+        children.reverse()
+
+        rule = self.__layouts[idx].rule
+        ranges = self.__p_ranges[passive]
+        lhs = LHS_instance(rule.lhs().nont())
+        for i in range(0, len(ranges), 2):
+            lhs.add_arg()
+            lhs.add_mem(Span(ranges[i], ranges[i + 1]))
+        tree.add_rule(id, Rule_instance(rule, lhs, rule.rank()), -math.log(rule.weight()))
+        for i, child in enumerate(children):
+            self.__best_derivation_tree_rec(child, tree, tree.child_id(id, i))
+
+
+__all__ = ["LCFRS_parser", "LHS_instance", "Span"]
@@ -4,12 +4,72 @@ __author__ = 'kilian'
 
 from abc import ABCMeta, abstractmethod
 from parser.sDCPevaluation.evaluator import dcp_to_hybridtree, DCP_evaluator
+from parser.worker_pool import DeadlinePool, TIMEOUT
 from collections import defaultdict
+import multiprocessing
+import time
+
+
+class Budget(object):
+    """
+    Cooperative bound of a parse by a deadline (in seconds since the epoch, cf. time.time) and/or
+    a maximum number of processed items. Parsers check the budget in their agenda loop and stop
+    cleanly, once it is exhausted.
+    """
+    # the clock is read at the first item and then once per this many items
+    CLOCK_INTERVAL = 64
+
+    def __init__(self, deadline=None, max_items=None):
+        """
+        :type deadline: float
+        :type max_items: int
+        """
+        self.deadline = deadline
+        self.max_items = max_items
+        self.items = 0
+        self.exhausted = False
+
+    def reset(self):
+        self.items = 0
+        self.exhausted = False
+
+    def spend(self):
+        """
+        Account for one processed item.
+        :return: whether the budget is exhausted, i.e., the parser has to stop
+        :rtype: bool
+        """
+        self.items += 1
+        if self.max_items is not None and self.items > self.max_items:
+            self.exhausted = True
+        elif self.deadline is not None and (self.items - 1) % self.CLOCK_INTERVAL == 0 \
+                and time.time() > self.deadline:
+            self.exhausted = True
+        return self.exhausted
+
+    def expired(self):
+        """
+        Check the deadline only, e.g., between the phases of a parser.
+        :rtype: bool
+        """
+        if self.deadline is not None and time.time() > self.deadline:
+            self.exhausted = True
+        return self.exhausted
+
+    def seconds_left(self):
+        """
+        :return: seconds until the deadline (at least 0) or None
+        :rtype: float
+        """
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
 
 
 class AbstractParser:
     __metaclass__ = ABCMeta
     secondaries = None
+    budget = None
 
     @abstractmethod
     def __init__(self, grammar, input=None, save_preprocessing=None, load_preprocessing=None):
@@ -79,12 +139,15 @@ class AbstractParser:
             return []
 
     @staticmethod
-    def preprocess_grammar(grammar):
+    def preprocess_grammar(grammar, trim=False):
         """
-        :type grammar: LCFRS
-        :param term_labelling: the terminal labelling
+        :type grammar: LCFRS | CompactLCFRS
+        :param trim: first remove useless rules and nonterminals from grammar (cf. LCFRS.trim);
+            note that this renumbers the rules of grammar
+        :type trim: bool
         """
-        pass
+        if trim:
+            grammar.trim()
 
     @abstractmethod
     def set_input(self, input):
@@ -101,6 +164,72 @@ class AbstractParser:
     def k_best_derivation_trees(self):
         pass
 
+    def set_budget(self, deadline=None, max_items=None):
+        """
+        Bound the following calls of parse (cf. Budget). Once the budget is exhausted, the parser
+        stops cleanly: recognized() and the derivation methods refer to the partial chart and
+        budget_exhausted() is True.
+
+        :param deadline: point in time (cf. time.time) or None
+        :type deadline: float
+        :param max_items: max. number of items processed per parse or None
+        :type max_items: int
+        """
+        self.budget = Budget(deadline, max_items) if deadline is not None or max_items is not None else None
+
+    def budget_exhausted(self):
+        """
+        :return: whether the last parse was stopped, since the budget was exhausted
+        :rtype: bool
+        """
+        return self.budget is not None and self.budget.exhausted
+
+    def parse_batch(self, inputs, action=None, workers=1, chunksize=1, max_length=None, timeout=None):
+        """
+        Parse each input (cf. set_input, parse, clear) and yield the result of action in the order of inputs.
+        For workers > 1, the inputs are parsed in a pool of forked processes, which inherit the parser,
+        i.e., its preprocessed grammar and weights, and action. Only the inputs and the results of action
+        are passed between the processes. Results are yielded as soon as all previous inputs are done.
+
+        :param inputs: inputs of the parser
+        :type inputs: list
+        :param action: function of the parser and the index of the input, which is called after parsing
+            the input (default: best weight, if the input is recognized, None otherwise); with workers > 1
+            its result needs to be picklable
+        :param workers: number of processes
+        :type workers: int
+        :param chunksize: number of inputs that are sent to a worker at once
+        :type chunksize: int
+        :param max_length: inputs that are longer are not parsed (but action is called)
+        :type max_length: int
+        :param timeout: seconds per input, which includes action; if set, the inputs are parsed by a
+            DeadlinePool of workers processes (chunksize does not apply) and TIMEOUT is yielded for
+            each input that is not done in time
+        :type timeout: float
+        """
+        if action is None:
+            action = best_weight
+        if timeout is not None:
+            with DeadlinePool(lambda indexed_input: parse_input(self, action, max_length, *indexed_input),
+                              workers, timeout) as pool:
+                for result in pool.imap(enumerate(inputs)):
+                    yield result
+            return
+        if workers <= 1:
+            for index, input in enumerate(inputs):
+                yield parse_input(self, action, max_length, index, input)
+            return
+
+        # the pool is forked, hence the worker state is not pickled
+        pool = multiprocessing.get_context('fork').Pool(workers, initializer=_init_batch_worker,
+                                                        initargs=(self, action, max_length))
+        try:
+            for result in pool.imap(_batch_worker, enumerate(inputs), chunksize):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
     def best_trees(self, derivation_to_tree):
         weights = defaultdict(lambda: 0.0)
         witnesses = defaultdict(list)
@@ -113,6 +242,33 @@ class AbstractParser:
         return [(tree, weight, witnesses[tree]) for tree, weight in the_derivations]
 
 
+def best_weight(parser, index):
+    return parser.best() if parser.recognized() else None
+
+
+def parse_input(parser, action, max_length, index, input):
+    parser.set_input(input)
+    if max_length is None or len(input) <= max_length:
+        parser.parse()
+    result = action(parser, index)
+    parser.clear()
+    return result
+
+
+# parser, action and max_length of a batch worker process, cf. AbstractParser.parse_batch
+_batch_worker_state = None
+
+
+def _init_batch_worker(parser, action, max_length):
+    global _batch_worker_state
+    _batch_worker_state = parser, action, max_length
+
+
+def _batch_worker(indexed_input):
+    parser, action, max_length = _batch_worker_state
+    return parse_input(parser, action, max_length, *indexed_input)
+
+
 def best_hybrid_tree_for_best_derivation():
     pass
 
@@ -57,7 +57,7 @@ cdef extern from "DCP/SDCP_Parser.h" namespace "DCP":
     cdef cppclass SDCPParser[Nonterminal,Terminal,Position]:
         SDCPParser()
         SDCPParser(bint,bint,bint,bint)
-        void do_parse()
+        void do_parse() nogil
         void clear()
         void set_input(HybridTree[Terminal,Position])
         HybridTree input;
@@ -287,7 +287,8 @@ cdef class PySDCPParser(object):
         self.nonterminal_map = nonterminal_map
 
     cpdef void do_parse(self):
-        self.parser[0].do_parse()
+        with nogil:
+            self.parser[0].do_parse()
         if self.debug:
             output_helper_utf8("parsing completed\n")
 
@@ -496,10 +497,13 @@ class PysDCPParser(pi.AbstractParser):
 
 
     @staticmethod
-    def preprocess_grammar(grammar, term_labelling, debug=False):
+    def preprocess_grammar(grammar, term_labelling, debug=False, trim=False):
         """
         :type grammar: LCFRS
+        :param trim: first remove useless rules and nonterminals from grammar (cf. LCFRS.trim)
         """
+        if trim:
+            grammar.trim()
         grammar.sdcp_parser = PysDCPParser.__preprocess(grammar, term_labelling, debug)
 
 
@@ -540,10 +544,13 @@ class LCFRS_sDCP_Parser(PysDCPParser):
         return parser
 
     @staticmethod
-    def preprocess_grammar(grammar, term_labelling, debug=False):
+    def preprocess_grammar(grammar, term_labelling, debug=False, trim=False):
         """
         :type grammar: LCFRS
+        :param trim: first remove useless rules and nonterminals from grammar (cf. LCFRS.trim)
         """
+        if trim:
+            grammar.trim()
         grammar.sdcp_parser = LCFRS_sDCP_Parser.__preprocess(grammar, term_labelling, debug)
 
 
@@ -3,6 +3,7 @@ from libcpp.memory cimport make_shared
 from util.enumerator cimport Enumerator
 from parser.commons.commons cimport *
 from parser.trace_manager.trace_manager cimport PyTraceManager, build_trace_manager_ptr, TraceManagerPtr
+from parser.trace_manager.sharded_reducts import compute_reducts_sharded
 from sdcp_parser_wrapper cimport PySDCPParser, grammar_to_SDCP, SDCPParser
 import time
 
@@ -49,15 +50,40 @@ cdef class PySDCPTraceManager(PyTraceManager):
 
         cdef vector[NONTERMINAL] node_labels = range(0, self.parser.nonterminal_map.counter)
         cdef vector[size_t] edge_labels = range(0, len(grammar.rule_index()))
+        self.node_labels = make_shared[vector[NONTERMINAL]](node_labels)
+        self.edge_labels = make_shared[vector[size_t]](edge_labels)
 
-        self.trace_manager = build_trace_manager_ptr[NONTERMINAL, size_t](
-            make_shared[vector[NONTERMINAL]](node_labels)
-            , make_shared[vector[size_t]](edge_labels)
-            , False)
+        self.trace_manager = build_trace_manager_ptr[NONTERMINAL, size_t](self.node_labels, self.edge_labels, False)
 
         self.debug = True if debug else False
 
-    def compute_reducts(self, corpus, frequency=1.0):
+    def empty_copy(self):
+        """
+        :return: an empty trace manager with the same parser, nonterminal map and labels
+        :rtype: PySDCPTraceManager
+        """
+        cdef PySDCPTraceManager copy = PySDCPTraceManager.__new__(PySDCPTraceManager)
+        copy.parser = self.parser
+        copy.debug = self.debug
+        copy.node_labels = self.node_labels
+        copy.edge_labels = self.edge_labels
+        copy.trace_manager = build_trace_manager_ptr[NONTERMINAL, size_t](self.node_labels, self.edge_labels, False)
+        return copy
+
+    def compute_reducts(self, corpus, frequency=1.0, workers=1, directory=None):
+        """
+        :param workers: if > 1, the corpus is split into shards, whose reducts are computed by as many forked
+            processes, cf. compute_reducts_sharded
+        :type workers: int
+        :param directory: directory for the serialized reducts of the shards (default: temporary)
+        :type directory: str
+        """
+        if workers > 1:
+            compute_reducts_sharded(self, self.empty_copy,
+                                    lambda manager, trees: manager.compute_reducts(trees, frequency=frequency),
+                                    corpus, workers, directory=directory)
+            output_helper_utf8("Computed reducts for " + str(len(self)) + " trees in total")
+            return
         start_time = time.time()
         cdef int successful = 0
         cdef int fails = 0
@@ -86,11 +112,11 @@ cdef class PySDCPTraceManager(PyTraceManager):
         return self.parser
 
 def compute_reducts(grammar, corpus, term_labelling, PySDCPParser parser=None, Enumerator nont_map=None, debug=False,
-                    frequency=1.0):
+                    frequency=1.0, workers=1, directory=None):
     output_helper_utf8("creating trace")
     trace = PySDCPTraceManager(grammar, term_labelling, parser=parser, nont_map=nont_map, debug=debug)
     output_helper_utf8("computing reducts")
-    trace.compute_reducts(corpus, frequency=frequency)
+    trace.compute_reducts(corpus, frequency=frequency, workers=workers, directory=directory)
     return trace
 
 
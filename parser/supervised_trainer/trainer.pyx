@@ -10,14 +10,6 @@ from typing import Iterable
 from discodop.containers import Grammar
 
 
-cdef extern from "Trainer/TraceManager.h" namespace "Trainer":
-    cdef void add_hypergraph_to_trace[Nonterminal, TraceID](
-            TraceManagerPtr[Nonterminal, TraceID] manager
-            , shared_ptr[Hypergraph[Nonterminal, size_t]] hypergraph
-            , Element[Node[Nonterminal]] root
-            , double frequency)
-
-
 cdef class PyElement:
     cdef shared_ptr[Element[Node[NONTERMINAL]]] element
     def __cinit__(self):
@@ -25,6 +17,41 @@ cdef class PyElement:
          # self.element = make_shared[Element[Node[NONTERMINAL]]](element)
 
 
+cdef class ChartLabelTable:
+    def __init__(self, disco_grammar, Enumerator nonterminal_map):
+        """
+        :param disco_grammar: a discodop grammar obtained by transform_grammar
+        :type disco_grammar: Grammar
+        :param nonterminal_map: the nonterminal map of a PyDerivationManager
+        Index of the labels of disco_grammar: primary labels are mapped to their nonterminal id
+        and intermediate labels (one per rule) to their rule id. Build it once per grammar, since
+        the lookup of the label strings is the bottleneck of the chart conversion.
+        """
+        cdef size_t label
+        self.nonterminals.resize(disco_grammar.nonterminals, -1)
+        self.rules.resize(disco_grammar.nonterminals, -1)
+        for label in range(disco_grammar.nonterminals):
+            nont = disco_grammar.nonterminalstr(label)
+            if striplabelre.match(unescape_brackets(nont)):
+                self.rules[label] = rule_idx_from_label(nont)
+            else:
+                nont = unescape_brackets(nont)
+                if nont in nonterminal_map.obj_to_ind:
+                    self.nonterminals[label] = nonterminal_map.obj_to_ind[nont]
+
+    def nonterminal_id(self, size_t label):
+        """
+        :return: the nonterminal id of a primary label or -1
+        """
+        return self.nonterminals[label]
+
+    def rule_id(self, size_t label):
+        """
+        :return: the rule id of an intermediate label or -1
+        """
+        return self.rules[label]
+
+
 cdef class PyDerivationManager(PyTraceManager):
     def __init__(self, grammar, Enumerator nonterminal_map=None):
         """
@@ -206,85 +233,111 @@ cdef class PyDerivationManager(PyTraceManager):
             add_hypergraph_to_trace[NONTERMINAL, size_t](self.trace_manager, hg, deref(pyElement.element), frequency)
             # nodeMap.clear()
 
-    cpdef void convert_chart_to_hypergraph(self, chart, disco_grammar, bint debug=False) except +:
+    cpdef void convert_chart_to_hypergraph(self, chart, disco_grammar, bint debug=False,
+                                           ChartLabelTable labels=None) except +:
         """
         :param chart: a populated Chart from the discodop parser (obtained with *disco_grammar*) 
         :type chart: Chart
         :param disco_grammar: a discodop grammar
         :type disco_grammar: Grammar
+        :param labels: the label table of disco_grammar and the nonterminal map of this manager,
+            which is built if None
+        :type labels: ChartLabelTable
         Converts the chart in an equivalent hypergraph and adds it to the trace manager.
         """
         cdef shared_ptr[Hypergraph[NONTERMINAL, size_t]] hg
         cdef vector[Element[Node[NONTERMINAL]]] sources
-        cdef PyElement pyElement
-        cdef int node_intermediate
-        cdef int node_prim
-        cdef int node
-        cdef size_t eLabel
-        cdef set intermediate_nodes
+        # node of each chart item (-1 for intermediate items)
+        cdef vector[long] node_of_item
+        cdef vector[Element[Node[NONTERMINAL]]] nodes
+        cdef size_t num_items = chart.numitems()
+        cdef size_t item, item_intermediate, child
+        cdef long node, rule, label
         cdef int edge_num, edge_num_prim
 
+        if labels is None:
+            labels = ChartLabelTable(disco_grammar, self.nonterminal_map)
+
         hg = make_shared[Hypergraph[NONTERMINAL, size_t]](self.node_labels, self.edge_labels)
-        nodeMap = {}
-        intermediate_nodes = set()
+        node_of_item.resize(num_items, -1)
 
-        # create nodes
-        for node in range(1, chart.numitems()):
-            orig_nont = disco_grammar.nonterminalstr(chart.label(node))
-            orig_nont = unescape_brackets(orig_nont)
-            # print(orig_nont)
-            if striplabelre.match(orig_nont):
-                intermediate_nodes.add(node)
+        # create nodes (intermediate items are contracted into the hyperedges)
+        for item in range(1, num_items):
+            label = chart.label(item)
+            if labels.rules[label] >= 0:
                 continue
-
-            assert orig_nont in self.nonterminal_map.obj_to_ind
-            nLabel = self.nonterminal_map.object_index(orig_nont)
-            pyElement2 = PyElement()
-            pyElement2.element = make_shared[Element[Node[NONTERMINAL]]](deref(hg).create(nLabel))
-            nodeMap[node] = pyElement2
+            if labels.nonterminals[label] < 0:
+                raise ValueError("Chart item %s has no nonterminal of the grammar" % chart.itemstr(item))
+            node_of_item[item] = nodes.size()
+            nodes.push_back(deref(hg).create(<NONTERMINAL> labels.nonterminals[label]))
 
         # create edges
-        for node_prim in range(1, chart.numitems()):
-            # skip intermediate nodes
-            if node_prim in intermediate_nodes:
+        for item in range(1, num_items):
+            node = node_of_item[item]
+            if node < 0:
                 continue
-            # print("node prim", node_prim)
             # go over intermediate unary edges
-            for edge_num_prim in range(chart.numedges(node_prim)):
-                edge = chart.getEdgeForItem(node_prim, edge_num_prim)
-                # print("edge", edge)
-                assert isinstance(edge, tuple)
-                assert edge[2] == 0
-
-
-                # determine intermediate node
-                node_intermediate = edge[1]
+            for edge_num_prim in range(chart.numedges(item)):
+                item_intermediate = chart.getEdgeForItem(item, edge_num_prim)[1]
+                rule = labels.rules[chart.label(item_intermediate)]
 
                 # create hyperedges for primary node for each edge outgoing from intermediate node
-                for edge_num in range(chart.numedges(node_intermediate)):
-                    eLabel = rule_idx_from_label(disco_grammar.nonterminalstr(chart.label(node_intermediate)))
-
+                for edge_num in range(chart.numedges(item_intermediate)):
                     if debug:
-                        print("goal", node_prim, "edge", eLabel, "sources:", end=" ")
-                    edge_inter = chart.getEdgeForItem(node_intermediate, edge_num)
-                    if isinstance(edge_inter, tuple):
-                        for rhs_nont in [j for j in [edge_inter[1], edge_inter[2]] if j != 0]:
-                            if debug:
-                                print(rhs_nont, end=" ")
-                            pyElement = nodeMap[rhs_nont]
-                            sources.push_back(deref(pyElement.element))
+                        print("goal", item, "edge", rule, "sources:", end=" ")
+                    edge = chart.getEdgeForItem(item_intermediate, edge_num)
+                    if isinstance(edge, tuple):
+                        for child in edge[1:3]:
+                            if child != 0:
+                                if debug:
+                                    print(child, end=" ")
+                                sources.push_back(nodes[node_of_item[child]])
                     if debug:
                         print()
-                    # target
-                    pyElement = nodeMap[node_prim]
-                    deref(hg).add_hyperedge(eLabel, deref(pyElement.element), sources)
+                    deref(hg).add_hyperedge(<size_t> rule, nodes[node], sources)
                     sources.clear()
 
-
         # root
-        pyElement = nodeMap[chart.root()]
-        add_hypergraph_to_trace[NONTERMINAL, size_t](self.trace_manager, hg, deref(pyElement.element), 1.0)
-        # nodeMap.clear()
+        add_hypergraph_to_trace[NONTERMINAL, size_t](self.trace_manager, hg, nodes[node_of_item[chart.root()]], 1.0)
+
+    cpdef void convert_forest_to_hypergraph(self, nodes, edges, root, float frequency=1.0) except +:
+        """
+        :param nodes: the nonterminal of each node of the forest
+        :type nodes: list[str]
+        :param edges: hyperedges (rule index, head node, list of tail nodes), where nodes are positions in *nodes*
+        :type edges: list[tuple[int, int, list[int]]]
+        :param root: position of the root node in *nodes*
+        :type root: int
+        Converts a parse forest in an equivalent hypergraph and adds it to the trace manager.
+        The i-th hyperedge of the hypergraph corresponds to edges[i].
+        """
+        cdef shared_ptr[Hypergraph[NONTERMINAL, size_t]] hg
+        cdef vector[Element[Node[NONTERMINAL]]] sources
+        cdef PyElement pyElement
+        cdef size_t eLabel
+
+        hg = make_shared[Hypergraph[NONTERMINAL, size_t]](self.node_labels, self.edge_labels)
+        elements = []
+
+        # create nodes
+        for nont in nodes:
+            assert nont in self.nonterminal_map.obj_to_ind
+            nLabel = self.nonterminal_map.object_index(nont)
+            pyElement = PyElement()
+            pyElement.element = make_shared[Element[Node[NONTERMINAL]]](deref(hg).create(nLabel))
+            elements.append(pyElement)
+
+        # create edges
+        for eLabel, head, tails in edges:
+            for tail in tails:
+                pyElement = elements[tail]
+                sources.push_back(deref(pyElement.element))
+            pyElement = elements[head]
+            deref(hg).add_hyperedge(eLabel, deref(pyElement.element), sources)
+            sources.clear()
+
+        pyElement = elements[root]
+        add_hypergraph_to_trace[NONTERMINAL, size_t](self.trace_manager, hg, deref(pyElement.element), frequency)
 
 
-__all__ = ["PyDerivationManager"]
+__all__ = ["ChartLabelTable", "PyDerivationManager"]
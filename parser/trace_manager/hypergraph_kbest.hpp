@@ -0,0 +1,206 @@
+// hypergraph_kbest.hpp
+//
+// Lazy k-best derivations of a hypergraph with numbered nodes and edges and arbitrary edge weights,
+// cf. Huang & Chiang 2005, Better k-best parsing, Algorithm 3.
+
+#ifndef PANDA_HYPERGRAPH_KBEST_HPP
+#define PANDA_HYPERGRAPH_KBEST_HPP
+
+#include <algorithm>
+#include <cmath>
+#include <limits>
+#include <queue>
+#include <set>
+#include <vector>
+
+class HypergraphKBest {
+public:
+    // derivation of a node by an edge and the ranks of the derivations of its sources
+    struct Derivation {
+        double weight;
+        std::size_t edge;
+        std::vector<unsigned> ranks;
+
+        bool operator<(const Derivation &other) const {
+            return weight < other.weight;
+        }
+    };
+
+    // additive: weights are combined by + (e.g., log weights), otherwise by *; greater weights are better
+    HypergraphKBest(std::size_t nodes, bool additive)
+            : additive(additive), entries(nodes), incoming(nodes), outgoing(nodes) {}
+
+    // the edges are numbered in the order of insertion; edges with NaN weight are ignored
+    void add_edge(std::size_t target, const std::vector<std::size_t> &sources, double weight) {
+        std::size_t edge = targets.size();
+        targets.push_back(target);
+        this->sources.push_back(sources);
+        weights.push_back(weight);
+        if (std::isnan(weight))
+            return;
+        incoming[target].push_back(edge);
+        for (std::size_t source : sources)
+            outgoing[source].push_back(edge);
+    }
+
+    // Find the derivation of node with the given rank (0 is the best).
+    // Returns false, if there are no more derivations. Derivations, which would contain a cycle through
+    // a node, whose derivations are being expanded, are skipped.
+    bool derivation(std::size_t node, unsigned rank, double &weight) {
+        if (!viterbi_done)
+            viterbi();
+        if (!entries[node].initialized)
+            initialize(node);
+        if (entries[node].derivations.empty())
+            return false;
+        while (entries[node].derivations.size() <= rank) {
+            if (entries[node].expanding)
+                return false;
+            entries[node].expanding = true;
+            Derivation last = entries[node].derivations.back();
+            successors(node, last);
+            entries[node].expanding = false;
+            std::priority_queue<Derivation> &candidates = entries[node].candidates;
+            if (candidates.empty())
+                return false;
+            entries[node].derivations.push_back(candidates.top());
+            candidates.pop();
+        }
+        weight = entries[node].derivations[rank].weight;
+        return true;
+    }
+
+    // Edge and source ranks of a derivation, which was found by derivation(node, rank, weight).
+    const Derivation &get(std::size_t node, unsigned rank) const {
+        return entries[node].derivations[rank];
+    }
+
+    const std::vector<std::size_t> &edge_sources(std::size_t edge) const {
+        return sources[edge];
+    }
+
+private:
+    struct Entry {
+        bool initialized = false;
+        bool expanding = false;
+        std::vector<Derivation> derivations;
+        std::priority_queue<Derivation> candidates;
+        std::set<std::pair<std::size_t, std::vector<unsigned>>> seen;
+    };
+
+    const bool additive;
+    std::vector<Entry> entries;
+    std::vector<std::vector<std::size_t>> incoming, outgoing;
+    std::vector<std::size_t> targets;
+    std::vector<std::vector<std::size_t>> sources;
+    std::vector<double> weights;
+
+    // Viterbi derivations by Knuth's generalization of Dijkstra's algorithm
+    bool viterbi_done = false;
+    std::vector<double> best;
+    std::vector<std::size_t> best_edge;
+    const std::size_t NONE = std::numeric_limits<std::size_t>::max();
+
+    double combine(double x, double y) const {
+        return additive ? x + y : x * y;
+    }
+
+    void viterbi() {
+        viterbi_done = true;
+        std::size_t nodes = entries.size();
+        best.assign(nodes, -std::numeric_limits<double>::infinity());
+        best_edge.assign(nodes, NONE);
+        std::vector<bool> finished(nodes, false);
+        std::vector<std::size_t> missing(targets.size());
+        std::priority_queue<std::pair<double, std::size_t>> agenda;
+
+        auto relax = [&](std::size_t edge) {
+            double weight = weights[edge];
+            for (std::size_t source : sources[edge])
+                weight = combine(weight, best[source]);
+            std::size_t target = targets[edge];
+            if (!finished[target] && (best_edge[target] == NONE || weight > best[target])) {
+                best[target] = weight;
+                best_edge[target] = edge;
+                agenda.emplace(weight, target);
+            }
+        };
+
+        for (std::size_t edge = 0; edge < targets.size(); ++edge) {
+            if (std::isnan(weights[edge]))
+                continue;
+            missing[edge] = sources[edge].size();
+            if (missing[edge] == 0)
+                relax(edge);
+        }
+        while (!agenda.empty()) {
+            std::size_t node = agenda.top().second;
+            agenda.pop();
+            if (finished[node])
+                continue;
+            finished[node] = true;
+            for (std::size_t edge : outgoing[node]) {
+                // an edge may contain node more than once
+                for (std::size_t source : sources[edge])
+                    if (source == node)
+                        --missing[edge];
+                if (missing[edge] == 0)
+                    relax(edge);
+            }
+        }
+    }
+
+    void initialize(std::size_t node) {
+        Entry &entry = entries[node];
+        entry.initialized = true;
+        if (best_edge[node] == NONE)
+            return;
+        // the Viterbi derivation, whose sources are finished before node, is the first one,
+        // such that the first derivations do not depend on each other cyclically
+        Derivation viterbi_derivation{best[node], best_edge[node],
+                                      std::vector<unsigned>(sources[best_edge[node]].size(), 0)};
+        entry.seen.emplace(viterbi_derivation.edge, viterbi_derivation.ranks);
+        entry.derivations.push_back(viterbi_derivation);
+        for (std::size_t edge : incoming[node]) {
+            std::vector<unsigned> ranks(sources[edge].size(), 0);
+            if (edge == best_edge[node])
+                continue;
+            bool derivable = true;
+            double weight = weights[edge];
+            for (std::size_t source : sources[edge]) {
+                if (best_edge[source] == NONE) {
+                    derivable = false;
+                    break;
+                }
+                weight = combine(weight, best[source]);
+            }
+            if (derivable) {
+                entry.seen.emplace(edge, ranks);
+                entry.candidates.push(Derivation{weight, edge, ranks});
+            }
+        }
+    }
+
+    void successors(std::size_t node, const Derivation &derivation) {
+        const std::vector<std::size_t> &edge_sources = sources[derivation.edge];
+        for (std::size_t i = 0; i < edge_sources.size(); ++i) {
+            std::vector<unsigned> ranks = derivation.ranks;
+            ++ranks[i];
+            if (entries[node].seen.count(std::make_pair(derivation.edge, ranks)))
+                continue;
+            double weight = weights[derivation.edge];
+            bool derivable = true;
+            for (std::size_t j = 0; j < edge_sources.size() && derivable; ++j) {
+                double source_weight;
+                derivable = this->derivation(edge_sources[j], ranks[j], source_weight);
+                weight = combine(weight, source_weight);
+            }
+            if (derivable) {
+                entries[node].seen.emplace(derivation.edge, ranks);
+                entries[node].candidates.push(Derivation{weight, derivation.edge, ranks});
+            }
+        }
+    }
+};
+
+#endif //PANDA_HYPERGRAPH_KBEST_HPP
@@ -0,0 +1,79 @@
+from __future__ import print_function, division
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+
+def compute_reducts_sharded(manager, new_manager, compute, corpus, workers, directory=None, shard_size=None):
+    """
+    Splits corpus into consecutive shards, computes the reducts of each shard in a pool of forked processes,
+    and appends the traces of all shards to manager (in the order of corpus), cf. PyTraceManager.merge.
+    The workers inherit the parser (and its grammar and nonterminal map), new_manager, compute and corpus;
+    only the bounds of the shards and the paths of the serialized traces are passed between processes.
+
+    :param manager: trace manager to which the reducts are added
+    :type manager: PyTraceManager
+    :param new_manager: function that returns an empty trace manager, whose nonterminal map is that of manager
+    :param compute: function of an (empty) trace manager and a list of trees, which adds the reducts of the trees
+    :param corpus: training trees
+    :param workers: number of processes
+    :type workers: int
+    :param directory: directory for the serialized traces of the shards, which are kept; if None, a temporary
+        directory is used and removed afterwards
+    :type directory: str
+    :param shard_size: number of trees per shard (default: the corpus is split into 4 shards per worker)
+    :type shard_size: int
+    """
+    corpus = list(corpus)
+    if shard_size is None:
+        shard_size = max(1, int(math.ceil(len(corpus) / (4 * workers))))
+    shards = [(shard, start, min(start + shard_size, len(corpus)))
+              for shard, start in enumerate(range(0, len(corpus), shard_size))]
+
+    temporary = directory is None
+    if temporary:
+        directory = tempfile.mkdtemp(prefix='reducts')
+    elif not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    try:
+        # the pool is forked, hence the worker state is not pickled
+        pool = multiprocessing.get_context('fork').Pool(workers, initializer=_init_shard_worker,
+                                                        initargs=(new_manager, compute, corpus, directory))
+        try:
+            paths = pool.map(_shard_worker, shards, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+        manager.load_traces_from_files(paths)
+    finally:
+        if temporary:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def shard_path(directory, shard):
+    return os.path.join(directory, 'shard-%05d.reduct' % shard)
+
+
+# new_manager, compute, corpus and directory of a shard worker process, cf. compute_reducts_sharded
+_shard_worker_state = None
+
+
+def _init_shard_worker(new_manager, compute, corpus, directory):
+    global _shard_worker_state
+    _shard_worker_state = new_manager, compute, corpus, directory
+
+
+def _shard_worker(shard_bounds):
+    new_manager, compute, corpus, directory = _shard_worker_state
+    shard, start, end = shard_bounds
+    manager = new_manager()
+    compute(manager, corpus[start:end])
+    path = shard_path(directory, shard).encode('utf-8')
+    manager.serialize(path)
+    return path
+
+
+__all__ = ["compute_reducts_sharded", "shard_path"]
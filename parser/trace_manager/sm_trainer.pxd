@@ -34,11 +34,14 @@ cdef class PyLatentAnnotation:
                         , double ioPrecision
                         , unsigned_int ioCycleLimit)
     cpdef tuple serialize(self)
+    cpdef double get_weight(self, size_t rule, vector[size_t] index)
+    cpdef tuple to_arrays(self)
     # cpdef PyLatentAnnotation project_annotation_by_merging(self,
     #                                                        PyGrammarInfo grammarInfo,
     #                                                        vector[vector[vector[size_t]]] merge_sources,
     #                                                        c_bool debug)
     cpdef void make_proper(self)
+    cpdef PyLatentAnnotation remap_rules(self, index_map, PyGrammarInfo grammarInfo, PyStorageManager storageManager)
     cpdef c_bool is_proper(self)
     cpdef c_bool check_for_validity(self, double delta = *)
     cpdef c_bool check_rule_split_alignment(self)
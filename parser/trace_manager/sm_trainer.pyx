@@ -3,10 +3,12 @@ Provides classes for latent annotations, EMTraining, and Split/Merge-Training
 """
 
 import itertools
-import random
 import time
 
+import numpy as np
+
 from cython.operator cimport dereference as deref
+from libc.string cimport memcpy
 from libcpp cimport bool as c_bool
 from libcpp.functional cimport function
 from libcpp.map cimport map
@@ -14,10 +16,11 @@ from libcpp.memory cimport make_shared
 from libcpp.string cimport string
 
 import grammar.rtg as gr
+from grammar.weights import normalize, group_sizes
 from parser.commons.commons cimport NONTERMINAL, unsigned_int
 from parser.commons.commons cimport output_helper_utf8 as output_helper
 from parser.trace_manager.score_validator cimport PyCandidateScoreValidator, CandidateScoreValidator
-from parser.trace_manager.sm_trainer_util cimport PyGrammarInfo, GrammarInfo2, PyStorageManager
+from parser.trace_manager.sm_trainer_util cimport PyGrammarInfo, GrammarInfo2, PyStorageManager, kept_rules
 from parser.trace_manager.trace_manager cimport PyTraceManager, TraceManagerPtr
 
 DEF ENCODE_NONTERMINALS = True
@@ -139,82 +142,247 @@ cdef class PyEMTrainer:
     def __init__(self, PyTraceManager traceManager):
         self.traceManager = traceManager
 
-    def em_training(self, grammar, n_epochs, init="rfe", tie_breaking=False, sigma=0.005, seed=0):
-        random.seed(seed)
+    def em_training(self, grammar, n_epochs, init="rfe", tie_breaking=False, sigma=0.005, seed=0,
+                    unsigned_int threads=0, PyGrammarInfo grammarInfo=None, PyStorageManager storageManager=None):
+        """
+        Trains the rule weights of grammar (in place) by EM on the traces.
+
+        :param init: initial weights, either "rfe" (the weights of grammar) or "equal"
+        :param tie_breaking: add Gaussian noise with standard deviation sigma to the initial weights
+        :param seed: seed of the noise
+        :param threads: if > 0, the expectation step is computed by this many threads: the weights are trained as
+            a latent annotation without splits by the simple expector and maximizer of the split/merge trainer
+        :type threads: int
+        :param grammarInfo: grammar info of grammar (only for threads > 0, default: built from the nonterminal
+            map of the traces)
+        :param storageManager: storage manager of the latent annotation (only for threads > 0)
+        """
         assert isinstance(grammar, gr.RTG_like)
-        rtg = grammar.to_rtg()
-        normalization_groups = []
-        rule_to_group = {}
-        for nont in rtg.nonterminals:
-            normalization_group = []
-            for rule in rtg.lhs_nont_to_rules(nont):
-                rule_idx = rule.symbol
-                normalization_group.append(rule_idx)
-                rule_to_group[rule_idx] = self.traceManager.get_nonterminal_map().object_index(nont)
-            normalization_groups.append(normalization_group)
-        initial_weights = [0.0] * 0
-        for i in range(0, len(rtg.rules)):
-            if init == "rfe":
-                prob = grammar.rule_index(i).weight()
-            elif init == "equal" or True:
-                prob = 1.0 / len(normalization_groups[rule_to_group[i]])
-
-            # this may violates properness
-            # but we make the grammar proper again soon
-            if tie_breaking:
-                prob_new = random.gauss(prob, sigma)
-                while prob_new <= 0.0:
-                    prob_new = random.gauss(prob, sigma)
-                prob = prob_new
-
-            initial_weights.append(prob)
-
-        # restore properness
+        groups, _ = grammar.lhs_group_index()
+
+        if init == "rfe":
+            initial_weights = grammar.weight_vector()
+        elif init == "equal" or True:
+            initial_weights = 1.0 / group_sizes(groups)[groups]
+
         if tie_breaking:
-            for group in normalization_groups:
-                group_sum = 0.0
-                for idx in group:
-                    group_sum += initial_weights[idx]
-                if group_sum > 0:
-                    for idx in group:
-                        initial_weights[idx] = initial_weights[idx] / group_sum
-                else:
-                    for idx in group:
-                        initial_weights[idx] = 1 / len(group)
+            # this may violate properness, which is restored by normalization
+            rng = np.random.RandomState(seed)
+            noisy_weights = rng.normal(initial_weights, sigma)
+            invalid = noisy_weights <= 0.0
+            while invalid.any():
+                noisy_weights[invalid] = rng.normal(initial_weights[invalid], sigma)
+                invalid = noisy_weights <= 0.0
+            initial_weights = normalize(noisy_weights, groups)
 
         cdef EMTrainerBuilder trainerBuilder
-        cdef shared_ptr[EMTrainer[NONTERMINAL, size_t]] emTrainer \
-            = make_shared[EMTrainer[NONTERMINAL, size_t]](trainerBuilder.build_em_trainer[NONTERMINAL, size_t](self.traceManager.trace_manager))
-
-        final_weights = deref(emTrainer).do_em_training[SemiRing](initial_weights, normalization_groups, n_epochs)
+        cdef shared_ptr[EMTrainer[NONTERMINAL, size_t]] emTrainer
+        cdef vector[double] weights = initial_weights.tolist()
+        cdef PyLatentAnnotation la
+        if threads > 0:
+            if grammarInfo is None:
+                grammarInfo = PyGrammarInfo(grammar, self.traceManager.get_nonterminal_map())
+            if storageManager is None:
+                storageManager = PyStorageManager()
+            la = PyLatentAnnotation()
+            la.latentAnnotation = make_shared[LatentAnnotation](weights
+                                                                , deref(grammarInfo.grammarInfo)
+                                                                , deref(storageManager.storageManager))
+            PySplitMergeTrainerBuilder(self.traceManager, grammarInfo)\
+                .set_em_epochs(n_epochs)\
+                .set_simple_expector(threads)\
+                .set_simple_maximizer(threads)\
+                .build()\
+                .em_train(la)
+            # a single weight per rule
+            final_weights = la.to_arrays()[2]
+        else:
+            emTrainer = make_shared[EMTrainer[NONTERMINAL, size_t]](
+                trainerBuilder.build_em_trainer[NONTERMINAL, size_t](self.traceManager.trace_manager))
+            final_weights = deref(emTrainer).do_em_training[SemiRing](weights, normalization_groups(groups), n_epochs)
 
         # ensure properness
         if tie_breaking:
-            for group in normalization_groups:
-                group_sum = 0.0
-                for idx in group:
-                    group_sum += final_weights[idx]
-                if group_sum > 0:
-                    for idx in group:
-                        final_weights[idx] = final_weights[idx] / group_sum
-                else:
-                    for idx in group:
-                        final_weights[idx] = 1 / len(group)
-
-        for i in range(0, len(grammar.rule_index())):
-            grammar.rule_index(i).set_weight(final_weights[i])
+            final_weights = normalize(final_weights, groups)
+
+        grammar.set_weight_vector(final_weights)
+
+
+cdef vector[vector[unsigned_int]] normalization_groups(groups) except *:
+    """
+    :param groups: the normalization group of each rule, cf. grammar.weights
+    :type groups: numpy.ndarray
+    :return: the rule ids of each non-empty group (ordered by group)
+    """
+    cdef Py_ssize_t[:] order = np.argsort(groups, kind='stable').astype(np.intp)
+    cdef Py_ssize_t[:] sizes = group_sizes(groups).astype(np.intp)
+    cdef vector[vector[unsigned_int]] result
+    cdef Py_ssize_t group, i, start = 0
+    for group in range(sizes.shape[0]):
+        if sizes[group] == 0:
+            continue
+        result.push_back(vector[unsigned_int]())
+        result.back().reserve(sizes[group])
+        for i in range(start, start + sizes[group]):
+            result.back().push_back(order[i])
+        start += sizes[group]
+    return result
+
+
+cdef class PyStepwiseEMTrainer:
+    """
+    Stepwise (online) EM for latent annotations, cf. Liang & Klein 2009, Online EM for unsupervised models.
+    In each epoch, the trace ids are split into mini-batches in random order (cf. mini_batches). For the k-th
+    mini-batch, one EM epoch on its traces trains the annotation in place, whose weights are then interpolated
+    with the previous weights by the step size (k + offset) ** -exponent. If the traces are read from a
+    TraceStore, only the traces of one mini-batch are in memory at a time.
+    """
+    cdef PyTraceManager traceManager
+    cdef object traceStore
+    cdef PyGrammarInfo grammarInfo
+    cdef PyStorageManager storageManager
+    cdef size_t batch_size
+    cdef unsigned epochs
+    cdef double offset
+    cdef double exponent
+    cdef unsigned seed
+    cdef unsigned_int threads
+    cdef vector[size_t] smoothingRuleIDs
+    cdef double smoothValue
+    cdef size_t updates
+    # weights before the EM epoch on the current mini-batch
+    cdef vector[double] previousRootWeights
+    cdef vector[vector[double]] previousRuleWeights
+
+    def __init__(self, PyTraceManager traceManager, PyGrammarInfo grammarInfo, PyStorageManager storageManager,
+                 size_t batch_size, unsigned epochs=1, double offset=2.0, double exponent=0.7, unsigned seed=0,
+                 unsigned_int threads=0, traceStore=None):
+        """
+        :param traceManager: the traces or, if traceStore is given, a trace manager with the same nonterminal
+            map, which provides the empty trace managers of the mini-batches (cf. PyTraceManager.empty_copy)
+        :param storageManager: storage manager of the latent annotations
+        :param batch_size: number of traces per mini-batch
+        :param epochs: number of passes over the traces
+        :param offset: offset of the step size schedule (> 0)
+        :param exponent: exponent of the step size schedule; in (0.5, 1] for convergence
+        :param seed: seed of the order of the traces
+        :param threads: threads of the expector (0: default)
+        :param traceStore: the traces, from which each mini-batch is loaded (cf. TraceStore.load)
+        :type traceStore: TraceStore
+        """
+        if batch_size == 0:
+            raise ValueError("The mini-batch size needs to be positive.")
+        if not offset > 0.0 or not 0.5 < exponent <= 1.0:
+            raise ValueError("The step size schedule needs offset > 0 and 0.5 < exponent <= 1.")
+        self.traceManager = traceManager
+        self.traceStore = traceStore
+        self.grammarInfo = grammarInfo
+        self.storageManager = storageManager
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.offset = offset
+        self.exponent = exponent
+        self.seed = seed
+        self.threads = threads
+        self.smoothValue = 0.0
+        self.updates = 0
+
+    cpdef void set_count_smoothing(self, vector[size_t] ruleIDs, double smoothValue):
+        """
+        Applies count smoothing in the EM epochs on the mini-batches, cf. PySplitMergeTrainerBuilder.
+        """
+        self.smoothingRuleIDs = ruleIDs
+        self.smoothValue = smoothValue
+
+    cpdef double step_size(self):
+        """
+        :return: the step size of the next update
+        """
+        return (self.updates + self.offset) ** -self.exponent
+
+    def mini_batches(self, seed):
+        """
+        :param seed: seed of the random order of the traces
+        :return: the trace ids of each mini-batch (the last one may be smaller)
+        :rtype: list[numpy.ndarray]
+        """
+        traces = self.traceManager if self.traceStore is None else self.traceStore
+        order = np.random.RandomState(seed).permutation(len(traces))
+        return [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+
+    cdef PyTraceManager load_mini_batch(self, traceIds):
+        """
+        :return: an empty copy of the trace manager, to which only the traces of the mini-batch are added
+        """
+        cdef PyTraceManager batch = self.traceManager.empty_copy()
+        if self.traceStore is None:
+            batch.add_traces(self.traceManager, traceIds)
+        else:
+            self.traceStore.load(batch, traceIds)
+        return batch
+
+    def em_train(self, PyLatentAnnotation la):
+        """
+        Trains la in place. The step size schedule continues over calls, i.e., over split/merge cycles.
+        """
+        cdef unsigned epoch
+        cdef PySplitMergeTrainerBuilder builder
+        for epoch in range(self.epochs):
+            timeStart = time.time()
+            for traceIds in self.mini_batches(self.seed + epoch):
+                # the trainer of the library is bound to the traces it is built for
+                builder = PySplitMergeTrainerBuilder(self.load_mini_batch(traceIds), self.grammarInfo)
+                builder.set_em_epochs(1)
+                builder.set_simple_expector(threads=self.threads)
+                if self.smoothingRuleIDs.size() > 0:
+                    builder.set_count_smoothing(self.smoothingRuleIDs, self.smoothValue)
+                self.previousRootWeights = deref(la.latentAnnotation).get_root_weights()
+                self.previousRuleWeights = deref(la.latentAnnotation).get_rule_weights()
+                builder.build().em_train(la)
+                la.set_latent_annotation(self.interpolate(la, self.step_size()))
+                self.updates += 1
+            output_helper("Completed stepwise EM epoch " + str(epoch + 1) + " in " + str(time.time() - timeStart)
+                          + " seconds (" + str(self.updates) + " updates)")
+
+    cdef shared_ptr[LatentAnnotation] interpolate(self, PyLatentAnnotation la, double step):
+        """
+        :return: (1 - step) * previous weights + step * la
+        """
+        cdef vector[double] rootWeights = deref(la.latentAnnotation).get_root_weights()
+        cdef vector[vector[double]] ruleWeights = deref(la.latentAnnotation).get_rule_weights()
+        cdef size_t i, j
+        for i in range(rootWeights.size()):
+            rootWeights[i] = (1.0 - step) * self.previousRootWeights[i] + step * rootWeights[i]
+        for i in range(ruleWeights.size()):
+            for j in range(ruleWeights[i].size()):
+                ruleWeights[i][j] = (1.0 - step) * self.previousRuleWeights[i][j] + step * ruleWeights[i][j]
+        return make_shared[LatentAnnotation](deref(la.latentAnnotation).nonterminalSplits
+                                             , rootWeights
+                                             , ruleWeights
+                                             , deref(self.grammarInfo.grammarInfo)
+                                             , deref(self.storageManager.storageManager))
 
 
 cdef class PySplitMergeTrainerBuilder:
     cdef shared_ptr[SplitMergeTrainerBuilder[NONTERMINAL, size_t]] splitMergeTrainerBuilder
+    cdef PyTraceManager traceManager
+    cdef PyGrammarInfo grammarInfo
+    cdef unsigned_int expectorThreads
+    cdef vector[size_t] smoothingRuleIDs
+    cdef double smoothValue
+    cdef PyStepwiseEMTrainer stepwise
+    cdef c_bool stepwiseFullBatch
     def __init__(self, PyTraceManager traceManager, PyGrammarInfo grammarInfo):
         self.splitMergeTrainerBuilder = make_shared[SplitMergeTrainerBuilder[NONTERMINAL, size_t]](traceManager.trace_manager, grammarInfo.grammarInfo)
+        self.traceManager = traceManager
+        self.grammarInfo = grammarInfo
 
     cpdef PySplitMergeTrainerBuilder set_threads(self, unsigned_int threads):
         deref(self.splitMergeTrainerBuilder).set_threads(threads)
         return self
 
     cpdef PySplitMergeTrainerBuilder set_simple_expector(self, unsigned_int threads=0):
+        self.expectorThreads = threads
         if threads > 0:
             deref(self.splitMergeTrainerBuilder).set_simple_expector(threads)
         else:
@@ -251,6 +419,31 @@ cdef class PySplitMergeTrainerBuilder:
 
     cpdef PySplitMergeTrainerBuilder set_count_smoothing(self, vector[size_t] ruleIDs, double smoothValue):
         deref(self.splitMergeTrainerBuilder).set_count_smoothing(ruleIDs, smoothValue)
+        self.smoothingRuleIDs = ruleIDs
+        self.smoothValue = smoothValue
+        return self
+
+    cpdef PySplitMergeTrainerBuilder set_stepwise_em(self
+                                                     , PyStorageManager storageManager
+                                                     , size_t batch_size
+                                                     , unsigned epochs=1
+                                                     , double offset=2.0
+                                                     , double exponent=0.7
+                                                     , unsigned seed=0
+                                                     , c_bool full_batch=False
+                                                     , traceStore=None):
+        """
+        Train by stepwise EM on mini-batches in em_train, cf. PyStepwiseEMTrainer. The expector threads and
+        count smoothing are taken over when build is called.
+
+        :param full_batch: the stepwise epochs are followed by the full-batch EM epochs (cf. set_em_epochs),
+            which are subject to the validator, i.e., it picks the result among them
+        :param traceStore: TraceStore of the traces, from which the mini-batches are loaded
+        """
+        self.stepwise = PyStepwiseEMTrainer(self.traceManager, self.grammarInfo, storageManager, batch_size,
+                                            epochs=epochs, offset=offset, exponent=exponent, seed=seed,
+                                            traceStore=traceStore)
+        self.stepwiseFullBatch = full_batch
         return self
 
     cpdef PySplitMergeTrainerBuilder set_simple_validator(
@@ -319,6 +512,12 @@ cdef class PySplitMergeTrainerBuilder:
         trainer = PySplitMergeTrainer()
         trainer.splitMergeTrainer = make_shared[SplitMergeTrainer[NONTERMINAL, size_t]](deref(self.splitMergeTrainerBuilder).build())
         trainer.emTrainer = (deref(self.splitMergeTrainerBuilder)).getEmTrainer()
+        if self.stepwise is not None:
+            self.stepwise.threads = self.expectorThreads
+            if self.smoothingRuleIDs.size() > 0:
+                self.stepwise.set_count_smoothing(self.smoothingRuleIDs, self.smoothValue)
+            trainer.stepwise = self.stepwise
+            trainer.stepwiseFullBatch = self.stepwiseFullBatch
         return trainer
 
 
@@ -535,9 +734,81 @@ cdef class PyLatentAnnotation:
         cdef vector[vector[double]] ruleWeights = deref(self.latentAnnotation).get_rule_weights()
         return splits, rootWeights, ruleWeights
 
+    cpdef double get_weight(self, size_t rule, vector[size_t] index):
+        """
+        :param index: the splits of the lhs and rhs nonterminals of rule
+        :return: the weight of the split rule
+        """
+        return deref(self.latentAnnotation).get_weight(rule, index)
+
+    cpdef tuple to_arrays(self):
+        """
+        Copies the weights into contiguous arrays without creating a Python object per weight.
+
+        :return: the splits of each nonterminal, the root weights, the weights of all rules (concatenated in the
+            order of the rule ids and of serialize) and the offset of the weights of each rule in the latter (with
+            the end of the weights of the last rule appended)
+        :rtype: tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]
+        """
+        cdef vector[size_t] splits = deref(self.latentAnnotation).nonterminalSplits
+        cdef vector[vector[double]] ruleWeights = deref(self.latentAnnotation).get_rule_weights()
+        cdef size_t i
+        split_array = np.empty(splits.size(), dtype=np.intp)
+        cdef Py_ssize_t[::1] split_view = split_array
+        for i in range(splits.size()):
+            split_view[i] = splits[i]
+        offsets = np.zeros(ruleWeights.size() + 1, dtype=np.intp)
+        cdef Py_ssize_t[::1] offset_view = offsets
+        for i in range(ruleWeights.size()):
+            offset_view[i + 1] = offset_view[i] + ruleWeights[i].size()
+        weights = np.empty(offset_view[ruleWeights.size()], dtype=np.float64)
+        cdef double[::1] weight_view = weights
+        for i in range(ruleWeights.size()):
+            if ruleWeights[i].size() > 0:
+                memcpy(&weight_view[offset_view[i]], ruleWeights[i].data(), ruleWeights[i].size() * sizeof(double))
+        return split_array, double_array(deref(self.latentAnnotation).get_root_weights()), weights, offsets
+
+    def rule_weight_arrays(self, PyGrammarInfo grammarInfo):
+        """
+        :return: the splits of each nonterminal, the root weights and, for each rule, the array of its weights
+            indexed by the splits of its lhs and rhs nonterminals; the latter are views of the rule weights of
+            to_arrays, where the last nonterminal varies fastest (as in construct_fine_grammar)
+        :rtype: tuple[numpy.ndarray, numpy.ndarray, list[numpy.ndarray]]
+        """
+        splits, root_weights, weights, offsets = self.to_arrays()
+        cdef vector[vector[size_t]] ruleToNonterminals = deref(grammarInfo.grammarInfo).rule_to_nonterminals
+        if ruleToNonterminals.size() != len(offsets) - 1:
+            raise ValueError("The grammar info has %d rules, the latent annotation %d."
+                             % (ruleToNonterminals.size(), len(offsets) - 1))
+        cdef size_t i
+        rule_weights = []
+        for i in range(ruleToNonterminals.size()):
+            rule_weights.append(weights[offsets[i]:offsets[i + 1]].reshape(splits[ruleToNonterminals[i]]))
+        return splits, root_weights, rule_weights
+
     cpdef void make_proper(self):
         deref(self.latentAnnotation).make_proper()
 
+    cpdef PyLatentAnnotation remap_rules(self, index_map, PyGrammarInfo grammarInfo, PyStorageManager storageManager):
+        """
+        Drop the weights of removed rules and move the remaining ones to their new indices.
+        :param index_map: mapping from old to new rule indices with -1 for removed rules, cf. LCFRS.remove_rules
+        :param grammarInfo: grammar info of the grammar after rule removal, cf. PyGrammarInfo.remap_rules
+        :rtype: PyLatentAnnotation
+        """
+        cdef vector[vector[double]] ruleWeights = deref(self.latentAnnotation).get_rule_weights()
+        cdef vector[vector[double]] remappedWeights
+        remappedWeights.resize(kept_rules(index_map, ruleWeights.size()))
+        cdef size_t old_idx
+        for old_idx in range(0, ruleWeights.size()):
+            if index_map[old_idx] >= 0:
+                remappedWeights[index_map[old_idx]] = ruleWeights[old_idx]
+        return build_PyLatentAnnotation(deref(self.latentAnnotation).nonterminalSplits
+                                        , deref(self.latentAnnotation).get_root_weights()
+                                        , remappedWeights
+                                        , grammarInfo
+                                        , storageManager)
+
 
 
 cpdef PyLatentAnnotation build_PyLatentAnnotation_initial(
@@ -558,10 +829,75 @@ cpdef PyLatentAnnotation build_PyLatentAnnotation_initial(
     return latentAnnotation
 
 
+cdef object double_array(const vector[double] &values):
+    array = np.empty(values.size(), dtype=np.float64)
+    cdef double[::1] view = array
+    if values.size() > 0:
+        memcpy(&view[0], values.data(), values.size() * sizeof(double))
+    return array
+
+
+def build_PyLatentAnnotation_from_arrays(splits, root_weights, rule_weights, offsets, PyGrammarInfo grammarInfo,
+                                         PyStorageManager storageManager):
+    """
+    Inverse of PyLatentAnnotation.to_arrays.
+
+    :param offsets: offset of the weights of each rule in rule_weights and the end of the weights of the last rule
+    :rtype: PyLatentAnnotation
+    """
+    cdef double[::1] weight_view = np.ascontiguousarray(rule_weights, dtype=np.float64)
+    cdef Py_ssize_t[::1] offset_view = np.ascontiguousarray(offsets, dtype=np.intp)
+    if offset_view.shape[0] == 0 or offset_view[0] != 0 \
+            or offset_view[offset_view.shape[0] - 1] != weight_view.shape[0]:
+        raise ValueError("The offsets do not match the rule weights.")
+    cdef vector[vector[double]] ruleWeights
+    ruleWeights.resize(offset_view.shape[0] - 1)
+    cdef Py_ssize_t i, size
+    for i in range(offset_view.shape[0] - 1):
+        size = offset_view[i + 1] - offset_view[i]
+        if size < 0:
+            raise ValueError("The offsets are not sorted.")
+        ruleWeights[i].resize(size)
+        if size > 0:
+            memcpy(ruleWeights[i].data(), &weight_view[offset_view[i]], size * sizeof(double))
+    return build_PyLatentAnnotation(np.asarray(splits, dtype=np.uintp).tolist()
+                                    , np.asarray(root_weights, dtype=np.float64).tolist()
+                                    , ruleWeights
+                                    , grammarInfo
+                                    , storageManager)
+
+
+def save_latent_annotation(PyLatentAnnotation la, path, compressed=False):
+    """
+    Writes the arrays of la (cf. PyLatentAnnotation.to_arrays) to an .npz file.
+
+    :type path: str
+    :param compressed: compress the arrays with zlib
+    :type compressed: bool
+    """
+    splits, root_weights, rule_weights, offsets = la.to_arrays()
+    (np.savez_compressed if compressed else np.savez)(path, splits=splits, root_weights=root_weights,
+                                                      rule_weights=rule_weights, offsets=offsets)
+
+
+def load_latent_annotation(path, PyGrammarInfo grammarInfo, PyStorageManager storageManager):
+    """
+    Reads a latent annotation written by save_latent_annotation.
+
+    :type path: str
+    :rtype: PyLatentAnnotation
+    """
+    with np.load(path) as arrays:
+        return build_PyLatentAnnotation_from_arrays(arrays['splits'], arrays['root_weights'], arrays['rule_weights'],
+                                                    arrays['offsets'], grammarInfo, storageManager)
+
+
 cdef class PySplitMergeTrainer:
     cdef map[string,TrainingMode] modes
     cdef shared_ptr[SplitMergeTrainer[NONTERMINAL, size_t]] splitMergeTrainer
     cdef shared_ptr[EMTrainerLA] emTrainer
+    cdef PyStepwiseEMTrainer stepwise
+    cdef c_bool stepwiseFullBatch
 
     def __init__(self):
         modes_ = { b"default": Default
@@ -586,7 +922,11 @@ cdef class PySplitMergeTrainer:
         pyLaMerged.latentAnnotation = la_merged
         return pyLaMerged
 
-    cpdef void em_train(self, PyLatentAnnotation la):
+    cpdef void em_train(self, PyLatentAnnotation la) except *:
+        if self.stepwise is not None:
+            self.stepwise.em_train(la)
+            if not self.stepwiseFullBatch:
+                return
         deref(self.splitMergeTrainer).em_train(deref(la.latentAnnotation))
 
     cpdef reset_random_seed(self, unsigned seed):
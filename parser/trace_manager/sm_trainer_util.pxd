@@ -14,7 +14,11 @@ cdef extern from "Trainer/StorageManager.h" namespace "Trainer":
 
 cdef class PyGrammarInfo:
     cdef shared_ptr[GrammarInfo2] grammarInfo
+    cdef size_t start
     cpdef c_bool check_for_consistency(self)
+    cpdef PyGrammarInfo remap_rules(self, index_map)
+
+cdef Py_ssize_t kept_rules(index_map, size_t rules) except -1
 
 cdef class PyStorageManager:
     cdef shared_ptr[StorageManager] storageManager
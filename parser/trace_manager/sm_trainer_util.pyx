@@ -16,11 +16,44 @@ cdef class PyGrammarInfo:
             nonts = [nont_map.object_index(rule.lhs().nont())] + [nont_map.object_index(nont) for nont in rule.rhs()]
             rule_to_nonterminals.push_back(nonts)
 
-        self.grammarInfo = make_shared[GrammarInfo2](rule_to_nonterminals, nont_map.object_index(grammar.initial()))
+        self.start = nont_map.object_index(grammar.initial())
+        self.grammarInfo = make_shared[GrammarInfo2](rule_to_nonterminals, self.start)
+
+    cpdef PyGrammarInfo remap_rules(self, index_map):
+        """
+        :param index_map: mapping from old to new rule indices with -1 for removed rules, cf. LCFRS.remove_rules
+        :return: the grammar info after rule removal, which is obtained without traversing the grammar
+        :rtype: PyGrammarInfo
+        """
+        cdef size_t rules = deref(self.grammarInfo).rule_to_nonterminals.size()
+        cdef vector[vector[size_t]] rule_to_nonterminals
+        rule_to_nonterminals.resize(kept_rules(index_map, rules))
+        cdef size_t old_idx
+        for old_idx in range(0, rules):
+            if index_map[old_idx] >= 0:
+                rule_to_nonterminals[index_map[old_idx]] = deref(self.grammarInfo).rule_to_nonterminals[old_idx]
+        cdef PyGrammarInfo remapped = PyGrammarInfo.__new__(PyGrammarInfo)
+        remapped.start = self.start
+        remapped.grammarInfo = make_shared[GrammarInfo2](rule_to_nonterminals, self.start)
+        return remapped
 
     cpdef c_bool check_for_consistency(self):
         return deref(self.grammarInfo).check_for_consistency()
 
+cdef Py_ssize_t kept_rules(index_map, size_t rules) except -1:
+    """
+    :param index_map: mapping from old to new rule indices with -1 for removed rules, cf. LCFRS.remove_rules
+    :return: the number of kept rules n, if index_map maps the kept rules one-to-one to 0, ..., n - 1
+    :raises ValueError: otherwise
+    """
+    if len(index_map) != rules:
+        raise ValueError("The index map has %d entries, but there are %d rules." % (len(index_map), rules))
+    new_indices = sorted([new_idx for new_idx in index_map if new_idx >= 0])
+    if new_indices != list(range(len(new_indices))):
+        raise ValueError("The index map does not map the kept rules one-to-one to consecutive indices.")
+    return len(new_indices)
+
+
 cdef class PyStorageManager:
     def __init__(self, bint selfMalloc=False):
         self.storageManager = make_shared[StorageManager](selfMalloc)
\ No newline at end of file
@@ -57,6 +57,7 @@ cdef extern from "Trainer/TraceManager.h" namespace "Trainer":
 
     cdef cppclass TraceManager2[Nonterminal, TraceID]:
         Trace[Nonterminal, TraceID] operator[](size_t)
+        size_t size()
         void set_io_cycle_limit(unsigned int io_cycle_limit)
         void set_io_precision(double io_precision)
     cdef cppclass TraceManagerPtr[Nonterminal, TraceID]:
@@ -67,6 +68,11 @@ cdef extern from "Trainer/TraceManager.h" namespace "Trainer":
             , bint)
     cdef void serialize_trace[Nonterminal, TraceID](TraceManagerPtr[Nonterminal, TraceID] traceManager, string path)
     cdef TraceManagerPtr[Nonterminal, TraceID] load_trace_manager[Nonterminal, TraceID](string path)
+    cdef void add_hypergraph_to_trace[Nonterminal, TraceID](
+            TraceManagerPtr[Nonterminal, TraceID] manager
+            , shared_ptr[Hypergraph[Nonterminal, size_t]] hypergraph
+            , Element[Node[Nonterminal]] root
+            , double frequency)
 
     cdef shared_ptr[TraceManager2[Nonterminal, TraceID]] fool_cython_unwrap[Nonterminal, TraceID](TraceManagerPtr[Nonterminal, TraceID] tmp)
 
@@ -74,6 +80,8 @@ ctypedef size_t NONTERMINAL
 
 cdef class PyTraceManager:
     cdef TraceManagerPtr[NONTERMINAL, size_t] trace_manager
+    cdef shared_ptr[vector[NONTERMINAL]] node_labels
+    cdef shared_ptr[vector[size_t]] edge_labels
     cpdef serialize(self, string path)
     cpdef void load_traces_from_file(self, string path)
     cpdef Enumerator get_nonterminal_map(self)
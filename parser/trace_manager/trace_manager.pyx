@@ -5,6 +5,7 @@ from libcpp.map cimport map as cmap
 from libcpp.set cimport set as cset
 from cython.operator cimport dereference as deref, preincrement as inc
 from libc.math cimport log, NAN, INFINITY, isnan, isinf
+from libc.string cimport memcpy
 from itertools import product
 from parser.trace_manager.sm_trainer cimport PyLatentAnnotation
 from libcpp cimport bool
@@ -24,6 +25,19 @@ cdef extern from "cpp_priority_queue.hpp":
 
     cdef comperator_function[T] construct_comparator[T](...)
 
+cdef extern from "hypergraph_kbest.hpp":
+    cdef cppclass HypergraphKBest:
+        cppclass Derivation:
+            double weight
+            size_t edge
+            vector[unsigned] ranks
+        HypergraphKBest(size_t nodes, bint additive)
+        void add_edge(size_t target, const vector[size_t]& sources, double weight)
+        bint derivation(size_t node, unsigned rank, double& weight) except +
+        const Derivation& get(size_t node, unsigned rank)
+        const vector[size_t]& edge_sources(size_t edge)
+
+
 cpdef double prod(double x, double y):
     return x * y
 
@@ -64,6 +78,94 @@ cdef class PyTraceManager:
     cpdef void set_io_precision(self, double io_precision):
         deref(fool_cython_unwrap(self.trace_manager)).set_io_precision(io_precision)
 
+    def __len__(self):
+        return deref(fool_cython_unwrap(self.trace_manager)).size()
+
+    def merge(self, others):
+        """
+        :param others: trace managers built for the same grammar
+        :type others: Iterable[PyTraceManager]
+        Appends copies of the traces of others (in the given order) to this trace manager. If both trace
+        managers have a nonterminal map, node labels are translated by nonterminal, otherwise they are
+        copied. Edge labels (i.e., rule ids) are always copied.
+        """
+        cdef PyTraceManager other
+        for other in others:
+            self.add_traces(other, range(len(other)))
+
+    def add_traces(self, PyTraceManager other, traceIds):
+        """
+        :param other: trace manager built for the same grammar
+        :param traceIds: ids of traces of other, whose copies are appended in the given order, cf. merge
+        :type traceIds: Iterable[int]
+        """
+        cdef vector[NONTERMINAL] label_map
+        cdef size_t traceId
+        if not self.node_labels or not self.edge_labels:
+            raise ValueError("The trace manager has no node and edge labels to build hypergraphs with.")
+        label_map = self.__label_map(other)
+        for traceId in traceIds:
+            if traceId >= len(other):
+                raise IndexError("trace %d of %d" % (traceId, len(other)))
+            copy_trace(self, other, traceId, label_map)
+
+    def empty_copy(self):
+        """
+        :return: an empty trace manager with the same node and edge labels
+        :rtype: PyTraceManager
+        """
+        cdef PyTraceManager copy = PyTraceManager()
+        copy.node_labels = self.node_labels
+        copy.edge_labels = self.edge_labels
+        copy.trace_manager = build_trace_manager_ptr[NONTERMINAL, size_t](self.node_labels, self.edge_labels, False)
+        return copy
+
+    def load_traces_from_files(self, paths):
+        """
+        :param paths: files written by serialize, e.g., by the workers of compute_reducts_sharded
+        :type paths: Iterable[bytes]
+        Appends the traces of all files (in the given order) to this trace manager, cf. merge. Node labels are
+        copied, i.e., the files need to be written by trace managers with the same nonterminal map.
+        """
+        cdef PyTraceManager shard
+        for path in paths:
+            shard = PyTraceManager()
+            shard.load_traces_from_file(path)
+            self.merge([shard])
+
+    def trace_to_bytes(self, size_t traceId):
+        """
+        :return: the hypergraph, goal and frequency of the trace in native byte order, cf. TraceStore
+        :rtype: bytes
+        """
+        cdef vector[size_t] words = encode_trace(self, traceId)
+        return (<char*> words.data())[:words.size() * sizeof(size_t)]
+
+    def add_trace_from_bytes(self, const unsigned char[:] data):
+        """
+        :param data: a trace encoded by trace_to_bytes of a trace manager with the same nonterminal map
+        Appends the trace to this trace manager.
+        """
+        if not self.node_labels or not self.edge_labels:
+            raise ValueError("The trace manager has no node and edge labels to build hypergraphs with.")
+        decode_trace(self, data)
+
+    def __label_map(self, PyTraceManager other):
+        try:
+            nonterminal_map = self.get_nonterminal_map()
+            other_nonterminal_map = other.get_nonterminal_map()
+        except NotImplementedError:
+            return []
+        if nonterminal_map is other_nonterminal_map:
+            return []
+        label_map = [0] * other_nonterminal_map.counter
+        for label, nont in other_nonterminal_map.ind_to_obj.items():
+            if nont not in nonterminal_map.obj_to_ind \
+                    or nonterminal_map.obj_to_ind[nont] >= deref(self.node_labels).size():
+                raise ValueError("Nonterminal %s is unknown to the trace manager." % str(nont))
+            label_map[label] = nonterminal_map.obj_to_ind[nont]
+        return label_map
+
     def viterbi_derivation(self, size_t traceId, vector[double] edge_weights, grammar, op=prod, log_mode=True):
         """
         :param traceId: trace of which the viterbi derivation shall be computed
@@ -272,6 +374,46 @@ cdef class PyTraceManager:
         return DerivationTree(rule_id, children)
 
 
+    def k_best_derivations(self, size_t traceId, vector[double] edge_weights, grammar, unsigned k, op=prod,
+                           log_mode=True):
+        """
+        :param traceId: trace of which the k best derivations shall be computed
+        :type traceId: size_t
+        :param edge_weights: weights for each edge (ordered according to edge ordering in hypergraph),
+            e.g., log rule weights or projected weights; edges with weight NaN are ignored
+        :type edge_weights: list[double]
+        :param grammar:
+        :type grammar: RTG_like
+        :param k: maximum number of derivations
+        :param op: path operation without log_mode (prod or add)
+        :return: the derivations and their weights in descending order of weight
+        :rtype: Iterable[tuple[float, TraceManagerDerivation]]
+        Lazy k-best enumeration, cf. Huang & Chiang 2005, Algorithm 3. The best derivations of all nodes are
+        computed as in viterbi_derivation and the next derivations of a node only on demand. In cyclic
+        hypergraphs, derivations that contain a node more than once may be skipped.
+        """
+        if not log_mode and op is not prod and op is not add:
+            raise ValueError("k-best enumeration supports the path operations prod and add only")
+        cdef PyHypergraphKBest kbest = build_hypergraph_kbest(self, traceId, edge_weights, log_mode or op is add)
+        cdef unsigned rank
+        for rank in range(k):
+            derivation = kbest.derivation(rank)
+            if derivation is None:
+                break
+            weight, tree = derivation
+            yield weight, TraceManagerDerivation(tree, grammar)
+
+    def edge_rule_ids(self, size_t traceId):
+        """
+        :return: the label (i.e., rule id) of each edge of the trace's hypergraph in edge ordering
+        :rtype: list[int]
+        """
+        cdef Trace[NONTERMINAL, size_t]* trace = &(deref(fool_cython_unwrap(self.trace_manager))[traceId])
+        cdef shared_ptr[Manager[HyperEdge[Node[NONTERMINAL], size_t]]] edges
+        edges = deref(deref(trace).get_hypergraph()).get_edges().lock()
+        cdef size_t edge_idx
+        return [deref(edges)[edge_idx].get_label() for edge_idx in range(deref(edges).size())]
+
     def enumerate_derivations(self, size_t traceId, grammar):
         cdef Trace[NONTERMINAL, size_t]* trace = &(deref(fool_cython_unwrap(self.trace_manager))[traceId])
         cdef PyElement goal = PyElement()
@@ -308,6 +450,213 @@ cdef class PyTraceManager:
                 yield DerivationTree(rule_id, list(children))
 
 
+cdef class PyHypergraphKBest:
+    """
+    Lazy k-best derivations of the goal of a trace, cf. PyTraceManager.k_best_derivations.
+    """
+    cdef HypergraphKBest* kbest
+    cdef vector[size_t] edge_labels
+    cdef size_t goal
+
+    def __dealloc__(self):
+        del self.kbest
+
+    cdef derivation(self, unsigned rank):
+        cdef double weight = 0.0
+        if self.kbest == NULL or not self.kbest.derivation(self.goal, rank, weight):
+            return None
+        return weight, self.tree(self.goal, rank)
+
+    cdef DerivationTree tree(self, size_t node, unsigned rank):
+        cdef const HypergraphKBest.Derivation* derivation = &self.kbest.get(node, rank)
+        cdef size_t edge = derivation.edge
+        cdef vector[unsigned] ranks = derivation.ranks
+        cdef const vector[size_t]* sources = &self.kbest.edge_sources(edge)
+        cdef size_t i
+        return DerivationTree(self.edge_labels[edge], [self.tree(deref(sources)[i], ranks[i]) for i in range(ranks.size())])
+
+
+cdef PyHypergraphKBest build_hypergraph_kbest(PyTraceManager manager, size_t traceId, vector[double] edge_weights,
+                                              bint additive):
+    cdef Trace[NONTERMINAL, size_t]* trace = &(deref(fool_cython_unwrap(manager.trace_manager))[traceId])
+    cdef shared_ptr[Manager[HyperEdge[Node[NONTERMINAL], size_t]]] edges
+    edges = deref(deref(trace).get_hypergraph()).get_edges().lock()
+    cdef HyperEdge[Node[NONTERMINAL], size_t]* edge
+    cdef cmap[Element[Node[NONTERMINAL]], size_t] node_idx
+    cdef vector[size_t] sources
+    cdef size_t edge_idx, source_idx
+    cdef PyHypergraphKBest kbest = PyHypergraphKBest()
+
+    if edge_weights.size() != deref(edges).size():
+        raise ValueError("Expected %d edge weights, got %d" % (deref(edges).size(), edge_weights.size()))
+
+    # number the nodes
+    cdef size_t nodes = 0
+    for edge_idx in range(deref(edges).size()):
+        edge = &deref(edges)[edge_idx]
+        if node_idx.count(deref(edge).get_target()) == 0:
+            node_idx[deref(edge).get_target()] = nodes
+            nodes += 1
+        for source_idx in range(deref(edge).get_sources().size()):
+            if node_idx.count(deref(edge).get_sources()[source_idx]) == 0:
+                node_idx[deref(edge).get_sources()[source_idx]] = nodes
+                nodes += 1
+    if node_idx.count(deref(trace).get_goal()) == 0:
+        return kbest
+
+    kbest.kbest = new HypergraphKBest(nodes, additive)
+    kbest.goal = node_idx[deref(trace).get_goal()]
+    for edge_idx in range(deref(edges).size()):
+        edge = &deref(edges)[edge_idx]
+        for source_idx in range(deref(edge).get_sources().size()):
+            sources.push_back(node_idx[deref(edge).get_sources()[source_idx]])
+        kbest.kbest.add_edge(node_idx[deref(edge).get_target()], sources, edge_weights[edge_idx])
+        kbest.edge_labels.push_back(deref(edge).get_label())
+        sources.clear()
+    return kbest
+
+
+cdef void copy_trace(PyTraceManager manager, PyTraceManager source, size_t traceId,
+                     vector[NONTERMINAL] & label_map) except *:
+    """
+    Adds a copy of the trace with traceId of source to manager, where node label l is replaced by label_map[l]
+    (unless label_map is empty).
+    """
+    cdef Trace[NONTERMINAL, size_t]* trace = &(deref(fool_cython_unwrap(source.trace_manager))[traceId])
+    cdef shared_ptr[Manager[HyperEdge[Node[NONTERMINAL], size_t]]] edges
+    edges = deref(deref(trace).get_hypergraph()).get_edges().lock()
+    cdef shared_ptr[Hypergraph[NONTERMINAL, size_t]] hg \
+        = make_shared[Hypergraph[NONTERMINAL, size_t]](manager.node_labels, manager.edge_labels)
+    cdef HyperEdge[Node[NONTERMINAL], size_t]* edge
+    cdef cmap[Element[Node[NONTERMINAL]], size_t] node_idx
+    cdef vector[Element[Node[NONTERMINAL]]] nodes
+    cdef vector[Element[Node[NONTERMINAL]]] sources
+    cdef size_t edge_idx, source_idx
+
+    # create the nodes in the order of their first occurrence
+    for edge_idx in range(deref(edges).size()):
+        edge = &deref(edges)[edge_idx]
+        copy_node(hg, deref(edge).get_target(), node_idx, nodes, label_map)
+        for source_idx in range(deref(edge).get_sources().size()):
+            copy_node(hg, deref(edge).get_sources()[source_idx], node_idx, nodes, label_map)
+    copy_node(hg, deref(trace).get_goal(), node_idx, nodes, label_map)
+
+    for edge_idx in range(deref(edges).size()):
+        edge = &deref(edges)[edge_idx]
+        for source_idx in range(deref(edge).get_sources().size()):
+            sources.push_back(nodes[node_idx[deref(edge).get_sources()[source_idx]]])
+        deref(hg).add_hyperedge(deref(edge).get_label(), nodes[node_idx[deref(edge).get_target()]], sources)
+        sources.clear()
+
+    add_hypergraph_to_trace[NONTERMINAL, size_t](manager.trace_manager, hg, nodes[node_idx[deref(trace).get_goal()]],
+                                                 deref(trace).get_frequency())
+
+
+cdef void copy_node(shared_ptr[Hypergraph[NONTERMINAL, size_t]] hg, Element[Node[NONTERMINAL]] node,
+                    cmap[Element[Node[NONTERMINAL]], size_t] & node_idx, vector[Element[Node[NONTERMINAL]]] & nodes,
+                    vector[NONTERMINAL] & label_map):
+    if node_idx.count(node):
+        return
+    cdef NONTERMINAL label = node.get().get_label()
+    if not label_map.empty():
+        label = label_map[label]
+    node_idx[node] = nodes.size()
+    nodes.push_back(deref(hg).create(label))
+
+
+# Binary encoding of a trace as a sequence of words (size_t): the frequency (bits of a double), the numbers of
+# nodes and edges, the goal, the label of each node, and for each edge its label, target, number of sources, and
+# sources, where nodes are numbered in the order of their first occurrence.
+DEF TRACE_HEADER_WORDS = 4
+
+
+cdef vector[size_t] encode_trace(PyTraceManager manager, size_t traceId):
+    cdef Trace[NONTERMINAL, size_t]* trace = &(deref(fool_cython_unwrap(manager.trace_manager))[traceId])
+    cdef shared_ptr[Manager[HyperEdge[Node[NONTERMINAL], size_t]]] edges
+    edges = deref(deref(trace).get_hypergraph()).get_edges().lock()
+    cdef HyperEdge[Node[NONTERMINAL], size_t]* edge
+    cdef cmap[Element[Node[NONTERMINAL]], size_t] node_idx
+    cdef vector[size_t] labels
+    cdef vector[size_t] words = vector[size_t](TRACE_HEADER_WORDS)
+    cdef size_t edge_idx, source_idx
+    cdef double frequency = deref(trace).get_frequency()
+
+    for edge_idx in range(deref(edges).size()):
+        edge = &deref(edges)[edge_idx]
+        number_node(deref(edge).get_target(), node_idx, labels)
+        for source_idx in range(deref(edge).get_sources().size()):
+            number_node(deref(edge).get_sources()[source_idx], node_idx, labels)
+    number_node(deref(trace).get_goal(), node_idx, labels)
+
+    memcpy(&words[0], &frequency, sizeof(double))
+    words[1] = labels.size()
+    words[2] = deref(edges).size()
+    words[3] = node_idx[deref(trace).get_goal()]
+    words.insert(words.end(), labels.begin(), labels.end())
+    for edge_idx in range(deref(edges).size()):
+        edge = &deref(edges)[edge_idx]
+        words.push_back(deref(edge).get_label())
+        words.push_back(node_idx[deref(edge).get_target()])
+        words.push_back(deref(edge).get_sources().size())
+        for source_idx in range(deref(edge).get_sources().size()):
+            words.push_back(node_idx[deref(edge).get_sources()[source_idx]])
+    return words
+
+
+cdef void number_node(Element[Node[NONTERMINAL]] node, cmap[Element[Node[NONTERMINAL]], size_t] & node_idx,
+                      vector[size_t] & labels):
+    if node_idx.count(node):
+        return
+    node_idx[node] = labels.size()
+    labels.push_back(node.get().get_label())
+
+
+cdef void decode_trace(PyTraceManager manager, const unsigned char[:] data) except *:
+    cdef size_t length = data.shape[0] // sizeof(size_t)
+    if data.shape[0] % sizeof(size_t) != 0 or length < TRACE_HEADER_WORDS:
+        raise ValueError("Malformed trace encoding.")
+    cdef vector[size_t] words = vector[size_t](length)
+    memcpy(words.data(), &data[0], length * sizeof(size_t))
+
+    cdef double frequency
+    memcpy(&frequency, &words[0], sizeof(double))
+    cdef size_t num_nodes = words[1], num_edges = words[2], goal = words[3]
+    cdef size_t position = TRACE_HEADER_WORDS + num_nodes
+    cdef size_t node, edge_idx, source_idx, label, target, num_sources
+    if num_nodes > length - TRACE_HEADER_WORDS or goal >= num_nodes:
+        raise ValueError("Malformed trace encoding.")
+
+    cdef shared_ptr[Hypergraph[NONTERMINAL, size_t]] hg \
+        = make_shared[Hypergraph[NONTERMINAL, size_t]](manager.node_labels, manager.edge_labels)
+    cdef vector[Element[Node[NONTERMINAL]]] nodes
+    cdef vector[Element[Node[NONTERMINAL]]] sources
+    for node in range(num_nodes):
+        if words[TRACE_HEADER_WORDS + node] >= deref(manager.node_labels).size():
+            raise ValueError("Node label %d is unknown to the trace manager." % words[TRACE_HEADER_WORDS + node])
+        nodes.push_back(deref(hg).create(words[TRACE_HEADER_WORDS + node]))
+
+    for edge_idx in range(num_edges):
+        if position + 3 > length:
+            raise ValueError("Malformed trace encoding.")
+        label, target, num_sources = words[position], words[position + 1], words[position + 2]
+        position += 3
+        if target >= num_nodes or num_sources > length - position:
+            raise ValueError("Malformed trace encoding.")
+        if label >= deref(manager.edge_labels).size():
+            raise ValueError("Edge label %d is unknown to the trace manager." % label)
+        for source_idx in range(position, position + num_sources):
+            if words[source_idx] >= num_nodes:
+                raise ValueError("Malformed trace encoding.")
+            sources.push_back(nodes[words[source_idx]])
+        position += num_sources
+        deref(hg).add_hyperedge(label, nodes[target], sources)
+        sources.clear()
+    if position != length:
+        raise ValueError("Malformed trace encoding.")
+
+    add_hypergraph_to_trace[NONTERMINAL, size_t](manager.trace_manager, hg, nodes[goal], frequency)
+
+
 cdef class PyElement:
     def __cinit__(self):
         self.element = shared_ptr[Element[Node[NONTERMINAL]]]()
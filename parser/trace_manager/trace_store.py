@@ -0,0 +1,158 @@
+from __future__ import print_function
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+# File layout: a header (magic, version, compression, word size, number of traces, offset of the index), the
+# traces encoded by PyTraceManager.trace_to_bytes (optionally compressed), and the index, i.e., the offset of
+# each trace and the end of the last trace. All numbers are stored in native byte order.
+MAGIC = b'PANDATRC'
+VERSION = 1
+HEADER = struct.Struct('=8sIIIIQQ')
+INDEX_ITEM = 'Q'
+NO_COMPRESSION = 0
+ZLIB_COMPRESSION = 1
+
+
+def write_trace_store(manager, path, compression=False, level=6, traces=None):
+    """
+    :param manager: trace manager whose traces are written
+    :type manager: PyTraceManager
+    :param path: file of the store, which is replaced atomically
+    :type path: str
+    :param compression: compress each trace with zlib
+    :type compression: bool
+    :param level: zlib compression level
+    :type level: int
+    :param traces: ids of the traces that are written (default: all)
+    :type traces: Iterable[int]
+    """
+    if traces is None:
+        traces = range(len(manager))
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'\0' * HEADER.size)
+            offsets = []
+            for traceId in traces:
+                offsets.append(f.tell())
+                data = manager.trace_to_bytes(traceId)
+                f.write(zlib.compress(data, level) if compression else data)
+            offsets.append(f.tell())
+            # the index is aligned to its items
+            f.write(b'\0' * (-f.tell() % struct.calcsize(INDEX_ITEM)))
+            index_offset = f.tell()
+            f.write(struct.pack('=%d%s' % (len(offsets), INDEX_ITEM), *offsets))
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, ZLIB_COMPRESSION if compression else NO_COMPRESSION,
+                                struct.calcsize('N'), 0, len(offsets) - 1, index_offset))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def is_trace_store(path):
+    """
+    :return: whether path is a file written by write_trace_store
+    :rtype: bool
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class TraceStore(object):
+    """
+    Read-only, memory-mapped traces written by write_trace_store. Traces are only decoded and added to a trace
+    manager on request, e.g., the traces of a mini-batch, such that the reducts of a corpus need not fit into
+    memory at once. Pages of the file, which are not used any more, are reclaimed by the operating system.
+    """
+    def __init__(self, path):
+        """
+        :param path: file written by write_trace_store
+        :type path: str
+        """
+        self.path = path
+        self.__file = open(path, 'rb')
+        try:
+            self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.__file.close()
+            raise ValueError("%s is not a trace store." % path)
+        if len(self.__mmap) < HEADER.size:
+            self.close()
+            raise ValueError("%s is not a trace store." % path)
+        magic, version, compression, word_size, _, self.__size, index_offset = HEADER.unpack_from(self.__mmap)
+        if magic != MAGIC or version != VERSION or word_size != struct.calcsize('N') \
+                or compression not in [NO_COMPRESSION, ZLIB_COMPRESSION]:
+            self.close()
+            raise ValueError("%s is not a trace store of version %d for this platform." % (path, VERSION))
+        self.compression = compression == ZLIB_COMPRESSION
+        index_end = index_offset + (self.__size + 1) * struct.calcsize(INDEX_ITEM)
+        if index_end > len(self.__mmap):
+            self.close()
+            raise ValueError("%s is truncated." % path)
+        self.__index = memoryview(self.__mmap)[index_offset:index_end].cast(INDEX_ITEM)
+
+    def __len__(self):
+        return self.__size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Unmaps the file. Trace managers, to which traces were added, are not affected.
+        """
+        if getattr(self, '_TraceStore__index', None) is not None:
+            self.__index.release()
+            self.__index = None
+        if not self.__mmap.closed:
+            self.__mmap.close()
+        self.__file.close()
+
+    def trace_bytes(self, traceId):
+        """
+        :return: the (decompressed) encoding of the trace, cf. PyTraceManager.trace_to_bytes
+        :rtype: bytes
+        """
+        if not 0 <= traceId < self.__size:
+            raise IndexError("trace %d of %d" % (traceId, self.__size))
+        data = self.__mmap[self.__index[traceId]:self.__index[traceId + 1]]
+        return zlib.decompress(data) if self.compression else data
+
+    def load(self, manager, traces=None):
+        """
+        :param manager: trace manager with the nonterminal map of the manager that wrote the store
+        :type manager: PyTraceManager
+        :param traces: ids of the traces that are added to manager (in the given order, default: all)
+        :type traces: Iterable[int]
+        """
+        if traces is None:
+            traces = range(self.__size)
+        for traceId in traces:
+            manager.add_trace_from_bytes(self.trace_bytes(traceId))
+
+
+def load_traces(manager, path):
+    """
+    Loads the traces of path into an empty manager, where path is either a trace store or a file written by
+    PyTraceManager.serialize.
+
+    :type manager: PyTraceManager
+    :type path: str
+    """
+    if is_trace_store(path):
+        with TraceStore(path) as store:
+            store.load(manager)
+    else:
+        manager.load_traces_from_file(path.encode('utf-8'))
+
+
+__all__ = ["TraceStore", "write_trace_store", "is_trace_store", "load_traces"]
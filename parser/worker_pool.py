@@ -0,0 +1,143 @@
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+
+
+class _Timeout(object):
+    def __repr__(self):
+        return 'TIMEOUT'
+
+
+# result of tasks that exceed their deadline
+TIMEOUT = _Timeout()
+
+
+class DeadlinePool(object):
+    """
+    Pool of long-lived worker processes, which apply a function to tasks, each within a deadline.
+    The workers are forked, i.e., they inherit the function and all state it refers to (e.g., a
+    parser with a preprocessed grammar). Tasks and results are sent over one pipe per worker. A worker
+    that exceeds the deadline of its task is terminated and replaced by a fresh fork, all other
+    workers are reused for the next tasks.
+    """
+    def __init__(self, function, workers=1, timeout=None, lookahead=16):
+        """
+        :param function: function of a task, whose results are picklable
+        :param workers: number of processes
+        :type workers: int
+        :param timeout: seconds per task or None
+        :type timeout: float
+        :param lookahead: max. number of tasks per worker that are started before all
+            previous results are yielded
+        :type lookahead: int
+        """
+        self.__function = function
+        self.__context = multiprocessing.get_context('fork')
+        self.__workers = [self.__start_worker() for _ in range(max(1, workers))]
+        self.__timeout = timeout
+        self.__lookahead = lookahead * len(self.__workers)
+        self.completed = 0
+        self.timeouts = 0
+
+    def __start_worker(self):
+        connection, worker_connection = self.__context.Pipe()
+        process = self.__context.Process(target=_worker_loop, args=(self.__function, worker_connection))
+        process.daemon = True
+        process.start()
+        worker_connection.close()
+        return process, connection
+
+    def imap(self, tasks):
+        """
+        :return: generator of the results of the tasks in their order, where TIMEOUT replaces the
+            result of tasks, which exceed the deadline
+        """
+        tasks = enumerate(tasks)
+        idle = list(self.__workers)
+        # connection -> (worker, index of task, deadline)
+        busy = {}
+        results = {}
+        next_index = 0
+        exhausted = False
+        while True:
+            while idle and not exhausted and len(busy) + len(results) < self.__lookahead:
+                try:
+                    index, task = next(tasks)
+                except StopIteration:
+                    exhausted = True
+                    break
+                worker = idle.pop()
+                worker[1].send(task)
+                deadline = None if self.__timeout is None else time.time() + self.__timeout
+                busy[worker[1]] = worker, index, deadline
+
+            while next_index in results:
+                yield results.pop(next_index)
+                next_index += 1
+            if not busy:
+                if exhausted:
+                    return
+                continue
+
+            deadlines = [deadline for _, _, deadline in busy.values() if deadline is not None]
+            ready = wait(list(busy), max(0.0, min(deadlines) - time.time()) if deadlines else None)
+            for connection in ready:
+                worker, index, _ = busy.pop(connection)
+                try:
+                    success, result = connection.recv()
+                except EOFError:
+                    raise RuntimeError('worker process ' + str(worker[0].pid) + ' died')
+                if not success:
+                    raise result
+                results[index] = result
+                self.completed += 1
+                idle.append(worker)
+
+            now = time.time()
+            for connection, (worker, index, deadline) in list(busy.items()):
+                if deadline is not None and deadline <= now:
+                    del busy[connection]
+                    idle.append(self.__replace_worker(worker))
+                    results[index] = TIMEOUT
+                    self.timeouts += 1
+
+    def __replace_worker(self, worker):
+        process, connection = worker
+        process.terminate()
+        process.join()
+        connection.close()
+        self.__workers.remove(worker)
+        self.__workers.append(self.__start_worker())
+        return self.__workers[-1]
+
+    def close(self):
+        """
+        Stop all workers, including the ones that are still busy.
+        """
+        for process, connection in self.__workers:
+            process.terminate()
+        for process, connection in self.__workers:
+            process.join()
+            connection.close()
+        self.__workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _worker_loop(function, connection):
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send((True, function(task)))
+        except Exception as exc:
+            connection.send((False, exc))
+
+
+__all__ = ["DeadlinePool", "TIMEOUT"]
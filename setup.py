@@ -57,14 +57,14 @@ class CustomBuildExtCommand(build_ext):
         return retval
 
 
-extra_compile_args = ["-std=c++17", "-gdwarf-3", "-Wall", "-rdynamic"]
+extra_compile_args = ["-std=c++17", "-gdwarf-3", "-Wall", "-rdynamic", "-pthread"]
 # openmp = ["-fopenmp", "-lpthread"]
 openmp = []
 # optimizations = ["-O3"]
 optimizations = []
 # optimizations_tensors = ["-O3", "-fdump-tree-optimized", "-ftree-vectorizer-verbose=2", "-ftree-vectorize", "-march=native"]
 optimizations_tensors = ["-mfpmath=sse", "-msse2"]
-linker_args = ["-rdynamic"]
+linker_args = ["-rdynamic", "-pthread"]
 
 ext_modules = [
     Extension("grammar.induction.decomposition", ["grammar/induction/decomposition.pyx"], language='c++'),
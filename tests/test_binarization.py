@@ -0,0 +1,113 @@
+from __future__ import print_function
+
+import itertools
+import unittest
+
+from grammar.binarization import binarize, grammar_complexity, STRATEGIES
+from grammar.dcp import DCP_rule, DCP_var, DCP_term, DCP_string
+from grammar.lcfrs import LCFRS, LCFRS_lhs, LCFRS_var
+from parser.naive.parsing import LCFRS_parser
+
+
+def discontinuous_grammar():
+    """
+    S -> A B C D with crossing dependencies a^n b^m c^n d^m, plus a flat rule of rank 4
+    with a terminal between members.
+    """
+    grammar = LCFRS('S')
+    x = [[LCFRS_var(i, j) for j in range(2)] for i in range(4)]
+
+    lhs = LCFRS_lhs('S')
+    lhs.add_arg([x[0][0], x[1][0], x[0][1], x[1][1]])
+    dcp = [DCP_rule(DCP_var(-1, 0), [DCP_term(DCP_string('S'), [DCP_var(0, 0), DCP_var(1, 0)])])]
+    grammar.add_rule(lhs, ['A', 'B'], weight=0.5, dcp=dcp)
+
+    lhs = LCFRS_lhs('S')
+    lhs.add_arg([x[0][0], x[2][0], x[1][0], 'e', x[3][0], x[2][1], x[3][1], x[1][1]])
+    grammar.add_rule(lhs, ['A1', 'B', 'C', 'D'], weight=0.5)
+
+    for nont, term1, term2 in [('A', 'a', 'c'), ('B', 'b', 'd'), ('C', 'c', 'a'), ('D', 'd', 'b')]:
+        lhs = LCFRS_lhs(nont)
+        lhs.add_arg([term1])
+        lhs.add_arg([term2])
+        grammar.add_rule(lhs, [], weight=0.5)
+        lhs = LCFRS_lhs(nont)
+        lhs.add_arg([term1, x[0][0]])
+        lhs.add_arg([term2, x[0][1]])
+        grammar.add_rule(lhs, [nont], weight=0.5)
+
+    lhs = LCFRS_lhs('A1')
+    lhs.add_arg(['a'])
+    grammar.add_rule(lhs, [], weight=1.0)
+    return grammar
+
+
+def preorder(derivation, id=None):
+    if id is None:
+        id = derivation.root_id()
+    rules = [derivation.getRule(id).get_idx()]
+    for child in derivation.child_ids(id):
+        rules += preorder(derivation, child)
+    return rules
+
+
+class BinarizationTest(unittest.TestCase):
+    def test_binary_and_equivalent(self):
+        grammar = discontinuous_grammar()
+        words = [list(word) for n in range(1, 6) for word in itertools.product('abcd', repeat=n)]
+        flat = [list(word) for word in ['acbedabd', 'acbbedabdd', 'accbedaabd', 'acbedadb', 'acbdeabd']]
+        words += flat
+        recognized, recognized_flat = 0, 0
+        for strategy in STRATEGIES:
+            binarization = binarize(grammar, strategy=strategy)
+            binary = binarization.grammar()
+            self.assertEqual(binary.well_formed(), None)
+            self.assertEqual(binary.ordered()[0], True)
+            self.assertEqual(grammar_complexity(binary)[0], 2)
+            self.assertEqual(binary.start(), 'S')
+
+            for word in words:
+                parser = LCFRS_parser(grammar, word)
+                binary_parser = LCFRS_parser(binary, word)
+                self.assertEqual(parser.recognized(), binary_parser.recognized())
+                if not parser.recognized():
+                    continue
+                recognized += 1
+                self.assertAlmostEqual(parser.best(), binary_parser.best())
+                derivation = binarization.debinarize(binary_parser.best_derivation_tree())
+                self.assertEqual(preorder(derivation), preorder(parser.best_derivation_tree()))
+                self.assertEqual(derivation.compute_yield(), word)
+                if word in flat:
+                    recognized_flat += 1
+        self.assertGreater(recognized, 0)
+        self.assertEqual(recognized_flat, 3 * len(STRATEGIES))
+
+    def test_optimal(self):
+        grammar = discontinuous_grammar()
+        complexities = {strategy: grammar_complexity(binarize(grammar, strategy=strategy).grammar())[2]
+                        for strategy in STRATEGIES}
+        self.assertEqual(grammar_complexity(grammar), (4, 2, 8))
+        self.assertEqual(complexities['optimal'], 6)
+        self.assertEqual(min(complexities.values()), complexities['optimal'])
+        self.assertGreater(complexities['left-to-right'], complexities['optimal'])
+
+    def test_mapping(self):
+        grammar = discontinuous_grammar()
+        binarization = binarize(grammar)
+        binary = binarization.grammar()
+        # rank 2 rules are copied with DCP rules
+        copied = binary.rule_index(0)
+        self.assertEqual(binarization.original_rule_idx(0), 0)
+        self.assertEqual(copied.key(), grammar.rule_index(0).key())
+        intermediate = [rule for rule in binary.rules() if binarization.is_intermediate(rule.lhs().nont())]
+        self.assertEqual(len(intermediate), 2)
+        for rule in intermediate:
+            self.assertEqual(binarization.original_rule_idx(rule.get_idx()), 1)
+            self.assertEqual(rule.weight(), 1.0)
+            self.assertEqual(rule.dcp(), None)
+        self.assertEqual(sum([rule.weight() for rule in binary.lhs_nont_to_rules('S')]), 1.0)
+        self.assertRaises(ValueError, binarize, grammar, 'head-outward')
+
+
+if __name__ == '__main__':
+    unittest.main()
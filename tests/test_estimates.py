@@ -0,0 +1,58 @@
+from __future__ import print_function
+
+import itertools
+import math
+import unittest
+
+from parser.active.parsing import Parser
+from parser.estimates import ContextSummaryEstimate
+from parser.naive.parsing import LCFRS_parser
+from tests.test_binarization import discontinuous_grammar
+
+
+def derivation_cost(derivation):
+    return sum([-math.log(derivation.getRule(id).weight()) for id in derivation.ids()])
+
+
+class EstimateTest(unittest.TestCase):
+    def test_context_summary(self):
+        grammar = discontinuous_grammar()
+        estimate = ContextSummaryEstimate(grammar, 10)
+        self.assertEqual(estimate.passive('S', 8, 8), 0.0)
+        # S -> A B with A(a;c), B(b;d)
+        self.assertAlmostEqual(estimate.passive('A', 2, 4), 2 * math.log(2))
+        self.assertAlmostEqual(estimate.inside('A', 4), math.log(2))
+        self.assertAlmostEqual(estimate.inside('S', 4), 3 * math.log(2))
+        self.assertEqual(estimate.passive('A', 3, 4), float('inf'))
+        self.assertAlmostEqual(estimate.active('S', 1, 4), 0.0)
+        # inputs longer than max_length are not estimated
+        self.assertEqual(estimate.passive('A', 3, 11), 0.0)
+
+        grammar.rule_index(0).set_weight(2.0)
+        self.assertRaises(ValueError, ContextSummaryEstimate, grammar, 10)
+
+    def test_best_first(self):
+        grammar = discontinuous_grammar()
+        estimate = ContextSummaryEstimate(grammar, 10)
+        words = [list(word) for n in [2, 4, 6] for word in itertools.product('abcd', repeat=n)]
+        words += [list('acbedabd'), list('acbbedabdd')]
+        recognized = 0
+        for word in words:
+            exhaustive = LCFRS_parser(grammar, word)
+            for parser in [LCFRS_parser(grammar, word, best_first=True),
+                           LCFRS_parser(grammar, word, best_first=True, estimate=estimate),
+                           Parser(grammar, word, best_first=True),
+                           Parser(grammar, word, best_first=True, estimate=estimate)]:
+                self.assertEqual(parser.recognized(), exhaustive.recognized())
+                if exhaustive.recognized():
+                    derivation = parser.best_derivation_tree()
+                    self.assertEqual(derivation.compute_yield(), word)
+                    self.assertAlmostEqual(derivation_cost(derivation), exhaustive.best())
+            if exhaustive.recognized():
+                recognized += 1
+                self.assertAlmostEqual(LCFRS_parser(grammar, word, best_first=True).best(), exhaustive.best())
+        self.assertEqual(recognized, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
 from __future__ import print_function
+import itertools
+import os
+import tempfile
 import unittest
-from parser.trace_manager.sm_trainer import build_PyLatentAnnotation
+from parser.trace_manager.sm_trainer import build_PyLatentAnnotation, save_latent_annotation, load_latent_annotation
 from parser.trace_manager.sm_trainer_util import PyStorageManager, PyGrammarInfo
 from grammar.lcfrs import LCFRS, LCFRS_lhs, LCFRS_var
 from util.enumerator import Enumerator
@@ -75,7 +78,65 @@ class TestProjection(unittest.TestCase):
         p_2 = sum(map(mult, o_a, vec[2])) / f_a
         return [p_0, p_1, p_2]
 
-    def __test_projection(self, split_weights, goal_weights, merge_method=False):
+    def test_la_arrays(self):
+        grammar = self.__grammar()
+        grammarInfo = PyGrammarInfo(grammar, Enumerator())
+        storageManager = PyStorageManager()
+        split_weights = self.__random_vector()
+        # rule 0 has splits (1, 2, 2), whose weights differ in each index
+        split_weights[0] = [0.1, 0.2, 0.3, 0.4]
+        la = build_PyLatentAnnotation([1, 2], [1.0], split_weights, grammarInfo, storageManager)
+
+        splits, root_weights, rule_weights = la.rule_weight_arrays(grammarInfo)
+        self.assertEqual(list(splits), [1, 2])
+        self.assertEqual(list(root_weights), [1.0])
+        self.assertEqual([weights.shape for weights in rule_weights], [(1, 2, 2), (2,), (2,)])
+        for weights, expected in zip(rule_weights, split_weights):
+            for x, y in zip(weights.ravel(), expected):
+                self.assertAlmostEqual(x, y)
+        # the arrays are indexed like get_weight, which build_sm_grammar and construct_fine_grammar relied on
+        for i, weights in enumerate(rule_weights):
+            for index in itertools.product(*[range(dim) for dim in weights.shape]):
+                self.assertEqual(weights[index], la.get_weight(i, list(index)))
+
+        fd, path = tempfile.mkstemp(suffix='.npz')
+        os.close(fd)
+        try:
+            for compressed in [False, True]:
+                save_latent_annotation(la, path, compressed=compressed)
+                loaded = load_latent_annotation(path, grammarInfo, storageManager)
+                self.assertEqual(list(loaded.serialize()[0]), [1, 2])
+                for weights, expected in zip(loaded.serialize()[2], split_weights):
+                    for x, y in zip(weights, expected):
+                        self.assertAlmostEqual(x, y)
+        finally:
+            os.remove(path)
+
+    def test_remap_rules(self):
+        grammar = self.__grammar()
+        grammarInfo = PyGrammarInfo(grammar, Enumerator())
+        storageManager = PyStorageManager()
+        split_weights = [[0.1, 0.2, 0.3, 0.4], [0.5, 0.6], [0.7, 0.8]]
+        la = build_PyLatentAnnotation([1, 2], [1.0], split_weights, grammarInfo, storageManager)
+        indices = [list(index) for index in itertools.product([0], [0, 1], [0, 1])], [[0], [1]], [[0], [1]]
+
+        index_map = grammar.remove_rules([False, True, False])
+        self.assertEqual(list(index_map), [0, -1, 1])
+        # a permutation of the kept rules is remapped as well
+        for index_map in [index_map, [1, -1, 0]]:
+            remapped_info = grammarInfo.remap_rules(index_map)
+            remapped = la.remap_rules(index_map, remapped_info, storageManager)
+            self.assertEqual(len(remapped.serialize()[2]), 2)
+            for old_idx, new_idx in enumerate(index_map):
+                if new_idx >= 0:
+                    for index in indices[old_idx]:
+                        self.assertEqual(remapped.get_weight(new_idx, index), la.get_weight(old_idx, index))
+
+        for index_map in [[0, -1, 0], [0, -1, 2], [0, 1]]:
+            self.assertRaises(ValueError, grammarInfo.remap_rules, index_map)
+            self.assertRaises(ValueError, la.remap_rules, index_map, grammarInfo, storageManager)
+
+    def __grammar(self):
         grammar = LCFRS("S")
         # rule 0
         lhs = LCFRS_lhs("S")
@@ -90,7 +151,10 @@ class TestProjection(unittest.TestCase):
         lhs = LCFRS_lhs("A")
         lhs.add_arg(["b"])
         grammar.add_rule(lhs, [], weight=2.0)
+        return grammar
 
+    def __test_projection(self, split_weights, goal_weights, merge_method=False):
+        grammar = self.__grammar()
 
         grammar.make_proper()
         # print(grammar)
@@ -0,0 +1,378 @@
+from __future__ import print_function
+
+import os
+import pickle
+import tempfile
+import unittest
+
+from collections import defaultdict
+from grammar.lcfrs import LCFRS, LCFRS_lhs, LCFRS_var, CompactLCFRS, LCFRS_rule, useless_rules
+from grammar.dcp import DCP_rule, DCP_var, DCP_index, DCP_string, DCP_term
+from grammar.lcfrs_binary import BinaryGrammar, is_binary_grammar
+from parser.parser_interface import AbstractParser
+
+
+def hybrid_grammar():
+    grammar = LCFRS('S')
+
+    x1 = LCFRS_var(0, 0)
+    x2 = LCFRS_var(0, 1)
+    y1 = LCFRS_var(1, 0)
+
+    lhs1 = LCFRS_lhs('S')
+    lhs1.add_arg([x1, y1, x2])
+    dcp1 = [DCP_rule(DCP_var(-1, 0), [DCP_term(DCP_string('S', edge_label='--'),
+                                                [DCP_var(0, 0), DCP_var(1, 0)])])]
+    grammar.add_rule(lhs1, ['A', 'B'], weight=2.0, dcp=dcp1)
+
+    lhs2 = LCFRS_lhs('A')
+    lhs2.add_arg(['a'])
+    lhs2.add_arg(['c'])
+    dcp2 = [DCP_rule(DCP_var(-1, 0), [DCP_term(DCP_index(0, edge_label='HD', pos='NN'), []),
+                                      DCP_term(DCP_index(1), [])])]
+    grammar.add_rule(lhs2, [], weight=0.5, dcp=dcp2)
+
+    lhs3 = LCFRS_lhs('B')
+    lhs3.add_arg(['b', 'b'])
+    dcp3 = [DCP_rule(DCP_var(-1, 0), [DCP_term(DCP_index(0, pos='ART'), [DCP_term(DCP_index(1), [])])])]
+    grammar.add_rule(lhs3, [], weight=0.25, dcp=dcp3)
+
+    lhs4 = LCFRS_lhs('B')
+    lhs4.add_arg(['ä', x1])
+    grammar.add_rule(lhs4, ['B'], weight=0.75)
+
+    return grammar
+
+
+class BinaryGrammarTest(unittest.TestCase):
+    def setUp(self):
+        _, self.path = tempfile.mkstemp(suffix='.grammar')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        grammar = hybrid_grammar()
+        grammar.save_binary(self.path)
+        self.assertTrue(is_binary_grammar(self.path))
+
+        loaded = LCFRS.load_binary(self.path)
+        pickled = pickle.loads(pickle.dumps(grammar))
+
+        for other in [loaded, pickled]:
+            self.assertEqual(str(grammar), str(other))
+            self.assertEqual(grammar.start(), other.start())
+            self.assertEqual(grammar.nonts(), other.nonts())
+            for rule in grammar.rules():
+                other_rule = other.rule_index(rule.get_idx())
+                self.assertEqual(rule.key(), other_rule.key())
+                self.assertEqual(rule.weight(), other_rule.weight())
+            self.assertEqual(other.lex_rules('a'), [other.rule_index(1)])
+            self.assertEqual(other.well_formed(), None)
+
+    def test_lazy_access(self):
+        grammar = hybrid_grammar()
+        grammar.save_binary(self.path)
+        with BinaryGrammar(self.path) as binary:
+            self.assertEqual(len(binary), 4)
+            self.assertEqual(binary.start(), 'S')
+            lhs, rhs, weight, dcp = binary.rule(3)
+            self.assertEqual(str(lhs), str(grammar.rule_index(3).lhs()))
+            self.assertEqual(rhs, ['B'])
+            self.assertEqual(weight, 0.75)
+            self.assertEqual(dcp, None)
+
+    def test_not_binary(self):
+        with open(self.path, 'wb') as f:
+            pickle.dump(hybrid_grammar(), f)
+        self.assertFalse(is_binary_grammar(self.path))
+        self.assertRaises(IOError, BinaryGrammar, self.path)
+
+
+class RuleRemovalTest(unittest.TestCase):
+    def test_purge_rules(self):
+        grammar = hybrid_grammar()
+        feature_log = defaultdict(lambda: 0)
+        feature_log[(0, 'f', ('g',))] = 3
+        feature_log[(2, 'f', ())] = 2
+        feature_log[(3, 'f', ('h',))] = 1
+        feature_log[('B', 'f')] = 3
+
+        index_map = grammar.purge_rules(0.3, feature_log)
+        self.assertEqual(list(index_map), [0, 1, -1, 2])
+        self.assertEqual([rule.get_idx() for rule in grammar.rules()], [0, 1, 2])
+        self.assertEqual(grammar.rule_index(2).weight(), 0.75)
+        self.assertEqual([rule.get_idx() for rule in grammar.lhs_nont_to_rules('B')], [2])
+        self.assertEqual(grammar.lex_rules('b'), [])
+        self.assertEqual(dict(feature_log), {(0, 'f', ('g',)): 3, (2, 'f', ('h',)): 1, ('B', 'f'): 3})
+
+        # a removed rule can be added again
+        lhs = LCFRS_lhs('B')
+        lhs.add_arg(['b', 'b'])
+        self.assertEqual(grammar.add_rule(lhs, [], weight=0.1).get_idx(), 3)
+
+    def test_remove_by_mask(self):
+        for grammar in [hybrid_grammar(), CompactLCFRS.from_lcfrs(hybrid_grammar())]:
+            index_map = grammar.remove_rules([False, True, False, False])
+            self.assertEqual(list(index_map), [0, -1, 1, 2])
+            self.assertEqual(grammar.lex_rules('a'), [])
+            self.assertEqual(grammar.rule_index(1).lhs().nont(), 'B')
+
+    def test_purge_compact(self):
+        grammar = hybrid_grammar()
+        compact = CompactLCFRS.from_lcfrs(grammar)
+        self.assertEqual(list(compact.purge_rules(0.3)), list(grammar.purge_rules(0.3)))
+        self.assertEqual(str(compact), str(grammar))
+        self.assertEqual(compact.lex_rules('b'), [])
+
+        # a removed rule can be added again
+        lhs = LCFRS_lhs('B')
+        lhs.add_arg(['b', 'b'])
+        self.assertEqual(compact.add_rule(lhs, [], weight=0.1).get_idx(), 3)
+        self.assertEqual([rule.get_idx() for rule in compact.lhs_nont_to_rules('B')], [2, 3])
+
+
+class TrimTest(unittest.TestCase):
+    def useless_grammar(self):
+        grammar = hybrid_grammar()
+        x1 = LCFRS_var(0, 0)
+        # C is unproductive, D is unreachable, E occurs only in a rule of C
+        for nont, rhs in [('S', ['C']), ('C', ['C']), ('C', ['E']), ('D', ['B'])]:
+            lhs = LCFRS_lhs(nont)
+            lhs.add_arg([x1])
+            grammar.add_rule(lhs, rhs)
+        lhs = LCFRS_lhs('E')
+        lhs.add_arg(['e'])
+        grammar.add_rule(lhs, [])
+        lhs = LCFRS_lhs('D')
+        lhs.add_arg(['d'])
+        grammar.add_rule(lhs, [])
+        return grammar
+
+    def test_trim(self):
+        grammar = self.useless_grammar()
+        feature_log = defaultdict(lambda: 0)
+        feature_log[(3, 'f', ())] = 1
+        feature_log[(5, 'f', ())] = 1
+        report = grammar.trim(feature_log)
+        self.assertEqual(list(report.index_map), [0, 1, 2, 3, 4, 5, 6, -1, 7, -1])
+        self.assertEqual(report.unproductive, set())
+        self.assertEqual(report.unreachable, {'D'})
+        self.assertEqual(set(grammar.nonts()), {'S', 'A', 'B', 'C', 'E'})
+        self.assertEqual(dict(feature_log), {(3, 'f', ()): 1, (5, 'f', ()): 1})
+
+        grammar = self.useless_grammar()
+        grammar.remove_rules(lambda rule: rule.lhs().nont() == 'E')
+        report = grammar.trim()
+        self.assertEqual(report.unproductive, {'C', 'E'})
+        self.assertEqual(report.unreachable, {'D'})
+        self.assertEqual(set(grammar.nonts()), {'S', 'A', 'B'})
+        self.assertEqual(str(grammar), str(hybrid_grammar()))
+        self.assertEqual(grammar.lhs_nont_to_rules('C'), [])
+        self.assertEqual(grammar.lex_rules('d'), [])
+
+        # a trimmed grammar is left unchanged
+        report = grammar.trim()
+        self.assertEqual(list(report.index_map), [0, 1, 2, 3])
+        self.assertEqual(report.unproductive | report.unreachable, set())
+
+    def test_unproductive_start(self):
+        grammar = hybrid_grammar()
+        grammar.remove_rules(lambda rule: rule.lhs().nont() == 'A')
+        report = grammar.trim()
+        self.assertEqual(grammar.rules(), [])
+        self.assertEqual(report.unproductive, {'S', 'A'})
+        self.assertEqual(report.unreachable, {'B'})
+        self.assertEqual(grammar.start(), 'S')
+
+    def test_compact(self):
+        compact = CompactLCFRS.from_lcfrs(self.useless_grammar())
+        remove, unproductive, unreachable = useless_rules(compact)
+        self.assertEqual(remove, [False] * 7 + [True, False, True])
+        self.assertEqual(unreachable, {'D'})
+
+    def test_trim_compact(self):
+        for remove_e in [False, True]:
+            grammar = self.useless_grammar()
+            compact = CompactLCFRS.from_lcfrs(grammar)
+            views = compact.rules()
+            if remove_e:
+                grammar.remove_rules(lambda rule: rule.lhs().nont() == 'E')
+                compact.remove_rules(lambda rule: rule.lhs().nont() == 'E')
+            feature_log = defaultdict(lambda: 0)
+            feature_log[(3, 'f', ())] = 1
+            report = grammar.trim()
+            compact_report = compact.trim(feature_log)
+            self.assertEqual(list(compact_report.index_map), list(report.index_map))
+            self.assertEqual(compact_report.unproductive, report.unproductive)
+            self.assertEqual(compact_report.unreachable, report.unreachable)
+            self.assertEqual(str(compact), str(grammar))
+            self.assertEqual(compact.nonts(), grammar.nonts())
+            self.assertEqual(compact.lex_rules('d'), [])
+            for nont in ['B', 'C', 'D']:
+                self.assertEqual([rule.get_idx() for rule in compact.lhs_nont_to_rules(nont)],
+                                 [rule.get_idx() for rule in grammar.lhs_nont_to_rules(nont)])
+                self.assertEqual([rule.get_idx() for rule in compact.rhs_nont_to_rules(nont)],
+                                 [rule.get_idx() for rule in grammar.rhs_nont_to_rules(nont)])
+            self.assertEqual(dict(feature_log), {(3, 'f', ()): 1})
+            # views handed out before keep referring to their rules
+            self.assertEqual(views[3].key(), compact.rule_index(3).key())
+            groups, nonts = compact.lhs_group_index()
+            self.assertEqual(sorted(set(groups)), list(range(len(nonts))))
+
+    def test_preprocess_compact(self):
+        grammar = self.useless_grammar()
+        compact = CompactLCFRS.from_lcfrs(grammar)
+        AbstractParser.preprocess_grammar(compact, trim=True)
+        grammar.trim()
+        self.assertEqual(str(compact), str(grammar))
+        self.assertNotIn('D', compact.nonts())
+
+
+class InputFilterTest(unittest.TestCase):
+    def test_term_rules(self):
+        grammar = hybrid_grammar()
+        self.assertEqual([rule.get_idx() for rule in grammar.term_rules('c')], [1])
+        self.assertEqual([rule.get_idx() for rule in grammar.term_rules('b')], [2])
+        self.assertEqual([rule.get_idx() for rule in grammar.term_rules('ä')], [3])
+        self.assertEqual(grammar.term_rules('z'), [])
+        self.assertEqual([rule.get_idx() for rule in grammar.rhs_nont_to_rules('B')], [0, 3])
+
+    def test_filter_for_input(self):
+        for grammar in [hybrid_grammar(), CompactLCFRS.from_lcfrs(hybrid_grammar())]:
+            restricted = grammar.filter_for_input(['a', 'b', 'c', 'b'])
+            self.assertEqual([rule.get_idx() for rule in restricted.rules()], [0, 1, 2])
+            self.assertEqual(restricted.start(), 'S')
+            self.assertEqual(restricted.lex_rules('a'), [restricted.rule_index(1)])
+            self.assertEqual(restricted.nont_corner_of('B'), [])
+            self.assertEqual(restricted.fanout('A'), 2)
+
+            restricted = grammar.filter_for_input(['a', 'ä', 'b', 'c', 'b'])
+            self.assertEqual(len(restricted.rules()), 4)
+            self.assertEqual([rule.get_idx() for rule in restricted.lhs_nont_to_rules('B')], [2, 3])
+
+            # without c, A and thus the start symbol are unproductive
+            self.assertEqual(grammar.filter_for_input(['a', 'b', 'b']).rules(), [])
+
+    def test_filter_lexicalised(self):
+        grammar = LCFRS('S')
+        x1, y1 = LCFRS_var(0, 0), LCFRS_var(1, 0)
+        for i in range(100):
+            lhs = LCFRS_lhs('N')
+            lhs.add_arg(['w%d' % i])
+            grammar.add_rule(lhs, [])
+        lhs = LCFRS_lhs('S')
+        lhs.add_arg([x1, y1])
+        grammar.add_rule(lhs, ['N', 'N'])
+        lhs = LCFRS_lhs('S')
+        lhs.add_arg([x1, 'and', y1])
+        grammar.add_rule(lhs, ['N', 'N'])
+
+        restricted = grammar.filter_for_input(['w3', 'w7', 'w3'])
+        self.assertEqual([rule.get_idx() for rule in restricted.rules()], [3, 7, 100])
+        restricted = grammar.filter_for_input(['w3', 'and', 'w7'])
+        self.assertEqual([rule.get_idx() for rule in restricted.rules()], [3, 7, 100, 101])
+        self.assertEqual(restricted.rule_index(101), grammar.rule_index(101))
+
+        # the inverted index is restored for grammars pickled without it
+        state = grammar.__dict__.copy()
+        del state['_LCFRS__term_to_rules']
+        del state['_LCFRS__rhs_nont_to_rules']
+        legacy = LCFRS.__new__(LCFRS)
+        legacy.__setstate__(state)
+        self.assertEqual(len(legacy.filter_for_input(['w3', 'and', 'w7']).rules()), 4)
+
+
+class MergeTest(unittest.TestCase):
+    def test_signature(self):
+        rule1 = hybrid_grammar().rule_index(0)
+        rule2 = hybrid_grammar().rule_index(0)
+        self.assertEqual(rule1.signature(), rule2.signature())
+        self.assertEqual(hash(rule1.signature()), hash(rule2.signature()))
+        self.assertNotEqual(rule1.signature(), hybrid_grammar().rule_index(3).signature())
+
+        lhs = LCFRS_lhs('A')
+        lhs.add_arg(['a'])
+        lhs.add_arg(['c'])
+        grammar = LCFRS('S')
+        # same LCFRS part as rule 1 of hybrid_grammar, but without DCP rules
+        rule = grammar.add_rule(lhs, [])
+        self.assertNotEqual(rule.signature(), hybrid_grammar().rule_index(1).signature())
+
+    def test_merge(self):
+        logs = []
+        for i in range(3):
+            log = defaultdict(lambda: 0)
+            log[(3, 'f', ('g',))] += 1
+            log[('B', 'f')] += 1
+            logs.append(log)
+        merged_log = defaultdict(lambda: 0)
+        merged = LCFRS('S').merge([(hybrid_grammar(), log) for log in logs], merged_log)
+
+        added = LCFRS('S')
+        for _ in range(3):
+            added.add_gram(hybrid_grammar())
+
+        self.assertEqual(str(merged), str(added))
+        self.assertEqual(len(merged.rules()), 4)
+        self.assertEqual(merged.rule_index(0).weight(), 6.0)
+        self.assertEqual(merged_log[(3, 'f', ('g',))], 3)
+        self.assertEqual(merged_log[('B', 'f')], 3)
+
+    def test_merge_legacy_pickle(self):
+        grammar = hybrid_grammar()
+        state = grammar.__dict__.copy()
+        state['_LCFRS__key_to_rule'] = {rule.key(): rule for rule in grammar.rules()}
+        legacy = LCFRS.__new__(LCFRS)
+        legacy.__setstate__(state)
+        legacy.add_gram(hybrid_grammar())
+        self.assertEqual(len(legacy.rules()), 4)
+        self.assertEqual(legacy.rule_index(3).weight(), 1.5)
+
+
+class CompactLCFRSTest(unittest.TestCase):
+    def test_same_interface(self):
+        grammar = hybrid_grammar()
+        compact = CompactLCFRS.from_lcfrs(grammar)
+
+        self.assertEqual(str(grammar), str(compact))
+        self.assertEqual(grammar.nonts(), compact.nonts())
+        self.assertEqual(compact.well_formed(), None)
+        self.assertEqual(compact.ordered()[0], True)
+        for rule in grammar.rules():
+            view = compact.rule_index(rule.get_idx())
+            self.assertTrue(isinstance(view, LCFRS_rule))
+            self.assertEqual(rule.key(), view.key())
+            self.assertEqual(rule.get_idx(), view.get_idx())
+        self.assertEqual([r.get_idx() for r in compact.lhs_nont_to_rules('B')], [2, 3])
+        self.assertEqual([r.get_idx() for r in compact.lex_rules('a')], [1])
+        self.assertEqual(compact.lex_rules('z'), [])
+        self.assertEqual([r.get_idx() for r in compact.nont_corner_of('A')], [0])
+        self.assertEqual(str(compact.to_lcfrs()), str(grammar))
+
+    def test_shared_patterns(self):
+        compact = CompactLCFRS('S[0]')
+        x1, y1 = LCFRS_var(0, 0), LCFRS_var(1, 0)
+        for i in range(3):
+            for j in range(3):
+                lhs = LCFRS_lhs('S[%d]' % i)
+                lhs.add_arg([x1, y1])
+                compact.add_rule(lhs, ['A[%d]' % j, 'A[%d]' % i], weight=1.0)
+        lhs = LCFRS_lhs('S[0]')
+        lhs.add_arg([x1, y1])
+        rule = compact.add_rule(lhs, ['A[0]', 'A[0]'], weight=2.0)
+        self.assertEqual(rule.get_idx(), 0)
+        self.assertEqual(rule.weight(), 3.0)
+        self.assertEqual(len(compact.rules()), 9)
+        self.assertEqual(compact.number_of_patterns(), 1)
+
+        compact.make_proper()
+        self.assertAlmostEqual(sum(r.weight() for r in compact.lhs_nont_to_rules('S[0]')), 1.0)
+
+    def test_pickle(self):
+        compact = CompactLCFRS.from_lcfrs(hybrid_grammar())
+        self.assertEqual(str(pickle.loads(pickle.dumps(compact))), str(compact))
+
+
+if __name__ == '__main__':
+    unittest.main()
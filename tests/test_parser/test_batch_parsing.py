@@ -0,0 +1,181 @@
+from __future__ import print_function
+
+import itertools
+import shutil
+import tempfile
+import time
+import unittest
+
+from experiment.base_experiment import Experiment
+from experiment.resources import CallRecorder
+from grammar.lcfrs import LCFRS, LCFRS_lhs, LCFRS_var
+from parser.active.parsing import Parser
+from parser.cpp_cfg_parser.parser_wrapper import CFGParser
+from parser.naive.parsing import LCFRS_parser
+from parser.worker_pool import DeadlinePool, TIMEOUT
+from tests.test_binarization import discontinuous_grammar
+
+
+class BatchParsingTest(unittest.TestCase):
+    def test_parse_batch(self):
+        grammar = discontinuous_grammar()
+        words = [list(word) for n in [2, 4] for word in itertools.product('abcd', repeat=n)]
+        words += [list('acbedabd'), list('acbbedabdd')]
+        for parser in [LCFRS_parser(grammar), Parser(grammar)]:
+            sequential = list(parser.parse_batch(words))
+            self.assertEqual(len(sequential), len(words))
+            self.assertEqual(len([weight for weight in sequential if weight is not None]), 3)
+            self.assertEqual(list(parser.parse_batch(words, workers=3, chunksize=7)), sequential)
+
+    def test_action(self):
+        grammar = discontinuous_grammar()
+        words = [list('abcd'), list('ab'), list('acbedabd'), list('aabbccdd')]
+
+        def action(parser, index):
+            return index, parser.recognized()
+
+        for workers in [1, 2]:
+            results = LCFRS_parser(grammar).parse_batch(words, action, workers=workers, max_length=4)
+            self.assertEqual(list(results), [(0, True), (1, False), (2, False), (3, False)])
+
+    def test_timeout(self):
+        grammar = discontinuous_grammar()
+        words = [list('abcd'), list('ab'), list('acbedabd'), list('aabbccdd'), list('abcd')]
+
+        def action(parser, index):
+            if index == 1:
+                time.sleep(10)
+            return parser.recognized()
+
+        for workers in [1, 2]:
+            results = LCFRS_parser(grammar).parse_batch(words, action, workers=workers, timeout=1.0)
+            self.assertEqual(list(results), [True, TIMEOUT, True, True, True])
+
+
+class StubExperiment(Experiment):
+    def parsing_preprocess(self, obj):
+        return obj
+
+    def obtain_sentence(self, obj):
+        return obj
+
+    def parsing_postprocess(self, sentence, derivation, label=None):
+        return 'parsed', len(sentence), len(list(derivation.ids()))
+
+    def compute_fallback(self, sentence, label=None):
+        return 'fallback'
+
+    def serialize(self, obj):
+        return obj
+
+
+class ParallelExperimentTest(unittest.TestCase):
+    def test_do_parse_parallel(self):
+        grammar = LCFRS('S')
+        lhs = LCFRS_lhs('S')
+        lhs.add_arg([LCFRS_var(0, 0), LCFRS_var(1, 0)])
+        grammar.add_rule(lhs, ['A', 'A'])
+        lhs = LCFRS_lhs('A')
+        lhs.add_arg(['a'])
+        grammar.add_rule(lhs, [])
+        CFGParser.preprocess_grammar(grammar)
+
+        words = [list('aa'), list('a'), list('aa'), list('aa')]
+        results = []
+        for workers in [1, 2]:
+            experiment = StubExperiment(tempfile.mkdtemp())
+            self.addCleanup(shutil.rmtree, experiment.directory)
+            experiment.parser = CFGParser(grammar)
+            experiment.parsing_workers = workers
+            resource = CallRecorder()
+            experiment.do_parse_parallel(words, words, resource)
+            results.append(resource.calls)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual([args for _, args, _ in results[1]],
+                         [(('parsed', 2, 3),), ('fallback',), (('parsed', 2, 3),), (('parsed', 2, 3),)])
+
+
+class CountingParser(LCFRS_parser):
+    """
+    Naive parser that counts its calls of parse.
+    """
+    parse_calls = 0
+
+    def parse(self):
+        self.parse_calls += 1
+        LCFRS_parser.parse(self)
+
+
+class TimeoutExperimentTest(unittest.TestCase):
+    def test_do_parse_with_timeout(self):
+        words = [list('abcd'), list('ab'), list('acbedabd'), list('abcd')]
+
+        class CountingExperiment(StubExperiment):
+            def parsing_postprocess(self, sentence, derivation, label=None):
+                # the parser of the single worker process counts the inputs it parsed so far
+                return 'parsed', self.parser.parse_calls
+
+        experiment = CountingExperiment(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, experiment.directory)
+        experiment.parser = CountingParser(discontinuous_grammar())
+        experiment.parsing_timeout = 10.0
+        experiment.max_sentence_length_for_parsing = 4
+        resource = CallRecorder()
+        experiment.do_parse_with_timeout(words, resource)
+        self.assertEqual([args for _, args, _ in resource.calls],
+                         [(('parsed', 1),), ('fallback',), ('fallback',), (('parsed', 3),)])
+
+
+class BudgetTest(unittest.TestCase):
+    def test_budget(self):
+        grammar = discontinuous_grammar()
+        word = list('acbbedabdd')
+        for best_first in [False, True]:
+            for parser_class in [LCFRS_parser, Parser]:
+                parser = parser_class(grammar, word, best_first=best_first, max_items=5)
+                self.assertTrue(parser.budget_exhausted())
+                self.assertFalse(parser.recognized())
+
+                parser = parser_class(grammar, word, best_first=best_first, deadline=time.time() - 1)
+                self.assertTrue(parser.budget_exhausted())
+                self.assertFalse(parser.recognized())
+
+                parser = parser_class(grammar, word, best_first=best_first, max_items=10000,
+                                      deadline=time.time() + 100)
+                self.assertFalse(parser.budget_exhausted())
+                self.assertTrue(parser.recognized())
+                self.assertAlmostEqual(parser.best(), parser_class(grammar, word).best())
+
+                # the budget applies to each parse
+                parser.set_budget(max_items=5)
+                parser.clear()
+                parser.set_input(word)
+                parser.parse()
+                self.assertTrue(parser.budget_exhausted())
+                parser.set_budget()
+                parser.clear()
+                parser.set_input(word)
+                parser.parse()
+                self.assertFalse(parser.budget_exhausted())
+                self.assertTrue(parser.recognized())
+
+
+class DeadlinePoolTest(unittest.TestCase):
+    def test_imap(self):
+        def function(task):
+            if task < 0:
+                raise ValueError(task)
+            time.sleep(task)
+            return task * 2
+
+        with DeadlinePool(function, workers=3, timeout=0.5) as pool:
+            tasks = [0.2, 0.0, 5, 0.1, 0.0, 5, 0.3, 0.0]
+            self.assertEqual(list(pool.imap(tasks)), [0.4, 0.0, TIMEOUT, 0.2, 0.0, TIMEOUT, 0.6, 0.0])
+            self.assertEqual((pool.completed, pool.timeouts), (6, 2))
+            # workers are reused after timeouts
+            self.assertEqual(list(pool.imap([0.0, 0.1])), [0.0, 0.2])
+            self.assertRaises(ValueError, list, pool.imap([0.0, -1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+from __future__ import print_function
+
+import itertools
+import math
+import unittest
+
+from grammar.lcfrs import LCFRS, LCFRS_lhs, LCFRS_var
+from parser.cpp_cfg_parser.parser_wrapper import CFGParser
+from parser.naive.parsing import LCFRS_parser
+
+
+def ambiguous_cnf_grammar():
+    """
+    Grammar in Chomsky normal form with binary, chain and lexical rules, whose number of
+    derivations grows exponentially with the length of the input.
+    """
+    grammar = LCFRS('S')
+    x0, x1 = LCFRS_var(0, 0), LCFRS_var(1, 0)
+    for lhs, rhs, weight in [('S', ['S', 'S'], 0.3), ('S', ['A', 'B'], 0.2), ('A', ['A', 'A'], 0.05),
+                             ('B', ['B', 'A'], 0.4)]:
+        lhs = LCFRS_lhs(lhs)
+        lhs.add_arg([x0, x1])
+        grammar.add_rule(lhs, rhs, weight=weight)
+    for lhs, rhs, weight in [('S', 'A', 0.1), ('A', 'B', 0.3)]:
+        lhs = LCFRS_lhs(lhs)
+        lhs.add_arg([x0])
+        grammar.add_rule(lhs, [rhs], weight=weight)
+    for lhs, terminal, weight in [('S', 'a', 0.1), ('A', 'a', 0.4), ('A', 'b', 0.3), ('B', 'b', 0.6)]:
+        lhs = LCFRS_lhs(lhs)
+        lhs.add_arg([terminal])
+        grammar.add_rule(lhs, [], weight=weight)
+    return grammar
+
+
+def count_derivations(grammar, nont, word, left, right):
+    count = 0
+    for rule in grammar.lhs_nont_to_rules(nont):
+        if rule.rank() == 0:
+            count += int(right == left + 1 and rule.lhs().arg(0)[0] == word[left])
+        elif rule.rank() == 1:
+            count += count_derivations(grammar, rule.rhs_nont(0), word, left, right)
+        else:
+            count += sum([count_derivations(grammar, rule.rhs_nont(0), word, left, split)
+                          * count_derivations(grammar, rule.rhs_nont(1), word, split, right)
+                          for split in range(left + 1, right)])
+    return count
+
+
+def derivation_weight(derivation):
+    return math.exp(sum([math.log(derivation.getRule(id).weight()) for id in derivation.ids()]))
+
+
+class CFGParserTest(unittest.TestCase):
+    def test_viterbi(self):
+        grammar = ambiguous_cnf_grammar()
+        CFGParser.preprocess_grammar(grammar)
+        for word in [list(word) for n in range(1, 6) for word in itertools.product('ab', repeat=n)]:
+            parser = CFGParser(grammar, word)
+            naive = LCFRS_parser(grammar, word)
+            self.assertEqual(parser.recognized(), naive.recognized())
+            if parser.recognized():
+                self.assertAlmostEqual(parser.best(), -naive.best())
+                derivation = parser.best_derivation_tree()
+                self.assertAlmostEqual(math.log(derivation_weight(derivation)), parser.best())
+
+    def test_k_best(self):
+        grammar = ambiguous_cnf_grammar()
+        CFGParser.preprocess_grammar(grammar)
+        for word in [list('aab'), list('abab'), list('aabbb')]:
+            parser = CFGParser(grammar, word, k=10000)
+            k_best = list(parser.k_best_derivation_trees())
+            self.assertEqual(len(k_best), count_derivations(grammar, 'S', word, 0, len(word)))
+            self.assertEqual(len(set([str(derivation) for _, derivation in k_best])), len(k_best))
+            self.assertAlmostEqual(math.log(k_best[0][0]), parser.best())
+            for (weight, derivation), (next_weight, _) in zip(k_best, k_best[1:]):
+                self.assertGreaterEqual(weight + 1e-12, next_weight)
+                self.assertAlmostEqual(weight, derivation_weight(derivation))
+
+            parser.k = 3
+            self.assertEqual([weight for weight, _ in parser.k_best_derivation_trees()],
+                             [weight for weight, _ in k_best[:3]])
+            tree_weights = [weight for _, weight, _ in parser.best_trees(str)]
+            self.assertAlmostEqual(sum(tree_weights), sum([weight for weight, _ in k_best[:3]]))
+
+    def test_parse_batch(self):
+        grammar = ambiguous_cnf_grammar()
+        words = [list(word) for n in range(1, 5) for word in itertools.product('ab', repeat=n)]
+        parser = CFGParser(grammar, k=5)
+        sequential = list(parser.parse_batch(words))
+        self.assertEqual(list(parser.parse_batch(words, workers=3, chunksize=2)), sequential)
+
+        def action(parser, index):
+            return parser.input, [weight for weight, _ in parser.k_best_derivation_trees()]
+
+        for (word, k_best), expected in zip(parser.parse_batch(words, action, workers=4, max_length=3), words):
+            self.assertEqual(word, expected)
+            parser.set_input(word)
+            parser.parse()
+            self.assertEqual(k_best, [weight for weight, _ in parser.k_best_derivation_trees()]
+                             if len(word) <= 3 else [])
+            parser.clear()
+
+    def test_budget(self):
+        grammar = ambiguous_cnf_grammar()
+        CFGParser.preprocess_grammar(grammar)
+        parser = CFGParser(grammar, list('aabbb'))
+        parser.set_budget(max_items=3)
+        parser.clear()
+        parser.set_input(list('aabbb'))
+        parser.parse()
+        self.assertTrue(parser.budget_exhausted())
+        self.assertFalse(parser.recognized())
+        self.assertEqual(list(parser.k_best_derivation_trees()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
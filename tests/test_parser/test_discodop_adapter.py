@@ -1,8 +1,10 @@
 from __future__ import print_function, unicode_literals
 
+import os
 import re
 import tempfile
 import unittest
+from functools import reduce
 from math import exp
 from pprint import pprint
 
@@ -12,10 +14,12 @@ from discodop.estimates import getestimates
 from discodop.plcfrs import parse
 
 from grammar.lcfrs import LCFRS, LCFRS_var, LCFRS_lhs
+from parser.coarse_to_fine_parser.coarse_to_fine import MultiLevelCoarseToFineParser
 from parser.coarse_to_fine_parser.trace_weight_projection import py_edge_weight_projection
 from parser.discodop_parser.grammar_adapter import transform_grammar, transform_grammar_cfg_approx
+from parser.discodop_parser.grammar_cache import DiscodopGrammarCache, grammar_fingerprint
 from parser.discodop_parser.parser import DiscodopKbestParser
-from parser.supervised_trainer.trainer import PyDerivationManager
+from parser.supervised_trainer.trainer import ChartLabelTable, PyDerivationManager
 from parser.trace_manager.sm_trainer import build_PyLatentAnnotation_initial, build_PyLatentAnnotation
 from parser.trace_manager.sm_trainer_util import PyGrammarInfo, PyStorageManager
 from util.enumerator import Enumerator
@@ -139,6 +143,70 @@ class DiscodopAdapterTest(unittest.TestCase):
             counter += 1
         self.assertEqual(50, counter)
 
+    def test_hypergraph_k_best(self):
+        grammar = self.build_grammar()
+        parser = DiscodopKbestParser(grammar, k=1000)
+        inp = ["a", "b", "a", "b"]
+        parser.set_input(inp)
+        parser.parse()
+        self.assertTrue(parser.recognized())
+
+        def weight(der):
+            return reduce(lambda x, y: x * y, [der.getRule(idx).weight() for idx in der.ids()])
+
+        exhaustive = sorted([weight(der) for der in parser.derivation_manager().enumerate_derivations(0, grammar)],
+                            reverse=True)
+        k_best = list(parser.k_best_derivation_trees())
+        self.assertEqual(len(k_best), len(exhaustive))
+        self.assertEqual(len(set([str(der) for _, der in k_best])), len(k_best))
+        for (w, der), w_exhaustive in zip(k_best, exhaustive):
+            self.assertEqual(inp, der.compute_yield())
+            self.assertAlmostEqual(w, w_exhaustive)
+            self.assertAlmostEqual(w, weight(der))
+
+        # projected weights, e.g., of a latent annotation, in probability space
+        manager = parser.derivation_manager()
+        edge_weights = [0.5] * len(manager.edge_rule_ids(0))
+        k_best = list(manager.k_best_derivations(0, edge_weights, grammar, 3, log_mode=False))
+        self.assertEqual([w for w, _ in k_best], [0.5 ** len(der.ids()) for _, der in k_best])
+
+    def test_merge_trace_managers(self):
+        grammar = self.build_nm_grammar()
+        parser = DiscodopKbestParser(grammar)
+        shards = []
+        for n, m in [(1, 2), (2, 1), (2, 2)]:
+            parser.set_input(["a"] * n + ["b"] * m + ["c"] * n + ["d"] * m)
+            parser.parse()
+            self.assertTrue(parser.recognized())
+            shards.append(parser.derivation_manager())
+            parser.clear()
+
+        def derivations(manager, traceId):
+            return sorted([str(der) for der in manager.enumerate_derivations(traceId, grammar)])
+
+        # node labels are translated to a differently ordered nonterminal map
+        nonterminal_map = Enumerator()
+        for nont in reversed(list(grammar.nonts())):
+            nonterminal_map.object_index(nont)
+        merged = PyDerivationManager(grammar, nonterminal_map)
+        merged.merge(shards)
+        grammar_info = PyGrammarInfo(grammar, nonterminal_map)
+
+        # serialized shards are loaded with the nonterminal map of the managers that wrote them
+        directory = tempfile.mkdtemp()
+        paths = [os.path.join(directory, "shard-%d.reduct" % i).encode("utf-8") for i in range(len(shards))]
+        for shard, path in zip(shards, paths):
+            shard.serialize(path)
+        loaded = PyDerivationManager(grammar)
+        loaded.load_traces_from_files(paths)
+
+        for manager in [merged, loaded]:
+            self.assertEqual(len(manager), len(shards))
+            for traceId, shard in enumerate(shards):
+                self.assertEqual(derivations(manager, traceId), derivations(shard, 0))
+        for traceId in range(len(shards)):
+            self.assertTrue(merged.is_consistent_with_grammar(grammar_info, traceId))
+
     def test_copy_grammar(self):
         grammar = self.build_nm_grammar()
         for cfg_aprrox in [True, False]:
@@ -157,6 +225,35 @@ class DiscodopAdapterTest(unittest.TestCase):
                 counter += 1
             self.assertEqual(1, counter)
 
+    def test_grammar_cache(self):
+        grammar = self.build_nm_grammar()
+        fingerprint = grammar_fingerprint(grammar)
+        directory = tempfile.mkdtemp()
+        parser = DiscodopKbestParser(grammar, cfg_ctf=True, cache_dir=directory, estimates_max_length=12)
+        # compiled grammars are shared in memory
+        self.assertIs(DiscodopKbestParser(grammar, cfg_ctf=True, cache_dir=directory).disco_grammar,
+                      parser.disco_grammar)
+        self.assertEqual(sorted(os.listdir(directory)),
+                         [fingerprint + suffix for suffix in [".cfg.pickle", ".lcfrs.pickle", ".sx12.pickle"]])
+
+        # another process reads the transformed rules and estimates from disk
+        disco_grammar, disco_cfg_grammar = DiscodopGrammarCache(directory).grammars(grammar, cfg_ctf=True)
+        self.assertIsNot(disco_grammar, parser.disco_grammar)
+        self.assertEqual(disco_grammar.nonterminals, parser.disco_grammar.nonterminals)
+        self.assertEqual(disco_cfg_grammar.nonterminals, parser.disco_cfg_grammar.nonterminals)
+
+        n = 2
+        m = 3
+        inp = ["a"] * n + ["b"] * m + ["c"] * n + ["d"] * m
+        parser.set_input(inp)
+        parser.parse()
+        self.assertTrue(parser.recognized())
+        for weight, der in parser.k_best_derivation_trees():
+            self.assertEqual(inp, der.compute_yield())
+
+        grammar.rule_index(1).set_weight(0.5)
+        self.assertNotEqual(grammar_fingerprint(grammar), fingerprint)
+
     def test_cfg_approximation_conversion(self):
         grammar = self.build_nm_grammar()
         disco_grammar_rules = list(transform_grammar_cfg_approx(grammar))
@@ -300,6 +397,90 @@ class DiscodopAdapterTest(unittest.TestCase):
         for node in der.ids():
             print(node, der.getRule(node), der.spanned_ranges(node))
 
+    def test_shared_derivation_manager(self):
+        grammar = self.build_grammar()
+        nontMap = Enumerator()
+        gi = PyGrammarInfo(grammar, nontMap)
+        sm = PyStorageManager()
+        la = build_PyLatentAnnotation_initial(grammar, gi, sm)
+
+        parser = DiscodopKbestParser(grammar, la=la, nontMap=nontMap, grammarInfo=gi, projection_mode=True)
+        labels = ChartLabelTable(parser.disco_grammar, nontMap)
+        for label in range(parser.disco_grammar.nonterminals):
+            nont = parser.disco_grammar.nonterminalstr(label)
+            if label > 0 and labels.rule_id(label) < 0:
+                self.assertEqual(nontMap.object_index(nont), labels.nonterminal_id(label))
+            else:
+                self.assertEqual(-1, labels.nonterminal_id(label))
+        # one intermediate label per rule
+        self.assertEqual(sorted([labels.rule_id(label) for label in range(parser.disco_grammar.nonterminals)
+                                 if labels.rule_id(label) >= 0]),
+                         list(range(len(grammar.rule_index()))))
+
+        for inp in [["a"] * 3, ["a", "b"]]:
+            parser.set_input(inp)
+            parser.parse()
+            self.assertTrue(parser.recognized())
+            manager = parser.derivation_manager()
+            projection = parser.best_derivation_tree()
+            self.assertIs(parser.derivation_manager(), manager)
+            parser.set_secondary_mode("LATENT-VITERBI")
+            viterbi = parser.best_derivation_tree()
+            self.assertIs(parser.derivation_manager(), manager)
+            parser.set_secondary_mode("DEFAULT")
+            self.assertEqual(inp, projection.compute_yield())
+            self.assertEqual(inp, viterbi.compute_yield())
+            parser.clear()
+
+    def test_label_table_without_nonterminal_map(self):
+        parser = DiscodopKbestParser(self.build_grammar())
+        tables = []
+        for inp in [["a"] * 3, ["a", "b"], ["b"]]:
+            parser.set_input(inp)
+            parser.parse()
+            self.assertTrue(parser.recognized())
+            parser.derivation_manager()
+            tables.append(parser.labels[2])
+            parser.clear()
+        # the table is built for the first sentence only
+        for table in tables[1:]:
+            self.assertIs(tables[0], table)
+
+    def test_multi_level_coarse_to_fine_parser(self):
+        grammar = self.build_grammar()
+        inp = ["a"] * 3
+        nontMap = Enumerator()
+        gi = PyGrammarInfo(grammar, nontMap)
+        sm = PyStorageManager()
+        la = build_PyLatentAnnotation_initial(grammar, gi, sm)
+
+        # S[0-2] and S[1-3] have posterior 0.5 each: the second level would prune all derivations
+        parser = MultiLevelCoarseToFineParser(grammar, [la, la], gi, nontMap, thresholds=[0.4, 0.6])
+        parser.set_input(inp)
+        parser.parse()
+        self.assertTrue(parser.recognized())
+        items = parser.surviving_items()
+        self.assertIn(("S", (0, 1)), items)
+        self.assertIn(("S", (0, 1, 2)), items)
+        coarse, fine = parser.statistics
+        self.assertEqual(coarse.surviving_nodes, coarse.nodes)
+        self.assertEqual(coarse.failures, 0)
+        self.assertEqual(fine.surviving_nodes, fine.nodes)
+        self.assertEqual(fine.failures, 1)
+
+        der = parser.best_derivation_tree()
+        print(der)
+        self.assertEqual(len(der.ids()), 6)
+        parser.print_statistics()
+        parser.clear()
+
+        parser = MultiLevelCoarseToFineParser(grammar, la, gi, nontMap, thresholds=0.6)
+        parser.set_input(["a"] * 2)
+        parser.parse()
+        self.assertTrue(parser.recognized())
+        self.assertEqual(parser.statistics[0].failures, 0)
+        self.assertEqual(len(parser.max_rule_product_derivation().ids()), 4)
+
     def test_la_viterbi_parsing(self):
         grammar = self.build_grammar()
         inp = ["a"] * 3
@@ -51,6 +51,25 @@ class PassiveParserTest(unittest.TestCase):
         parser2 = LCFRS_parser(grammar, word)
         derivation = parser2.best_derivation_tree()
         print(derivation)
+        self.assertEqual(derivation.compute_yield(), word)
+
+    def test_reuse(self):
+        grammar = ambiguous_copy_grammar()
+        parser = LCFRS_parser(grammar)
+        for word, recognized in [(['a'] * 6, True), (['a', 'b'], False), (['a'] * 4, True)]:
+            parser.set_input(word)
+            parser.parse()
+            self.assertEqual(parser.recognized(), recognized)
+            if recognized:
+                derivation = parser.best_derivation_tree()
+                self.assertEqual(derivation.compute_yield(), word)
+                self.assertEqual(derivation.getRuleInstance(derivation.root_id()).lhs().arg(0)[0],
+                                 Span(0, len(word)))
+                self.assertAlmostEqual(parser.best(), LCFRS_parser(grammar, word, filter_input=False).best())
+            else:
+                self.assertEqual(parser.best(), -1)
+                self.assertEqual(parser.best_derivation_tree(), None)
+            parser.clear()
 
 
 if __name__ == '__main__':
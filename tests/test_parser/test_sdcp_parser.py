@@ -140,6 +140,25 @@ class sDCPParserTest(unittest.TestCase):
         for rule in grammar.rules():
             print(rule, file=stderr)
 
+    def test_threaded_em_training(self):
+        terminal_labeling = the_terminal_labeling_factory().get_strategy('pos')
+        (_, grammar) = induce_grammar([hybrid_tree_1(), hybrid_tree_2()],
+                                      the_labeling_factory().create_simple_labeling_strategy('empty', 'pos'),
+                                      terminal_labeling.token_label, [cfg], 'START')
+        trace = compute_reducts(grammar, [hybrid_tree_1(), hybrid_tree_2()], terminal_labeling)
+        initial_weights = grammar.weight_vector()
+
+        results = []
+        for threads in [0, 1, 2]:
+            grammar.set_weight_vector(initial_weights)
+            PyEMTrainer(trace).em_training(grammar, n_epochs=10, init="equal", tie_breaking=True, seed=3,
+                                           threads=threads)
+            results.append(grammar.weight_vector())
+
+        for weights in results[1:]:
+            for expected, weight in zip(results[0], weights):
+                self.assertAlmostEqual(expected, weight, places=6)
+
     def test_corpus_em_training(self):
         train = 'res/dependency_conll/german/tiger/train/german_tiger_train.conll'
         limit_train = 200
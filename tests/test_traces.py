@@ -1,9 +1,24 @@
+import json
+import os
+import shutil
+import tempfile
 import unittest
+from dependency.induction import induce_grammar
+from dependency.labeling import the_labeling_factory
+from experiment.lcfrs_parsing_experiment import LCFRSExperiment, InductionSettings
+from experiment.resources import TRAINING, VALIDATION
+from grammar.induction.recursive_partitioning import cfg
+from grammar.induction.terminal_labeling import PosTerminals
+from parser.sDCP_parser.sdcp_trace_manager import compute_reducts
 from parser.supervised_trainer.trainer import PyDerivationManager
-from parser.trace_manager.sm_trainer_util import PyGrammarInfo
+from parser.trace_manager.sm_trainer import PySplitMergeTrainerBuilder, PyStepwiseEMTrainer, \
+    build_PyLatentAnnotation_initial
+from parser.trace_manager.sm_trainer_util import PyGrammarInfo, PyStorageManager
+from parser.trace_manager.trace_store import TraceStore, write_trace_store, load_traces
 from util.enumerator import Enumerator
 from grammar.lcfrs import LCFRS, LCFRS_lhs, LCFRS_var
 from grammar.rtg import RTG
+from tests.test_induction import hybrid_tree_1, hybrid_tree_2
 
 
 class TraceManagerTest(unittest.TestCase):
@@ -53,6 +68,152 @@ class TraceManagerTest(unittest.TestCase):
         self.assertFalse(traces.is_consistent_with_grammar(grammar_info, traceId=1))
         self.assertFalse(traces.is_consistent_with_grammar(grammar_info, traceId=2))
 
+    @staticmethod
+    def build_rtgs(r1, r2, sizes):
+        """
+        :return: for each size n, the RTG of all derivations of a^n
+        """
+        def w(x):
+            return "S", x
+
+        rtgs = []
+        for size in sizes:
+            rtg = RTG(w(size))
+            for x in range(2, size + 1):
+                for y in range(1, x):
+                    rtg.construct_and_add_rule(w(x), r1, [w(y), w(x - y)])
+            rtg.construct_and_add_rule(w(1), r2, [])
+            rtgs.append(rtg)
+        return rtgs
+
+    def test_trace_store(self):
+        grammar, r1, r2 = self.build_grammar()
+        nont_map = Enumerator()
+        grammar_info = PyGrammarInfo(grammar, nont_map)
+
+        rtgs = self.build_rtgs(r1, r2, range(2, 5))
+        traces = PyDerivationManager(grammar, nont_map)
+        traces.convert_rtgs_to_hypergraphs(rtgs, frequency=2.0)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for compression in [False, True]:
+            path = os.path.join(directory, "traces-%s.reduct" % compression)
+            write_trace_store(traces, path, compression=compression)
+            with TraceStore(path) as store:
+                self.assertEqual(len(store), len(rtgs))
+                self.assertEqual(store.compression, compression)
+                # traces are materialized on demand
+                subset = PyDerivationManager(grammar, nont_map)
+                store.load(subset, [2, 0])
+                self.assertEqual(len(subset), 2)
+                self.assertEqual(subset.trace_to_bytes(0), traces.trace_to_bytes(2))
+                self.assertEqual(subset.trace_to_bytes(1), traces.trace_to_bytes(0))
+
+            loaded = PyDerivationManager(grammar, nont_map)
+            load_traces(loaded, path)
+            self.assertEqual(len(loaded), len(rtgs))
+            for traceId in range(len(rtgs)):
+                self.assertEqual(loaded.trace_to_bytes(traceId), traces.trace_to_bytes(traceId))
+                self.assertTrue(loaded.is_consistent_with_grammar(grammar_info, traceId=traceId))
+                self.assertEqual(sorted(map(str, loaded.enumerate_derivations(traceId, grammar))),
+                                 sorted(map(str, traces.enumerate_derivations(traceId, grammar))))
+
+        with self.assertRaises(ValueError):
+            traces.add_trace_from_bytes(traces.trace_to_bytes(0)[:-8])
+
+    def test_lcfrs_experiment_reducts(self):
+        trees = [hybrid_tree_1(), hybrid_tree_2()]
+        terminal_labeling = PosTerminals()
+        _, grammar = induce_grammar(trees, the_labeling_factory().create_simple_labeling_strategy('empty', 'pos'),
+                                    terminal_labeling.token_label, [cfg], 'START')
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        experiment = LCFRSExperiment(InductionSettings(), directory=directory)
+        experiment.base_grammar = grammar
+        experiment.terminal_labeling = terminal_labeling
+        experiment.stage_dict["base_grammar"] = os.path.join(directory, "base.gram")
+        grammar.save_binary(experiment.stage_dict["base_grammar"])
+        experiment.stage_dict["terminal_labeling"] = os.path.join(directory, "terminal_labeling.json")
+        with open(experiment.stage_dict["terminal_labeling"], "w") as f:
+            json.dump(terminal_labeling.serialize(), f)
+        for resource_type in [TRAINING, VALIDATION]:
+            experiment.update_reducts(compute_reducts(grammar, trees, terminal_labeling), type=resource_type)
+        experiment.write_stage_file()
+
+        # restart the experiment from its stage file
+        restarted = LCFRSExperiment(InductionSettings(), directory=directory)
+        restarted.read_stage_file()
+        for original, loaded in [(experiment.organizer.training_reducts, restarted.organizer.training_reducts),
+                                 (experiment.organizer.validation_reducts, restarted.organizer.validation_reducts)]:
+            self.assertEqual(len(loaded), len(trees))
+            for traceId in range(len(trees)):
+                self.assertEqual(loaded.trace_to_bytes(traceId), original.trace_to_bytes(traceId))
+
+    def test_mini_batches(self):
+        grammar, r1, r2 = self.build_grammar()
+        nont_map = Enumerator()
+        traces = PyDerivationManager(grammar, nont_map)
+        traces.convert_rtgs_to_hypergraphs(self.build_rtgs(r1, r2, range(1, 6)))
+        trainer = PyStepwiseEMTrainer(traces, PyGrammarInfo(grammar, nont_map), PyStorageManager(), 2)
+
+        batches = trainer.mini_batches(1)
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(sorted([traceId for batch in batches for traceId in batch]), list(range(5)))
+        self.assertEqual([list(batch) for batch in batches], [list(batch) for batch in trainer.mini_batches(1)])
+
+    def test_stepwise_em(self):
+        grammar, r1, r2 = self.build_grammar()
+        nont_map = Enumerator()
+        traces = PyDerivationManager(grammar, nont_map)
+        traces.convert_rtgs_to_hypergraphs(self.build_rtgs(r1, r2, [1, 2, 2, 3, 4, 5]))
+        grammar_info = PyGrammarInfo(grammar, nont_map)
+        storage_manager = PyStorageManager()
+
+        with self.assertRaises(ValueError):
+            PyStepwiseEMTrainer(traces, grammar_info, storage_manager, 2, exponent=0.3)
+
+        trainer = PyStepwiseEMTrainer(traces, grammar_info, storage_manager, 2, epochs=4, seed=3)
+        self.assertAlmostEqual(trainer.step_size(), 2.0 ** -0.7)
+        la = build_PyLatentAnnotation_initial(grammar, grammar_info, storage_manager)
+        la.add_random_noise(seed=0)
+        trainer.em_train(la)
+        self.assertAlmostEqual(trainer.step_size(), 14.0 ** -0.7)
+        self.assertTrue(la.is_proper())
+
+        # the same mini-batches are loaded from a trace store into empty copies of an empty trace manager
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "traces.reduct")
+        write_trace_store(traces, path)
+        with TraceStore(path) as store:
+            trainer = PyStepwiseEMTrainer(traces.empty_copy(), grammar_info, storage_manager, 2, epochs=4, seed=3,
+                                          traceStore=store)
+            self.assertEqual([list(batch) for batch in trainer.mini_batches(5)],
+                             [list(batch) for batch in PyStepwiseEMTrainer(
+                                 traces, grammar_info, storage_manager, 2).mini_batches(5)])
+            stored_la = build_PyLatentAnnotation_initial(grammar, grammar_info, storage_manager)
+            stored_la.add_random_noise(seed=0)
+            trainer.em_train(stored_la)
+        for weights, stored_weights in zip(la.serialize()[2], stored_la.serialize()[2]):
+            for weight, stored_weight in zip(weights, stored_weights):
+                self.assertAlmostEqual(weight, stored_weight)
+
+        # stepwise EM through the builder, optionally followed by full-batch EM
+        results = []
+        for full_batch in [False, True]:
+            builder = PySplitMergeTrainerBuilder(traces, grammar_info)
+            builder.set_em_epochs(5).set_simple_expector()
+            builder.set_stepwise_em(storage_manager, 3, epochs=2, full_batch=full_batch)
+            la = build_PyLatentAnnotation_initial(grammar, grammar_info, storage_manager)
+            la.add_random_noise(seed=0)
+            builder.build().em_train(la)
+            self.assertTrue(la.is_proper())
+            self.assertTrue(la.check_for_validity())
+            results.append(la.serialize()[2])
+        self.assertNotEqual(results[0], results[1])
+
 
 if __name__ == '__main__':
     unittest.main()
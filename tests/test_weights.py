@@ -0,0 +1,64 @@
+from __future__ import print_function
+
+import unittest
+
+import numpy as np
+
+from grammar.lcfrs import CompactLCFRS
+from grammar.weights import group_sums, normalize, log_weights, additive_smoothing, interpolation_smoothing, \
+    prune_mask
+from tests.test_lcfrs import hybrid_grammar
+
+
+class WeightVectorTest(unittest.TestCase):
+    def test_weight_vector(self):
+        for grammar in [hybrid_grammar(), CompactLCFRS.from_lcfrs(hybrid_grammar())]:
+            weights = grammar.weight_vector()
+            self.assertEqual(list(weights), [2.0, 0.5, 0.25, 0.75])
+            groups, nonts = grammar.lhs_group_index()
+            self.assertEqual([nonts[group] for group in groups], ['S', 'A', 'B', 'B'])
+
+            grammar.set_weight_vector(weights * 2)
+            self.assertEqual(grammar.rule_index(3).weight(), 1.5)
+            self.assertRaises(AssertionError, grammar.set_weight_vector, [1.0])
+
+    def test_make_proper(self):
+        for grammar in [hybrid_grammar(), CompactLCFRS.from_lcfrs(hybrid_grammar())]:
+            grammar.make_proper()
+            self.assertEqual(list(grammar.weight_vector()), [1.0, 1.0, 0.25, 0.75])
+
+    def test_purge_rules(self):
+        grammar = hybrid_grammar()
+        grammar.purge_rules(0.5)
+        self.assertEqual(list(grammar.weight_vector()), [2.0, 0.75])
+
+
+class WeightOperationsTest(unittest.TestCase):
+    def setUp(self):
+        self.weights = np.array([1.0, 3.0, 0.0, 2.0, 0.0, 0.0])
+        self.groups = np.array([0, 0, 1, 1, 2, 2])
+
+    def test_normalize(self):
+        self.assertEqual(list(group_sums(self.weights, self.groups)), [4.0, 2.0, 0.0])
+        self.assertEqual(list(normalize(self.weights, self.groups)), [0.25, 0.75, 0.0, 1.0, 0.5, 0.5])
+
+    def test_log(self):
+        logs = log_weights(self.weights)
+        self.assertEqual(logs[0], 0.0)
+        self.assertEqual(logs[2], float('-inf'))
+
+    def test_smoothing(self):
+        smoothed = additive_smoothing(self.weights, self.groups, 1.0)
+        self.assertEqual(list(smoothed), [2.0 / 6, 4.0 / 6, 1.0 / 4, 3.0 / 4, 0.5, 0.5])
+        smoothed = interpolation_smoothing(self.weights, self.groups, 0.2)
+        self.assertTrue(np.allclose(smoothed, [0.3, 0.7, 0.1, 0.9, 0.5, 0.5]))
+        background = np.array([1.0, 1.0, 3.0, 1.0, 1.0, 0.0])
+        smoothed = interpolation_smoothing(self.weights, self.groups, 0.5, background)
+        self.assertTrue(np.allclose(smoothed, [0.375, 0.625, 0.375, 0.625, 0.75, 0.25]))
+
+    def test_prune_mask(self):
+        self.assertEqual(list(prune_mask(self.weights, 1.0)), [True, False, True, False, True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
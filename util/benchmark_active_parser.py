@@ -0,0 +1,130 @@
+"""
+Benchmark for the active LCFRS parser (parser.active.parsing) on sentences of increasing length.
+
+The parser is compared with the one of another git revision (e.g., before the items were hashed
+by their packed ranges), which is loaded from a temporary copy of parser/active, and with the
+naive parser. Grammars are generated synthetically: binary and lexical rules plus discontinuous
+rules of fanout 2, with random proper weights; sentences are sampled from the grammar.
+"""
+from __future__ import print_function
+
+import importlib
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import plac
+
+from grammar.lcfrs import LCFRS, LCFRS_lhs, LCFRS_var
+from parser.active.parsing import Parser
+from parser.naive.parsing import LCFRS_parser
+
+MODULES = ['parse_items', 'derivation', 'parsing']
+
+
+def synthetic_grammar(nonterminals, terminals, seed):
+    rng = random.Random(seed)
+    nonts = ['S'] + ['N' + str(i) for i in range(nonterminals)]
+    grammar = LCFRS('S')
+    x = [[LCFRS_var(i, j) for j in range(2)] for i in range(2)]
+    for _ in range(10 * nonterminals):
+        lhs = LCFRS_lhs(rng.choice(nonts))
+        lhs.add_arg([x[0][0], x[1][0]])
+        grammar.add_rule(lhs, [rng.choice(nonts[1:]), rng.choice(nonts[1:])], weight=rng.random())
+    for nont in nonts[1:]:
+        for _ in range(7):
+            lhs = LCFRS_lhs(nont)
+            lhs.add_arg(['t' + str(rng.randrange(terminals))])
+            grammar.add_rule(lhs, [], weight=rng.random())
+    for i in range(nonterminals):
+        lhs = LCFRS_lhs('D' + str(i))
+        lhs.add_arg([x[0][0]])
+        lhs.add_arg([x[1][0]])
+        grammar.add_rule(lhs, [rng.choice(nonts[1:]), rng.choice(nonts[1:])], weight=rng.random())
+        lhs = LCFRS_lhs(rng.choice(nonts))
+        lhs.add_arg([x[0][0], x[1][0], x[0][1]])
+        grammar.add_rule(lhs, ['D' + str(i), rng.choice(nonts[1:])], weight=rng.random())
+    grammar.make_proper()
+    return grammar
+
+
+def sample(grammar, rng, nont, depth=0, max_depth=12):
+    rules = grammar.lhs_nont_to_rules(nont)
+    if depth >= max_depth:
+        rules = [rule for rule in rules if rule.rank() == 0] or rules
+    threshold = rng.random() * sum([rule.weight() for rule in rules])
+    for rule in rules:
+        threshold -= rule.weight()
+        if threshold <= 0:
+            break
+    children = [sample(grammar, rng, rule.rhs_nont(i), depth + 1, max_depth) for i in range(rule.rank())]
+    return [[terminal for obj in arg
+             for terminal in (children[obj.mem][obj.arg] if isinstance(obj, LCFRS_var) else [obj])]
+            for arg in rule.lhs().args()]
+
+
+def sentences(grammar, lengths, number, seed):
+    rng = random.Random(seed)
+    result = {length: [] for length in lengths}
+    while any([len(sents) < number for sents in result.values()]):
+        try:
+            sentence = sample(grammar, rng, grammar.start())[0]
+        except RuntimeError:
+            # recursion limit
+            continue
+        if len(sentence) in result and len(result[len(sentence)]) < number:
+            result[len(sentence)].append(sentence)
+    return result
+
+
+def reference_parser(revision):
+    """ Load parser.active of revision into a temporary package and return its Parser class. """
+    directory = tempfile.mkdtemp()
+    package = 'reference_active'
+    os.mkdir(os.path.join(directory, package))
+    open(os.path.join(directory, package, '__init__.py'), 'w').close()
+    for module in MODULES:
+        source = subprocess.check_output(['git', 'show', revision + ':parser/active/' + module + '.py'],
+                                         universal_newlines=True)
+        with open(os.path.join(directory, package, module + '.py'), 'w') as target:
+            target.write(source.replace('parser.active.', package + '.'))
+    sys.path.insert(0, directory)
+    try:
+        return importlib.import_module(package + '.parsing').Parser
+    finally:
+        sys.path.remove(directory)
+        shutil.rmtree(directory)
+
+
+def timed(parser_class, grammar, sentences):
+    start = time.time()
+    recognized = [parser_class(grammar, sentence).recognized() for sentence in sentences]
+    return time.time() - start, recognized
+
+
+@plac.annotations(
+    revision=('git revision of the reference implementation of the active parser', 'option', 'r', str),
+    lengths=('comma separated sentence lengths', 'option', 'l', str),
+    number=('number of sentences per length', 'option', 'n', int),
+    nonterminals=('number of nonterminals of the grammar', 'option', 'N', int),
+    terminals=('number of terminals of the grammar', 'option', 'T', int),
+    seed=('random seed', 'option', 's', int)
+)
+def main(revision='HEAD', lengths='4,8,12,16', number=5, nonterminals=20, terminals=30, seed=0):
+    grammar = synthetic_grammar(nonterminals, terminals, seed)
+    print('rules:', len(grammar.rules()))
+    parsers = [('active', Parser), ('active@' + revision, reference_parser(revision)),
+               ('naive', LCFRS_parser)]
+    print('{:>6}'.format('length') + ''.join(['{:>16}'.format(name) for name, _ in parsers]))
+    for length, sents in sorted(sentences(grammar, [int(l) for l in lengths.split(',')], number, seed).items()):
+        times, results = zip(*[timed(parser_class, grammar, sents) for _, parser_class in parsers])
+        assert all([result == results[0] for result in results])
+        print('{:>6}'.format(length) + ''.join(['{:>15.2f}s'.format(t) for t in times]))
+
+
+if __name__ == '__main__':
+    plac.call(main)
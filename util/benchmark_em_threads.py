@@ -0,0 +1,72 @@
+"""
+Benchmark for the expectation step of PyEMTrainer.em_training by number of threads.
+
+An sDCP grammar is induced from a dependency corpus in CoNLL format, the reducts of the corpus are
+computed once, and the same EM epochs are run by the plain EM trainer (threads 0) and by the simple
+expector of the split/merge trainer with an increasing number of threads. The time per epoch, the
+speedup over one thread and the maximal deviation of the trained weights from the plain EM trainer
+are reported.
+"""
+from __future__ import print_function
+
+import time
+
+import numpy as np
+import plac
+
+from corpora.conll_parse import parse_conll_corpus
+from dependency.induction import induce_grammar
+from dependency.labeling import the_labeling_factory
+from grammar.induction.recursive_partitioning import cfg
+from grammar.induction.terminal_labeling import the_terminal_labeling_factory
+from parser.sDCP_parser.sdcp_trace_manager import compute_reducts
+from parser.trace_manager.sm_trainer import PyEMTrainer
+
+TRAIN = 'res/dependency_conll/german/tiger/train/german_tiger_train.conll'
+
+
+def timed(name, function):
+    start = time.time()
+    result = function()
+    print('{:<28} {:8.2f}s'.format(name, time.time() - start))
+    return result
+
+
+@plac.annotations(
+    corpus=('corpus in CoNLL format', 'option', 'c', str),
+    sentences=('number of sentences', 'option', 'n', int),
+    epochs=('EM epochs per run', 'option', 'e', int),
+    threads=('comma-separated numbers of threads (0: plain EM trainer)', 'option', 't', str)
+)
+def main(corpus=TRAIN, sentences=2000, epochs=5, threads='0,1,2,4,8'):
+    labelling = the_labeling_factory().create_simple_labeling_strategy('childtop', 'deprel')
+    term_labelling = the_terminal_labeling_factory().get_strategy('pos')
+    _, grammar = timed('induction', lambda: induce_grammar(parse_conll_corpus(corpus, False, sentences),
+                                                           labelling, term_labelling.token_label, [cfg],
+                                                           'START'))
+    trace = timed('reducts', lambda: compute_reducts(grammar, parse_conll_corpus(corpus, False, sentences),
+                                                     term_labelling))
+    print('rules:', len(grammar.rules()), 'traces:', len(trace))
+
+    initial_weights = grammar.weight_vector()
+    trainer = PyEMTrainer(trace)
+    reference = None
+    single = None
+    print('{:>8} {:>12} {:>8} {:>12}'.format('threads', 's/epoch', 'speedup', 'max. diff.'))
+    for n_threads in [int(n) for n in threads.split(',')]:
+        grammar.set_weight_vector(initial_weights)
+        start = time.time()
+        trainer.em_training(grammar, epochs, threads=n_threads)
+        per_epoch = (time.time() - start) / epochs
+        weights = grammar.weight_vector()
+        if reference is None:
+            reference = weights
+        if single is None and n_threads == 1:
+            single = per_epoch
+        print('{:>8} {:>12.3f} {:>8} {:>12.2e}'.format(
+            n_threads, per_epoch, '{:.2f}'.format(single / per_epoch) if single else '-',
+            np.max(np.abs(weights - reference))))
+
+
+if __name__ == '__main__':
+    plac.call(main)
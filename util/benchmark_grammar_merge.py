@@ -0,0 +1,111 @@
+"""
+Benchmark for joining per-sentence grammars during induction: string keys (the former
+LCFRS.add_rule) vs. rule signatures (LCFRS.add_gram / LCFRS.merge).
+
+Grammars are either induced from a corpus in export format or generated synthetically
+with a shape similar to the grammars of constituent.induction.fringe_extract_lcfrs.
+"""
+from __future__ import print_function
+
+import random
+import time
+
+import plac
+
+from grammar.dcp import DCP_rule, DCP_var, DCP_index, DCP_string, DCP_term
+from grammar.lcfrs import LCFRS, LCFRS_lhs, LCFRS_var, LCFRS_rule
+
+
+def synthetic_grammars(sentences, length, seed):
+    rng = random.Random(seed)
+    labels = ['NP', 'VP', 'PP', 'S', 'AP', 'CNP', 'AVP', 'NM']
+    tags = ['NN', 'ART', 'ADJA', 'VVFIN', 'APPR', 'ADV', 'NE', 'KON', 'PPER', 'VAFIN']
+    words = ['w' + str(i) for i in range(5000)]
+    for _ in range(sentences):
+        grammar = LCFRS(start='START')
+        nonts = []
+        for i in range(length):
+            tag = rng.choice(tags)
+            lhs = LCFRS_lhs(tag + '/1')
+            lhs.add_arg([words[min(int(rng.paretovariate(1.0)) - 1, len(words) - 1)]])
+            grammar.add_rule(lhs, [], dcp=[DCP_rule(DCP_var(-1, 0), [DCP_term(DCP_index(0, edge_label='--',
+                                                                                         pos=tag), [])])])
+            nonts.append(tag + '/1')
+        while len(nonts) > 1:
+            i = rng.randrange(len(nonts) - 1)
+            label = rng.choice(labels)
+            lhs = LCFRS_lhs(label + '/1')
+            lhs.add_arg([LCFRS_var(0, 0), LCFRS_var(1, 0)])
+            dcp = [DCP_rule(DCP_var(-1, 0), [DCP_term(DCP_string(label, edge_label='--'),
+                                                      [DCP_var(0, 0), DCP_var(1, 0)])])]
+            grammar.add_rule(lhs, nonts[i:i + 2], dcp=dcp)
+            nonts[i:i + 2] = [label + '/1']
+        lhs = LCFRS_lhs('START')
+        lhs.add_arg([LCFRS_var(0, 0)])
+        grammar.add_rule(lhs, nonts, dcp=[DCP_rule(DCP_var(-1, 0), [DCP_var(0, 0)])])
+        yield grammar
+
+
+def corpus_grammars(path, sentences):
+    from corpora.negra_parse import sentence_names_to_hybridtrees
+    from constituent.induction import fringe_extract_lcfrs
+    from grammar.induction.recursive_partitioning import the_recursive_partitioning_factory
+    from grammar.induction.terminal_labeling import PosTerminals
+    rec_part = the_recursive_partitioning_factory().get_partitioning('fanout-2-left-to-right')[0]
+    corpus = sentence_names_to_hybridtrees([str(i) for i in range(1, sentences + 1)], path,
+                                           disconnect_punctuation=False)
+    for tree in corpus:
+        yield fringe_extract_lcfrs(tree, rec_part(tree), naming='child', term_labeling=PosTerminals())
+
+
+def string_key_merge(grammars):
+    """ Joins grammars by the string representation of rules, as LCFRS.add_rule used to. """
+    key_to_rule = {}
+    for other in grammars:
+        for other_rule in other.rules():
+            rule = LCFRS_rule(other_rule.lhs(), weight=other_rule.weight(), dcp=other_rule.dcp())
+            for nont in other_rule.rhs():
+                rule.add_rhs_nont(nont)
+            if rule.key() in key_to_rule:
+                key_to_rule[rule.key()].add_weight(other_rule.weight())
+            else:
+                key_to_rule[rule.key()] = rule
+    return len(key_to_rule)
+
+
+def timed(name, function):
+    start = time.time()
+    result = function()
+    print('{:<28} {:8.2f}s'.format(name, time.time() - start))
+    return result
+
+
+@plac.annotations(
+    corpus=('corpus in export format (default: synthetic corpus)', 'option', 'c', str),
+    sentences=('number of sentences', 'option', 'n', int),
+    length=('sentence length of the synthetic corpus', 'option', 'l', int),
+    seed=('random seed of the synthetic corpus', 'option', 's', int)
+)
+def main(corpus=None, sentences=40000, length=18, seed=0):
+    if corpus is None:
+        grammars = timed('synthetic induction', lambda: list(synthetic_grammars(sentences, length, seed)))
+    else:
+        grammars = timed('induction', lambda: list(corpus_grammars(corpus, sentences)))
+    print('per-sentence rules:', sum(len(grammar.rules()) for grammar in grammars))
+
+    rules_by_key = timed('string keys', lambda: string_key_merge(grammars))
+
+    def add_gram():
+        grammar = LCFRS(start='START')
+        for other in grammars:
+            grammar.add_gram(other)
+        return grammar
+
+    by_add_gram = timed('LCFRS.add_gram', add_gram)
+    by_merge = timed('LCFRS.merge', lambda: LCFRS(start='START').merge(grammars))
+    assert len(by_merge.rules()) == len(by_add_gram.rules()) == rules_by_key
+    print('merged rules:', len(by_merge.rules()))
+
+
+if __name__ == '__main__':
+    plac.call(main)
@@ -1,6 +1,7 @@
 import os, sys, plac, json, pickle
 from grammar.lcfrs import *
 from parser.sDCP_parser.sdcp_trace_manager import PySDCPTraceManager
+from parser.trace_manager.trace_store import load_traces
 from grammar.induction.terminal_labeling import deserialize_labeling
 
 
@@ -52,7 +53,7 @@ def main(directory: str = '.', posinfo: str = '', showpos=False, allposinfo=Fals
 
         training_reducts = PySDCPTraceManager(gr, terminal_labeling)
         training_reducts_path = changepath(stage_dict["training_reducts"])
-        training_reducts.load_traces_from_file(bytes(training_reducts_path, encoding="utf-8"))
+        load_traces(training_reducts, training_reducts_path)
 
         enumerator = training_reducts.get_nonterminal_map()
 